@@ -1,12 +1,17 @@
 from fastapi import APIRouter, Depends, HTTPException, status, UploadFile, File
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import func, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from typing import List
+import io
 import os
-import uuid
 from PIL import Image
 
-from app.core.database import get_db
+from app.core.cache import cache
+from app.core.database import get_async_db
 from app.core.config import settings
+from app.core.write_queue import write_queue
 from app.api.v1.auth import get_current_user
 from app.models.user import User
 from app.models.account import EmailAccount
@@ -19,6 +24,8 @@ from app.schemas.account import (
 )
 from app.services.imap_service import IMAPService
 from app.services.smtp_service import SMTPService
+from app.utils.password import account_password
+from app.utils.static_files import hashed_filename
 
 router = APIRouter()
 
@@ -26,10 +33,10 @@ router = APIRouter()
 @router.get("/", response_model=List[EmailAccountSchema])
 async def get_accounts(
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Get all email accounts for the current user"""
-    accounts = db.query(EmailAccount).filter(EmailAccount.user_id == current_user.id).all()
+    accounts = (await db.scalars(select(EmailAccount).where(EmailAccount.user_id == current_user.id))).all()
     return accounts
 
 
@@ -37,15 +44,15 @@ async def get_accounts(
 async def create_account(
     account_data: EmailAccountCreate,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Create a new email account"""
     
     # Check if email account already exists for this user
-    existing = db.query(EmailAccount).filter(
+    existing = await db.scalar(select(EmailAccount).where(
         EmailAccount.user_id == current_user.id,
         EmailAccount.email_address == account_data.email_address
-    ).first()
+    ))
     
     if existing:
         raise HTTPException(
@@ -57,7 +64,7 @@ async def create_account(
     # For now, we'll store them as-is (NOT SECURE - implement encryption)
     
     # Create new account
-    db_account = EmailAccount(
+    values = dict(
         user_id=current_user.id,
         name=account_data.name,
         email_address=account_data.email_address,
@@ -78,30 +85,37 @@ async def create_account(
         pop3_username=account_data.pop3_username,
         pop3_password=account_data.pop3_password,  # TODO: Encrypt
     )
+    account_id = await write_queue.apply_async(db, _insert_account, values)
+    
+    return await db.get(EmailAccount, account_id)
+
+
+def _insert_account(db: Session, values: dict) -> int:
+    db_account = EmailAccount(**values)
     
     # If this is the first account, make it default
-    user_accounts_count = db.query(EmailAccount).filter(EmailAccount.user_id == current_user.id).count()
+    user_accounts_count = db.scalar(
+        select(func.count(EmailAccount.id)).where(EmailAccount.user_id == values["user_id"])
+    )
     if user_accounts_count == 0:
         db_account.is_default = True
     
     db.add(db_account)
-    db.commit()
-    db.refresh(db_account)
-    
-    return db_account
+    db.flush()
+    return db_account.id
 
 
 @router.get("/{account_id}", response_model=EmailAccountSchema)
 async def get_account(
     account_id: int,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Get a specific email account"""
-    account = db.query(EmailAccount).filter(
+    account = await db.scalar(select(EmailAccount).where(
         EmailAccount.id == account_id,
         EmailAccount.user_id == current_user.id
-    ).first()
+    ))
     
     if not account:
         raise HTTPException(
@@ -117,13 +131,13 @@ async def update_account(
     account_id: int,
     account_update: EmailAccountUpdate,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Update an email account"""
-    account = db.query(EmailAccount).filter(
+    account = await db.scalar(select(EmailAccount).where(
         EmailAccount.id == account_id,
         EmailAccount.user_id == current_user.id
-    ).first()
+    ))
     
     if not account:
         raise HTTPException(
@@ -131,24 +145,12 @@ async def update_account(
             detail="Email account not found"
         )
     
-    # Update fields
     update_data = account_update.dict(exclude_unset=True)
-    for field, value in update_data.items():
-        if field.endswith('_password') and value:
-            # TODO: Encrypt password
-            setattr(account, field, value)
-        else:
-            setattr(account, field, value)
-    
-    # If setting as default, unset other defaults
-    if account_update.is_default:
-        db.query(EmailAccount).filter(
-            EmailAccount.user_id == current_user.id,
-            EmailAccount.id != account_id
-        ).update({"is_default": False})
+    await write_queue.apply_async(db, _update_account, account_id, current_user.id, update_data, idempotent=True)
+    await db.refresh(account)
     
-    db.commit()
-    db.refresh(account)
+    # Server settings may have changed
+    await cache.delete_async("folders", account_id)
     
     return account
 
@@ -157,13 +159,13 @@ async def update_account(
 async def delete_account(
     account_id: int,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Delete an email account"""
-    account = db.query(EmailAccount).filter(
+    account = await db.scalar(select(EmailAccount).where(
         EmailAccount.id == account_id,
         EmailAccount.user_id == current_user.id
-    ).first()
+    ))
     
     if not account:
         raise HTTPException(
@@ -171,23 +173,48 @@ async def delete_account(
             detail="Email account not found"
         )
     
-    db.delete(account)
-    db.commit()
+    await write_queue.apply_async(db, _delete_account, account_id, idempotent=True)
+    await cache.delete_async("folders", account_id)
     
     return {"message": "Email account deleted successfully"}
 
 
+def _update_account(db: Session, account_id: int, user_id: int, update_data: dict):
+    account = db.get(EmailAccount, account_id)
+    
+    # Update fields
+    for field, value in update_data.items():
+        if field.endswith('_password') and value:
+            # TODO: Encrypt password
+            setattr(account, field, value)
+        else:
+            setattr(account, field, value)
+    
+    # If setting as default, unset other defaults
+    if update_data.get("is_default"):
+        db.execute(update(EmailAccount).where(
+            EmailAccount.user_id == user_id,
+            EmailAccount.id != account_id
+        ).values(is_default=False))
+
+
+def _delete_account(db: Session, account_id: int):
+    account = db.get(EmailAccount, account_id)
+    if account is not None:
+        db.delete(account)
+
+
 @router.post("/{account_id}/test", response_model=AccountConnectionTest)
 async def test_account_connection(
     account_id: int,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Test email account connection"""
-    account = db.query(EmailAccount).filter(
+    account = await db.scalar(select(EmailAccount).where(
         EmailAccount.id == account_id,
         EmailAccount.user_id == current_user.id
-    ).first()
+    ))
     
     if not account:
         raise HTTPException(
@@ -195,9 +222,8 @@ async def test_account_connection(
             detail="Email account not found"
         )
     
-    # TODO: Decrypt passwords
-    imap_password = account.imap_password
-    smtp_password = account.smtp_password
+    imap_password = account_password(account, "imap")
+    smtp_password = account_password(account, "smtp")
     
     test_result = AccountConnectionTest(
         imap_success=False,
@@ -208,12 +234,12 @@ async def test_account_connection(
     try:
         # Test IMAP connection
         imap_service = IMAPService(account, imap_password)
-        imap_success, imap_error = imap_service.test_connection()
+        imap_success, imap_error = await run_in_threadpool(imap_service.test_connection)
         test_result.imap_success = imap_success
         
         # Test SMTP connection
         smtp_service = SMTPService(account, smtp_password)
-        smtp_success, smtp_error = smtp_service.test_connection()
+        smtp_success, smtp_error = await run_in_threadpool(smtp_service.test_connection)
         test_result.smtp_success = smtp_success
         
         # Set error message if any test failed
@@ -236,13 +262,13 @@ async def upload_avatar(
     account_id: int,
     file: UploadFile = File(...),
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Upload profile avatar for email account"""
-    account = db.query(EmailAccount).filter(
+    account = await db.scalar(select(EmailAccount).where(
         EmailAccount.id == account_id,
         EmailAccount.user_id == current_user.id
-    ).first()
+    ))
     
     if not account:
         raise HTTPException(
@@ -265,7 +291,7 @@ async def upload_avatar(
             detail=f"File size must be less than {settings.MAX_FILE_SIZE} bytes"
         )
     
-    # Generate unique filename
+    # Validate file extension
     file_extension = os.path.splitext(file.filename)[1].lower()
     if file_extension not in settings.ALLOWED_IMAGE_EXTENSIONS:
         raise HTTPException(
@@ -273,29 +299,36 @@ async def upload_avatar(
             detail="Invalid file extension"
         )
     
-    filename = f"avatar_{account_id}_{uuid.uuid4().hex}{file_extension}"
-    file_path = os.path.join(settings.UPLOAD_DIR, filename)
+    file_path = None
+    created = False
     
     try:
-        # Save and resize image
-        with open(file_path, "wb") as buffer:
-            buffer.write(content)
-        
-        # Resize image to 200x200
-        with Image.open(file_path) as img:
+        # Resize image to 200x200 in memory
+        with Image.open(io.BytesIO(content)) as img:
+            image_format = Image.registered_extensions().get(file_extension, img.format)
             img = img.resize((200, 200), Image.Resampling.LANCZOS)
-            img.save(file_path, optimize=True, quality=85)
+            output = io.BytesIO()
+            img.save(output, format=image_format, optimize=True, quality=85)
+        resized = output.getvalue()
+        
+        # Name the file after its content so it can be cached as immutable
+        filename = hashed_filename(f"avatar_{account_id}", resized, file_extension)
+        file_path = os.path.join(settings.UPLOAD_DIR, filename)
+        
+        if not os.path.exists(file_path):
+            with open(file_path, "wb") as buffer:
+                buffer.write(resized)
+            created = True
         
         # Update account with avatar URL
         avatar_url = f"/uploads/{filename}"
-        account.avatar_url = avatar_url
-        db.commit()
+        await write_queue.apply_async(db, _set_avatar_url, account_id, avatar_url, idempotent=True)
         
         return {"avatar_url": avatar_url, "message": "Avatar uploaded successfully"}
         
     except Exception as e:
         # Clean up file if something went wrong
-        if os.path.exists(file_path):
+        if created and os.path.exists(file_path):
             os.remove(file_path)
         
         raise HTTPException(
@@ -304,17 +337,21 @@ async def upload_avatar(
         )
 
 
+def _set_avatar_url(db: Session, account_id: int, avatar_url: str):
+    db.get(EmailAccount, account_id).avatar_url = avatar_url
+
+
 @router.get("/{account_id}/folders")
 async def get_folders(
     account_id: int,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Get available folders for an email account"""
-    account = db.query(EmailAccount).filter(
+    account = await db.scalar(select(EmailAccount).where(
         EmailAccount.id == account_id,
         EmailAccount.user_id == current_user.id
-    ).first()
+    ))
     
     if not account:
         raise HTTPException(
@@ -322,13 +359,18 @@ async def get_folders(
             detail="Email account not found"
         )
     
-    # TODO: Decrypt password
-    password = account.imap_password
+    password = account_password(account, "imap")
     
-    try:
+    def load_folders():
         with IMAPService(account, password) as imap:
-            folders = imap.get_folders()
-            return {"folders": folders}
+            if not imap.connection:
+                # Raise so the fallback folder list isn't cached
+                raise ConnectionError("Could not connect to IMAP server")
+            return imap.get_folders()
+    
+    try:
+        folders = await run_in_threadpool(cache.get_or_set, "folders", (account_id,), load_folders)
+        return {"folders": folders}
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
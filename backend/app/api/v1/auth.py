@@ -1,9 +1,15 @@
 from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi.concurrency import run_in_threadpool
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from typing import Optional
 
-from app.core.database import get_db
+from app.core.cache import cache
+from app.core.config import settings
+from app.core.database import get_async_db
+from app.core.write_queue import write_queue
 from app.core.security import (
     create_access_token, 
     verify_password, 
@@ -18,83 +24,113 @@ router = APIRouter()
 security = HTTPBearer()
 
 
-def get_user_by_username(db: Session, username: str) -> Optional[User]:
+async def get_user_by_username(db: AsyncSession, username: str) -> Optional[User]:
     """Get user by username"""
-    return db.query(User).filter(User.username == username).first()
+    return await db.scalar(select(User).where(User.username == username))
 
 
-def get_user_by_email(db: Session, email: str) -> Optional[User]:
+async def get_user_by_email(db: AsyncSession, email: str) -> Optional[User]:
     """Get user by email"""
-    return db.query(User).filter(User.email == email).first()
+    return await db.scalar(select(User).where(User.email == email))
 
 
-def authenticate_user(db: Session, username: str, password: str) -> Optional[User]:
+async def authenticate_user(db: AsyncSession, username: str, password: str) -> Optional[User]:
     """Authenticate user with username and password"""
-    user = get_user_by_username(db, username)
+    user = await get_user_by_username(db, username)
     if not user:
         return None
-    if not verify_password(password, user.hashed_password):
+    # bcrypt is deliberately slow, keep it off the event loop
+    if not await run_in_threadpool(verify_password, password, user.hashed_password):
         return None
     return user
 
 
-def get_current_user(
-    credentials: HTTPAuthorizationCredentials = Depends(security),
-    db: Session = Depends(get_db)
-) -> User:
-    """Get current authenticated user"""
-    token = credentials.credentials
+# User columns kept in the shared cache (never the password hash)
+CACHED_USER_FIELDS = ("id", "username", "email", "full_name", "is_active", "created_at", "updated_at")
+
+
+async def get_cached_user(db: AsyncSession, username: str) -> Optional[User]:
+    """Look a user up through the cache; returns a detached User without hashed_password"""
+    async def load_user():
+        user = await get_user_by_username(db, username)
+        if user is None:
+            return None
+        return {field: getattr(user, field) for field in CACHED_USER_FIELDS}
+    
+    fields = await cache.get_or_set_async("user", (username,), load_user, ttl=settings.USER_CACHE_TTL)
+    if fields is None:
+        return None
+    return User(**fields)
+
+
+async def get_user_from_token(db: AsyncSession, token: str) -> User:
+    """Resolve an access token to its user or raise 401"""
     username = verify_token(token)
     
     if username is None:
         raise create_credentials_exception()
     
-    user = get_user_by_username(db, username)
+    user = await get_cached_user(db, username)
     if user is None:
         raise create_credentials_exception()
     
     return user
 
 
+async def get_current_user(
+    credentials: HTTPAuthorizationCredentials = Depends(security),
+    db: AsyncSession = Depends(get_async_db)
+) -> User:
+    """Get current authenticated user"""
+    return await get_user_from_token(db, credentials.credentials)
+
+
 @router.post("/register", response_model=UserSchema)
-async def register(user_data: UserCreate, db: Session = Depends(get_db)):
+async def register(user_data: UserCreate, db: AsyncSession = Depends(get_async_db)):
     """Register a new user"""
     
     # Check if username already exists
-    if get_user_by_username(db, user_data.username):
+    if await get_user_by_username(db, user_data.username):
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Username already registered"
         )
     
     # Check if email already exists
-    if get_user_by_email(db, user_data.email):
+    if await get_user_by_email(db, user_data.email):
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Email already registered"
         )
     
     # Create new user
-    hashed_password = get_password_hash(user_data.password)
-    db_user = User(
+    hashed_password = await run_in_threadpool(get_password_hash, user_data.password)
+    user_id = await write_queue.apply_async(db, _insert_user, dict(
         username=user_data.username,
         email=user_data.email,
         full_name=user_data.full_name,
         hashed_password=hashed_password
-    )
+    ))
+    db_user = await db.get(User, user_id)
     
-    db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
+    # Drop any cached "no such user" lookup
+    await cache.delete_async("user", db_user.username)
     
     return db_user
 
 
+def _insert_user(db: Session, values: dict) -> int:
+    db_user = User(**values)
+    db.add(db_user)
+    db.flush()
+    return db_user.id
+
+
 @router.post("/login", response_model=Token)
-async def login(user_data: UserLogin, db: Session = Depends(get_db)):
+async def login(user_data: UserLogin, db: AsyncSession = Depends(get_async_db)):
     """Login user and return access token"""
     
-    user = authenticate_user(db, user_data.username, user_data.password)
+    user = await authenticate_user(db, user_data.username, user_data.password)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -1,130 +1,325 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Query
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, HTTPException, status, Query, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import exists, func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, undefer_group
+from datetime import datetime
 from typing import List, Optional
 import logging
+import uuid
 
-from app.core.database import get_db
+from app.core.cache import cache
+from app.core.config import settings
+from app.core.database import SessionLocal, get_async_db
+from app.core.locks import FlightBusy, single_flight
+from app.core.write_queue import write_queue
 from app.api.v1.auth import get_current_user
 from app.models.user import User
 from app.models.email import Email
+from app.models.email_archive import ArchivedEmailBody
 from app.models.account import EmailAccount
+from app.models.folder_state import FolderState
+from app.models.outbox import OutboundEmail
+from app.models.types import searchable_body
 from app.schemas.email import (
     Email as EmailSchema, 
     EmailCreate, 
     EmailUpdate, 
     EmailCompose,
-    EmailSearch
+    EmailSearch,
+    EmailBulkSend,
+    BulkSendStatus,
+    OutboundEmailStatus
 )
 from app.services.imap_service import IMAPService
-from app.services.smtp_service import SMTPService
+from app.services.message_store import load_stored_content, message_store
+from app.services.bulk_send import render_messages
+from app.services.events import event_broker, publish_folder_counters_async
+from app.services.flag_sync import queue_flag_changes
+from app.services.outbox import enqueue_bulk, enqueue_email, outbox_worker
+from app.services.sync_service import run_sync
+from app.services.tiering import rehydrate, unarchive
+from app.utils.etag import etag_matches, make_etag
+from app.utils.password import account_password
+from app.utils.serialization import json_bytes_response, render_rows, rows_response, schema_columns
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
 
+# Columns selected for list responses
+EMAIL_COLUMNS = schema_columns(Email, EmailSchema)
+
 
 @router.get("/", response_model=List[EmailSchema])
 async def get_emails(
+    request: Request,
     account_id: Optional[int] = Query(None),
     folder: str = Query("INBOX"),
     limit: int = Query(50, le=100),
     offset: int = Query(0, ge=0),
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Get emails for the current user"""
     
-    # Build query
-    query = db.query(Email).join(EmailAccount).filter(EmailAccount.user_id == current_user.id)
-    
+    # Validator from the change versions of the folders in view, without loading any emails
+    versions = select(EmailAccount.id, FolderState.folder, FolderState.version).outerjoin(
+        FolderState,
+        (FolderState.account_id == EmailAccount.id) & ((FolderState.folder == folder) if folder else True)
+    ).where(EmailAccount.user_id == current_user.id)
     if account_id:
-        query = query.filter(Email.account_id == account_id)
+        versions = versions.where(EmailAccount.id == account_id)
+    
+    folder_versions = (await db.execute(versions)).all()
+    etag = make_etag("emails", current_user.id, account_id, folder, limit, offset, sorted(
+        (acc_id, state_folder or "", version or 0)
+        for acc_id, state_folder, version in folder_versions
+    ))
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=_validator_headers(etag))
+    
+    # Build query; listing the accounts (rather than joining them) lets Postgres skip other accounts' partitions
+    query = select(*EMAIL_COLUMNS).where(
+        Email.account_id.in_({acc_id for acc_id, _, _ in folder_versions}),
+        Email.is_deleted.isnot(True)
+    )
     
     if folder:
-        query = query.filter(Email.folder == folder)
+        query = query.where(Email.folder == folder)
     
     # Order by date received (most recent first)
     query = query.order_by(Email.date_received.desc())
     
-    # Apply pagination
-    emails = query.offset(offset).limit(limit).all()
+    # Apply pagination; rows are serialized directly, skipping response_model validation.
+    # The page is fully determined by its ETag, so the rendered body can be shared by all workers.
+    async def render_page():
+        return render_rows((await db.execute(query.offset(offset).limit(limit))).all())
+    
+    body = await cache.get_or_set_bytes_async("email_list", (etag.strip('"'),), render_page)
     
-    return emails
+    return json_bytes_response(body, headers=_validator_headers(etag))
 
 
 @router.get("/{email_id}", response_model=EmailSchema)
 async def get_email(
     email_id: int,
+    request: Request,
+    response: Response,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Get a specific email by ID - FIXED VERSION"""
     
-    email = db.query(Email).join(EmailAccount).filter(
+    # Check the client's cached copy before loading the full row
+    current = (await db.execute(select(
+        Email.account_id, Email.updated_at, Email.created_at, Email.uid,
+        ((func.coalesce(Email.body_text, "") != "") | (func.coalesce(Email.body_html, "") != "")).label("has_body"),
+        FolderState.version
+    ).select_from(Email).outerjoin(
+        FolderState,
+        (FolderState.account_id == Email.account_id) & (FolderState.folder == Email.folder)
+    ).where(
         Email.id == email_id,
-        EmailAccount.user_id == current_user.id
-    ).first()
+        Email.account_id.in_(await _account_ids(db, current_user.id)),
+        Email.is_deleted.isnot(True)
+    ))).first()
     
-    if not email:
+    if not current:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Email not found"
         )
     
-    # If we don't have body content, try to fetch it from IMAP
+    # A copy without a body is never reported fresh, so the body fetch below gets a chance to run
+    if current.has_body or not current.uid:
+        etag = _email_etag(email_id, current.updated_at or current.created_at, current.version)
+        if etag_matches(request.headers.get("if-none-match"), etag):
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=_validator_headers(etag))
+    
+    email = await _load_email(db, email_id, current.account_id)
+    
+    # If we don't have body content, try to fetch it from IMAP (once, however many requests ask)
     if not email.body_text and not email.body_html and email.uid:
         try:
-            account = email.account
-            password = account.imap_password  # TODO: Decrypt password
-            
-            logger.info(f"Fetching content for email {email_id} with UID {email.uid} from folder {email.folder}")
-            
-            # Create IMAP service and fetch content
-            imap_service = IMAPService(account, password)
-            if imap_service.connect():
-                try:
-                    # CRITICAL FIX: Pass the folder to get_email_content
-                    email_content = imap_service.get_email_content(email.uid, email.folder)
-                    if email_content:
-                        # Update the email record with full content
-                        email.body_text = email_content.get('body_text')
-                        email.body_html = email_content.get('body_html')
-                        email.attachments = email_content.get('attachments')
-                        
-                        # Also update other fields if they're missing
-                        if not email.subject and email_content.get('subject'):
-                            email.subject = email_content.get('subject')
-                        if not email.sender_name and email_content.get('sender_name'):
-                            email.sender_name = email_content.get('sender_name')
-                        if not email.to_addresses and email_content.get('to_addresses'):
-                            email.to_addresses = email_content.get('to_addresses')
-                        
-                        db.commit()
-                        logger.info(f"Successfully updated email {email_id} with full content")
-                    else:
-                        logger.warning(f"No content returned for email {email_id} UID {email.uid}")
-                finally:
-                    imap_service.disconnect()
-            else:
-                logger.error(f"Failed to connect to IMAP server for email {email_id}")
+            stored, _ = await run_in_threadpool(
+                single_flight.run, f"body:{email_id}", lambda: _fetch_body(email_id, current.account_id),
+                settings.BODY_FETCH_LOCK_TTL, settings.BODY_FETCH_LOCK_WAIT
+            )
+            if stored:
+                # The body was stored through another session
+                email = await _load_email(db, email_id, email.account_id)
         except Exception as e:
             logger.error(f"Could not fetch full email content for email {email_id}: {str(e)}")
     
+    version = await db.scalar(select(FolderState.version).where(
+        FolderState.account_id == email.account_id,
+        FolderState.folder == email.folder
+    ))
+    response.headers.update(_validator_headers(_email_etag(email_id, email.updated_at or email.created_at, version)))
+    
+    return email
+
+
+async def _account_ids(db: AsyncSession, user_id: int) -> List[int]:
+    """The user's account ids, for filtering emails by account_id (which partitioned tables prune on)"""
+    return (await db.scalars(select(EmailAccount.id).where(EmailAccount.user_id == user_id))).all()
+
+
+async def _load_email(db: AsyncSession, email_id: int, account_id: int) -> Email:
+    """The email with its bodies (deferred otherwise), reloaded from the database, archived bodies included"""
+    email = await db.scalar(
+        select(Email).where(Email.id == email_id, Email.account_id == account_id)
+        .options(undefer_group("body")).execution_options(populate_existing=True)
+    )
+    if email is not None and email.archived_at is not None:
+        # Detached so the archived bodies are only served, never written back to the hot row
+        db.expunge(email)
+        rehydrate(email, await db.get(ArchivedEmailBody, email_id))
     return email
 
 
+def _fetch_body(email_id: int, account_id: int) -> bool:
+    """Load a message's content from the raw message store or IMAP and save it; True if it was saved. Blocking."""
+    db = SessionLocal()
+    try:
+        email = db.query(Email).filter(Email.id == email_id, Email.account_id == account_id).first()
+        email_content = load_stored_content(email.raw_hash, email.uid) or _fetch_from_imap(email)
+        if not email_content:
+            return False
+        
+        write_queue.apply(db, _store_content, email_id, account_id, email_content, idempotent=True)
+        logger.info(f"Successfully updated email {email_id} with full content")
+        return True
+    finally:
+        db.close()
+
+
+def _store_content(db: Session, email_id: int, account_id: int, email_content: dict):
+    email = db.scalar(select(Email).where(Email.id == email_id, Email.account_id == account_id))
+    
+    # Update the email record with full content
+    email.body_text = email_content.get('body_text')
+    email.body_html = email_content.get('body_html')
+    email.attachments = email_content.get('attachments')
+    email.raw_hash = email_content.get('raw_hash') or email.raw_hash
+    # The row holds the full bodies again, so an archived copy would overwrite them when served
+    unarchive(db, email)
+    
+    # Also update other fields if they're missing
+    if not email.subject and email_content.get('subject'):
+        email.subject = email_content.get('subject')
+    if not email.sender_name and email_content.get('sender_name'):
+        email.sender_name = email_content.get('sender_name')
+    if not email.to_addresses and email_content.get('to_addresses'):
+        email.to_addresses = email_content.get('to_addresses')
+
+
+def _fetch_from_imap(email: Email) -> Optional[dict]:
+    """Fetch and parse a message from the server, keeping the original in the raw message store"""
+    account = email.account
+    password = account_password(account, "imap")
+    
+    logger.info(f"Fetching content for email {email.id} with UID {email.uid} from folder {email.folder}")
+    
+    # Create IMAP service and fetch content
+    imap_service = IMAPService(account, password)
+    if not imap_service.connect():
+        logger.error(f"Failed to connect to IMAP server for email {email.id}")
+        return None
+    
+    try:
+        # CRITICAL FIX: Pass the folder to get_email_content
+        email_content = imap_service.get_email_content(email.uid, email.folder)
+        if not email_content:
+            logger.warning(f"No content returned for email {email.id} UID {email.uid}")
+        return email_content
+    finally:
+        imap_service.disconnect()
+
+
+def _store_raw(email_id: int, account_id: int) -> Optional[str]:
+    """Digest of the message in the raw message store, fetching it from IMAP if missing. Blocking."""
+    db = SessionLocal()
+    try:
+        email = db.query(Email).filter(Email.id == email_id, Email.account_id == account_id).first()
+        if email.raw_hash and message_store.has(email.raw_hash):
+            return email.raw_hash
+        if not email.uid:
+            return None
+        
+        email_content = _fetch_from_imap(email)
+        if not email_content or not email_content.get('raw_hash'):
+            return None
+        raw_hash = email_content['raw_hash']
+        write_queue.apply(db, _store_raw_hash, email_id, raw_hash, idempotent=True)
+        return raw_hash
+    finally:
+        db.close()
+
+
+def _store_raw_hash(db: Session, email_id: int, raw_hash: str):
+    db.get(Email, email_id).raw_hash = raw_hash
+
+
+@router.get("/{email_id}/raw")
+async def get_raw_email(
+    email_id: int,
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Download the original message (message/rfc822), e.g. for export"""
+    
+    account_id = await db.scalar(select(Email.account_id).where(
+        Email.id == email_id,
+        Email.account_id.in_(await _account_ids(db, current_user.id)),
+        Email.is_deleted.isnot(True)
+    ))
+    
+    if not account_id:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Email not found"
+        )
+    
+    raw_hash, _ = await run_in_threadpool(
+        single_flight.run, f"raw:{email_id}", lambda: _store_raw(email_id, account_id),
+        settings.BODY_FETCH_LOCK_TTL, settings.BODY_FETCH_LOCK_WAIT
+    )
+    raw = await run_in_threadpool(message_store.get, raw_hash) if raw_hash else None
+    if raw is None:
+        raise HTTPException(
+            status_code=status.HTTP_502_BAD_GATEWAY,
+            detail="Original message is not available"
+        )
+    
+    return Response(content=raw, media_type="message/rfc822", headers={
+        "Content-Disposition": f'attachment; filename="email-{email_id}.eml"',
+        "Cache-Control": "private, max-age=31536000, immutable"
+    })
+
+
+def _email_etag(email_id: int, updated_at, folder_version: Optional[int]) -> str:
+    return make_etag("email", email_id, updated_at, folder_version or 0)
+
+
+def _validator_headers(etag: str) -> dict:
+    # Clients may keep the response but must revalidate before using it
+    return {"ETag": etag, "Cache-Control": "private, no-cache"}
+
+
 @router.put("/{email_id}", response_model=EmailSchema)
 async def update_email(
     email_id: int,
     email_update: EmailUpdate,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Update email (mark as read/unread, star, etc.)"""
     
-    email = db.query(Email).join(EmailAccount).filter(
+    email = await db.scalar(select(Email).where(
         Email.id == email_id,
-        EmailAccount.user_id == current_user.id
-    ).first()
+        Email.account_id.in_(await _account_ids(db, current_user.id))
+    ))
     
     if not email:
         raise HTTPException(
@@ -132,46 +327,47 @@ async def update_email(
             detail="Email not found"
         )
     
-    # If we're marking as read/unread, also update it on the server
-    if 'is_read' in email_update.dict(exclude_unset=True):
-        try:
-            account = email.account
-            password = account.imap_password  # TODO: Decrypt password
-            
-            imap_service = IMAPService(account, password)
-            if imap_service.connect():
-                try:
-                    if email_update.is_read:
-                        imap_service.mark_as_read(email.uid, email.folder)
-                    else:
-                        imap_service.mark_as_unread(email.uid, email.folder)
-                finally:
-                    imap_service.disconnect()
-        except Exception as e:
-            logger.warning(f"Could not update read status on server for email {email_id}: {str(e)}")
-    
-    # Update fields
-    for field, value in email_update.dict(exclude_unset=True).items():
-        setattr(email, field, value)
-    
-    db.commit()
-    db.refresh(email)
+    # Update fields; read, starred and folder changes reach the server in the flag sync worker's next batch
+    changes = email_update.dict(exclude_unset=True)
+    previous_folder = email.folder
+    await write_queue.apply_async(db, _update_email_fields, email_id, email.account_id, changes, idempotent=True)
+    email = await _load_email(db, email_id, email.account_id)
+    
+    event_broker.publish(current_user.id, "email.updated", {
+        "id": email.id,
+        "account_id": email.account_id,
+        "folder": email.folder,
+        "changes": changes
+    })
+    for folder in {previous_folder, email.folder}:
+        await publish_folder_counters_async(db, current_user.id, email.account_id, folder)
     
     return email
 
 
+def _update_email_fields(db: Session, email_id: int, account_id: int, changes: dict):
+    email = db.scalar(select(Email).where(Email.id == email_id, Email.account_id == account_id))
+    queue_flag_changes(db, email, changes)
+    if "is_deleted" in changes and bool(changes["is_deleted"]) != bool(email.is_deleted):
+        email.deleted_at = datetime.utcnow() if changes["is_deleted"] else None
+        email.expunged_at = None
+    for field, value in changes.items():
+        setattr(email, field, value)
+
+
 @router.delete("/{email_id}")
 async def delete_email(
     email_id: int,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Delete an email"""
     
-    email = db.query(Email).join(EmailAccount).filter(
+    email = await db.scalar(select(Email).where(
         Email.id == email_id,
-        EmailAccount.user_id == current_user.id
-    ).first()
+        Email.account_id.in_(await _account_ids(db, current_user.id)),
+        Email.is_deleted.isnot(True)
+    ))
     
     if not email:
         raise HTTPException(
@@ -179,26 +375,32 @@ async def delete_email(
             detail="Email not found"
         )
     
-    # Mark as deleted instead of actually deleting
-    email.is_deleted = True
-    db.commit()
+    # Mark as deleted; the flag sync worker removes it on the server and the row is purged later
+    await write_queue.apply_async(db, _update_email_fields, email_id, email.account_id, {"is_deleted": True}, idempotent=True)
+    
+    event_broker.publish(current_user.id, "email.deleted", {
+        "id": email_id,
+        "account_id": email.account_id,
+        "folder": email.folder
+    })
+    await publish_folder_counters_async(db, current_user.id, email.account_id, email.folder)
     
     return {"message": "Email deleted successfully"}
 
 
-@router.post("/compose")
+@router.post("/compose", status_code=status.HTTP_202_ACCEPTED)
 async def compose_email(
     email_data: EmailCompose,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
-    """Compose and send a new email"""
+    """Queue a new email for background delivery"""
     
     # Get the email account
-    account = db.query(EmailAccount).filter(
+    account = await db.scalar(select(EmailAccount).where(
         EmailAccount.id == email_data.account_id,
         EmailAccount.user_id == current_user.id
-    ).first()
+    ))
     
     if not account:
         raise HTTPException(
@@ -206,29 +408,119 @@ async def compose_email(
             detail="Email account not found"
         )
     
-    # TODO: Implement proper password decryption
-    # For now, use stored password directly (NOT SECURE)
-    password = account.smtp_password
+    try:
+        outbox_id = await write_queue.apply_async(db, enqueue_email, email_data)
+    except Exception as e:
+        logger.error(f"Error queueing email: {str(e)}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Error queueing email: {str(e)}"
+        )
+    
+    outbox_worker.notify()
+    
+    return {"message": "Email queued for delivery", "outbox_id": outbox_id, "status": "queued"}
+
+
+@router.post("/bulk", status_code=status.HTTP_202_ACCEPTED)
+async def bulk_send_emails(
+    bulk_data: EmailBulkSend,
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Queue one templated email per recipient for background delivery"""
+    
+    account = await db.scalar(select(EmailAccount).where(
+        EmailAccount.id == bulk_data.account_id,
+        EmailAccount.user_id == current_user.id
+    ))
+    
+    if not account:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Email account not found"
+        )
+    
+    if len(bulk_data.recipients) > settings.BULK_SEND_MAX_RECIPIENTS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"At most {settings.BULK_SEND_MAX_RECIPIENTS} recipients per request"
+        )
+    
+    messages = await run_in_threadpool(render_messages, bulk_data)
+    payloads = [message.model_dump(mode="json") for message in messages]
+    bulk_id = uuid.uuid4().hex
     
     try:
-        # Send email via SMTP
-        with SMTPService(account, password) as smtp:
-            success, error = smtp.send_email(email_data)
-            
-            if not success:
-                raise HTTPException(
-                    status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                    detail=f"Failed to send email: {error}"
-                )
-        
-        return {"message": "Email sent successfully"}
-        
+        queued = await write_queue.apply_async(db, enqueue_bulk, account.id, payloads, bulk_id)
     except Exception as e:
-        logger.error(f"Error sending email: {str(e)}")
+        logger.error(f"Error queueing bulk send: {str(e)}")
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"Error sending email: {str(e)}"
+            detail=f"Error queueing bulk send: {str(e)}"
         )
+    
+    outbox_worker.notify()
+    
+    return {"message": "Emails queued for delivery", "bulk_id": bulk_id, "queued": queued, "status": "queued"}
+
+
+@router.get("/bulk/{bulk_id}", response_model=BulkSendStatus)
+async def get_bulk_send_status(
+    bulk_id: str,
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Get how far a bulk send has got, with the recipients it failed for"""
+    
+    mine = (OutboundEmail.bulk_id == bulk_id, OutboundEmail.account_id.in_(await _account_ids(db, current_user.id)))
+    counts = dict((await db.execute(
+        select(OutboundEmail.status, func.count()).where(*mine).group_by(OutboundEmail.status)
+    )).all())
+    
+    if not counts:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Bulk send not found"
+        )
+    
+    failed = (await db.execute(
+        select(OutboundEmail.payload, OutboundEmail.last_error).where(*mine, OutboundEmail.status == "failed")
+    )).all()
+    
+    return {
+        "bulk_id": bulk_id,
+        "queued": counts.get("queued", 0),
+        "sending": counts.get("sending", 0),
+        "sent": counts.get("sent", 0),
+        "failed": counts.get("failed", 0),
+        "failures": [
+            {"email": payload["to_addresses"][0]["email"], "success": False, "error": error}
+            for payload, error in failed
+        ]
+    }
+
+
+@router.get("/outbox/{outbox_id}", response_model=OutboundEmailStatus)
+async def get_outbound_email_status(
+    outbox_id: int,
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Get the delivery status of a queued email"""
+    
+    item = await db.scalar(select(OutboundEmail).join(EmailAccount).where(
+        OutboundEmail.id == outbox_id,
+        EmailAccount.user_id == current_user.id
+    ))
+    
+    if not item:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Outbound email not found"
+        )
+    
+    return item
 
 
 @router.post("/sync/{account_id}")
@@ -236,15 +528,15 @@ async def sync_emails(
     account_id: int,
     folder: str = Query("INBOX"),
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Sync emails from IMAP server - IMPROVED VERSION"""
     
     # Get the email account
-    account = db.query(EmailAccount).filter(
+    account = await db.scalar(select(EmailAccount).where(
         EmailAccount.id == account_id,
         EmailAccount.user_id == current_user.id
-    ).first()
+    ))
     
     if not account:
         raise HTTPException(
@@ -252,107 +544,13 @@ async def sync_emails(
             detail="Email account not found"
         )
     
-    # TODO: Implement proper password decryption
-    # For now, use stored password directly (NOT SECURE)
-    password = account.imap_password
-    
     try:
-        # Fetch emails via IMAP
-        imap_service = IMAPService(account, password)
-        
-        if not imap_service.connect():
-            raise HTTPException(
-                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                detail="Could not connect to IMAP server"
-            )
+        # Concurrent syncs of the same folder (other tabs, other workers) share one IMAP session
+        result = await run_in_threadpool(run_sync, account.id, folder, 50)
+        synced_count = result["synced"]
+        updated_count = result["updated"]
+        full_content_count = result["full_content"]
         
-        try:
-            logger.info(f"Starting email sync for account {account_id}, folder {folder}")
-            email_list = imap_service.get_email_list(folder=folder, limit=50)
-            logger.info(f"Retrieved {len(email_list)} emails from IMAP server")
-            
-            synced_count = 0
-            updated_count = 0
-            full_content_count = 0
-            
-            for email_data in email_list:
-                try:
-                    # Check if email already exists
-                    existing = db.query(Email).filter(
-                        Email.message_id == email_data.get('message_id', ''),
-                        Email.account_id == account_id
-                    ).first()
-                    
-                    if not existing:
-                        # For new emails, try to get full content immediately
-                        full_content = None
-                        if email_data.get('uid'):
-                            try:
-                                full_content = imap_service.get_email_content(email_data['uid'], folder)
-                                if full_content:
-                                    full_content_count += 1
-                            except Exception as e:
-                                logger.debug(f"Could not fetch full content for UID {email_data.get('uid')}: {e}")
-                        
-                        # Use full content if available, otherwise use header data
-                        content_data = full_content if full_content else email_data
-                        
-                        # Create new email record
-                        new_email = Email(
-                            account_id=account_id,
-                            message_id=content_data.get('message_id', ''),
-                            uid=content_data.get('uid'),
-                            subject=content_data.get('subject'),
-                            sender_email=content_data.get('sender_email', ''),
-                            sender_name=content_data.get('sender_name'),
-                            reply_to=content_data.get('reply_to'),
-                            to_addresses=content_data.get('to_addresses'),
-                            body_text=content_data.get('body_text'),
-                            body_html=content_data.get('body_html'),
-                            attachments=content_data.get('attachments'),
-                            date_sent=content_data.get('date_sent'),
-                            date_received=content_data.get('date_received'),
-                            size=content_data.get('size', 0),
-                            is_read=content_data.get('is_read', False),
-                            folder=folder
-                        )
-                        
-                        db.add(new_email)
-                        synced_count += 1
-                    else:
-                        # Update existing email if read status changed
-                        if existing.is_read != email_data.get('is_read', False):
-                            existing.is_read = email_data.get('is_read', False)
-                            updated_count += 1
-                        
-                        # If existing email doesn't have content, try to fetch it
-                        if not existing.body_text and not existing.body_html and existing.uid:
-                            try:
-                                full_content = imap_service.get_email_content(existing.uid, folder)
-                                if full_content:
-                                    existing.body_text = full_content.get('body_text')
-                                    existing.body_html = full_content.get('body_html')
-                                    existing.attachments = full_content.get('attachments')
-                                    updated_count += 1
-                                    full_content_count += 1
-                            except Exception as e:
-                                logger.debug(f"Could not fetch full content for existing email {existing.id}: {e}")
-                            
-                except Exception as e:
-                    logger.error(f"Error processing email {email_data.get('uid', 'unknown')}: {str(e)}")
-                    continue
-            
-            # Update account last sync time
-            from datetime import datetime
-            account.last_sync = datetime.utcnow()
-            
-            db.commit()
-            
-            logger.info(f"Sync completed: {synced_count} new emails, {updated_count} updated emails, {full_content_count} with full content")
-            
-        finally:
-            imap_service.disconnect()
-            
         message = f"Successfully synced {synced_count} new emails"
         if updated_count > 0:
             message += f" and updated {updated_count} existing emails"
@@ -364,6 +562,16 @@ async def sync_emails(
     except HTTPException:
         # Re-raise HTTP exceptions
         raise
+    except ConnectionError:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Could not connect to IMAP server"
+        )
+    except FlightBusy:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="A sync of this folder is already in progress"
+        )
     except Exception as e:
         logger.error(f"Error syncing emails: {str(e)}")
         raise HTTPException(
@@ -376,41 +584,49 @@ async def sync_emails(
 async def search_emails(
     search_data: EmailSearch,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Search emails"""
     
-    query = db.query(Email).join(EmailAccount).filter(EmailAccount.user_id == current_user.id)
+    query = select(*EMAIL_COLUMNS).where(
+        Email.account_id.in_(await _account_ids(db, current_user.id)),
+        Email.is_deleted.isnot(True)
+    )
     
     # Apply search filters
     if search_data.query:
-        query = query.filter(
+        query = query.where(
             Email.subject.contains(search_data.query) |
-            Email.body_text.contains(search_data.query) |
+            searchable_body(Email.body_text).contains(search_data.query) |
+            # Archived emails keep only a preview on the row
+            (Email.archived_at.isnot(None) & exists().where(
+                ArchivedEmailBody.email_id == Email.id,
+                searchable_body(ArchivedEmailBody.body_text).contains(search_data.query)
+            )) |
             Email.sender_email.contains(search_data.query)
         )
     
     if search_data.folder:
-        query = query.filter(Email.folder == search_data.folder)
+        query = query.where(Email.folder == search_data.folder)
     
     if search_data.sender:
-        query = query.filter(Email.sender_email.contains(search_data.sender))
+        query = query.where(Email.sender_email.contains(search_data.sender))
     
     if search_data.subject:
-        query = query.filter(Email.subject.contains(search_data.subject))
+        query = query.where(Email.subject.contains(search_data.subject))
     
     if search_data.date_from:
-        query = query.filter(Email.date_received >= search_data.date_from)
+        query = query.where(Email.date_received >= search_data.date_from)
     
     if search_data.date_to:
-        query = query.filter(Email.date_received <= search_data.date_to)
+        query = query.where(Email.date_received <= search_data.date_to)
     
     if search_data.is_read is not None:
-        query = query.filter(Email.is_read == search_data.is_read)
+        query = query.where(Email.is_read == search_data.is_read)
     
     if search_data.is_starred is not None:
-        query = query.filter(Email.is_starred == search_data.is_starred)
+        query = query.where(Email.is_starred == search_data.is_starred)
     
-    emails = query.order_by(Email.date_received.desc()).limit(100).all()
+    emails = (await db.execute(query.order_by(Email.date_received.desc()).limit(100))).all()
     
-    return emails
+    return rows_response(emails)
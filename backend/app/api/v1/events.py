@@ -0,0 +1,83 @@
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, status
+from fastapi.responses import StreamingResponse
+from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from starlette.types import Receive, Scope, Send
+from typing import Optional
+
+from app.core.config import settings
+from app.core.database import AsyncSessionLocal
+from app.core.security import create_credentials_exception
+from app.api.v1.auth import get_user_from_token
+from app.services.events import Subscription, event_broker
+
+router = APIRouter()
+optional_security = HTTPBearer(auto_error=False)
+
+
+@router.get("/stream")
+async def stream_events(
+    request: Request,
+    token: Optional[str] = Query(None),
+    credentials: Optional[HTTPAuthorizationCredentials] = Depends(optional_security)
+):
+    """Server-sent events for new mail, flag changes and folder counters.
+
+    EventSource cannot set headers, so the access token may also be passed as ?token=.
+    """
+    access_token = credentials.credentials if credentials else token
+    if not access_token:
+        raise create_credentials_exception()
+
+    # Authenticate with a short-lived session so no connection is held for the stream's lifetime
+    async with AsyncSessionLocal() as db:
+        user_id = (await get_user_from_token(db, access_token)).id
+
+    subscription = event_broker.subscribe(user_id)
+    if subscription is None:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Too many open event streams"
+        )
+
+    return EventStreamResponse(
+        subscription,
+        _event_stream(request, subscription),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+class EventStreamResponse(StreamingResponse):
+    """Streams a subscription's events and unsubscribes once the response ends, however it ends.
+
+    The generator's own cleanup only runs if it was started, which it is not
+    when the client goes away before the first chunk or sending fails.
+    """
+
+    def __init__(self, subscription: Subscription, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.subscription = subscription
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            # Unsubscribing twice is harmless
+            event_broker.unsubscribe(self.subscription)
+
+
+async def _event_stream(request: Request, subscription: Subscription):
+    try:
+        yield "retry: 5000\nevent: ready\ndata: {}\n\n"
+        while True:
+            message = await subscription.next_event(settings.EVENTS_KEEPALIVE_INTERVAL)
+            if message is None:
+                if await request.is_disconnected():
+                    break
+                yield ": keepalive\n\n"
+                continue
+            yield message
+            if subscription.dropped and subscription.queue.empty():
+                break
+    finally:
+        event_broker.unsubscribe(subscription)
@@ -0,0 +1,407 @@
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+import asyncio
+import logging
+import threading
+import time
+import uuid
+
+import orjson
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class CacheBackend:
+    """Byte-oriented key/value store with per-key expiry"""
+
+    def get(self, key: str) -> Optional[bytes]:
+        raise NotImplementedError
+
+    def set(self, key: str, value: bytes, ttl: int):
+        raise NotImplementedError
+
+    def delete(self, *keys: str):
+        raise NotImplementedError
+
+    def add(self, key: str, value: bytes, ttl: int) -> bool:
+        """Set only if the key doesn't exist; True if it was set"""
+        raise NotImplementedError
+
+    def delete_if_equal(self, key: str, value: bytes):
+        """Delete a key only if it still holds value (for releasing locks)"""
+        raise NotImplementedError
+
+    # For the event loop; backends doing network I/O override these, in-process ones need not
+    async def get_async(self, key: str) -> Optional[bytes]:
+        return self.get(key)
+
+    async def set_async(self, key: str, value: bytes, ttl: int):
+        self.set(key, value, ttl)
+
+    async def delete_async(self, *keys: str):
+        self.delete(*keys)
+
+    async def add_async(self, key: str, value: bytes, ttl: int) -> bool:
+        return self.add(key, value, ttl)
+
+    async def delete_if_equal_async(self, key: str, value: bytes):
+        self.delete_if_equal(key, value)
+
+
+class MemoryCache(CacheBackend):
+    """In-process LRU cache, for tests and single-worker deployments"""
+
+    def __init__(self, max_entries: int = 10000):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Tuple[bytes, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: bytes, ttl: int):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, *keys: str):
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+
+    def add(self, key: str, value: bytes, ttl: int) -> bool:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] > time.monotonic():
+                return False
+            self._entries[key] = (value, time.monotonic() + ttl)
+            return True
+
+    def delete_if_equal(self, key: str, value: bytes):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == value:
+                del self._entries[key]
+
+
+class RedisCache(CacheBackend):
+    """Redis-backed cache shared by all workers.
+
+    Threads use a blocking client; the event loop gets a redis.asyncio client
+    of its own, so request handlers never wait on Redis with the loop blocked.
+    """
+
+    # Compare-and-delete so a lock is only released by its owner
+    RELEASE_SCRIPT = "if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('del', KEYS[1]) end return 0"
+
+    def __init__(self, url: str):
+        import redis
+
+        self.url = url
+        self.client = redis.Redis.from_url(url, socket_timeout=1, socket_connect_timeout=1)
+        self._release = self.client.register_script(self.RELEASE_SCRIPT)
+        # Connections belong to the loop that opened them; a new loop (e.g. in tests) gets a new client
+        self._async_client = None
+        self._async_release = None
+        self._async_loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def get(self, key: str) -> Optional[bytes]:
+        return self.client.get(key)
+
+    def set(self, key: str, value: bytes, ttl: int):
+        self.client.set(key, value, ex=ttl)
+
+    def delete(self, *keys: str):
+        if keys:
+            self.client.delete(*keys)
+
+    def add(self, key: str, value: bytes, ttl: int) -> bool:
+        return bool(self.client.set(key, value, ex=ttl, nx=True))
+
+    def delete_if_equal(self, key: str, value: bytes):
+        self._release(keys=[key], args=[value])
+
+    async def get_async(self, key: str) -> Optional[bytes]:
+        return await self._client_async().get(key)
+
+    async def set_async(self, key: str, value: bytes, ttl: int):
+        await self._client_async().set(key, value, ex=ttl)
+
+    async def delete_async(self, *keys: str):
+        if keys:
+            await self._client_async().delete(*keys)
+
+    async def add_async(self, key: str, value: bytes, ttl: int) -> bool:
+        return bool(await self._client_async().set(key, value, ex=ttl, nx=True))
+
+    async def delete_if_equal_async(self, key: str, value: bytes):
+        client = self._client_async()
+        await self._async_release(keys=[key], args=[value], client=client)
+
+    def _client_async(self):
+        loop = asyncio.get_running_loop()
+        if self._async_loop is not loop:
+            import redis.asyncio
+
+            self._async_client = redis.asyncio.Redis.from_url(self.url, socket_timeout=1, socket_connect_timeout=1)
+            self._async_release = self._async_client.register_script(self.RELEASE_SCRIPT)
+            self._async_loop = loop
+        return self._async_client
+
+
+class Cache:
+    """Namespaced cache with stampede protection and hit/miss counters.
+
+    Backend errors are logged and treated as misses so a cache outage never
+    fails a request. On a miss, one caller (across all workers when the backend
+    is shared) computes the value while the others wait briefly for it.
+    """
+
+    def __init__(self, backend: CacheBackend, prefix: str = "mailbox"):
+        self.backend = backend
+        self.prefix = prefix
+        self._stats: Dict[str, Dict[str, int]] = {}
+        self._stats_lock = threading.Lock()
+        self._local_locks: Dict[str, threading.Lock] = {}
+        self._async_locks: Dict[str, asyncio.Lock] = {}
+
+    def key(self, namespace: str, *parts: Any) -> str:
+        return ":".join([self.prefix, namespace, *(str(part) for part in parts)])
+
+    def get_or_set(self, namespace: str, parts: tuple, loader: Callable[[], Any], ttl: Optional[int] = None) -> Any:
+        """Cached JSON-serializable value, computing it with loader on a miss"""
+        return self._get_or_set(namespace, parts, loader, ttl, orjson.dumps, orjson.loads)
+
+    def get_or_set_bytes(self, namespace: str, parts: tuple, loader: Callable[[], bytes], ttl: Optional[int] = None) -> bytes:
+        """Like get_or_set for values that are already bytes, e.g. rendered responses"""
+        return self._get_or_set(namespace, parts, loader, ttl, bytes, bytes)
+
+    async def get_or_set_async(self, namespace: str, parts: tuple, loader: Callable[[], Awaitable[Any]], ttl: Optional[int] = None) -> Any:
+        """get_or_set for request handlers, with a coroutine loader; waiting never blocks the event loop"""
+        return await self._get_or_set_async(namespace, parts, loader, ttl, orjson.dumps, orjson.loads)
+
+    async def get_or_set_bytes_async(self, namespace: str, parts: tuple, loader: Callable[[], Awaitable[bytes]], ttl: Optional[int] = None) -> bytes:
+        return await self._get_or_set_async(namespace, parts, loader, ttl, bytes, bytes)
+
+    def delete(self, namespace: str, *parts: Any):
+        try:
+            self.backend.delete(self.key(namespace, *parts))
+        except Exception as e:
+            self._record(namespace, "errors")
+            logger.warning(f"Cache delete failed for {namespace}: {str(e)}")
+
+    async def delete_async(self, namespace: str, *parts: Any):
+        """delete for request handlers"""
+        try:
+            await self.backend.delete_async(self.key(namespace, *parts))
+        except Exception as e:
+            self._record(namespace, "errors")
+            logger.warning(f"Cache delete failed for {namespace}: {str(e)}")
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        """Hit/miss/error counters per namespace for this worker"""
+        with self._stats_lock:
+            return {namespace: dict(counts) for namespace, counts in self._stats.items()}
+
+    def _get_or_set(self, namespace, parts, loader, ttl, encode, decode):
+        ttl = ttl or settings.EMAIL_CACHE_TIMEOUT
+        key = self.key(namespace, *parts)
+
+        cached = self._read(namespace, key)
+        if cached is not None:
+            self._record(namespace, "hits")
+            return decode(cached)
+        self._record(namespace, "misses")
+
+        # Only one thread per worker computes a given key...
+        with self._local_lock(key):
+            cached = self._read(namespace, key)
+            if cached is not None:
+                self._record(namespace, "coalesced")
+                return decode(cached)
+
+            # ...and only one worker, if another one already holds the fill lock we wait for its result
+            token = self._acquire_fill_lock(namespace, key)
+            if token is None:
+                cached = self._wait_for_fill(namespace, key)
+                if cached is not None:
+                    self._record(namespace, "coalesced")
+                    return decode(cached)
+
+            try:
+                value = loader()
+                self._write(namespace, key, encode(value), ttl)
+                return value
+            finally:
+                if token is not None:
+                    self._release_fill_lock(key, token)
+
+    async def _get_or_set_async(self, namespace, parts, loader, ttl, encode, decode):
+        ttl = ttl or settings.EMAIL_CACHE_TIMEOUT
+        key = self.key(namespace, *parts)
+
+        cached = await self._read_async(namespace, key)
+        if cached is not None:
+            self._record(namespace, "hits")
+            return decode(cached)
+        self._record(namespace, "misses")
+
+        # Same protocol as _get_or_set, with an asyncio lock per key for tasks on this loop
+        async with self._async_lock(key):
+            cached = await self._read_async(namespace, key)
+            if cached is not None:
+                self._record(namespace, "coalesced")
+                return decode(cached)
+
+            token = await self._acquire_fill_lock_async(namespace, key)
+            if token is None:
+                cached = await self._wait_for_fill_async(namespace, key)
+                if cached is not None:
+                    self._record(namespace, "coalesced")
+                    return decode(cached)
+
+            try:
+                value = await loader()
+                await self._write_async(namespace, key, encode(value), ttl)
+                return value
+            finally:
+                if token is not None:
+                    await self._release_fill_lock_async(key, token)
+
+    def _read(self, namespace: str, key: str) -> Optional[bytes]:
+        try:
+            return self.backend.get(key)
+        except Exception as e:
+            self._record(namespace, "errors")
+            logger.warning(f"Cache read failed for {namespace}: {str(e)}")
+            return None
+
+    def _write(self, namespace: str, key: str, value: bytes, ttl: int):
+        try:
+            self.backend.set(key, value, ttl)
+        except Exception as e:
+            self._record(namespace, "errors")
+            logger.warning(f"Cache write failed for {namespace}: {str(e)}")
+
+    async def _read_async(self, namespace: str, key: str) -> Optional[bytes]:
+        try:
+            return await self.backend.get_async(key)
+        except Exception as e:
+            self._record(namespace, "errors")
+            logger.warning(f"Cache read failed for {namespace}: {str(e)}")
+            return None
+
+    async def _write_async(self, namespace: str, key: str, value: bytes, ttl: int):
+        try:
+            await self.backend.set_async(key, value, ttl)
+        except Exception as e:
+            self._record(namespace, "errors")
+            logger.warning(f"Cache write failed for {namespace}: {str(e)}")
+
+    def _acquire_fill_lock(self, namespace: str, key: str) -> Optional[bytes]:
+        token = uuid.uuid4().hex.encode()
+        try:
+            if self.backend.add(f"{key}:fill", token, settings.CACHE_FILL_LOCK_TIMEOUT):
+                return token
+            return None
+        except Exception as e:
+            self._record(namespace, "errors")
+            logger.warning(f"Cache fill lock failed for {namespace}: {str(e)}")
+            # Without a working backend there's nothing to coordinate through
+            return token
+
+    async def _acquire_fill_lock_async(self, namespace: str, key: str) -> Optional[bytes]:
+        token = uuid.uuid4().hex.encode()
+        try:
+            if await self.backend.add_async(f"{key}:fill", token, settings.CACHE_FILL_LOCK_TIMEOUT):
+                return token
+            return None
+        except Exception as e:
+            self._record(namespace, "errors")
+            logger.warning(f"Cache fill lock failed for {namespace}: {str(e)}")
+            return token
+
+    def _release_fill_lock(self, key: str, token: bytes):
+        try:
+            self.backend.delete_if_equal(f"{key}:fill", token)
+        except Exception:
+            pass
+
+    async def _release_fill_lock_async(self, key: str, token: bytes):
+        try:
+            await self.backend.delete_if_equal_async(f"{key}:fill", token)
+        except Exception:
+            pass
+
+    def _wait_for_fill(self, namespace: str, key: str) -> Optional[bytes]:
+        deadline = time.monotonic() + settings.CACHE_FILL_WAIT
+        delay = 0.01
+        while time.monotonic() < deadline:
+            time.sleep(delay)
+            cached = self._read(namespace, key)
+            if cached is not None:
+                return cached
+            delay = min(delay * 2, 0.2)
+        # The filler is slow or gone; compute it ourselves rather than fail
+        return None
+
+    async def _wait_for_fill_async(self, namespace: str, key: str) -> Optional[bytes]:
+        deadline = time.monotonic() + settings.CACHE_FILL_WAIT
+        delay = 0.01
+        while time.monotonic() < deadline:
+            await asyncio.sleep(delay)
+            cached = await self._read_async(namespace, key)
+            if cached is not None:
+                return cached
+            delay = min(delay * 2, 0.2)
+        return None
+
+    def _async_lock(self, key: str) -> asyncio.Lock:
+        with self._stats_lock:
+            lock = self._async_locks.get(key)
+            if lock is None:
+                if len(self._async_locks) > 10000:
+                    self._async_locks = {k: v for k, v in self._async_locks.items() if v.locked()}
+                lock = self._async_locks[key] = asyncio.Lock()
+            return lock
+
+    def _local_lock(self, key: str) -> threading.Lock:
+        with self._stats_lock:
+            lock = self._local_locks.get(key)
+            if lock is None:
+                if len(self._local_locks) > 10000:
+                    self._local_locks = {k: v for k, v in self._local_locks.items() if v.locked()}
+                lock = self._local_locks[key] = threading.Lock()
+            return lock
+
+    def _record(self, namespace: str, counter: str):
+        with self._stats_lock:
+            counts = self._stats.setdefault(namespace, {"hits": 0, "misses": 0, "coalesced": 0, "errors": 0})
+            counts[counter] += 1
+
+
+def create_cache() -> Cache:
+    """Redis when REDIS_URL is configured, otherwise an in-process LRU"""
+    if settings.REDIS_URL:
+        try:
+            return Cache(RedisCache(settings.REDIS_URL))
+        except ImportError:
+            logger.warning("REDIS_URL is set but the redis package is not installed; using in-memory cache")
+    return Cache(MemoryCache(settings.CACHE_MAX_ENTRIES))
+
+
+# Global instance
+cache = create_cache()
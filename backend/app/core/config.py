@@ -7,9 +7,29 @@ class Settings(BaseSettings):
     HOST: str = "0.0.0.0"
     PORT: int = 8000
     DEBUG: bool = True
+    WEB_CONCURRENCY: int = 1  # Worker processes; uvicorn reads the same variable, so set it rather than --workers
     
     # Database
     DATABASE_URL: str = "sqlite:///./data/email.db"
+    ASYNC_DATABASE_URL: Optional[str] = None  # Derived from DATABASE_URL (aiosqlite/asyncpg) when unset
+    DATABASE_POOL_SIZE: int = 5
+    DATABASE_MAX_OVERFLOW: int = 10
+    DATABASE_POOL_TIMEOUT: int = 30  # Seconds to wait for a free connection
+    DATABASE_POOL_RECYCLE: int = 1800  # Reconnect connections older than this
+    
+    # SQLite Production Profile (WAL, tuned pragmas, batched small writes)
+    SQLITE_PRODUCTION_PROFILE: bool = False
+    SQLITE_SYNCHRONOUS: str = "NORMAL"  # Safe with WAL; a power loss can only drop the last commits
+    SQLITE_MMAP_SIZE: int = 268435456  # 256MB of the database file memory-mapped
+    SQLITE_CACHE_SIZE: int = -65536  # Page cache per connection; negative is KiB, so 64MB
+    SQLITE_BUSY_TIMEOUT: int = 5000  # Milliseconds to wait for a lock before "database is locked"
+    SQLITE_WRITE_BATCH_SIZE: int = 100  # Writes grouped into one transaction
+    SQLITE_WRITE_BATCH_WINDOW: float = 0.002  # Seconds the writer waits for more writes to group
+    
+    # Partitioning (Postgres only; applied online by python -m app.ops.partition_emails, checked at startup)
+    EMAIL_PARTITIONS: int = 0  # Hash partitions of emails by account_id, 0 keeps a single table
+    EMAIL_REPARTITION_BATCH_SIZE: int = 5000  # Email ids copied per transaction when an existing table is repartitioned
+    EMAIL_REPARTITION_BATCH_PAUSE: float = 0.1  # Seconds between batches, leaving room for other writes
     
     # Security
     SECRET_KEY: str = "your-super-secret-key-change-this-in-production"
@@ -29,14 +49,126 @@ class Settings(BaseSettings):
     DEFAULT_SMTP_PORT: int = 465
     DEFAULT_SMTP_SSL: bool = True
     
+    # SMTP Session Pool
+    SMTP_POOL_IDLE_TIMEOUT: int = 60  # Seconds an idle session is kept open
+    SMTP_POOL_MAX_IDLE_PER_ACCOUNT: int = 2
+    SMTP_TIMEOUT: int = 60  # Seconds to connect and for each SMTP command
+    
+    # SMTP Rate Limits (messages per minute, 0 = unlimited)
+    SMTP_DEFAULT_RATE_LIMIT: int = 0
+    SMTP_RATE_LIMITS: dict = {}  # Per SMTP host, e.g. {"send.one.com": 60}
+    BULK_SEND_MAX_RECIPIENTS: int = 10000
+    
+    # Outbound Mail Queue
+    OUTBOX_POLL_INTERVAL: int = 5  # Seconds between queue scans
+    OUTBOX_BATCH_SIZE: int = 20
+    OUTBOX_ACCOUNT_CONCURRENCY: int = 2  # Messages sending at once per account
+    OUTBOX_MAX_ATTEMPTS: int = 8
+    OUTBOX_BACKOFF_BASE: int = 30  # Seconds before the first retry, doubled per attempt
+    OUTBOX_BACKOFF_MAX: int = 3600
+    OUTBOX_SEND_TIMEOUT: int = 300  # Reclaim messages in "sending" once their worker stopped renewing its lease for this long
+    
+    # Sent Mail Copies
+    SENT_APPEND_ENABLED: bool = True  # APPEND sent mail to the IMAP Sent folder, queued and retried like flag changes
+    SENT_COPY_SPOOL_SIZE: int = 1048576  # Keep sent copies in memory up to 1MB, then spill to disk
+    SENT_FOLDER_DEFAULT: str = "Sent"  # Used until the Sent folder has been detected
+    
+    # IMAP Flag Sync (read, starred, folder changes and deletions apply locally at once and reach the server in batches)
+    FLAG_SYNC_WINDOW: float = 2.0  # Seconds a change waits, so changes made right after it go in the same commands
+    FLAG_SYNC_POLL_INTERVAL: float = 1.0  # Seconds between scans for due changes
+    FLAG_SYNC_MAX_ATTEMPTS: int = 6  # Then the change is dropped and the email put back the way it is on the server
+    FLAG_SYNC_BACKOFF_BASE: int = 15  # Seconds before the first retry, doubled per attempt
+    FLAG_SYNC_BACKOFF_MAX: int = 900
+    FLAG_SYNC_LEASE_TTL: int = 60  # Lease that keeps other workers from pushing the same account's changes
+    DELETE_EXPUNGE: bool = False  # Expunge deleted mail on the server; otherwise it moves to Trash (and is expunged there)
+    
+    # IMAP IDLE Listener
+    IMAP_IDLE_ENABLED: bool = True
+    IMAP_IDLE_MAX_CONNECTIONS: int = 50  # Accounts watched per process; each process takes ones no other is watching
+    IMAP_IDLE_TIMEOUT: int = 1500  # Re-issue IDLE after 25 minutes, before the 29 minute server timeout
+    IMAP_POLL_INTERVAL: int = 60  # NOOP interval for servers without IDLE
+    IMAP_IDLE_RESCAN_INTERVAL: int = 60  # Seconds between checks for added or removed accounts
+    IMAP_IDLE_RECONNECT_DELAY: int = 5  # Doubled after each consecutive failure
+    IMAP_IDLE_RECONNECT_MAX_DELAY: int = 600
+    IMAP_IDLE_LEASE_TTL: int = 60  # Lease that keeps other workers from watching the same account
+    
+    # Event Streams
+    EVENTS_QUEUE_SIZE: int = 100  # Undelivered events per stream before the client is dropped
+    EVENTS_MAX_STREAMS_PER_USER: int = 5
+    EVENTS_KEEPALIVE_INTERVAL: int = 15  # Seconds between keepalive comments
+    EVENTS_RELAY_QUEUE_SIZE: int = 10000  # Events waiting to go out through Redis; more are dropped and counted
+    
+    # Metrics
+    METRICS_ENABLED: bool = True  # Expose /metrics in the Prometheus text format
+    
+    # Request Profiling (off unless enabled; output is one file per profiled request)
+    PROFILING_ENABLED: bool = False
+    PROFILING_SAMPLE_RATE: float = 0.0  # Fraction of requests profiled at random
+    PROFILING_TOKEN: Optional[str] = None  # Requests with "X-Profile: <token>" are always profiled
+    PROFILING_MODE: str = "sample"  # "sample" for collapsed stacks, "cprofile" to add a .prof of the event loop thread
+    PROFILING_INTERVAL: float = 0.005  # Seconds between stack samples
+    PROFILING_MAX_SECONDS: float = 30.0  # Longer requests and streams are only profiled this long
+    PROFILING_DIR: str = "./data/profiles"
+    PROFILING_KEEP: int = 200  # Newest profiles kept in PROFILING_DIR; older ones are removed
+    
+    # Response Compression
+    COMPRESSION_MIN_SIZE: int = 1024  # Smaller bodies are sent uncompressed
+    COMPRESSION_GZIP_LEVEL: int = 6
+    COMPRESSION_BROTLI_QUALITY: int = 5  # Used when brotli is installed and accepted
+    
     # File Upload
     MAX_FILE_SIZE: int = 5242880  # 5MB
     UPLOAD_DIR: str = "./uploads"
     ALLOWED_IMAGE_EXTENSIONS: set = {".jpg", ".jpeg", ".png", ".gif", ".webp"}
+    UPLOAD_CACHE_MAX_AGE: int = 31536000  # 1 year, for content-hashed files
     
     # Email Configuration
     MAX_EMAILS_PER_FETCH: int = 50
-    EMAIL_CACHE_TIMEOUT: int = 300  # 5 minutes
+    EMAIL_CACHE_TIMEOUT: int = 300  # 5 minutes, default cache entry lifetime
+    MIME_FAST_PARSE: bool = True  # Parse fetched messages with app.services.mime_parser
+    
+    # Body Compression (SQLite stores large bodies gzip-compressed; Postgres compresses them with TOAST)
+    BODY_COMPRESSION_ENABLED: bool = True
+    BODY_COMPRESSION_MIN_SIZE: int = 1024  # Characters; smaller bodies are stored as plain text
+    BODY_COMPRESSION_LEVEL: int = 6
+    BODY_COMPRESSION_MIGRATE: bool = False  # Opt in: compress bodies stored before compression in the background (SQLite only)
+    BODY_COMPRESSION_BATCH_SIZE: int = 200  # Rows rewritten per transaction by the migration
+    BODY_COMPRESSION_BATCH_PAUSE: float = 0.2  # Seconds between migration batches, leaving room for other writes
+    BODY_COMPRESSION_POSTGRES_METHOD: str = "lz4"  # Column compression set on Postgres 14+, empty to keep the default
+    
+    # Cold Storage (bodies of old mail move to the email_archive table, leaving a preview)
+    ARCHIVE_ENABLED: bool = False  # Opt in: list views show only a preview of archived mail
+    ARCHIVE_AFTER_DAYS: int = 365  # By date received
+    ARCHIVE_INTERVAL: int = 21600  # Seconds between archiving runs
+    ARCHIVE_BATCH_SIZE: int = 200  # Emails moved per transaction
+    ARCHIVE_BATCH_PAUSE: float = 0.2  # Seconds between batches, leaving room for other writes
+    ARCHIVE_PREVIEW_LENGTH: int = 200  # Characters of text kept in the emails table for list views
+    
+    # Tombstones (deleted emails are hidden at once and purged once the server has confirmed the deletion)
+    TOMBSTONE_PURGE_ENABLED: bool = True
+    TOMBSTONE_RETENTION: int = 600  # Seconds a deleted row is kept after the server confirmed the deletion
+    TOMBSTONE_PURGE_INTERVAL: int = 600  # Seconds between purge runs
+    TOMBSTONE_PURGE_BATCH_SIZE: int = 500  # Rows removed per transaction
+    TOMBSTONE_PURGE_BATCH_PAUSE: float = 0.1  # Seconds between batches, leaving room for other writes
+    
+    # Raw Message Store (fetched originals, compressed and stored once per distinct message)
+    MESSAGE_STORE_ENABLED: bool = True
+    MESSAGE_STORE_DIR: str = "./data/messages"
+    MESSAGE_STORE_COMPRESSION: str = "zstd"  # Used when zstandard is installed, otherwise zlib
+    
+    # Cache (shared through Redis when REDIS_URL is set, otherwise per process)
+    REDIS_URL: Optional[str] = None
+    CACHE_MAX_ENTRIES: int = 10000  # In-memory cache only
+    CACHE_FILL_LOCK_TIMEOUT: int = 10  # Seconds one worker may hold the right to fill a key
+    CACHE_FILL_WAIT: float = 5  # Seconds other callers wait for that value before computing it themselves
+    USER_CACHE_TTL: int = 60
+    
+    # Single-flight Locks (leases in Redis when REDIS_URL is set, otherwise in the database)
+    SYNC_LOCK_TTL: int = 120  # Lease lifetime, renewed while a sync runs
+    SYNC_LOCK_WAIT: int = 60  # How long a duplicate sync waits for the running one
+    BODY_FETCH_LOCK_TTL: int = 30
+    BODY_FETCH_LOCK_WAIT: int = 20
+    SINGLE_FLIGHT_RESULT_TTL: int = 30  # Shared results are kept this long for waiting workers
     
     class Config:
         env_file = ".env"
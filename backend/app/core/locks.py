@@ -0,0 +1,263 @@
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, Optional, Tuple
+import logging
+import threading
+import time
+import uuid
+
+import orjson
+from sqlalchemy import delete, update
+from sqlalchemy.exc import IntegrityError
+
+from app.core.cache import Cache, RedisCache, cache
+from app.core.config import settings
+from app.core.database import SessionLocal
+from app.core.write_queue import BYPASS
+from app.models.lease import Lease
+
+logger = logging.getLogger(__name__)
+
+
+class LeaseBackend:
+    """Store for expiring named locks"""
+
+    def acquire(self, name: str, owner: str, ttl: float) -> bool:
+        raise NotImplementedError
+
+    def renew(self, name: str, owner: str, ttl: float) -> bool:
+        raise NotImplementedError
+
+    def release(self, name: str, owner: str):
+        raise NotImplementedError
+
+
+class RedisLeaseBackend(LeaseBackend):
+    RENEW_SCRIPT = "if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('pexpire', KEYS[1], ARGV[2]) end return 0"
+    RELEASE_SCRIPT = "if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('del', KEYS[1]) end return 0"
+
+    def __init__(self, client, prefix: str = "mailbox:lease"):
+        self.client = client
+        self.prefix = prefix
+        self._renew = client.register_script(self.RENEW_SCRIPT)
+        self._release = client.register_script(self.RELEASE_SCRIPT)
+
+    def acquire(self, name: str, owner: str, ttl: float) -> bool:
+        return bool(self.client.set(f"{self.prefix}:{name}", owner, px=int(ttl * 1000), nx=True))
+
+    def renew(self, name: str, owner: str, ttl: float) -> bool:
+        return bool(self._renew(keys=[f"{self.prefix}:{name}"], args=[owner, int(ttl * 1000)]))
+
+    def release(self, name: str, owner: str):
+        self._release(keys=[f"{self.prefix}:{name}"], args=[owner])
+
+
+class DatabaseLeaseBackend(LeaseBackend):
+    """Leases in the leases table, for deployments without Redis.
+
+    Written directly rather than through the write queue: a renewal must not
+    wait behind queued batches, and each is one short statement.
+    """
+
+    def acquire(self, name: str, owner: str, ttl: float) -> bool:
+        now = datetime.utcnow()
+        expires_at = now + timedelta(seconds=ttl)
+        db = SessionLocal(info={BYPASS: "leases"})
+        try:
+            # Take over an expired lease, or create it if it doesn't exist
+            taken = db.execute(
+                update(Lease)
+                .where(Lease.name == name, Lease.expires_at < now)
+                .values(owner=owner, expires_at=expires_at)
+            ).rowcount
+            if not taken:
+                db.add(Lease(name=name, owner=owner, expires_at=expires_at))
+                db.flush()
+            db.commit()
+            return True
+        except IntegrityError:
+            db.rollback()
+            return False
+        finally:
+            db.close()
+
+    def renew(self, name: str, owner: str, ttl: float) -> bool:
+        db = SessionLocal(info={BYPASS: "leases"})
+        try:
+            renewed = db.execute(
+                update(Lease)
+                .where(Lease.name == name, Lease.owner == owner)
+                .values(expires_at=datetime.utcnow() + timedelta(seconds=ttl))
+            ).rowcount
+            db.commit()
+            return bool(renewed)
+        finally:
+            db.close()
+
+    def release(self, name: str, owner: str):
+        db = SessionLocal(info={BYPASS: "leases"})
+        try:
+            db.execute(delete(Lease).where(Lease.name == name, Lease.owner == owner))
+            db.commit()
+        finally:
+            db.close()
+
+
+class LeaseLock:
+    """A lease that is renewed in the background while held.
+
+    If a renewal fails (the lease expired and someone else took it), lost is set.
+    """
+
+    def __init__(self, backend: LeaseBackend, name: str, ttl: float):
+        self.backend = backend
+        self.name = name
+        self.ttl = ttl
+        self.owner = uuid.uuid4().hex
+        self.lost = threading.Event()
+        self._released = threading.Event()
+        self._renewer: Optional[threading.Thread] = None
+
+    def acquire(self) -> bool:
+        try:
+            acquired = self.backend.acquire(self.name, self.owner, self.ttl)
+        except Exception as e:
+            logger.warning(f"Could not acquire lease {self.name}: {str(e)}")
+            return False
+        if acquired:
+            self._renewer = threading.Thread(target=self._keep_alive, name=f"lease-{self.name}", daemon=True)
+            self._renewer.start()
+        return acquired
+
+    def release(self):
+        self._released.set()
+        try:
+            self.backend.release(self.name, self.owner)
+        except Exception as e:
+            logger.warning(f"Could not release lease {self.name}: {str(e)}")
+
+    def _keep_alive(self):
+        while not self._released.wait(self.ttl / 3):
+            try:
+                renewed = self.backend.renew(self.name, self.owner, self.ttl)
+            except Exception as e:
+                logger.warning(f"Could not renew lease {self.name}: {str(e)}")
+                continue
+            if not renewed:
+                logger.warning(f"Lost lease {self.name}")
+                self.lost.set()
+                return
+
+
+class FlightBusy(Exception):
+    """The same operation is running elsewhere and did not finish in time"""
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class SingleFlight:
+    """Runs concurrent identical operations once and shares the result.
+
+    Callers in the same process wait for the running call. Other workers are
+    kept out by a lease; they wait for it to finish and pick up its result from
+    the shared cache (with an in-memory cache they run the operation again once
+    the lease is free, which still avoids running it concurrently). Results must
+    be JSON-serializable.
+    """
+
+    def __init__(self, leases: LeaseBackend, results: Cache):
+        self.leases = leases
+        self.results = results
+        self._calls: Dict[str, _Call] = {}
+        self._lock = threading.Lock()
+
+    def run(self, key: str, fn: Callable[[], Any], ttl: float = 120, wait: float = 60) -> Tuple[Any, bool]:
+        """Run fn unless an identical call is in flight; returns (result, shared)"""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            if not call.done.wait(wait):
+                raise FlightBusy(key)
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result, shared = self._run_exclusive(key, fn, ttl, wait)
+            return call.result, shared
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def _run_exclusive(self, key: str, fn: Callable[[], Any], ttl: float, wait: float) -> Tuple[Any, bool]:
+        started = time.time()
+        deadline = time.monotonic() + wait
+        delay = 0.05
+        while True:
+            lease = LeaseLock(self.leases, f"flight:{key}", ttl)
+            if lease.acquire():
+                try:
+                    finished = self._finished_result(key, started)
+                    if finished is not None:
+                        # Another worker completed it just before we got the lease
+                        return finished[0], True
+                    result = fn()
+                    self._store_result(key, result)
+                    return result, False
+                finally:
+                    lease.release()
+
+            finished = self._finished_result(key, started)
+            if finished is not None:
+                return finished[0], True
+            if time.monotonic() >= deadline:
+                raise FlightBusy(key)
+            time.sleep(delay)
+            delay = min(delay * 2, 0.5)
+
+    def _store_result(self, key: str, result: Any):
+        try:
+            self.results.backend.set(
+                self.results.key("flight_result", key),
+                orjson.dumps({"finished_at": time.time(), "result": result}),
+                settings.SINGLE_FLIGHT_RESULT_TTL
+            )
+        except Exception as e:
+            logger.warning(f"Could not share result of {key}: {str(e)}")
+
+    def _finished_result(self, key: str, started: float) -> Optional[Tuple[Any]]:
+        """(result,) of a call that finished after started, if another worker stored one"""
+        try:
+            stored = self.results.backend.get(self.results.key("flight_result", key))
+        except Exception:
+            return None
+        if stored is None:
+            return None
+        entry = orjson.loads(stored)
+        if entry["finished_at"] < started:
+            return None
+        return (entry["result"],)
+
+
+def create_lease_backend() -> LeaseBackend:
+    """Redis leases alongside the Redis cache, otherwise leases in the database"""
+    if isinstance(cache.backend, RedisCache):
+        return RedisLeaseBackend(cache.backend.client)
+    return DatabaseLeaseBackend()
+
+
+# Global instances
+lease_backend = create_lease_backend()
+single_flight = SingleFlight(lease_backend, cache)
@@ -0,0 +1,154 @@
+from contextvars import ContextVar
+from typing import Callable, Dict, List, Optional, Tuple
+import os
+import time
+
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Histogram, generate_latest
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+from sqlalchemy import event
+
+# Round-trips are mostly milliseconds, syncs and sends can take many seconds
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+IMAP_COMMAND_SECONDS = Histogram(
+    "imap_command_duration_seconds", "IMAP command round-trip time",
+    ["command"], buckets=LATENCY_BUCKETS
+)
+SMTP_SEND_SECONDS = Histogram(
+    "smtp_send_duration_seconds", "Time to deliver one message over an open SMTP session",
+    ["outcome"], buckets=LATENCY_BUCKETS
+)
+SYNC_SECONDS = Histogram(
+    "mail_sync_duration_seconds", "Duration of a folder sync",
+    ["mode"], buckets=LATENCY_BUCKETS
+)
+SYNC_THROUGHPUT = Histogram(
+    "mail_sync_messages_per_second", "Messages stored per second of sync, for syncs that stored any",
+    ["mode"], buckets=(1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500)
+)
+EMAIL_BODY_BYTES = Counter(
+    "email_body_bytes", "Size of email bodies written compressed, before (original) and after (stored) compression",
+    ["form"]
+)
+EVENTS_RELAY_DROPPED = Counter(
+    "events_relay_dropped", "Events lost because the queue of events waiting to go out through Redis was full"
+)
+DB_QUERY_SECONDS = Histogram(
+    "db_query_duration_seconds", "Database statement time by API endpoint (background for workers)",
+    ["endpoint"], buckets=LATENCY_BUCKETS
+)
+
+# ASGI scope of the request being handled, for labelling database time
+_current_scope: ContextVar[Optional[dict]] = ContextVar("metrics_scope", default=None)
+
+
+def current_endpoint() -> str:
+    """Route template of the current request, e.g. /api/v1/emails/{email_id}"""
+    scope = _current_scope.get()
+    if scope is None:
+        return "background"
+    route = scope.get("route")
+    return getattr(route, "path", "unmatched")
+
+
+class MetricsMiddleware:
+    """Makes the request's route available to the database instrumentation"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        token = _current_scope.set(scope)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _current_scope.reset(token)
+
+
+def instrument_engine(engine):
+    """Time every statement run on a (sync) engine"""
+    @event.listens_for(engine, "before_cursor_execute")
+    def _start_timer(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _stop_timer(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info["query_start"].pop()
+        DB_QUERY_SECONDS.labels(current_endpoint()).observe(time.perf_counter() - started)
+
+    @event.listens_for(engine, "handle_error")
+    def _drop_timer(exception_context):
+        starts = exception_context.connection.info.get("query_start") if exception_context.connection else None
+        if starts:
+            starts.pop()
+
+
+class RuntimeCollector:
+    """Values read when /metrics is scraped: pool usage, open streams, cache counters"""
+
+    def __init__(self):
+        self._metrics: List[Tuple[str, str, str, Tuple[str, ...], Callable]] = []
+
+    def add_gauge(self, name: str, documentation: str, read: Callable, labels: Tuple[str, ...] = ()):
+        """read() returns a number, or {label values: number} when labels are given"""
+        self._metrics.append(("gauge", name, documentation, labels, read))
+
+    def add_counter(self, name: str, documentation: str, read: Callable, labels: Tuple[str, ...] = ()):
+        self._metrics.append(("counter", name, documentation, labels, read))
+
+    def collect(self):
+        for kind, name, documentation, labels, read in self._metrics:
+            family_class = GaugeMetricFamily if kind == "gauge" else CounterMetricFamily
+            family = family_class(name, documentation, labels=list(labels))
+            try:
+                values = read()
+            except Exception:
+                continue
+            if not labels:
+                values = {(): values}
+            for label_values, value in values.items():
+                family.add_metric(list(label_values), value)
+            yield family
+
+
+def pool_status(engine) -> Dict[str, int]:
+    """Connections in use and idle in an engine's pool (zeros for pools that don't track them)"""
+    pool = engine.pool
+    return {
+        "in_use": pool.checkedout() if hasattr(pool, "checkedout") else 0,
+        "idle": pool.checkedin() if hasattr(pool, "checkedin") else 0,
+    }
+
+
+def metrics_body() -> Tuple[bytes, str]:
+    """The exposition text and its content type.
+
+    With several workers, set PROMETHEUS_MULTIPROC_DIR (emptied before the
+    workers start, as the production image does) so histograms are aggregated
+    across processes; runtime values then come from the worker that answers
+    the scrape.
+    """
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        registry.register(runtime_collector)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
+
+
+def mark_process_dead():
+    """Let the multiprocess collector drop this worker's live values; call on worker exit"""
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+
+        multiprocess.mark_process_dead(os.getpid())
+
+
+# Global instance
+runtime_collector = RuntimeCollector()
+REGISTRY.register(runtime_collector)
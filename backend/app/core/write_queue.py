@@ -0,0 +1,215 @@
+from concurrent.futures import Future
+from contextlib import contextmanager
+from typing import Any, Callable, List, Optional
+import asyncio
+import logging
+import queue
+import threading
+import time
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.core.database import SQLITE_PROFILE, SessionLocal, engine
+
+try:
+    import fcntl
+except ImportError:  # Not on Windows; writes there are only funnelled within each process
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Session.info key of the few sessions allowed to write directly, set to the reason
+BYPASS = "write_queue_bypass"
+
+
+class _Write:
+    def __init__(self, fn: Callable, args: tuple, idempotent: bool):
+        self.fn = fn
+        self.args = args
+        self.idempotent = idempotent
+        self.future: Future = Future()
+
+
+class WriteQueue:
+    """Funnels small writes through one thread that commits them in groups.
+
+    SQLite allows a single writer at a time; instead of every worker thread
+    competing for the lock (and fsyncing its own commit), writes queue up
+    here and each batch becomes one transaction. A write is fn(session, *args);
+    it must not commit and should return plain values, not ORM objects. When
+    disabled, writes run directly in the caller's session and are committed there.
+
+    Only idempotent writes (safe to run twice, e.g. setting fields or upserts)
+    are batched; if their batch fails, each is retried in a transaction of its
+    own so one bad write does not fail the others. Other writes, such as
+    inserts, get a transaction of their own and are never run twice.
+
+    When enabled, every session write must go through here: flushes and DML
+    anywhere else raise (see guard). The exception is a session opened with
+    info={BYPASS: reason}; leases are the only such writer, since a renewal
+    must not wait behind queued batches and each is one short statement.
+
+    Each worker process has its own writer thread; with a lock_path they take
+    turns through an exclusive lock on that file, so there is still a single
+    writer across processes, queueing in order rather than retrying against
+    SQLite's busy timeout.
+    """
+
+    def __init__(self, session_factory, enabled: bool, batch_size: int = 100, batch_window: float = 0.002,
+                 lock_path: Optional[str] = None):
+        self.session_factory = session_factory
+        self.enabled = enabled
+        self.batch_size = batch_size
+        self.batch_window = batch_window
+        self.lock_path = lock_path if fcntl is not None else None
+        self._queue: "queue.Queue[Optional[_Write]]" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self._lock_file = None
+        # Set on the writer thread while it runs a batch
+        self._writing = threading.local()
+
+    def apply(self, db, fn: Callable, *args, idempotent: bool = False) -> Any:
+        """Run a write for a caller with a sync session; blocks until it is committed"""
+        if not self.enabled:
+            result = fn(db, *args)
+            db.commit()
+            return result
+        # End the caller's transaction so it reads the writer's commit afterwards
+        db.commit()
+        return self.submit(fn, *args, idempotent=idempotent).result()
+
+    async def apply_async(self, db, fn: Callable, *args, idempotent: bool = False) -> Any:
+        """Run a write for a caller with an AsyncSession; refresh loaded objects afterwards"""
+        if not self.enabled:
+            result = await db.run_sync(fn, *args)
+            await db.commit()
+            return result
+        await db.commit()
+        return await asyncio.wrap_future(self.submit(fn, *args, idempotent=idempotent))
+
+    def submit(self, fn: Callable, *args, idempotent: bool = False) -> Future:
+        """Queue a write for the writer thread"""
+        write = _Write(fn, args, idempotent)
+        self._ensure_started()
+        self._queue.put(write)
+        return write.future
+
+    def pending(self) -> int:
+        """Writes waiting for the writer thread"""
+        return self._queue.qsize()
+
+    def shutdown(self):
+        """Commit what is queued and stop the writer thread"""
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            self._queue.put(None)
+            thread.join()
+
+    def guard(self, session_class=Session):
+        """Make session writes outside the writer thread raise while the queue is enabled"""
+        event.listen(session_class, "before_flush", self._check_flush)
+        event.listen(session_class, "do_orm_execute", self._check_execute)
+
+    def _check_flush(self, session, flush_context, instances):
+        if session.new or session.deleted or any(session.is_modified(obj) for obj in session.dirty):
+            self._check_writer(session)
+
+    def _check_execute(self, orm_execute_state):
+        if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+            self._check_writer(orm_execute_state.session)
+
+    def _check_writer(self, session):
+        if self.enabled and not getattr(self._writing, "active", False) and not session.info.get(BYPASS):
+            raise RuntimeError("Database write outside the write queue; run it through write_queue.apply()")
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="sqlite-writer", daemon=True)
+                self._thread.start()
+
+    @contextmanager
+    def _exclusive(self):
+        """Hold the lock file for one transaction, if there is one"""
+        if self.lock_path is None:
+            yield
+            return
+        if self._lock_file is None:
+            self._lock_file = open(self.lock_path, "a")
+        fcntl.flock(self._lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+
+    def _run(self):
+        while True:
+            write = self._queue.get()
+            if write is None:
+                return
+            batch = [write]
+            alone = None
+            stopping = False
+            deadline = time.monotonic() + self.batch_window
+            while write.idempotent and len(batch) < self.batch_size:
+                try:
+                    write = self._queue.get(timeout=max(deadline - time.monotonic(), 0))
+                except queue.Empty:
+                    break
+                if write is None:
+                    stopping = True
+                    break
+                if not write.idempotent:
+                    # Committed on its own, after the batch, to keep the order
+                    alone = write
+                    break
+                batch.append(write)
+            self._commit_batch(batch)
+            if alone is not None:
+                self._commit_batch([alone])
+            if stopping:
+                return
+
+    def _commit_batch(self, batch: List[_Write]):
+        error: Optional[Exception] = None
+        db = self.session_factory()
+        self._writing.active = True
+        try:
+            with self._exclusive():
+                results = []
+                for write in batch:
+                    results.append(write.fn(db, *write.args))
+                    db.flush()
+                db.commit()
+        except Exception as e:
+            db.rollback()
+            error = e
+        finally:
+            db.close()
+            self._writing.active = False
+
+        if error is None:
+            for write, result in zip(batch, results):
+                write.future.set_result(result)
+        elif len(batch) > 1:
+            # Only idempotent writes are batched; one bad write must not fail the others, so retry them one transaction each
+            logger.warning(f"Batch of {len(batch)} writes failed, retrying them separately: {str(error)}")
+            for write in batch:
+                self._commit_batch([write])
+        else:
+            batch[0].future.set_exception(error)
+
+
+# Global instance
+write_queue = WriteQueue(
+    SessionLocal,
+    enabled=SQLITE_PROFILE,
+    batch_size=settings.SQLITE_WRITE_BATCH_SIZE,
+    batch_window=settings.SQLITE_WRITE_BATCH_WINDOW,
+    lock_path=f"{engine.url.database}.write-lock" if SQLITE_PROFILE else None
+)
+write_queue.guard()
@@ -1,26 +1,75 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Response
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
 from contextlib import asynccontextmanager
 import os
 
+from app.core.cache import cache
 from app.core.config import settings
-from app.core.database import create_tables
-from app.api.v1 import auth, emails, accounts
+from app.core.database import async_engine, create_tables, engine
+from app.core.metrics import MetricsMiddleware, mark_process_dead, metrics_body, pool_status, runtime_collector
+from app.core.write_queue import write_queue
+from app.api.v1 import auth, emails, accounts, events
+from app.services.body_compression import body_compression_migration
+from app.services.tiering import body_tiering
+from app.services.tombstones import tombstone_compaction
+from app.services.events import event_broker
+from app.services.flag_sync import flag_sync_worker
+from app.services.idle_service import idle_manager
+from app.services.outbox import outbox_worker
+from app.services.smtp_pool import smtp_pool
+from app.services.partitioning import check_partitions
+from app.utils.compression import CompressionMiddleware
+from app.utils.profiling import ProfilingMiddleware
+from app.utils.static_files import CachedStaticFiles
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup
+    # Event streams only see this process's events unless they are relayed through Redis
+    if settings.WEB_CONCURRENCY > 1 and not event_broker.shared:
+        raise RuntimeError("More than one worker (WEB_CONCURRENCY) needs REDIS_URL so event streams get every worker's events")
     create_tables()
+    check_partitions()
     
     # Create upload directory if it doesn't exist
     os.makedirs(settings.UPLOAD_DIR, exist_ok=True)
     
+    # Relay events between worker processes
+    await event_broker.start()
+    
+    # Start background delivery of queued mail
+    await outbox_worker.start()
+    
+    # Send queued read, starred and folder changes to the IMAP servers
+    await flag_sync_worker.start()
+    
+    # Watch active accounts' inboxes with IMAP IDLE
+    await idle_manager.start()
+    
+    # Compress bodies stored before body compression was enabled
+    await body_compression_migration.start()
+    
+    # Move bodies of old mail to the archive table
+    await body_tiering.start()
+    
+    # Purge deleted emails once the deletion has reached the server
+    await tombstone_compaction.start()
+    
     yield
     
     # Shutdown
-    pass
+    await tombstone_compaction.stop()
+    await body_tiering.stop()
+    await body_compression_migration.stop()
+    await idle_manager.stop()
+    await flag_sync_worker.stop()
+    await outbox_worker.stop()
+    await event_broker.stop()
+    smtp_pool.close_all()
+    write_queue.shutdown()
+    await async_engine.dispose()
+    mark_process_dead()
 
 
 app = FastAPI(
@@ -39,13 +88,38 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Mount static files for uploads
-app.mount("/uploads", StaticFiles(directory=settings.UPLOAD_DIR), name="uploads")
+# Compress large JSON payloads (brotli when available, otherwise gzip)
+app.add_middleware(
+    CompressionMiddleware,
+    minimum_size=settings.COMPRESSION_MIN_SIZE,
+    gzip_level=settings.COMPRESSION_GZIP_LEVEL,
+    brotli_quality=settings.COMPRESSION_BROTLI_QUALITY,
+)
+
+# Label database time with the route being served
+app.add_middleware(MetricsMiddleware)
+
+# Profile sampled or token-marked requests (not installed at all when disabled)
+if settings.PROFILING_ENABLED:
+    app.add_middleware(
+        ProfilingMiddleware,
+        output_dir=settings.PROFILING_DIR,
+        sample_rate=settings.PROFILING_SAMPLE_RATE,
+        token=settings.PROFILING_TOKEN,
+        mode=settings.PROFILING_MODE,
+        interval=settings.PROFILING_INTERVAL,
+        max_seconds=settings.PROFILING_MAX_SECONDS,
+        keep=settings.PROFILING_KEEP,
+    )
+
+# Mount static files for uploads (content-hashed names are served as immutable)
+app.mount("/uploads", CachedStaticFiles(directory=settings.UPLOAD_DIR), name="uploads")
 
 # Include API routes
 app.include_router(auth.router, prefix="/api/v1/auth", tags=["authentication"])
 app.include_router(emails.router, prefix="/api/v1/emails", tags=["emails"])
 app.include_router(accounts.router, prefix="/api/v1/accounts", tags=["accounts"])
+app.include_router(events.router, prefix="/api/v1/events", tags=["events"])
 
 
 @app.get("/")
@@ -59,7 +133,40 @@ async def root():
 
 @app.get("/health")
 async def health_check():
-    return {"status": "healthy", "message": "Email client API is running"}
+    return {"status": "healthy", "message": "Email client API is running", "cache": cache.stats()}
+
+
+# Point-in-time values reported with each scrape
+runtime_collector.add_gauge(
+    "db_pool_connections", "Database connections by engine and state",
+    lambda: {
+        (name, state): count
+        for name, db_engine in (("sync", engine), ("async", async_engine.sync_engine))
+        for state, count in pool_status(db_engine).items()
+    },
+    labels=("engine", "state")
+)
+runtime_collector.add_gauge("smtp_pool_idle_sessions", "Authenticated SMTP sessions parked for reuse", smtp_pool.idle_count)
+runtime_collector.add_gauge("imap_idle_watchers", "Accounts watched with IMAP IDLE by this worker", lambda: len(idle_manager.watched_accounts()))
+runtime_collector.add_gauge("event_streams", "Open server-sent event streams", event_broker.stream_count)
+runtime_collector.add_gauge("outbox_in_flight", "Outbound messages being delivered by this worker", outbox_worker.in_flight_count)
+runtime_collector.add_gauge("sqlite_write_queue_depth", "Writes waiting for the SQLite writer thread", write_queue.pending)
+runtime_collector.add_counter(
+    "cache_requests", "Cache lookups by namespace and result (hits, misses, coalesced, errors)",
+    lambda: {
+        (namespace, result): count
+        for namespace, counts in cache.stats().items()
+        for result, count in counts.items()
+    },
+    labels=("namespace", "result")
+)
+
+
+if settings.METRICS_ENABLED:
+    @app.get("/metrics", include_in_schema=False)
+    async def metrics():
+        body, content_type = metrics_body()
+        return Response(content=body, headers={"Content-Type": content_type})
 
 
 if __name__ == "__main__":
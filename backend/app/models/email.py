@@ -1,8 +1,9 @@
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, ForeignKey, Text, JSON
-from sqlalchemy.orm import relationship
+from sqlalchemy import Column, Integer, String, Boolean, DateTime, ForeignKey, JSON
+from sqlalchemy.orm import deferred, relationship
 from sqlalchemy.sql import func
 
 from app.core.database import Base
+from app.models.types import CompressedText
 
 
 class Email(Base):
@@ -27,10 +28,11 @@ class Email(Base):
     cc_addresses = Column(JSON, nullable=True)  # CC recipients
     bcc_addresses = Column(JSON, nullable=True)  # BCC recipients
     
-    # Email Content
-    body_text = Column(Text, nullable=True)  # Plain text body
-    body_html = Column(Text, nullable=True)  # HTML body
+    # Email Content (loaded, and decompressed, on first access; undefer_group("body") to load with the row)
+    body_text = deferred(Column(CompressedText, nullable=True), group="body")  # Plain text body
+    body_html = deferred(Column(CompressedText, nullable=True), group="body")  # HTML body
     attachments = Column(JSON, nullable=True)  # List of attachment info
+    raw_hash = Column(String(64), nullable=True, index=True)  # SHA-256 of the original in the message store
     
     # Email Metadata
     date_sent = Column(DateTime(timezone=True), nullable=True)
@@ -41,6 +43,8 @@ class Email(Base):
     is_read = Column(Boolean, default=False)
     is_starred = Column(Boolean, default=False)
     is_deleted = Column(Boolean, default=False)
+    deleted_at = Column(DateTime(timezone=True), nullable=True)  # When it was deleted here
+    expunged_at = Column(DateTime(timezone=True), nullable=True)  # When the server confirmed it gone; purged some time after
     is_draft = Column(Boolean, default=False)
     is_sent = Column(Boolean, default=False)
     
@@ -48,6 +52,9 @@ class Email(Base):
     folder = Column(String, default="INBOX")  # IMAP folder
     labels = Column(JSON, nullable=True)  # List of labels/tags
     
+    # Cold Storage (set when the bodies were moved to email_archive, leaving a preview in body_text)
+    archived_at = Column(DateTime(timezone=True), nullable=True)
+    
     # Timestamps
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
@@ -0,0 +1,17 @@
+from sqlalchemy import Column, Integer, DateTime, ForeignKey, JSON
+from sqlalchemy.sql import func
+
+from app.core.database import Base
+from app.models.types import CompressedText
+
+
+class ArchivedEmailBody(Base):
+    """Bodies and attachment list of an old email, moved out of the emails table (cold tier)"""
+    __tablename__ = "email_archive"
+
+    email_id = Column(Integer, ForeignKey("emails.id", ondelete="CASCADE"), primary_key=True)
+    account_id = Column(Integer, nullable=True)  # Part of the foreign key when emails is partitioned by account
+    body_text = Column(CompressedText, nullable=True)
+    body_html = Column(CompressedText, nullable=True)
+    attachments = Column(JSON, nullable=True)
+    archived_at = Column(DateTime(timezone=True), server_default=func.now())
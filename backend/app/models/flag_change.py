@@ -0,0 +1,33 @@
+from sqlalchemy import Column, Integer, String, Boolean, DateTime, ForeignKey, Text, UniqueConstraint
+from sqlalchemy.sql import func
+
+from app.core.database import Base
+
+
+class FlagChange(Base):
+    """A read, starred, folder or deleted change made locally, or sent mail to append, that the IMAP server has not been told about yet"""
+    __tablename__ = "flag_changes"
+    # One pending change per email and flag (or move): later changes update it instead of queueing another
+    __table_args__ = (UniqueConstraint("email_id", "change"),)
+
+    id = Column(Integer, primary_key=True, index=True)
+    account_id = Column(Integer, ForeignKey("email_accounts.id"), nullable=False, index=True)
+    email_id = Column(Integer, nullable=False)
+    
+    # Change
+    change = Column(String, nullable=False)  # IMAP flag (\Seen, \Flagged), "move", "delete" or "append"
+    value = Column(Boolean, nullable=True)  # Flag set (True) or cleared (False)
+    target_folder = Column(String, nullable=True)  # Where a move goes
+    
+    # Where the message is on the server
+    folder = Column(String, nullable=False)
+    uid = Column(String, nullable=False)  # Empty for appends, and for deletions of mail whose UID is unknown; it is looked up by Message-ID
+    
+    # Delivery State
+    attempts = Column(Integer, nullable=False, default=0)
+    next_attempt_at = Column(DateTime(timezone=True), nullable=False, index=True)
+    last_error = Column(Text, nullable=True)
+    
+    # Timestamps
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), onupdate=func.now())
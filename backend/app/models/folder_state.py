@@ -0,0 +1,76 @@
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, event, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session, attributes
+from sqlalchemy.sql import func
+
+from app.core.database import Base
+
+
+class FolderState(Base):
+    """Change counter per (account, folder), bumped whenever an email in it changes"""
+    __tablename__ = "folder_states"
+
+    account_id = Column(Integer, ForeignKey("email_accounts.id"), primary_key=True)
+    folder = Column(String, primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+
+def bump_folder_versions(session: Session, folders):
+    """Increment the version of each (account_id, folder) pair
+
+    The flush hooks below only see ORM changes. Core UPDATE/DELETE statements on emails that change
+    what a listing shows must call this themselves, in the same transaction.
+    """
+    connection = session.connection()
+    dialect = connection.dialect.name
+    
+    for account_id, folder in set(folders):
+        if dialect in ("sqlite", "postgresql"):
+            insert = sqlite_insert if dialect == "sqlite" else pg_insert
+            stmt = insert(FolderState).values(account_id=account_id, folder=folder, version=1)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[FolderState.account_id, FolderState.folder],
+                set_={"version": FolderState.version + 1, "updated_at": func.now()}
+            )
+            connection.execute(stmt)
+        else:
+            result = connection.execute(
+                update(FolderState)
+                .where(FolderState.account_id == account_id, FolderState.folder == folder)
+                .values(version=FolderState.version + 1)
+            )
+            if result.rowcount == 0:
+                connection.execute(FolderState.__table__.insert().values(account_id=account_id, folder=folder, version=1))
+
+
+def _changed_folders(session: Session):
+    """(account_id, folder) pairs touched by the pending emails in a flush"""
+    folders = set()
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if getattr(obj, "__tablename__", None) != "emails":
+            continue
+        if obj in session.dirty and not session.is_modified(obj):
+            continue
+        folders.add((obj.account_id, obj.folder or "INBOX"))
+        # A move changes both the old and the new folder
+        history = attributes.get_history(obj, "folder")
+        for old_folder in history.deleted or ():
+            if old_folder:
+                folders.add((obj.account_id, old_folder))
+    return folders
+
+
+@event.listens_for(Session, "before_flush")
+def _collect_changed_folders(session, flush_context, instances):
+    folders = _changed_folders(session)
+    if folders:
+        session.info.setdefault("changed_folders", set()).update(folders)
+
+
+@event.listens_for(Session, "after_flush")
+def _bump_changed_folders(session, flush_context):
+    folders = session.info.pop("changed_folders", None)
+    if folders:
+        bump_folder_versions(session, folders)
@@ -0,0 +1,12 @@
+from sqlalchemy import Column, String, DateTime
+
+from app.core.database import Base
+
+
+class Lease(Base):
+    """Named lock with an expiry, shared by all workers through the database"""
+    __tablename__ = "leases"
+
+    name = Column(String, primary_key=True)
+    owner = Column(String, nullable=False)
+    expires_at = Column(DateTime, nullable=False)
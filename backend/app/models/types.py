@@ -0,0 +1,81 @@
+from typing import Optional, Union
+import zlib
+
+from sqlalchemy import Text
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.functions import FunctionElement
+from sqlalchemy.types import TypeDecorator
+
+from app.core.config import settings
+from app.core.metrics import EMAIL_BODY_BYTES
+
+# gzip framing: its trailer records the original size, which storage reports read back
+GZIP_WBITS = 31
+
+
+def compress_body(value: str) -> Union[str, bytes]:
+    """The value to store for a body: gzip bytes when that is enabled and pays off, else the text"""
+    if not settings.BODY_COMPRESSION_ENABLED or len(value) < settings.BODY_COMPRESSION_MIN_SIZE:
+        return value
+    encoded = value.encode("utf-8")
+    compressor = zlib.compressobj(settings.BODY_COMPRESSION_LEVEL, zlib.DEFLATED, GZIP_WBITS)
+    compressed = compressor.compress(encoded) + compressor.flush()
+    if len(compressed) >= len(encoded):
+        return value
+    EMAIL_BODY_BYTES.labels("original").inc(len(encoded))
+    EMAIL_BODY_BYTES.labels("stored").inc(len(compressed))
+    return compressed
+
+
+def decompress_body(value: Union[str, bytes, None]) -> Optional[str]:
+    if isinstance(value, bytes):
+        return zlib.decompress(value, GZIP_WBITS).decode("utf-8")
+    return value
+
+
+def register_sqlite_functions(dbapi_connection, connection_record):
+    """Make decompress_body callable from SQL on a new SQLite connection, for searching compressed bodies"""
+    dbapi_connection.create_function("decompress_body", 1, decompress_body, deterministic=True)
+
+
+class searchable_body(FunctionElement):
+    """A CompressedText column as plain text inside a query, e.g. for LIKE; as stored outside SQLite"""
+
+    type = Text()
+    inherit_cache = True
+
+
+@compiles(searchable_body)
+def _compile_searchable_body(element, compiler, **kw):
+    return compiler.process(element.clauses, **kw)
+
+
+@compiles(searchable_body, "sqlite")
+def _compile_searchable_body_sqlite(element, compiler, **kw):
+    return f"decompress_body({compiler.process(element.clauses, **kw)})"
+
+
+class CompressedText(TypeDecorator):
+    """Text that SQLite stores gzip-compressed above BODY_COMPRESSION_MIN_SIZE.
+
+    Compressed values go into the TEXT column as BLOBs, which SQLite keeps as
+    they are, so a value reads back as bytes exactly when it was compressed and
+    older rows stay readable. Other databases get plain text; Postgres already
+    compresses large values itself (TOAST). Queries that look inside the text
+    go through searchable_body.
+    """
+
+    impl = Text
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if value is not None and dialect.name == "sqlite":
+            return compress_body(value)
+        return value
+
+    def process_result_value(self, value, dialect):
+        return decompress_body(value)
+
+    def coerce_compared_value(self, op, value):
+        # Search terms compared with a body are plain text, never compressed
+        return Text()
@@ -0,0 +1,57 @@
+"""Repartition the emails table by hash of account_id (Postgres), online, and report per-partition sizes.
+
+Run from backend/:  python -m app.ops.partition_emails [--partitions 16] [--drop-old]
+
+Uses DATABASE_URL and EMAIL_PARTITIONS, like the server. This is how emails
+gets partitioned: --partitions (EMAIL_PARTITIONS by default) rebuilds the
+table with that many partitions in batches while the server keeps running;
+the server only warns at startup when the two differ. --partitions 1 goes
+back to a single partition. --drop-old drops the table a repartition
+replaced. The report lists estimated rows, table and index size, dead rows
+and the last autovacuum of every partition.
+"""
+import argparse
+import time
+
+from app.core.config import settings
+from app.core.database import engine
+from app.models import account, email, email_archive, flag_change, folder_state, lease, outbox, user  # noqa: F401 (register tables)
+from app.services.partitioning import EmailRepartition, drop_previous, partition_count, partition_report
+
+
+def megabytes(size: int) -> str:
+    return f"{size / 1024 / 1024:.1f} MB"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--partitions", type=int, default=settings.EMAIL_PARTITIONS or None,
+                        help="repartition emails into this many hash partitions first (default EMAIL_PARTITIONS)")
+    parser.add_argument("--drop-old", action="store_true", help="drop the table replaced by a repartition")
+    args = parser.parse_args()
+
+    if engine.dialect.name != "postgresql":
+        parser.error("emails can only be partitioned on Postgres")
+
+    if args.partitions:
+        started = time.perf_counter()
+        done = EmailRepartition(args.partitions).run()
+        if done is None:
+            print(f"Nothing to do: emails already has {args.partitions} partitions, or another repartition is running")
+        else:
+            print(f"Copied {done['rows']} emails ({done['archived']} archive rows linked) "
+                  f"in {time.perf_counter() - started:.1f}s")
+
+    if args.drop_old:
+        drop_previous()
+
+    with engine.connect() as conn:
+        print(f"emails has {partition_count(conn)} partitions")
+        print(f"  {'partition':<18} {'rows':>10} {'table':>10} {'indexes':>10} {'dead':>8}  last autovacuum")
+        for row in partition_report(conn):
+            print(f"  {row['partition']:<18} {row['rows']:>10} {megabytes(row['table_bytes']):>10} "
+                  f"{megabytes(row['index_bytes']):>10} {row['dead_rows'] or 0:>8}  {row['last_autovacuum'] or '-'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -89,6 +89,51 @@ class EmailCompose(BaseModel):
     attachments: Optional[List[str]] = None  # File paths or IDs
 
 
+class BulkRecipient(BaseModel):
+    email: EmailStr
+    name: Optional[str] = None
+    variables: Dict[str, str] = {}  # Values for $placeholders in the template
+
+
+class EmailBulkSend(BaseModel):
+    account_id: int
+    recipients: List[BulkRecipient]
+    subject: str  # Templates use $name / ${name} placeholders
+    body_text: Optional[str] = None
+    body_html: Optional[str] = None
+    attachments: Optional[List[str]] = None
+
+
+class BulkSendResult(BaseModel):
+    email: str
+    success: bool
+    error: Optional[str] = None
+
+
+class BulkSendStatus(BaseModel):
+    bulk_id: str
+    queued: int
+    sending: int
+    sent: int
+    failed: int
+    failures: List[BulkSendResult]  # Recipients whose message failed for good
+
+
+class OutboundEmailStatus(BaseModel):
+    id: int
+    account_id: int
+    status: str
+    attempts: int
+    last_error: Optional[str] = None
+    next_attempt_at: Optional[datetime] = None
+    sent_at: Optional[datetime] = None
+    created_at: datetime
+    updated_at: Optional[datetime] = None
+
+    class Config:
+        from_attributes = True
+
+
 class EmailReply(BaseModel):
     original_email_id: int
     account_id: int
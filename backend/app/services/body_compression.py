@@ -0,0 +1,196 @@
+from typing import Dict, List, Optional, Tuple
+import asyncio
+import logging
+import struct
+import threading
+
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import LargeBinary, Text, and_, func, or_, select, text, type_coerce, update
+
+from app.core.config import settings
+from app.core.database import SessionLocal, engine
+from app.core.locks import LeaseLock, lease_backend
+from app.core.write_queue import write_queue
+from app.models.email import Email
+from app.models.types import compress_body
+
+logger = logging.getLogger(__name__)
+
+BODY_COLUMNS = ("body_text", "body_html")
+
+# Keeps a second worker from migrating the same rows
+MIGRATION_LEASE_TTL = 60
+
+
+class BodyCompressionMigration:
+    """Compresses bodies stored before compression was enabled, in small batches in the background.
+
+    Only SQLite stores bodies compressed (see CompressedText). Each batch is
+    rewritten in one short transaction through the write queue; rows already
+    compressed or below the size threshold are skipped, so the migration picks
+    up where it stopped after a restart. Postgres relies on TOAST compressing
+    large values, so the server never starts the job there; running it by hand
+    only sets the column compression method.
+    """
+
+    def __init__(self):
+        self._task: Optional[asyncio.Task] = None
+        self._stop = threading.Event()
+
+    async def start(self):
+        """Start migrating in a worker thread"""
+        if (
+            self._task is None and settings.BODY_COMPRESSION_ENABLED and settings.BODY_COMPRESSION_MIGRATE
+            and engine.dialect.name == "sqlite"
+        ):
+            self._stop.clear()
+            self._task = asyncio.create_task(run_in_threadpool(self.run))
+
+    async def stop(self):
+        """Stop after the current batch"""
+        if self._task is not None:
+            self._stop.set()
+            try:
+                await self._task
+            except Exception as e:
+                logger.error(f"Body compression migration failed: {str(e)}")
+            self._task = None
+
+    def run(self) -> Optional[Dict[str, int]]:
+        """Migrate until no eligible body is left or stop is requested; returns what was done. Blocking."""
+        dialect = engine.dialect.name
+        if dialect == "postgresql":
+            set_postgres_compression()
+            return None
+        if dialect != "sqlite":
+            return None
+
+        lease = LeaseLock(lease_backend, "body-compression", MIGRATION_LEASE_TTL)
+        if not lease.acquire():
+            return None
+        try:
+            done = {"rows": 0, "original_bytes": 0, "stored_bytes": 0}
+            last_id = 0
+            while not self._stop.is_set() and not lease.lost.is_set():
+                batch = _uncompressed_batch(last_id, settings.BODY_COMPRESSION_BATCH_SIZE)
+                if not batch:
+                    break
+                last_id = batch[-1][0]
+                original, stored = _compress_batch(batch)
+                done["rows"] += len(batch)
+                done["original_bytes"] += original
+                done["stored_bytes"] += stored
+                self._stop.wait(settings.BODY_COMPRESSION_BATCH_PAUSE)
+            if done["rows"]:
+                logger.info(
+                    f"Compressed bodies of {done['rows']} emails, "
+                    f"{done['original_bytes']} bytes now stored in {done['stored_bytes']}"
+                )
+            return done
+        finally:
+            lease.release()
+
+
+def _uncompressed_batch(after_id: int, limit: int) -> List[Tuple[int, Optional[str], Optional[str]]]:
+    """Rows after after_id with a body stored as plain text that is long enough to compress"""
+    eligible = [
+        and_(func.typeof(column) == "text", func.length(column) >= settings.BODY_COMPRESSION_MIN_SIZE)
+        for column in (Email.body_text, Email.body_html)
+    ]
+    db = SessionLocal()
+    try:
+        return [tuple(row) for row in db.execute(
+            select(Email.id, Email.body_text, Email.body_html)
+            .where(Email.id > after_id, or_(*eligible))
+            .order_by(Email.id)
+            .limit(limit)
+        )]
+    finally:
+        db.close()
+
+
+def _compress_batch(batch) -> Tuple[int, int]:
+    """Store a batch's bodies compressed; returns their size in bytes before and after"""
+    original = stored = 0
+    rows = []
+    for email_id, *bodies in batch:
+        values = {}
+        for column, body in zip(BODY_COLUMNS, bodies):
+            if body is None:
+                continue
+            value = compress_body(body)
+            original += len(body.encode("utf-8"))
+            stored += len(value) if isinstance(value, bytes) else len(body.encode("utf-8"))
+            # Already compressed, so bypass the column type
+            values[column] = type_coerce(value, LargeBinary if isinstance(value, bytes) else Text)
+        rows.append((email_id, values))
+
+    def write(db):
+        for email_id, values in rows:
+            # Same content: updated_at, the folder's version and the ETags built from them stay as they are
+            db.execute(
+                update(Email).where(Email.id == email_id).values(updated_at=Email.updated_at, **values),
+                execution_options={"synchronize_session": False}
+            )
+
+    db = SessionLocal()
+    try:
+        write_queue.apply(db, write, idempotent=True)
+    finally:
+        db.close()
+    return original, stored
+
+
+def set_postgres_compression():
+    """Compress bodies written from now on with BODY_COMPRESSION_POSTGRES_METHOD (Postgres 14+)"""
+    method = settings.BODY_COMPRESSION_POSTGRES_METHOD
+    if not method:
+        return
+    with engine.begin() as conn:
+        if conn.dialect.server_version_info < (14,):
+            return
+        for column in BODY_COLUMNS:
+            # Only changes the catalog; existing values keep their compression
+            conn.exec_driver_sql(f"ALTER TABLE emails ALTER COLUMN {column} SET COMPRESSION {method}")
+
+
+def body_storage_report(db) -> Dict[str, Dict[str, int]]:
+    """Per body column: values, how many are stored compressed, and total bytes before and after compression"""
+    postgres = db.get_bind().dialect.name == "postgresql"
+    report = {}
+    for column in BODY_COLUMNS:
+        column_report = _postgres_report(db, column) if postgres else _sqlite_report(db, column)
+        column_report["saved_bytes"] = column_report["original_bytes"] - column_report["stored_bytes"]
+        report[column] = column_report
+    return report
+
+
+def _postgres_report(db, column: str) -> Dict[str, int]:
+    values, compressed, original, stored = db.execute(text(
+        f"SELECT count({column}), count(*) FILTER (WHERE pg_column_size({column}) < octet_length({column})), "
+        f"coalesce(sum(octet_length({column})), 0), coalesce(sum(pg_column_size({column})), 0) FROM emails"
+    )).one()
+    return {"values": values, "compressed": compressed, "original_bytes": original, "stored_bytes": stored}
+
+
+def _sqlite_report(db, column: str) -> Dict[str, int]:
+    values, compressed, plain_bytes, compressed_bytes = db.execute(text(
+        f"SELECT count({column}), count(*) FILTER (WHERE typeof({column}) = 'blob'), "
+        f"coalesce(sum(length(CAST({column} AS BLOB))) FILTER (WHERE typeof({column}) = 'text'), 0), "
+        f"coalesce(sum(length({column})) FILTER (WHERE typeof({column}) = 'blob'), 0) FROM emails"
+    )).one()
+    # The gzip trailer ends with the original size (little-endian, modulo 4GB)
+    original_bytes = sum(
+        struct.unpack("<I", size)[0]
+        for size, in db.execute(text(f"SELECT substr({column}, -4, 4) FROM emails WHERE typeof({column}) = 'blob'"))
+    )
+    return {
+        "values": values,
+        "compressed": compressed,
+        "original_bytes": plain_bytes + original_bytes,
+        "stored_bytes": plain_bytes + compressed_bytes
+    }
+
+
+# Global instance
+body_compression_migration = BodyCompressionMigration()
@@ -0,0 +1,29 @@
+from string import Template
+from typing import List
+import html
+
+from app.schemas.email import BulkRecipient, EmailAddress, EmailBulkSend, EmailCompose
+
+
+def render_message(template: EmailBulkSend, recipient: BulkRecipient) -> EmailCompose:
+    """Fill the template placeholders for one recipient"""
+    variables = {"email": recipient.email, "name": recipient.name or ""}
+    variables.update(recipient.variables)
+    html_variables = {key: html.escape(value) for key, value in variables.items()}
+
+    def render(text, values):
+        return Template(text).safe_substitute(values) if text else text
+
+    return EmailCompose(
+        account_id=template.account_id,
+        to_addresses=[EmailAddress(email=recipient.email, name=recipient.name)],
+        subject=render(template.subject, variables),
+        body_text=render(template.body_text, variables),
+        body_html=render(template.body_html, html_variables),
+        attachments=template.attachments
+    )
+
+
+def render_messages(template: EmailBulkSend) -> List[EmailCompose]:
+    """One message per recipient, for the outbox to deliver"""
+    return [render_message(template, recipient) for recipient in template.recipients]
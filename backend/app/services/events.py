@@ -0,0 +1,323 @@
+from typing import Any, Callable, Dict, Optional, Set
+import asyncio
+import json
+import logging
+import queue
+import threading
+
+from sqlalchemy import case, func, select
+
+from app.core.cache import cache
+from app.core.config import settings
+from app.core.metrics import EVENTS_RELAY_DROPPED
+from app.models.email import Email
+from app.models.folder_state import FolderState
+
+logger = logging.getLogger(__name__)
+
+
+class Subscription:
+    """One connected event stream with a bounded backlog"""
+
+    def __init__(self, user_id: int, queue_size: int):
+        self.user_id = user_id
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.dropped = False
+
+    async def next_event(self, timeout: float) -> Optional[str]:
+        """Wait for the next encoded event; None if none arrived within timeout"""
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+
+class RedisEventRelay:
+    """Carries events between worker processes over Redis pub/sub.
+
+    Every worker publishes to one channel and listens on it, handing what
+    arrives to its own streams, so a stream gets the events of every
+    worker. Both directions run on their own threads and never block the
+    caller. Events published while Redis is unreachable are lost, so after
+    reconnecting the listener tells the local streams to resync. So are
+    events beyond queue_size waiting to be published; they are counted.
+    """
+
+    CHANNEL = "mailbox:events"
+
+    def __init__(self, url: str, deliver: Callable[[int, str], None], resync: Callable[[], None], queue_size: int = 10000):
+        import redis
+
+        # No socket timeout: the listener waits on the connection between messages
+        self.client = redis.Redis.from_url(url, socket_connect_timeout=1)
+        self._deliver = deliver
+        self._resync = resync
+        self._outgoing: queue.Queue = queue.Queue(maxsize=queue_size)
+        self._full = False
+        self._stop = threading.Event()
+        self._threads = []
+
+    def start(self):
+        self._stop.clear()
+        self._threads = [
+            threading.Thread(target=self._publish_loop, name="event-relay-publish", daemon=True),
+            threading.Thread(target=self._listen_loop, name="event-relay-listen", daemon=True),
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self):
+        self._stop.set()
+        for thread in self._threads:
+            thread.join(timeout=2)
+        self._threads = []
+
+    def send(self, user_id: int, message: str):
+        try:
+            self._outgoing.put_nowait(json.dumps({"user_id": user_id, "message": message}))
+            self._full = False
+        except queue.Full:
+            EVENTS_RELAY_DROPPED.inc()
+            if not self._full:
+                # Once per overflow, not per event
+                logger.warning("Event relay queue is full; dropping events until Redis catches up")
+                self._full = True
+
+    def _publish_loop(self):
+        while not self._stop.is_set():
+            try:
+                payload = self._outgoing.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            try:
+                self.client.publish(self.CHANNEL, payload)
+            except Exception as e:
+                logger.warning(f"Could not relay event through Redis: {str(e)}")
+
+    def _listen_loop(self):
+        connected_before = False
+        while not self._stop.is_set():
+            pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+            try:
+                pubsub.subscribe(self.CHANNEL)
+                if connected_before:
+                    self._resync()
+                connected_before = True
+                while not self._stop.is_set():
+                    item = pubsub.get_message(timeout=1.0)
+                    if item is not None and item["type"] == "message":
+                        event = json.loads(item["data"])
+                        self._deliver(event["user_id"], event["message"])
+            except Exception as e:
+                logger.warning(f"Event relay lost its Redis subscription: {str(e)}")
+                self._stop.wait(1)
+            finally:
+                try:
+                    pubsub.close()
+                except Exception:
+                    pass
+
+
+class EventBroker:
+    """Fans events out to each user's open streams.
+
+    publish() may be called from any thread. Streams that fall more than
+    queue_size events behind are dropped instead of buffering without limit;
+    the client reconnects and refetches. With REDIS_URL set, events go
+    through Redis so that streams held by other worker processes get them
+    too; without it, only streams of this process do, so the server must
+    run a single worker (enforced at startup).
+    """
+
+    def __init__(self, queue_size: int, max_streams_per_user: int, redis_url: Optional[str] = None, relay_queue_size: int = 10000):
+        self.queue_size = queue_size
+        self.max_streams_per_user = max_streams_per_user
+        self._subscriptions: Dict[int, Set[Subscription]] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._lock = threading.Lock()
+        self._relay: Optional[RedisEventRelay] = None
+        if redis_url:
+            try:
+                self._relay = RedisEventRelay(redis_url, self._deliver, self._resync_all, relay_queue_size)
+            except ImportError:
+                logger.warning("REDIS_URL is set but the redis package is not installed; events stay in this process")
+
+    @property
+    def shared(self) -> bool:
+        """Whether events reach streams held by other worker processes"""
+        return self._relay is not None
+
+    async def start(self):
+        """Start relaying events between workers, if configured"""
+        self._loop = asyncio.get_running_loop()
+        if self._relay is not None:
+            self._relay.start()
+
+    async def stop(self):
+        if self._relay is not None:
+            self._relay.stop()
+
+    def subscribe(self, user_id: int) -> Optional[Subscription]:
+        """Register a stream for a user; None if the user has too many open"""
+        self._loop = asyncio.get_running_loop()
+        with self._lock:
+            # Refused streams leave no entry behind, which would make has_streams() True
+            if len(self._subscriptions.get(user_id, ())) >= self.max_streams_per_user:
+                return None
+            subscription = Subscription(user_id, self.queue_size)
+            self._subscriptions.setdefault(user_id, set()).add(subscription)
+            return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        with self._lock:
+            streams = self._subscriptions.get(subscription.user_id)
+            if streams is not None:
+                streams.discard(subscription)
+                if not streams:
+                    del self._subscriptions[subscription.user_id]
+
+    def has_streams(self, user_id: int) -> bool:
+        """Whether anyone is listening, so callers can skip building expensive events.
+
+        Streams held by other workers are not known here, so with a shared
+        relay this is always True.
+        """
+        return self._relay is not None or user_id in self._subscriptions
+
+    def publish(self, user_id: int, event: str, data: Dict[str, Any]):
+        """Send an event to every open stream of a user, in any worker"""
+        if not self.has_streams(user_id):
+            return
+
+        message = f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+        if self._relay is not None:
+            # Comes back through the listener, for this worker's streams as well
+            self._relay.send(user_id, message)
+        else:
+            self._deliver(user_id, message)
+
+    def _deliver(self, user_id: int, message: str):
+        """Hand a message to this worker's streams of a user, from any thread"""
+        loop = self._loop
+        if loop is None or user_id not in self._subscriptions:
+            return
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+
+        if running is loop:
+            self._dispatch(user_id, message)
+        elif not loop.is_closed():
+            loop.call_soon_threadsafe(self._dispatch, user_id, message)
+
+    def stream_count(self) -> int:
+        with self._lock:
+            return sum(len(streams) for streams in self._subscriptions.values())
+
+    def _dispatch(self, user_id: int, message: str):
+        with self._lock:
+            streams = list(self._subscriptions.get(user_id, ()))
+        for subscription in streams:
+            if subscription.dropped:
+                continue
+            try:
+                subscription.queue.put_nowait(message)
+            except asyncio.QueueFull:
+                self._drop(subscription)
+
+    def _resync_all(self):
+        """Drop every local stream after events may have been lost, so clients reconnect and refetch"""
+        loop = self._loop
+        if loop is None or loop.is_closed():
+            return
+
+        def drop_all():
+            with self._lock:
+                streams = [subscription for streams in self._subscriptions.values() for subscription in streams]
+            for subscription in streams:
+                if not subscription.dropped:
+                    self._drop(subscription, "events may have been lost")
+
+        loop.call_soon_threadsafe(drop_all)
+
+    def _drop(self, subscription: Subscription, reason: str = "not keeping up"):
+        """Disconnect a stream that is not keeping up"""
+        logger.warning(f"Dropping event stream for user {subscription.user_id}: {reason}")
+        subscription.dropped = True
+        self.unsubscribe(subscription)
+        # Make room for one final message telling the client to resync
+        while not subscription.queue.empty():
+            subscription.queue.get_nowait()
+        subscription.queue.put_nowait('event: overflow\ndata: {}\n\n')
+
+
+def folder_counters(db, account_id: int, folder: str) -> Dict[str, int]:
+    """Total and unread message counts of a folder, as sent with events"""
+    version = db.scalar(_folder_version_query(account_id, folder))
+    # Counts only change with the folder version, so cached entries never go stale
+    return cache.get_or_set(
+        "folder_counters", (account_id, folder, version or 0),
+        lambda: _counters(db.execute(_count_query(account_id, folder)).one())
+    )
+
+
+async def folder_counters_async(db, account_id: int, folder: str) -> Dict[str, int]:
+    """folder_counters with an AsyncSession"""
+    version = await db.scalar(_folder_version_query(account_id, folder))
+
+    async def count():
+        return _counters((await db.execute(_count_query(account_id, folder))).one())
+
+    return await cache.get_or_set_async("folder_counters", (account_id, folder, version or 0), count)
+
+
+def _folder_version_query(account_id: int, folder: str):
+    return select(FolderState.version).where(
+        FolderState.account_id == account_id,
+        FolderState.folder == folder
+    )
+
+
+def _count_query(account_id: int, folder: str):
+    return select(
+        func.count(Email.id),
+        func.coalesce(func.sum(case((Email.is_read.is_(True), 0), else_=1)), 0)
+    ).where(
+        Email.account_id == account_id,
+        Email.folder == folder,
+        Email.is_deleted.isnot(True)
+    )
+
+
+def _counters(row) -> Dict[str, int]:
+    total, unread = row
+    return {"total": total, "unread": unread}
+
+
+def publish_folder_counters(db, user_id: int, account_id: int, folder: str):
+    """Publish the current counters of a folder to the user's streams"""
+    if not event_broker.has_streams(user_id):
+        return
+    event_broker.publish(user_id, "folder.counters", {
+        "account_id": account_id,
+        "folder": folder,
+        **folder_counters(db, account_id, folder)
+    })
+
+
+async def publish_folder_counters_async(db, user_id: int, account_id: int, folder: str):
+    """publish_folder_counters with an AsyncSession"""
+    if not event_broker.has_streams(user_id):
+        return
+    event_broker.publish(user_id, "folder.counters", {
+        "account_id": account_id,
+        "folder": folder,
+        **await folder_counters_async(db, account_id, folder)
+    })
+
+
+# Global instance
+event_broker = EventBroker(
+    settings.EVENTS_QUEUE_SIZE, settings.EVENTS_MAX_STREAMS_PER_USER, settings.REDIS_URL, settings.EVENTS_RELAY_QUEUE_SIZE
+)
@@ -0,0 +1,476 @@
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Set, Tuple
+import asyncio
+import logging
+import random
+import threading
+
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import delete, true, update
+
+from app.core.config import settings
+from app.core.database import SessionLocal
+from app.core.locks import LeaseLock, lease_backend
+from app.core.write_queue import write_queue
+from app.models.account import EmailAccount
+from app.models.email import Email
+from app.models.flag_change import FlagChange
+from app.services.events import event_broker, publish_folder_counters
+from app.services.imap_service import IMAPService
+from app.services.message_store import message_store
+from app.utils.password import account_password
+
+logger = logging.getLogger(__name__)
+
+SEEN = "\\Seen"
+FLAGGED = "\\Flagged"
+MOVE = "move"
+DELETE = "delete"
+APPEND = "append"
+
+# Email fields kept in step with an IMAP flag
+FLAG_FIELDS = {"is_read": SEEN, "is_starred": FLAGGED}
+
+# UIDs per STORE or MOVE command, keeping command lines a sensible length
+MAX_UIDS_PER_COMMAND = 500
+
+# Trash and Sent folders by account id, detected on the first deletion or append
+_trash_folders: Dict[int, str] = {}
+_trash_folders_lock = threading.Lock()
+_sent_folders: Dict[int, str] = {}
+_sent_folders_lock = threading.Lock()
+
+
+def queue_flag_changes(db, email: Email, changes: Dict) -> int:
+    """Queue the read, starred, folder and deleted changes among changes for the IMAP server; the caller commits.
+
+    Call before the changes are applied to the row. An email has at most one
+    pending change per flag and one pending move, so quick toggles collapse
+    into the last one; a deletion replaces everything else pending. Returns
+    how many changes were queued or updated.
+    """
+    pending = {item.change: item for item in db.query(FlagChange).filter(FlagChange.email_id == email.id)}
+    move = pending.get(MOVE)
+    # Until a pending move has run, the message is still where it was
+    folder, uid = (move.folder, move.uid) if move else (email.folder, email.uid or "")
+    due = datetime.utcnow() + timedelta(seconds=settings.FLAG_SYNC_WINDOW)
+    queued = 0
+
+    def add(change: str, **values):
+        db.add(FlagChange(
+            account_id=email.account_id, email_id=email.id, change=change, folder=folder, uid=uid,
+            attempts=0, next_attempt_at=due, **values
+        ))
+
+    deleted = changes.get("is_deleted")
+    if deleted is not None and deleted != bool(email.is_deleted):
+        if deleted:
+            if APPEND in pending:
+                # Not on the server yet; the append is dropped when it finds the email deleted
+                return 0
+            for item in pending.values():
+                db.delete(item)
+            add(DELETE)
+            return 1
+        if DELETE in pending:
+            # Restored before the deletion was sent
+            db.delete(pending.pop(DELETE))
+            queued += 1
+    elif email.is_deleted:
+        return 0
+    # A deletion without a UID finds the message by Message-ID; nothing else can be sent without one.
+    # Mail still to be appended goes with the flags and folder it has by then
+    if not uid:
+        return queued
+
+    for field, flag in FLAG_FIELDS.items():
+        value = changes.get(field)
+        if value is None or value == getattr(email, field):
+            continue
+        if flag in pending:
+            # Keeps its place in the current window
+            pending[flag].value = value
+        else:
+            add(flag, value=value)
+        queued += 1
+
+    target = changes.get("folder")
+    if target and target != email.folder:
+        if move is None:
+            add(MOVE, target_folder=target)
+        elif target == move.folder:
+            # Back where it is on the server
+            db.delete(move)
+        else:
+            move.target_folder = target
+        queued += 1
+
+    return queued
+
+
+def queue_append(db, email: Email):
+    """Queue the APPEND of sent mail, read from its stored copy, to the Sent folder; the caller commits"""
+    db.add(FlagChange(
+        account_id=email.account_id, email_id=email.id, change=APPEND, folder=email.folder, uid="",
+        attempts=0, next_attempt_at=datetime.utcnow()
+    ))
+
+
+def sent_folder(account_id: int) -> str:
+    """The account's Sent folder if already detected, otherwise the default name"""
+    return _sent_folders.get(account_id, settings.SENT_FOLDER_DEFAULT)
+
+
+def _sent_folder(account_id: int, imap_service: IMAPService) -> str:
+    folder = _sent_folders.get(account_id)
+    if folder is None:
+        folder = imap_service.find_special_folder("\\Sent") or settings.SENT_FOLDER_DEFAULT
+        with _sent_folders_lock:
+            _sent_folders[account_id] = folder
+    return folder
+
+
+def _trash_folder(account_id: int, imap_service: IMAPService) -> Optional[str]:
+    folder = _trash_folders.get(account_id)
+    if folder is None:
+        folder = imap_service.find_special_folder("\\Trash")
+        if folder:
+            with _trash_folders_lock:
+                _trash_folders[account_id] = folder
+    return folder
+
+
+def pending_email_ids(db, account_id: int, change: str) -> Set[int]:
+    """Emails of an account with a change not yet on the server, whose local state wins over the server's"""
+    return {email_id for email_id, in db.query(FlagChange.email_id).filter(
+        FlagChange.account_id == account_id,
+        FlagChange.change == change
+    )}
+
+
+class FlagSyncWorker:
+    """Applies queued flag changes and moves on the IMAP servers, one connection per account and batch"""
+
+    def __init__(self):
+        self._task: Optional[asyncio.Task] = None
+        self._in_flight: Dict[int, asyncio.Task] = {}
+
+    async def start(self):
+        """Start the scan loop on the running event loop"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop scanning and wait for the batches being sent"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._in_flight:
+            await asyncio.gather(*self._in_flight.values(), return_exceptions=True)
+
+    async def _run(self):
+        while True:
+            try:
+                for account_id in await run_in_threadpool(_due_accounts):
+                    if account_id in self._in_flight:
+                        continue
+                    task = asyncio.create_task(run_in_threadpool(push_account, account_id))
+                    self._in_flight[account_id] = task
+                    task.add_done_callback(lambda _, account_id=account_id: self._in_flight.pop(account_id, None))
+            except Exception as e:
+                logger.error(f"Flag sync scan failed: {str(e)}")
+            await asyncio.sleep(settings.FLAG_SYNC_POLL_INTERVAL)
+
+
+def _due_accounts() -> List[int]:
+    db = SessionLocal()
+    try:
+        return [account_id for account_id, in db.query(FlagChange.account_id).filter(
+            FlagChange.next_attempt_at <= datetime.utcnow()
+        ).distinct()]
+    finally:
+        db.close()
+
+
+def push_account(account_id: int) -> int:
+    """Send an account's due changes to its IMAP server; returns how many were applied. Blocking."""
+    lease = LeaseLock(lease_backend, f"flag-sync:{account_id}", settings.FLAG_SYNC_LEASE_TTL)
+    if not lease.acquire():
+        return 0
+    db = SessionLocal()
+    try:
+        items = db.query(FlagChange).filter(
+            FlagChange.account_id == account_id,
+            FlagChange.next_attempt_at <= datetime.utcnow()
+        ).order_by(FlagChange.id).all()
+        if not items:
+            return 0
+        # Plain values: the results are written through the write queue, possibly by another session
+        changes = [
+            (item.id, item.email_id, item.change, item.value, item.target_folder, item.folder, item.uid, item.attempts)
+            for item in items
+        ]
+        # Deletions of messages whose UID is not known are found by Message-ID
+        unknown = [item.email_id for item in items if item.change == DELETE and not item.uid]
+        message_ids = dict(db.query(Email.id, Email.message_id).filter(Email.id.in_(unknown)).all()) if unknown else {}
+        # Sent mail is appended from its stored copy, with the flags and folder the email has now
+        appending = [item.email_id for item in items if item.change == APPEND]
+        appends = {row.id: row for row in db.query(
+            Email.id, Email.raw_hash, Email.folder, Email.is_read, Email.is_starred, Email.is_deleted
+        ).filter(Email.id.in_(appending))} if appending else {}
+        account = db.query(EmailAccount).filter(EmailAccount.id == account_id).first()
+        user_id = account.user_id
+
+        imap_service = IMAPService(account, account_password(account, "imap"))
+        if imap_service.connect():
+            try:
+                errors, moved, appended = _apply(imap_service, changes, account_id, message_ids, appends)
+            finally:
+                imap_service.disconnect()
+        else:
+            errors, moved, appended = {change[0]: "Could not connect to IMAP server" for change in changes}, {}, {}
+
+        dropped = write_queue.apply(db, _record_results, changes, errors, moved, appended)
+        counters = set()
+        for email_id, (folder, target, _) in appended.items():
+            if target != folder:
+                event_broker.publish(user_id, "email.updated", {
+                    "id": email_id,
+                    "account_id": account_id,
+                    "folder": target,
+                    "changes": {"folder": target}
+                })
+                counters |= {folder, target}
+        for email_id, change, error, restored, folders in dropped:
+            logger.error(f"Giving up on {change} for email {email_id} after {settings.FLAG_SYNC_MAX_ATTEMPTS} attempts: {error}")
+            event_broker.publish(user_id, "email.sync_failed", {
+                "id": email_id,
+                "account_id": account_id,
+                "change": change,
+                "error": error
+            })
+            if restored:
+                event_broker.publish(user_id, "email.updated", {
+                    "id": email_id,
+                    "account_id": account_id,
+                    "changes": restored
+                })
+            counters |= folders
+        for folder in counters:
+            publish_folder_counters(db, user_id, account_id, folder)
+        return len(changes) - len(errors)
+    except Exception as e:
+        logger.error(f"Error pushing flag changes for account {account_id}: {str(e)}")
+        return 0
+    finally:
+        db.close()
+        lease.release()
+
+
+def _apply(imap_service: IMAPService, changes, account_id: int, message_ids: Dict[int, str],
+           appends: Dict[int, Any]) -> Tuple[Dict[int, str], Dict[int, Tuple[str, Optional[str]]], Dict[int, Tuple[str, str, Optional[str]]]]:
+    """Send changes grouped into one command per flag per folder, then moves per target, then deletions per folder, then appends.
+
+    Returns the error of every change that failed, the new folder and UID
+    (None if the server did not report it) of every email moved, and the
+    local folder, server folder and UID of every email appended. A deletion
+    whose message is not in its folder (looked up by Message-ID when the UID
+    is unknown) succeeds: there is nothing left to delete. So does the append
+    of an email deleted meanwhile.
+    """
+    flags = defaultdict(list)
+    moves = defaultdict(list)
+    deletions = defaultdict(list)
+    appending = []
+    for change in changes:
+        change_id, email_id, kind, value, target, folder, uid, _ = change
+        if kind == MOVE:
+            moves[(folder, target)].append(change)
+        elif kind == DELETE:
+            deletions[folder].append(change)
+        elif kind == APPEND:
+            appending.append(change)
+        else:
+            flags[(folder, kind, value)].append(change)
+
+    errors: Dict[int, str] = {}
+    moved: Dict[int, Tuple[str, Optional[str]]] = {}
+    # Flags first: they apply to messages where they are before any move
+    for (folder, flag, value), group in flags.items():
+        for batch in _chunks(group):
+            success, error = imap_service.store_flags([change[6] for change in batch], flag, value, folder)
+            if not success:
+                errors.update((change[0], error) for change in batch)
+    for (folder, target), group in moves.items():
+        for batch in _chunks(group):
+            success, error, new_uids = imap_service.move_messages([change[6] for change in batch], target, folder)
+            if not success:
+                errors.update((change[0], error) for change in batch)
+                continue
+            for change in batch:
+                moved[change[1]] = (target, new_uids.get(change[6]))
+    if deletions:
+        trash = None if settings.DELETE_EXPUNGE else _trash_folder(account_id, imap_service)
+    for folder, group in deletions.items():
+        located = {}
+        lookups = {change[0]: message_ids.get(change[1]) for change in group if not change[6]}
+        if any(lookups.values()):
+            try:
+                found = imap_service.find_uids_by_message_id([message_id for message_id in lookups.values() if message_id], folder)
+            except Exception as e:
+                errors.update((change_id, str(e)) for change_id in lookups)
+                found = {}
+            located = {change_id: found.get(message_id) for change_id, message_id in lookups.items() if message_id}
+        uids_by_change = [
+            (change, change[6] or located.get(change[0])) for change in group
+            if change[0] not in errors and (change[6] or located.get(change[0]))
+        ]
+        for batch in _chunks(uids_by_change):
+            uids = [uid for _, uid in batch]
+            batch = [change for change, _ in batch]
+            # Mail already in Trash (or with no Trash to go to) is removed for good
+            if trash and folder != trash:
+                success, error, _ = imap_service.move_messages(uids, trash, folder)
+            else:
+                success, error = imap_service.expunge_messages(uids, folder)
+            if not success:
+                errors.update((change[0], error) for change in batch)
+
+    appended: Dict[int, Tuple[str, str, Optional[str]]] = {}
+    for change in appending:
+        email = appends.get(change[1])
+        if email is None or email.is_deleted:
+            continue
+        if not email.raw_hash:
+            errors[change[0]] = "No stored copy to append"
+            continue
+        # Still in the folder it was given when sent: that is the Sent folder, detected on the server now
+        target = _sent_folder(account_id, imap_service) if email.folder == change[5] else email.folder
+        on = [flag for flag, is_set in ((SEEN, email.is_read), (FLAGGED, email.is_starred)) if is_set]
+        success, uid = imap_service.append_stream(
+            target, lambda digest=email.raw_hash: message_store.chunks(digest), f"({' '.join(on)})"
+        )
+        if not success:
+            errors[change[0]] = f"Could not append to {target}"
+            continue
+        appended[change[1]] = (email.folder, target, uid)
+    return errors, moved, appended
+
+
+def _chunks(group: List) -> List[List]:
+    return [group[start:start + MAX_UIDS_PER_COMMAND] for start in range(0, len(group), MAX_UIDS_PER_COMMAND)]
+
+
+def _restore(db, email_id: int, kind: str, value: Optional[bool], target: Optional[str], folder: str, uid: str) -> Tuple[Dict, Set[str]]:
+    """Put a row back the way it still is on the server after giving up on a change.
+
+    Returns the fields restored and the folders whose counters changed.
+
+    Sync neither reads \\Flagged nor moves existing rows, so nothing else would
+    undo the local change. Through the ORM, so folder versions are bumped.
+    Sent mail that could not be appended stays as it is, only local.
+    """
+    email = db.get(Email, email_id)
+    if email is None or kind == APPEND:
+        return {}, set()
+    if kind == DELETE:
+        if not email.is_deleted:
+            return {}, set()
+        email.is_deleted = False
+        email.deleted_at = None
+        return {"is_deleted": False}, {email.folder}
+    if kind == MOVE:
+        # Moved again locally since: that move is queued from the old place too
+        if email.folder != target:
+            return {}, set()
+        email.folder = folder
+        email.uid = uid or None
+        return {"folder": folder}, {folder, target}
+    field = next(field for field, flag in FLAG_FIELDS.items() if flag == kind)
+    if getattr(email, field) != value:
+        return {}, set()
+    setattr(email, field, not value)
+    return {field: not value}, {email.folder}
+
+
+def _record_results(db, changes, errors: Dict[int, str], moved: Dict[int, Tuple[str, Optional[str]]],
+                    appended: Dict[int, Tuple[str, str, Optional[str]]]) -> List[Tuple[int, str, str, Dict, Set[str]]]:
+    """Remove applied changes, reschedule failed ones and follow moved and appended messages.
+
+    Returns the changes given up on, with the fields of their rows restored and the folders affected.
+    """
+    now = datetime.utcnow()
+    dropped = []
+    for change_id, email_id, kind, value, target, folder, uid, attempts in changes:
+        error = errors.get(change_id)
+        if error is None:
+            # Only if it was not changed again while it was being sent; then it goes out with the next batch
+            unchanged = FlagChange.target_folder == target if kind == MOVE else FlagChange.value == value
+            db.execute(
+                delete(FlagChange).where(FlagChange.id == change_id, unchanged if kind not in (DELETE, APPEND) else true()),
+                execution_options={"synchronize_session": False}
+            )
+            if kind == DELETE:
+                # Confirmed gone from the server, so the row may be purged. expunged_at is not listed, so no version bump
+                db.execute(
+                    update(Email).where(Email.id == email_id, Email.is_deleted.is_(True)).values(expunged_at=now),
+                    execution_options={"synchronize_session": False}
+                )
+        elif attempts + 1 >= settings.FLAG_SYNC_MAX_ATTEMPTS:
+            db.execute(delete(FlagChange).where(FlagChange.id == change_id), execution_options={"synchronize_session": False})
+            dropped.append((email_id, kind, error, *_restore(db, email_id, kind, value, target, folder, uid)))
+        else:
+            db.execute(
+                update(FlagChange).where(FlagChange.id == change_id).values(
+                    attempts=attempts + 1, last_error=error, next_attempt_at=now + timedelta(seconds=_backoff(attempts + 1))
+                ),
+                execution_options={"synchronize_session": False}
+            )
+
+    for email_id, (target, new_uid) in moved.items():
+        # Through the ORM, so the new UID bumps the folder's version like the appended branch below.
+        # Without a new UID (no UIDPLUS) the next sync of the target folder fills it in
+        email = db.get(Email, email_id)
+        if email is not None and email.folder == target:
+            email.uid = new_uid
+        # Changes queued meanwhile still point at the old place. Without the new UID flag changes
+        # cannot be sent, and the next sync reads the flags back; a deletion finds it by Message-ID
+        later = (FlagChange.email_id == email_id, FlagChange.change != MOVE)
+        if new_uid:
+            db.execute(
+                update(FlagChange).where(*later).values(folder=target, uid=new_uid),
+                execution_options={"synchronize_session": False}
+            )
+        else:
+            db.execute(
+                update(FlagChange).where(*later, FlagChange.change == DELETE).values(folder=target, uid=""),
+                execution_options={"synchronize_session": False}
+            )
+            db.execute(
+                delete(FlagChange).where(*later, FlagChange.change != DELETE),
+                execution_options={"synchronize_session": False}
+            )
+
+    for email_id, (folder, target, new_uid) in appended.items():
+        # Through the ORM, so a correction of the folder bumps both folders' versions.
+        # Without a UID (no UIDPLUS) the next sync of the folder fills it in
+        email = db.get(Email, email_id)
+        if email is not None and email.folder == folder:
+            email.folder = target
+            email.uid = new_uid
+    return dropped
+
+
+def _backoff(attempts: int) -> float:
+    """Exponential backoff with jitter for the given number of failed attempts"""
+    delay = min(settings.FLAG_SYNC_BACKOFF_BASE * (2 ** (attempts - 1)), settings.FLAG_SYNC_BACKOFF_MAX)
+    return delay * random.uniform(0.8, 1.2)
+
+
+# Global instance
+flag_sync_worker = FlagSyncWorker()
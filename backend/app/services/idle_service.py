@@ -0,0 +1,279 @@
+from typing import Dict, List, Optional
+import asyncio
+import logging
+import re
+import threading
+
+from fastapi.concurrency import run_in_threadpool
+
+from app.core.config import settings
+from app.core.database import SessionLocal
+from app.core.locks import FlightBusy, LeaseLock, lease_backend, single_flight
+from app.models.account import EmailAccount
+from app.services.imap_service import IMAPService, MAILBOX_CHANGE_RE
+from app.services.sync_service import apply_read_flags, latest_uid, mark_expunged, sync_folder, sync_key
+from app.utils.password import account_password
+
+logger = logging.getLogger(__name__)
+
+FETCH_UID_RE = re.compile(rb'\bUID (\d+)', re.IGNORECASE)
+FETCH_FLAGS_RE = re.compile(rb'\bFLAGS \(([^)]*)\)', re.IGNORECASE)
+
+
+class _AnySet:
+    """Quacks like a threading.Event that is set when any of the given events is"""
+
+    def __init__(self, *events: threading.Event):
+        self.events = events
+
+    def is_set(self) -> bool:
+        return any(event.is_set() for event in self.events)
+
+
+class MailboxWatcher(threading.Thread):
+    """Keeps one IMAP connection in IDLE (or NOOP polling) on an account's folder.
+
+    The UIDs of the folder are kept in sequence order so that EXPUNGE and FETCH
+    responses, which only carry sequence numbers, map back to stored emails.
+    The account's lease, taken by the caller, is held until the watcher stops;
+    if it is lost the watcher stops by itself.
+    """
+
+    def __init__(self, account_id: int, lease: LeaseLock, folder: str = "INBOX"):
+        super().__init__(name=f"imap-idle-{account_id}", daemon=True)
+        self.account_id = account_id
+        self.lease = lease
+        self.folder = folder
+        self.stop_event = threading.Event()
+        self._uids: List[int] = []
+
+    def stop(self):
+        self.stop_event.set()
+
+    def run(self):
+        failures = 0
+        interrupted = _AnySet(self.stop_event, self.lease.lost)
+        try:
+            while not interrupted.is_set():
+                try:
+                    self._watch(interrupted)
+                    failures = 0
+                except Exception as e:
+                    failures += 1
+                    delay = min(settings.IMAP_IDLE_RECONNECT_DELAY * 2 ** (failures - 1), settings.IMAP_IDLE_RECONNECT_MAX_DELAY)
+                    logger.warning(f"IMAP watcher for account {self.account_id} failed: {str(e)}; reconnecting in {delay}s")
+                    self.stop_event.wait(delay)
+        finally:
+            self.lease.release()
+
+    def _watch(self, interrupted: _AnySet):
+        account = self._load_account()
+        if account is None:
+            self.stop_event.set()
+            return
+
+        imap_service = IMAPService(account, account_password(account, "imap"))
+        if not imap_service.connect():
+            raise ConnectionError(f"Could not connect to {account.imap_host}")
+
+        try:
+            if not imap_service.select_folder(self.folder):
+                raise ConnectionError(f"Could not select {self.folder}")
+            self._catch_up(imap_service)
+
+            use_idle = imap_service.supports_idle()
+            if not use_idle:
+                logger.info(f"IMAP server for account {self.account_id} has no IDLE, polling with NOOP")
+
+            while not interrupted.is_set():
+                if use_idle:
+                    # Re-issued before the server's 29 minute inactivity timeout (RFC 2177)
+                    changes = imap_service.idle(settings.IMAP_IDLE_TIMEOUT, interrupted)
+                else:
+                    if self.stop_event.wait(settings.IMAP_POLL_INTERVAL) or self.lease.lost.is_set():
+                        break
+                    changes = imap_service.poll()
+                if changes:
+                    self._apply_changes(imap_service, changes)
+        finally:
+            imap_service.disconnect()
+
+    def _catch_up(self, imap_service: IMAPService):
+        """Fetch whatever arrived while we were not connected and load the UID map"""
+        db = SessionLocal()
+        try:
+            account = db.query(EmailAccount).filter(EmailAccount.id == self.account_id).first()
+            self._sync_new(db, account, imap_service)
+        finally:
+            db.close()
+        self._uids = imap_service.search_uids(self.folder)
+
+    def _apply_changes(self, imap_service: IMAPService, changes: List[bytes]):
+        """Turn untagged EXISTS/EXPUNGE/FETCH responses into targeted updates"""
+        new_mail = False
+        resync = False
+        expunged: List[int] = []
+        read_by_uid: Dict[int, bool] = {}
+
+        for line in changes:
+            match = MAILBOX_CHANGE_RE.match(line)
+            number, kind, rest = int(match.group(1)), match.group(2).upper(), match.group(3)
+
+            if kind == b'EXPUNGE':
+                if 1 <= number <= len(self._uids):
+                    expunged.append(self._uids.pop(number - 1))
+                else:
+                    resync = True
+            elif kind == b'EXISTS':
+                if number > len(self._uids):
+                    new_mail = True
+                elif number < len(self._uids):
+                    resync = True
+            else:
+                flags = FETCH_FLAGS_RE.search(rest)
+                if not flags:
+                    continue
+                uid_match = FETCH_UID_RE.search(rest)
+                if uid_match:
+                    uid = int(uid_match.group(1))
+                elif 1 <= number <= len(self._uids):
+                    uid = self._uids[number - 1]
+                else:
+                    resync = True
+                    continue
+                read_by_uid[uid] = b'\\Seen' in flags.group(1).split()
+
+        if new_mail:
+            since_uid = self._uids[-1] if self._uids else None
+            self._uids.extend(imap_service.search_uids(self.folder, since_uid=since_uid))
+        if resync:
+            current = imap_service.search_uids(self.folder)
+            present = set(current)
+            expunged.extend(uid for uid in self._uids if uid not in present)
+            self._uids = current
+
+        db = SessionLocal()
+        try:
+            account = db.query(EmailAccount).filter(EmailAccount.id == self.account_id).first()
+            if account is None:
+                self.stop_event.set()
+                return
+            if expunged:
+                mark_expunged(db, account, self.folder, expunged)
+            if read_by_uid:
+                apply_read_flags(db, account, self.folder, read_by_uid)
+            if new_mail:
+                self._sync_new(db, account, imap_service)
+        finally:
+            db.close()
+
+    def _sync_new(self, db, account: EmailAccount, imap_service: IMAPService):
+        """Store messages above the highest stored UID, unless a sync of the folder is already running"""
+        def sync():
+            since_uid = latest_uid(db, self.account_id, self.folder)
+            return sync_folder(db, account, imap_service, self.folder, limit=settings.MAX_EMAILS_PER_FETCH, since_uid=since_uid)
+
+        try:
+            single_flight.run(sync_key(self.account_id, self.folder), sync, settings.SYNC_LOCK_TTL, settings.SYNC_LOCK_WAIT)
+        except FlightBusy:
+            logger.info(f"Sync of account {self.account_id} {self.folder} already running elsewhere")
+
+    def _load_account(self) -> Optional[EmailAccount]:
+        db = SessionLocal()
+        try:
+            return db.query(EmailAccount).filter(
+                EmailAccount.id == self.account_id,
+                EmailAccount.is_active.is_(True)
+            ).first()
+        finally:
+            db.close()
+
+
+class IdleManager:
+    """Runs a MailboxWatcher for active accounts' INBOXes, up to a per-process cap.
+
+    Each worker process takes the accounts whose lease no other worker holds,
+    so together they watch up to IMAP_IDLE_MAX_CONNECTIONS times as many.
+    """
+
+    def __init__(self):
+        self._task: Optional[asyncio.Task] = None
+        self._watchers: Dict[int, MailboxWatcher] = {}
+        self._over_cap = False
+
+    async def start(self):
+        """Start watching accounts on the running event loop"""
+        if settings.IMAP_IDLE_ENABLED and self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop all watchers and wait for their connections to close"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+        watchers = list(self._watchers.values())
+        self._watchers.clear()
+        for watcher in watchers:
+            watcher.stop()
+        for watcher in watchers:
+            await run_in_threadpool(watcher.join, 5)
+
+    def watched_accounts(self) -> List[int]:
+        return sorted(self._watchers)
+
+    async def _run(self):
+        while True:
+            try:
+                await run_in_threadpool(self._rescan)
+            except Exception as e:
+                logger.error(f"Error refreshing IMAP watchers: {str(e)}")
+            await asyncio.sleep(settings.IMAP_IDLE_RESCAN_INTERVAL)
+
+    def _rescan(self):
+        """Stop watchers no longer wanted, then watch accounts no other worker watches, up to this process's cap"""
+        db = SessionLocal()
+        try:
+            account_ids = [
+                account_id for (account_id,) in db.query(EmailAccount.id).filter(
+                    EmailAccount.is_active.is_(True)
+                ).order_by(EmailAccount.id).all()
+            ]
+        finally:
+            db.close()
+
+        active = set(account_ids)
+        for account_id, watcher in list(self._watchers.items()):
+            # A watcher that lost its lease has stopped; another worker watches the account now
+            if account_id not in active or not watcher.is_alive():
+                watcher.stop()
+                del self._watchers[account_id]
+
+        unwatched = 0
+        for account_id in account_ids:
+            if account_id in self._watchers:
+                continue
+            if len(self._watchers) >= settings.IMAP_IDLE_MAX_CONNECTIONS:
+                unwatched += 1
+                continue
+            # Held by the worker watching the account; only free ones are taken here
+            lease = LeaseLock(lease_backend, f"idle:{account_id}", settings.IMAP_IDLE_LEASE_TTL)
+            if lease.acquire():
+                watcher = MailboxWatcher(account_id, lease)
+                self._watchers[account_id] = watcher
+                watcher.start()
+
+        if unwatched and not self._over_cap:
+            logger.warning(
+                f"Watching IMAP_IDLE_MAX_CONNECTIONS={settings.IMAP_IDLE_MAX_CONNECTIONS} accounts in this process; "
+                f"up to {unwatched} more are left to other workers, or only update on manual sync"
+            )
+        self._over_cap = bool(unwatched)
+
+
+# Global instance
+idle_manager = IdleManager()
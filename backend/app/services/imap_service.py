@@ -1,16 +1,69 @@
 import imaplib
 import email
 import email.utils
-from typing import List, Dict, Optional, Tuple
+from typing import Callable, Iterable, Iterator, List, Dict, Optional, Tuple
 from datetime import datetime
 import logging
 import re
+import select
+import ssl
+import threading
+import time
 
+from app.core.config import settings
+from app.core.metrics import IMAP_COMMAND_SECONDS
 from app.schemas.email import EmailCreate
 from app.schemas.account import EmailAccount
+from app.services.message_store import store_raw_message
+from app.services.mime_parser import parse_message
 
 logger = logging.getLogger(__name__)
 
+# Untagged LIST response: (<flags>) <delimiter> <name>
+LIST_RESPONSE_RE = re.compile(r'\((?P<flags>[^)]*)\)\s+(?:"(?:[^"\\]|\\.)*"|NIL)\s+(?P<name>.+)$')
+
+# Untagged responses that mean the selected mailbox changed
+MAILBOX_CHANGE_RE = re.compile(rb'^\* (\d+) (EXISTS|EXPUNGE|FETCH)\b(.*)$', re.IGNORECASE)
+
+# Any line ending, sent as CRLF in literals
+LINE_ENDING_RE = re.compile(rb'\r\n|\r|\n')
+
+# Folder names to try when the server doesn't advertise RFC 6154 special-use attributes
+SPECIAL_FOLDER_NAMES = {
+    "\\Sent": ["Sent", "Sent Items", "Sent Messages", "Sent Mail"],
+    "\\Trash": ["Trash", "Deleted Items", "Deleted Messages", "Bin"],
+    "\\Drafts": ["Drafts"],
+}
+
+
+class _TimedCommands:
+    """Records the round-trip time of every command sent through imaplib"""
+
+    def _simple_command(self, name, *args):
+        command = f"UID {args[0]}" if name == "UID" and args else name
+        with IMAP_COMMAND_SECONDS.labels(command).time():
+            return super()._simple_command(name, *args)
+
+
+class _IMAP4(_TimedCommands, imaplib.IMAP4):
+    pass
+
+
+class _IMAP4_SSL(_TimedCommands, imaplib.IMAP4_SSL):
+    pass
+
+
+def _crlf_chunks(chunks: Iterable[bytes]) -> Iterator[bytes]:
+    """The chunks with every line ending made CRLF, as imaplib does for APPEND"""
+    pending = b''
+    for chunk in chunks:
+        chunk = pending + chunk
+        # A CR at the end may be half of a CRLF split across chunks
+        pending = b'\r' if chunk.endswith(b'\r') else b''
+        yield LINE_ENDING_RE.sub(b'\r\n', chunk[:len(chunk) - len(pending)])
+    if pending:
+        yield b'\r\n'
+
 
 class IMAPService:
     def __init__(self, account: EmailAccount, password: str):
@@ -24,19 +77,25 @@ class IMAPService:
         try:
             logger.info(f"Connecting to IMAP server {self.account.imap_host}:{self.account.imap_port}")
             
-            if self.account.imap_ssl:
-                self.connection = imaplib.IMAP4_SSL(
-                    self.account.imap_host, 
-                    self.account.imap_port
-                )
-            else:
-                self.connection = imaplib.IMAP4(
-                    self.account.imap_host, 
-                    self.account.imap_port
-                )
+            with IMAP_COMMAND_SECONDS.labels("CONNECT").time():
+                if self.account.imap_ssl:
+                    self.connection = _IMAP4_SSL(
+                        self.account.imap_host, 
+                        self.account.imap_port
+                    )
+                else:
+                    self.connection = _IMAP4(
+                        self.account.imap_host, 
+                        self.account.imap_port
+                    )
             
             logger.info(f"Attempting login for user: {self.account.imap_username}")
             self.connection.login(self.account.imap_username, self.password)
+            
+            # Servers often announce more capabilities (MOVE, UIDPLUS) once logged in; keep those
+            _, advertised = self.connection.response('CAPABILITY')
+            if advertised and advertised[-1]:
+                self.connection.capabilities = tuple(advertised[-1].decode(errors='ignore').upper().split())
             logger.info(f"Successfully connected to IMAP server for {self.account.email_address}")
             return True
             
@@ -97,6 +156,104 @@ class IMAPService:
             logger.error(f"Error getting folders: {str(e)}")
             return ["INBOX"]
     
+    def find_special_folder(self, attribute: str = "\\Sent") -> Optional[str]:
+        """Find a folder by its RFC 6154 special-use attribute, falling back to common names"""
+        if not self.connection:
+            if not self.connect():
+                return None
+        
+        try:
+            status, folders = self.connection.list()
+            if status != 'OK':
+                return None
+            
+            names = []
+            for folder in folders:
+                parsed = self._parse_list_entry(folder)
+                if not parsed:
+                    continue
+                flags, name = parsed
+                if attribute.lower() in (flag.lower() for flag in flags):
+                    return name
+                names.append(name)
+            
+            # Servers without SPECIAL-USE: match well-known names
+            fallbacks = SPECIAL_FOLDER_NAMES.get(attribute, [])
+            by_leaf = {}
+            for name in names:
+                leaf = re.split(r'[./]', name)[-1].lower()
+                by_leaf.setdefault(leaf, name)
+            for candidate in fallbacks:
+                if candidate.lower() in by_leaf:
+                    return by_leaf[candidate.lower()]
+            return None
+        except Exception as e:
+            logger.error(f"Error finding {attribute} folder: {str(e)}")
+            return None
+    
+    def append_stream(self, folder: str, chunks: Callable[[], Iterable[bytes]], flags: str = "(\\Seen)") -> Tuple[bool, Optional[str]]:
+        """APPEND a message to a folder; returns (success, uid) with the uid when the server reports APPENDUID
+        
+        The message is streamed rather than held in memory: chunks() yields it
+        and is called twice, once to size the literal and once to send it.
+        """
+        if not self.connection:
+            if not self.connect():
+                return False, None
+        
+        connection = self.connection
+        try:
+            with IMAP_COMMAND_SECONDS.labels("APPEND").time():
+                size = sum(len(chunk) for chunk in _crlf_chunks(chunks()))
+                tag = connection._new_tag()
+                date = imaplib.Time2Internaldate(time.time())
+                connection.send(tag + f' APPEND {self._quote_mailbox(folder)} {flags} {date} {{{size}}}\r\n'.encode())
+                while True:
+                    line = self._read_response_line()
+                    if line.startswith(b'+'):
+                        break
+                    if line.startswith(tag):
+                        logger.error(f"Failed to append message to {folder}: {line.decode(errors='ignore')}")
+                        return False, None
+                
+                for chunk in _crlf_chunks(chunks()):
+                    connection.send(chunk)
+                connection.send(b'\r\n')
+                while True:
+                    line = self._read_response_line()
+                    if line.startswith(tag):
+                        break
+            
+            if not line[len(tag):].lstrip().upper().startswith(b'OK'):
+                logger.error(f"Failed to append message to {folder}: {line.decode(errors='ignore')}")
+                return False, None
+            
+            # RFC 4315 UIDPLUS: "<tag> OK [APPENDUID <uidvalidity> <uid>] ..."
+            match = re.search(rb'APPENDUID \d+ (\d+)', line)
+            return True, match.group(1).decode() if match else None
+        except Exception as e:
+            logger.error(f"Error appending message to {folder}: {str(e)}")
+            return False, None
+    
+    @staticmethod
+    def _parse_list_entry(entry) -> Optional[Tuple[List[str], str]]:
+        """Parse a LIST response line like: (\\HasNoChildren \\Sent) "." "INBOX.Sent" """
+        entry = entry.decode(errors='ignore') if isinstance(entry, bytes) else str(entry)
+        match = LIST_RESPONSE_RE.match(entry)
+        if not match:
+            return None
+        name = match.group('name').strip()
+        if len(name) >= 2 and name[0] == name[-1] == '"':
+            name = name[1:-1].replace('\\"', '"').replace('\\\\', '\\')
+        return match.group('flags').split(), name
+    
+    @staticmethod
+    def _quote_mailbox(folder: str) -> str:
+        """Quote a mailbox name for commands (imaplib sends arguments verbatim)"""
+        if folder.startswith('"') or not re.search(r'[\s"\\(){%*]', folder):
+            return folder
+        return '"' + folder.replace('\\', '\\\\').replace('"', '\\"') + '"'
+    
     def select_folder(self, folder: str = "INBOX") -> bool:
         """Select a folder"""
         if not self.connection:
@@ -124,7 +281,7 @@ class IMAPService:
             return self.select_folder(folder)
         return True
     
-    def get_email_list(self, folder: str = "INBOX", limit: int = 50) -> List[Dict]:
+    def get_email_list(self, folder: str = "INBOX", limit: int = 50, since_uid: Optional[int] = None) -> List[Dict]:
         """Get list of emails from folder with improved UID handling"""
         if not self.ensure_folder_selected(folder):
             logger.error(f"Failed to select folder: {folder}")
@@ -132,7 +289,8 @@ class IMAPService:
             
         try:
             # Use UID SEARCH instead of regular SEARCH for more reliable results
-            status, messages = self.connection.uid('search', None, 'ALL')
+            criteria = f'UID {since_uid + 1}:*' if since_uid is not None else 'ALL'
+            status, messages = self.connection.uid('search', None, criteria)
             
             if status != 'OK':
                 logger.error(f"IMAP UID search failed with status: {status}")
@@ -144,6 +302,9 @@ class IMAPService:
             
             # Get UIDs as strings (they should remain as strings for IMAP operations)
             email_uids = messages[0].decode().split()
+            if since_uid is not None:
+                # "N:*" always matches the newest message, even when its UID is below N
+                email_uids = [uid for uid in email_uids if uid.isdigit() and int(uid) > since_uid]
             email_list = []
             
             if not email_uids:
@@ -181,6 +342,121 @@ class IMAPService:
             logger.error(f"Error getting email list from folder {folder}: {str(e)}")
             return []
     
+    def search_uids(self, folder: str = "INBOX", since_uid: Optional[int] = None) -> List[int]:
+        """UIDs in a folder (optionally only those above since_uid), in message sequence order"""
+        if not self.ensure_folder_selected(folder):
+            raise imaplib.IMAP4.error(f"Could not select {folder}")
+        
+        criteria = f'UID {since_uid + 1}:*' if since_uid is not None else 'ALL'
+        status, messages = self.connection.uid('search', None, criteria)
+        if status != 'OK':
+            raise imaplib.IMAP4.error(f"UID SEARCH failed in {folder}: {status}")
+        uids = [int(uid) for uid in (messages[0] or b'').split()]
+        if since_uid is not None:
+            uids = [uid for uid in uids if uid > since_uid]
+        return uids
+    
+    def find_uids_by_message_id(self, message_ids: List[str], folder: str = "INBOX") -> Dict[str, str]:
+        """UIDs of the messages in a folder with the given Message-IDs; ids not found are left out"""
+        if not self.ensure_folder_selected(folder):
+            raise imaplib.IMAP4.error(f"Could not select {folder}")
+        
+        found = {}
+        for message_id in message_ids:
+            quoted = message_id.replace('\\', '\\\\').replace('"', '\\"')
+            status, messages = self.connection.uid('search', None, 'HEADER', 'Message-ID', f'"{quoted}"')
+            if status != 'OK':
+                raise imaplib.IMAP4.error(f"UID SEARCH failed in {folder}: {status}")
+            uids = (messages[0] or b'').split()
+            if uids:
+                found[message_id] = uids[-1].decode()
+        return found
+    
+    def supports_idle(self) -> bool:
+        """Whether the server advertises RFC 2177 IDLE"""
+        return bool(self.connection) and 'IDLE' in self.connection.capabilities
+    
+    def idle(self, timeout: float, stop_event: Optional[threading.Event] = None) -> List[bytes]:
+        """IDLE on the selected folder until it changes, timeout expires or stop_event is set.
+        
+        Returns the untagged EXISTS/EXPUNGE/FETCH responses received, in order.
+        """
+        connection = self.connection
+        tag = connection._new_tag()
+        connection.send(tag + b' IDLE\r\n')
+        
+        changes = []
+        while True:
+            line = self._read_response_line()
+            if line.startswith(b'+'):
+                break
+            if line.startswith(tag):
+                raise imaplib.IMAP4.error(f"IDLE rejected: {line.decode(errors='ignore')}")
+            self._collect_change(line, changes)
+        
+        deadline = time.monotonic() + timeout
+        while not changes and time.monotonic() < deadline:
+            if stop_event is not None and stop_event.is_set():
+                break
+            # Wake up at least once a second to notice stop_event
+            if self._wait_readable(min(deadline - time.monotonic(), 1.0)):
+                self._collect_change(self._read_response_line(), changes)
+        
+        connection.send(b'DONE\r\n')
+        while True:
+            line = self._read_response_line()
+            if line.startswith(tag):
+                break
+            self._collect_change(line, changes)
+        return changes
+    
+    def poll(self) -> List[bytes]:
+        """NOOP for servers without IDLE; returns changes in the same form as idle()"""
+        connection = self.connection
+        connection.noop()
+        changes = []
+        for kind in ('EXPUNGE', 'EXISTS', 'FETCH'):
+            for data in connection.untagged_responses.pop(kind, []):
+                if isinstance(data, tuple):
+                    data = data[0]
+                number, _, rest = data.partition(b' ')
+                changes.append(b'* ' + number + b' ' + kind.encode() + (b' ' + rest if rest else b''))
+        # imaplib groups responses by type; EXPUNGE first keeps later sequence numbers valid
+        return changes
+    
+    def _read_response_line(self) -> bytes:
+        line = self.connection.readline()
+        if not line:
+            raise imaplib.IMAP4.abort("socket closed during IDLE")
+        match = re.search(rb'\{(\d+)\}\r\n$', line)
+        if match:
+            # A literal (e.g. in a FETCH response) follows; keep the line whole
+            line = line + self.connection.read(int(match.group(1))) + self.connection.readline()
+        return line.rstrip(b'\r\n')
+    
+    def _wait_readable(self, timeout: float) -> bool:
+        """Wait for server data without blocking inside imaplib's buffered reader"""
+        if timeout <= 0:
+            return False
+        sock = self.connection.sock
+        previous = sock.gettimeout()
+        sock.setblocking(False)
+        try:
+            # Data may already sit in the reader (or TLS) buffer where select can't see it
+            if self.connection.file.peek(1):
+                return True
+        except (BlockingIOError, ssl.SSLWantReadError):
+            pass
+        finally:
+            sock.settimeout(previous)
+        readable, _, _ = select.select([sock], [], [], timeout)
+        return bool(readable)
+    
+    @staticmethod
+    def _collect_change(line: bytes, changes: List[bytes]):
+        if MAILBOX_CHANGE_RE.match(line):
+            changes.append(line)
+    
     def get_email_content(self, uid: str, folder: str = "INBOX") -> Optional[Dict]:
         """Get full email content by UID with improved error handling"""
         # Ensure we're connected and have the right folder selected
@@ -213,8 +489,14 @@ class IMAPService:
                 return None
                 
             # Parse the email message
-            email_message = email.message_from_bytes(email_body)
-            parsed_data = self._parse_email_message(email_message, str(uid))
+            if settings.MIME_FAST_PARSE:
+                parsed_data = parse_message(email_body, str(uid))
+            else:
+                email_message = email.message_from_bytes(email_body)
+                parsed_data = self._parse_email_message(email_message, str(uid))
+            
+            # Keep the original so later reads, downloads and exports don't need the server
+            parsed_data['raw_hash'] = store_raw_message(email_body)
             
             # Also get flags to see if it's read
             try:
@@ -300,6 +582,91 @@ class IMAPService:
             logger.error(f"Error deleting email: {str(e)}")
             return False
     
+    def store_flags(self, uids: List[str], flag: str, value: bool, folder: str = "INBOX") -> Tuple[bool, Optional[str]]:
+        """Set (value=True) or clear a flag on several messages with one UID STORE; returns (success, error)"""
+        if not self.ensure_folder_selected(folder):
+            return False, f"Could not select folder {folder}"
+        
+        try:
+            status, response = self.connection.uid(
+                'store', ','.join(uids), '+FLAGS.SILENT' if value else '-FLAGS.SILENT', f'({flag})'
+            )
+            if status != 'OK':
+                return False, f"UID STORE {flag} failed: {status} - {response}"
+            return True, None
+        except Exception as e:
+            logger.error(f"Error storing {flag} in {folder}: {str(e)}")
+            return False, str(e)
+    
+    def move_messages(self, uids: List[str], target: str, folder: str = "INBOX") -> Tuple[bool, Optional[str], Dict[str, str]]:
+        """Move messages to another folder; returns (success, error, new UID by old UID when the server reports them)"""
+        if not self.ensure_folder_selected(folder):
+            return False, f"Could not select folder {folder}", {}
+        
+        uid_set = ','.join(uids)
+        try:
+            # Drop a COPYUID left from an earlier command
+            self.connection.response('COPYUID')
+            copied = []
+            if 'MOVE' in self.connection.capabilities:
+                status, response = self.connection.uid('move', uid_set, self._quote_mailbox(target))
+            else:
+                status, response = self.connection.uid('copy', uid_set, self._quote_mailbox(target))
+                copied = response
+                if status == 'OK':
+                    status, response = self._expunge_uids(uid_set)
+            if status != 'OK':
+                return False, f"Moving to {target} failed: {status} - {response}", {}
+            
+            # RFC 4315 UIDPLUS: "[COPYUID <uidvalidity> <source uids> <new uids>]", untagged
+            # for MOVE and in the tagged reply for COPY
+            _, untagged = self.connection.response('COPYUID')
+            codes = [data.decode(errors='ignore') for data in untagged or [] if isinstance(data, bytes)]
+            for data in copied or []:
+                if isinstance(data, bytes):
+                    codes.extend(re.findall(r'\[COPYUID ([^\]]*)\]', data.decode(errors='ignore')))
+            new_uids = {}
+            for code in codes:
+                parts = code.split()
+                if len(parts) == 3:
+                    new_uids.update(zip(self._expand_uid_set(parts[1]), self._expand_uid_set(parts[2])))
+            return True, None, new_uids
+        except Exception as e:
+            logger.error(f"Error moving messages from {folder} to {target}: {str(e)}")
+            return False, str(e), {}
+    
+    def expunge_messages(self, uids: List[str], folder: str = "INBOX") -> Tuple[bool, Optional[str]]:
+        """Permanently remove messages from a folder; returns (success, error)"""
+        if not self.ensure_folder_selected(folder):
+            return False, f"Could not select folder {folder}"
+        
+        try:
+            status, response = self._expunge_uids(','.join(uids))
+            if status != 'OK':
+                return False, f"Expunging from {folder} failed: {status} - {response}"
+            return True, None
+        except Exception as e:
+            logger.error(f"Error expunging messages from {folder}: {str(e)}")
+            return False, str(e)
+    
+    def _expunge_uids(self, uid_set: str) -> Tuple[str, list]:
+        status, response = self.connection.uid('store', uid_set, '+FLAGS.SILENT', '(\\Deleted)')
+        if status != 'OK':
+            return status, response
+        # UID EXPUNGE (UIDPLUS) leaves other messages marked \Deleted alone
+        if 'UIDPLUS' in self.connection.capabilities:
+            return self.connection.uid('expunge', uid_set)
+        return self.connection.expunge()
+    
+    @staticmethod
+    def _expand_uid_set(spec: str) -> List[str]:
+        """UIDs of a set such as "4,7:9", in order"""
+        uids = []
+        for part in spec.split(','):
+            low, _, high = part.partition(':')
+            uids.extend(str(uid) for uid in range(int(low), int(high or low) + 1))
+        return uids
+    
     def _fetch_email_headers(self, uid: str) -> Optional[Dict]:
         """Fetch email headers for list display with improved UID handling"""
         try:
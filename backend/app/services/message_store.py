@@ -0,0 +1,179 @@
+from typing import BinaryIO, Dict, Iterator, Optional, Union
+import hashlib
+import logging
+import mmap
+import os
+import re
+import tempfile
+import time
+import zlib
+
+from app.core.config import settings
+from app.services.mime_parser import parse_message
+
+try:
+    import zstandard
+except ImportError:  # zstandard is optional; zlib is always available
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+# Files are recognised by their first bytes, so a store keeps working when the codec setting changes
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+ZSTD_LEVEL = 3
+ZLIB_LEVEL = 6
+
+READ_CHUNK_SIZE = 1024 * 1024
+
+_DIGEST_RE = re.compile(r"[0-9a-f]{64}")
+
+
+class MessageStore:
+    """Raw RFC 5322 messages on disk, compressed and addressed by their SHA-256.
+
+    A message lives at <root>/<digest[:2]>/<digest[2:4]>/<digest>, so the same
+    message in several folders or accounts is stored once. Files are written
+    to a temporary name and renamed into place, and never change afterwards;
+    storing a message again only touches its file, so a file that has not
+    been touched for a while can be removed once no email refers to it.
+    """
+
+    def __init__(self, root: str, compression: str = "zstd"):
+        self.root = root
+        self.compression = "zstd" if compression == "zstd" and zstandard is not None else "zlib"
+
+    def path(self, digest: str) -> str:
+        if not _DIGEST_RE.fullmatch(digest):
+            raise ValueError(f"Invalid message digest: {digest!r}")
+        return os.path.join(self.root, digest[:2], digest[2:4], digest)
+
+    def has(self, digest: str) -> bool:
+        return os.path.exists(self.path(digest))
+
+    def put(self, raw: bytes) -> str:
+        """Store a message unless it is already there; returns its digest"""
+        digest = hashlib.sha256(raw).hexdigest()
+        if not self._touch(digest):
+            self._write(digest, [raw])
+        return digest
+
+    def put_file(self, source: BinaryIO) -> str:
+        """Like put, for a message in a seekable file; leaves the file at its end"""
+        source.seek(0)
+        hasher = hashlib.sha256()
+        for chunk in _chunks(source):
+            hasher.update(chunk)
+        digest = hasher.hexdigest()
+        if not self._touch(digest):
+            source.seek(0)
+            self._write(digest, _chunks(source))
+        return digest
+
+    def get(self, digest: str) -> Optional[bytes]:
+        """The raw message, or None if it is not stored"""
+        try:
+            with open(self.path(digest), "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                # Decompress straight from the page cache instead of copying the file into memory first
+                if mapped[:4] == ZSTD_MAGIC:
+                    if zstandard is None:
+                        logger.error(f"Stored message {digest} is zstd compressed but zstandard is not installed")
+                        return None
+                    return zstandard.ZstdDecompressor().decompressobj().decompress(mapped)
+                return zlib.decompress(mapped)
+        except FileNotFoundError:
+            return None
+
+    def chunks(self, digest: str) -> Iterator[bytes]:
+        """The raw message in pieces, decompressed as they are read; raises FileNotFoundError if it is not stored"""
+        with open(self.path(digest), "rb") as f:
+            if f.read(4) == ZSTD_MAGIC:
+                if zstandard is None:
+                    raise ValueError(f"Stored message {digest} is zstd compressed but zstandard is not installed")
+                f.seek(0)
+                yield from zstandard.ZstdDecompressor().read_to_iter(f, read_size=READ_CHUNK_SIZE)
+                return
+            f.seek(0)
+            decompressor = zlib.decompressobj()
+            for chunk in _chunks(f):
+                yield decompressor.decompress(chunk)
+            yield decompressor.flush()
+
+    def remove(self, digest: str, untouched_for: float) -> bool:
+        """Delete a stored message not written or stored again in the last untouched_for seconds"""
+        path = self.path(digest)
+        try:
+            if time.time() - os.stat(path).st_mtime < untouched_for:
+                return False
+            os.unlink(path)
+            return True
+        except FileNotFoundError:
+            return False
+
+    def _touch(self, digest: str) -> bool:
+        """Mark a stored message as just stored; False if it is not there"""
+        try:
+            os.utime(self.path(digest))
+            return True
+        except FileNotFoundError:
+            return False
+
+    def _write(self, digest: str, chunks) -> None:
+        path = self.path(digest)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if self.compression == "zstd":
+            compressor = zstandard.ZstdCompressor(level=ZSTD_LEVEL).compressobj()
+        else:
+            compressor = zlib.compressobj(ZLIB_LEVEL)
+
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                for chunk in chunks:
+                    f.write(compressor.compress(chunk))
+                f.write(compressor.flush())
+            # Writers racing on the same digest all hold identical bytes, so the last rename wins harmlessly
+            os.replace(temp_path, path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+
+
+def _chunks(source: BinaryIO) -> Iterator[bytes]:
+    while True:
+        chunk = source.read(READ_CHUNK_SIZE)
+        if not chunk:
+            return
+        yield chunk
+
+
+def store_raw_message(raw: Union[bytes, BinaryIO]) -> Optional[str]:
+    """Keep a message (bytes or a seekable file) if the store is enabled; returns its digest, or None"""
+    if not settings.MESSAGE_STORE_ENABLED:
+        return None
+    try:
+        if isinstance(raw, bytes):
+            return message_store.put(raw)
+        return message_store.put_file(raw)
+    except Exception as e:
+        logger.error(f"Error storing raw message: {str(e)}")
+        return None
+
+
+def load_stored_content(raw_hash: Optional[str], uid: str) -> Optional[Dict]:
+    """Parse a message from the local store, sparing an IMAP fetch; None if it is not stored"""
+    if not raw_hash:
+        return None
+    try:
+        raw = message_store.get(raw_hash)
+    except Exception as e:
+        logger.error(f"Error reading stored message {raw_hash}: {str(e)}")
+        return None
+    if raw is None:
+        return None
+    content = parse_message(raw, str(uid))
+    content['raw_hash'] = raw_hash
+    return content
+
+
+# Global instance
+message_store = MessageStore(settings.MESSAGE_STORE_DIR, settings.MESSAGE_STORE_COMPRESSION)
@@ -0,0 +1,282 @@
+from datetime import datetime
+from email import policy
+from email.message import EmailMessage
+from email.parser import BytesParser
+from typing import Dict, List, Optional, Tuple
+import email.utils
+import logging
+import re
+
+logger = logging.getLogger(__name__)
+
+
+class _ParsedMessage(EmailMessage):
+    """EmailMessage that parses each header field once, however often it is read"""
+
+    def get(self, name, failobj=None):
+        name = name.lower()
+        for field, value in self.raw_items():
+            if field.lower() == name:
+                cache = self.__dict__.setdefault('_parsed_fields', {})
+                if (field, value) not in cache:
+                    cache[field, value] = self.policy.header_fetch_parse(field, value)
+                return cache[field, value]
+        return failobj
+
+
+_parser = BytesParser(_ParsedMessage, policy=policy.default)
+
+# What may follow "--boundary" on a delimiter line (RFC 2046 allows trailing whitespace)
+_DELIMITER_TAIL_RE = re.compile(rb"(--)?[ \t]*(?:\r\n|\n|$)")
+
+# A header field line, and the folded continuation of one
+_FIELD_RE = re.compile(r"[\x21-\x39\x3b-\x7e]+:")
+_CONTINUATION = (' ', '\t')
+
+# Nesting deeper than this is left to the full parser
+MAX_DEPTH = 20
+
+
+def parse_message(raw: bytes, uid: str) -> Dict:
+    """Parse a raw RFC 5322 message into the dict stored for an email.
+
+    Headers are read with the modern email policy, so encoded words are decoded
+    and folded lines joined. For well-formed mail the MIME structure is found by
+    scanning for boundaries in the raw bytes: only header blocks go through the
+    email parser and only the text parts that end up in the result are decoded.
+    Anything unusual (defects, odd line endings, message/* other than rfc822)
+    falls back to parsing the whole message, which yields the same tree.
+    """
+    try:
+        message = _scan(raw)
+        if message is None:
+            message = _parser.parsebytes(raw)
+        return _extract(message, uid, len(raw))
+    except Exception as e:
+        logger.error(f"Error parsing email message: {str(e)}")
+        return {
+            'uid': str(uid),
+            'message_id': f'<error-{uid}>',
+            'subject': 'Error parsing email',
+            'sender_email': 'unknown@unknown.com',
+            'sender_name': 'Unknown',
+            'body_text': f'Error parsing email: {str(e)}',
+            'date_sent': datetime.now(),
+            'date_received': datetime.now(),
+            'size': 0
+        }
+
+
+def _extract(msg: EmailMessage, uid: str, size: int) -> Dict:
+    subject = _header(msg, 'Subject')
+    sender_name, sender_email = _first_address(msg, 'From')
+    to_addresses = [{'name': name, 'email': addr} for name, addr in _addresses(msg, 'To') if addr]
+
+    try:
+        date_sent = email.utils.parsedate_to_datetime(_header(msg, 'Date'))
+    except Exception:
+        date_sent = datetime.now()
+
+    body_text = ""
+    body_html = ""
+    attachments = []
+
+    if msg.is_multipart():
+        text_parts = []
+        html_parts = []
+        for part in msg.walk():
+            content_type = part.get_content_type()
+            content_disposition = str(part.get('Content-Disposition', ''))
+            filename = part.get_filename()
+
+            if 'attachment' not in content_disposition:
+                if content_type == "text/plain":
+                    text_parts.append(part)
+                elif content_type == "text/html":
+                    html_parts.append(part)
+
+            if filename or 'attachment' in content_disposition:
+                attachments.append({
+                    'filename': filename or 'unknown',
+                    'content_type': content_type,
+                    'size': len(part.get_payload() or '')
+                })
+
+        # The last part that decodes wins; earlier ones are never decoded
+        body_text = _last_decodable(text_parts)
+        body_html = _last_decodable(html_parts)
+    else:
+        decoded = _decode(msg)
+        if decoded:
+            if msg.get_content_type() == "text/html":
+                body_html = decoded
+            else:
+                body_text = decoded
+
+    return {
+        'uid': str(uid),
+        'message_id': _header(msg, 'Message-ID', f'<local-{uid}>'),
+        'subject': subject or '(No Subject)',
+        'sender_email': sender_email,
+        'sender_name': sender_name or sender_email,
+        'reply_to': _header(msg, 'Reply-To'),
+        'to_addresses': to_addresses,
+        'body_text': body_text,
+        'body_html': body_html,
+        'attachments': attachments,
+        'date_sent': date_sent,
+        'date_received': date_sent,  # Use sent date as received for now
+        'size': size
+    }
+
+
+def _header(msg: EmailMessage, name: str, default: str = '') -> str:
+    try:
+        value = msg.get(name)
+    except Exception:
+        # The structured header parser can trip over hostile input; use the raw value
+        value = next((raw for key, raw in msg.raw_items() if key.lower() == name.lower()), None)
+    return default if value is None else str(value)
+
+
+def _addresses(msg: EmailMessage, name: str) -> List[Tuple[str, str]]:
+    try:
+        header = msg.get(name)
+        if header is None:
+            return []
+        return [(address.display_name, address.addr_spec) for address in header.addresses]
+    except Exception:
+        return email.utils.getaddresses([_header(msg, name)])
+
+
+def _first_address(msg: EmailMessage, name: str) -> Tuple[str, str]:
+    addresses = _addresses(msg, name)
+    if addresses and addresses[0][1]:
+        return addresses[0]
+    raw = _header(msg, name)
+    return (addresses[0][0] if addresses else ''), raw
+
+
+def _decode(part: EmailMessage) -> Optional[str]:
+    try:
+        payload = part.get_payload(decode=True)
+        if payload:
+            return payload.decode(part.get_content_charset() or 'utf-8', errors='ignore')
+    except Exception as e:
+        logger.debug(f"Error decoding {part.get_content_type()} part: {e}")
+    return None
+
+
+def _last_decodable(parts: List[EmailMessage]) -> str:
+    for part in reversed(parts):
+        decoded = _decode(part)
+        if decoded:
+            return decoded
+    return ""
+
+
+def _scan(raw: bytes) -> Optional[EmailMessage]:
+    """Build the message tree from boundary positions, or None if the full parser is needed"""
+    if b"\r" in raw:
+        if raw.count(b"\n") != raw.count(b"\r\n"):
+            return None
+        eol = b"\r\n"
+    else:
+        eol = b"\n"
+    return _scan_entity(raw, 0, len(raw), eol, 0)
+
+
+def _scan_entity(raw: bytes, start: int, end: int, eol: bytes, depth: int) -> Optional[EmailMessage]:
+    if depth > MAX_DEPTH:
+        return None
+
+    # Headers end at the first empty line; an entity may also start with one (no headers)
+    if raw.startswith(eol, start):
+        header_end = start
+        body_start = start + len(eol)
+    else:
+        blank = raw.find(eol + eol, start, end)
+        if blank < 0:
+            return None
+        header_end = blank + len(eol)
+        body_start = blank + 2 * len(eol)
+
+    msg = _parse_headers(raw[start:header_end].decode('ascii', 'surrogateescape'))
+    if msg is None:
+        return None
+
+    # Every header lookup parses the field afresh, so read the type once
+    maintype, _, subtype = msg.get_content_type().partition('/')
+    if maintype == 'multipart':
+        boundary = msg.get_boundary()
+        if not boundary or subtype == 'digest':
+            return None
+        ranges = _part_ranges(raw, body_start - len(eol), end, ("--" + boundary).encode('ascii', 'surrogateescape'), eol)
+        if ranges is None:
+            return None
+        msg.set_payload(None)
+        for part_start, part_end in ranges:
+            part = _scan_entity(raw, part_start, part_end, eol, depth + 1)
+            if part is None:
+                return None
+            msg.attach(part)
+        return msg
+
+    if maintype == 'message':
+        if subtype != 'rfc822' or msg.get('Content-Transfer-Encoding', '7bit').lower() not in ('7bit', '8bit', 'binary'):
+            return None
+        inner = _scan_entity(raw, body_start, end, eol, depth + 1)
+        if inner is None:
+            return None
+        msg.set_payload(None)
+        msg.attach(inner)
+        return msg
+
+    msg.set_payload(raw[body_start:end].decode('ascii', 'surrogateescape'))
+    return msg
+
+
+def _parse_headers(block: str) -> Optional[EmailMessage]:
+    """Header fields as the email parser would store them, or None for anything it would flag"""
+    msg = _ParsedMessage(policy.default)
+    lines: List[str] = []
+    for line in block.splitlines(keepends=True):
+        if line.startswith(_CONTINUATION) and lines:
+            lines.append(line)
+            continue
+        if lines:
+            msg.set_raw(*policy.default.header_source_parse(lines))
+        if not _FIELD_RE.match(line):
+            return None
+        lines = [line]
+    if lines:
+        msg.set_raw(*policy.default.header_source_parse(lines))
+    return msg
+
+
+def _part_ranges(raw: bytes, start: int, end: int, delimiter: bytes, eol: bytes) -> Optional[List[Tuple[int, int]]]:
+    """Byte ranges of the body parts between delimiter lines, or None without a closing delimiter.
+
+    start points at the line ending before the body, so a delimiter on the
+    first body line is found like any other. The line ending before each
+    delimiter belongs to the delimiter, not to the part.
+    """
+    marker = eol + delimiter
+    ranges = []
+    part_start = None
+    position = start
+    while True:
+        found = raw.find(marker, position, end)
+        if found < 0:
+            return None
+        tail = _DELIMITER_TAIL_RE.match(raw, found + len(marker), end)
+        if tail is None:
+            # A longer boundary that merely starts with ours
+            position = found + len(marker)
+            continue
+        if part_start is not None:
+            ranges.append((part_start, found))
+        if tail.group(1):
+            return ranges
+        part_start = tail.end()
+        position = part_start - len(eol) if part_start < end else part_start
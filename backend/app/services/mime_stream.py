@@ -0,0 +1,124 @@
+from email.generator import BytesGenerator
+from email.mime.base import MIMEBase
+from email.mime.multipart import MIMEMultipart
+from io import BytesIO
+from typing import BinaryIO, Iterable, Iterator, List, Tuple
+import base64
+import uuid
+
+# 57 raw bytes encode to exactly one 76 character base64 line
+BASE64_LINE_BYTES = 57
+READ_CHUNK_LINES = 1024
+
+
+class StreamingMessage:
+    """A MIME message whose attachments are base64-encoded from disk while it is written.
+
+    The MIME tree is built with the email package as usual, except that each
+    attachment part carries a unique marker instead of its payload. Writing the
+    message flattens the (small) tree once and splices the encoded file contents
+    in place of the markers chunk by chunk, so memory use does not depend on
+    attachment size.
+    """
+
+    def __init__(self, message: MIMEMultipart):
+        self.message = message
+        self._attachments: List[Tuple[bytes, str]] = []  # (marker, file path)
+
+    def __setitem__(self, name: str, value: str):
+        self.message[name] = value
+
+    def __getitem__(self, name: str):
+        return self.message[name]
+
+    def attach_file(self, container: MIMEMultipart, file_path: str, filename: str):
+        """Attach a file that will be read and encoded only when the message is written"""
+        marker = f"@@attachment-{uuid.uuid4().hex}@@"
+        part = MIMEBase('application', 'octet-stream')
+        part.set_payload(marker)
+        part['Content-Transfer-Encoding'] = 'base64'
+        part.add_header('Content-Disposition', 'attachment', filename=filename)
+        container.attach(part)
+        self._attachments.append((marker.encode('ascii'), file_path))
+
+    def iter_bytes(self) -> Iterator[bytes]:
+        """Yield the serialized message (CRLF line endings) in bounded chunks"""
+        buffer = BytesIO()
+        policy = self.message.policy.clone(linesep='\r\n')
+        BytesGenerator(buffer, policy=policy).flatten(self.message)
+        skeleton = buffer.getvalue()
+        del buffer
+
+        position = 0
+        for marker, file_path in self._attachments:
+            index = skeleton.index(marker, position)
+            yield skeleton[position:index]
+            yield from self._encode_file(file_path)
+            position = index + len(marker)
+        yield skeleton[position:]
+
+    def as_bytes(self) -> bytes:
+        """The whole serialized message; only for small messages"""
+        return b"".join(self.iter_bytes())
+
+    @staticmethod
+    def _encode_file(file_path: str) -> Iterator[bytes]:
+        read_size = BASE64_LINE_BYTES * READ_CHUNK_LINES
+        with open(file_path, 'rb') as f:
+            first = True
+            while True:
+                data = f.read(read_size)
+                if not data:
+                    break
+                # Reads are whole base64 lines, so chunks only need joining with CRLF
+                if not first:
+                    yield b"\r\n"
+                yield base64.encodebytes(data).replace(b"\n", b"\r\n").rstrip(b"\r\n")
+                first = False
+
+
+def coalesce(chunks: Iterable[bytes], min_size: int) -> Iterator[bytes]:
+    """Merge small chunks so that each yielded chunk is at least min_size (except the last)"""
+    pending: List[bytes] = []
+    size = 0
+    for chunk in chunks:
+        if not chunk:
+            continue
+        pending.append(chunk)
+        size += len(chunk)
+        if size >= min_size:
+            yield b"".join(pending)
+            pending, size = [], 0
+    if pending:
+        yield b"".join(pending)
+
+
+def tee_to(chunks: Iterable[bytes], sink: BinaryIO) -> Iterator[bytes]:
+    """Pass chunks through unchanged while also writing them to sink"""
+    for chunk in chunks:
+        sink.write(chunk)
+        yield chunk
+
+
+def dot_stuff(chunks: Iterable[bytes]) -> Iterator[bytes]:
+    """Escape lines starting with '.' for the SMTP DATA command (RFC 5321 4.5.2)"""
+    carry = b""
+    for chunk in chunks:
+        data = carry + chunk
+        cut = data.rfind(b"\n") + 1
+        if cut == 0:
+            carry = data
+            continue
+        complete, carry = data[:cut], data[cut:]
+        yield _stuff_lines(complete)
+    if carry:
+        yield _stuff_lines(carry)
+
+
+def _stuff_lines(data: bytes) -> bytes:
+    # dot_stuff only ever passes text that starts at the beginning of a line
+    data = data.replace(b"\n.", b"\n..")
+    if data.startswith(b"."):
+        data = b"." + data
+    return data
+
@@ -0,0 +1,301 @@
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+import asyncio
+import logging
+import random
+import threading
+import time
+
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import func, insert, select, update
+
+from app.core.config import settings
+from app.core.database import SessionLocal
+from app.core.locks import LeaseLock, lease_backend
+from app.core.write_queue import write_queue
+from app.models.account import EmailAccount
+from app.models.outbox import OutboundEmail
+from app.schemas.email import EmailCompose
+from app.services.events import event_broker
+from app.services.rate_limit import smtp_rate_limit, smtp_rate_limiter
+from app.services.sent_mail import new_sent_copy, record_sent_email
+from app.services.smtp_pool import smtp_pool
+from app.utils.password import account_password
+
+logger = logging.getLogger(__name__)
+
+
+class OutboxWorker:
+    """Delivers queued outbound mail in the background with retries.
+
+    Every account gets its turn in each scan, so a large bulk send does not
+    hold up other accounts' mail. A message over its SMTP provider's rate
+    limit (shared by all workers when Redis is configured) goes back in the
+    queue without counting an attempt, and that provider is skipped by this
+    worker until a token is free. A claimed message is held under a lease
+    that the sending worker renews, so only the claims of dead workers are
+    put back in the queue, however long a live send takes.
+    """
+
+    def __init__(self):
+        self._task: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._in_flight: set = set()
+        # SMTP host -> time.monotonic() when its rate limit frees a token
+        self._rate_limited: Dict[str, float] = {}
+        self._rate_limited_lock = threading.Lock()
+
+    async def start(self):
+        """Start the delivery loop on the running event loop"""
+        if self._task is None:
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop the delivery loop and wait for in-flight sends"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._in_flight:
+            await asyncio.gather(*self._in_flight, return_exceptions=True)
+
+    def in_flight_count(self) -> int:
+        """Messages currently being delivered by this worker"""
+        return len(self._in_flight)
+
+    def notify(self):
+        """Wake the loop up early, e.g. right after a message was queued"""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _run(self):
+        while True:
+            try:
+                claimed = await run_in_threadpool(self._claim_due)
+                for outbox_id, lease in claimed:
+                    task = asyncio.create_task(run_in_threadpool(self._deliver, outbox_id, lease))
+                    self._in_flight.add(task)
+                    task.add_done_callback(self._on_done)
+            except Exception as e:
+                logger.error(f"Outbox scan failed: {str(e)}")
+
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self._poll_timeout())
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    def _poll_timeout(self) -> float:
+        """Until the next scan: the poll interval, or sooner if a rate limit frees a token before then"""
+        now = time.monotonic()
+        with self._rate_limited_lock:
+            free_at = [until - now for until in self._rate_limited.values() if until > now]
+        return min([settings.OUTBOX_POLL_INTERVAL, *free_at])
+
+    def _blocked_hosts(self) -> set:
+        now = time.monotonic()
+        with self._rate_limited_lock:
+            self._rate_limited = {host: until for host, until in self._rate_limited.items() if until > now}
+            return set(self._rate_limited)
+
+    def _on_done(self, task: asyncio.Task):
+        self._in_flight.discard(task)
+        # A finished send frees a slot for the same account
+        self.notify()
+
+    def _claim_due(self) -> List[Tuple[int, LeaseLock]]:
+        """Atomically move due messages to "sending", respecting per-account limits; returns them with their leases"""
+        db = SessionLocal()
+        try:
+            now = datetime.utcnow()
+            self._reclaim_stale(db, now)
+
+            sending: Dict[int, int] = dict(
+                db.query(OutboundEmail.account_id, func.count(OutboundEmail.id))
+                .filter(OutboundEmail.status == "sending")
+                .group_by(OutboundEmail.account_id)
+                .all()
+            )
+
+            # The first few due messages of every account, so one account's backlog can't fill the batch
+            due = select(
+                OutboundEmail.id,
+                OutboundEmail.account_id,
+                OutboundEmail.next_attempt_at,
+                func.row_number().over(
+                    partition_by=OutboundEmail.account_id,
+                    order_by=(OutboundEmail.next_attempt_at, OutboundEmail.id)
+                ).label("position")
+            ).where(
+                OutboundEmail.status == "queued",
+                OutboundEmail.next_attempt_at <= now
+            ).subquery()
+            candidates = db.execute(
+                select(due.c.id, due.c.account_id, EmailAccount.smtp_host)
+                .join(EmailAccount, EmailAccount.id == due.c.account_id)
+                .where(due.c.position <= settings.OUTBOX_ACCOUNT_CONCURRENCY)
+                .order_by(due.c.next_attempt_at)
+                .limit(settings.OUTBOX_BATCH_SIZE)
+            ).all()
+            blocked = self._blocked_hosts()
+
+            claimed = []
+            for outbox_id, account_id, smtp_host in candidates:
+                if sending.get(account_id, 0) >= settings.OUTBOX_ACCOUNT_CONCURRENCY or smtp_host in blocked:
+                    continue
+
+                # Held until the outcome is recorded; a message whose lease is held elsewhere is left alone
+                lease = LeaseLock(lease_backend, f"outbox:{outbox_id}", settings.OUTBOX_SEND_TIMEOUT)
+                if not lease.acquire():
+                    continue
+
+                # Conditional update so only one worker process wins each message
+                updated = write_queue.apply(
+                    db, _update_outbound, outbox_id, {"status": "queued"}, {"status": "sending", "claimed_at": now},
+                    idempotent=True
+                )
+
+                if updated:
+                    sending[account_id] = sending.get(account_id, 0) + 1
+                    claimed.append((outbox_id, lease))
+                else:
+                    lease.release()
+
+            return claimed
+        finally:
+            db.close()
+
+    def _reclaim_stale(self, db, now: datetime):
+        """Requeue messages whose worker died mid-send"""
+        cutoff = now - timedelta(seconds=settings.OUTBOX_SEND_TIMEOUT)
+        candidates = db.query(OutboundEmail.id, OutboundEmail.claimed_at).filter(
+            OutboundEmail.status == "sending",
+            OutboundEmail.claimed_at < cutoff
+        ).all()
+        stale = 0
+        for outbox_id, claimed_at in candidates:
+            # The sender renews the lease while it is alive, so a free lease means its worker is gone
+            lease = LeaseLock(lease_backend, f"outbox:{outbox_id}", settings.OUTBOX_SEND_TIMEOUT)
+            if not lease.acquire():
+                continue
+            try:
+                stale += write_queue.apply(
+                    db, _update_outbound, outbox_id, {"status": "sending", "claimed_at": claimed_at},
+                    {"status": "queued", "claimed_at": None, "next_attempt_at": now},
+                    idempotent=True
+                )
+            finally:
+                lease.release()
+        if stale:
+            logger.warning(f"Requeued {stale} outbound emails stuck in sending")
+
+    def _deliver(self, outbox_id: int, lease: LeaseLock):
+        """Send one claimed message and record the outcome, then release its lease"""
+        db = SessionLocal()
+        try:
+            item = db.query(OutboundEmail).filter(OutboundEmail.id == outbox_id).first()
+            if item is None or item.status != "sending":
+                return
+
+            account = item.account
+            password = account_password(account, "smtp")
+
+            wait = smtp_rate_limiter.try_acquire(account.smtp_host, smtp_rate_limit(account.smtp_host))
+            if wait > 0:
+                # Not an attempt: back in the queue, and the provider rests until a token is free
+                with self._rate_limited_lock:
+                    self._rate_limited[account.smtp_host] = time.monotonic() + wait
+                write_queue.apply(db, _update_outbound, outbox_id, {}, {"status": "queued", "claimed_at": None}, idempotent=True)
+                return
+
+            sent_copy = new_sent_copy()
+            try:
+                email_data = EmailCompose(**item.payload)
+                with smtp_pool.session(account, password) as smtp:
+                    success, error = smtp.send_email(email_data, sink=sent_copy)
+            except Exception as e:
+                success, error = False, str(e)
+
+            # Absolute values, so the write can safely run again
+            attempts = item.attempts + 1
+            if success:
+                write_queue.apply(db, _update_outbound, outbox_id, {}, {
+                    "status": "sent", "attempts": attempts, "sent_at": datetime.utcnow(), "last_error": None
+                }, idempotent=True)
+                logger.info(f"Outbound email {outbox_id} delivered after {attempts} attempt(s)")
+                event_broker.publish(account.user_id, "outbox.sent", {"id": outbox_id, "account_id": account.id})
+
+                # Save a copy locally and to the Sent folder from the bytes we just sent
+                try:
+                    record_sent_email(db, account, email_data, sent_copy)
+                except Exception as e:
+                    logger.error(f"Could not record sent copy of outbound email {outbox_id}: {str(e)}")
+                return
+
+            sent_copy.close()
+            if attempts >= settings.OUTBOX_MAX_ATTEMPTS:
+                write_queue.apply(db, _update_outbound, outbox_id, {}, {
+                    "status": "failed", "attempts": attempts, "last_error": error
+                }, idempotent=True)
+                logger.error(f"Outbound email {outbox_id} failed permanently: {error}")
+                event_broker.publish(account.user_id, "outbox.failed", {"id": outbox_id, "account_id": account.id, "error": error})
+            else:
+                write_queue.apply(db, _update_outbound, outbox_id, {}, {
+                    "status": "queued", "attempts": attempts, "last_error": error,
+                    "next_attempt_at": datetime.utcnow() + timedelta(seconds=self._backoff(attempts))
+                }, idempotent=True)
+                logger.warning(f"Outbound email {outbox_id} attempt {attempts} failed, retrying: {error}")
+        except Exception as e:
+            logger.error(f"Error delivering outbound email {outbox_id}: {str(e)}")
+            db.rollback()
+        finally:
+            db.close()
+            lease.release()
+
+    @staticmethod
+    def _backoff(attempts: int) -> float:
+        """Exponential backoff with jitter for the given number of failed attempts"""
+        delay = min(settings.OUTBOX_BACKOFF_BASE * (2 ** (attempts - 1)), settings.OUTBOX_BACKOFF_MAX)
+        return delay * random.uniform(0.8, 1.2)
+
+
+def _update_outbound(db, outbox_id: int, expected: Dict, values: Dict) -> int:
+    """Set values on an outbox row if its columns still hold the expected values; returns 1 if it did"""
+    return db.execute(
+        update(OutboundEmail)
+        .where(OutboundEmail.id == outbox_id, *(getattr(OutboundEmail, column) == value for column, value in expected.items()))
+        .values(**values),
+        execution_options={"synchronize_session": False}
+    ).rowcount
+
+
+def enqueue_email(db, email_data: EmailCompose) -> int:
+    """Add a message to the outbox, returning its id; the caller commits"""
+    item = OutboundEmail(
+        account_id=email_data.account_id,
+        payload=email_data.model_dump(mode="json"),
+        status="queued",
+        attempts=0,
+        next_attempt_at=datetime.utcnow()
+    )
+    db.add(item)
+    db.flush()
+    return item.id
+
+
+def enqueue_bulk(db, account_id: int, payloads: List[Dict], bulk_id: str) -> int:
+    """Add the messages of a bulk send to the outbox under bulk_id, returning how many; the caller commits"""
+    now = datetime.utcnow()
+    db.execute(insert(OutboundEmail), [
+        {"account_id": account_id, "payload": payload, "bulk_id": bulk_id, "status": "queued", "attempts": 0, "next_attempt_at": now}
+        for payload in payloads
+    ])
+    return len(payloads)
+
+
+# Global instance
+outbox_worker = OutboxWorker()
@@ -0,0 +1,294 @@
+from typing import Dict, List, Optional
+import logging
+import threading
+
+from sqlalchemy import text
+
+from app.core.config import settings
+from app.core.database import engine
+from app.core.locks import LeaseLock, lease_backend
+from app.models.email import Email
+from app.models.email_archive import ArchivedEmailBody
+
+logger = logging.getLogger(__name__)
+
+EMAILS = "emails"
+ARCHIVE = ArchivedEmailBody.__tablename__
+ID_SEQUENCE = "emails_id_seq"
+ARCHIVE_FOREIGN_KEY = "email_archive_email_fkey"
+
+# Names used while an existing table is rebuilt
+STAGING = "emails_repartition"
+PREVIOUS = "emails_before_repartition"
+SYNC_TRIGGER = "emails_repartition_sync"
+
+# Keeps a second worker from repartitioning at the same time
+REPARTITION_LEASE_TTL = 60
+
+# The swap waits this long for running transactions on emails, then retries, rather than queueing every query behind it
+SWAP_LOCK_TIMEOUT = "5s"
+SWAP_ATTEMPTS = 5
+
+
+def partition_name(partitions: int, remainder: int) -> str:
+    # The modulus is part of the name, so a table can be repartitioned next to the one it replaces
+    return f"{EMAILS}_h{partitions}_{remainder}"
+
+
+def partition_count(conn, table: str = EMAILS) -> int:
+    """Partitions of a table; 0 for a plain or missing table"""
+    return conn.execute(text(
+        "SELECT count(i.inhrelid) FROM pg_partitioned_table p JOIN pg_inherits i ON i.inhparent = p.partrelid "
+        "WHERE p.partrelid = to_regclass(:table)"
+    ), {"table": table}).scalar()
+
+
+def table_exists(conn, table: str) -> bool:
+    return conn.execute(text("SELECT to_regclass(:table) IS NOT NULL"), {"table": table}).scalar()
+
+
+def _column_specs(conn, table, skip=()) -> List[str]:
+    ddl = conn.dialect.ddl_compiler(conn.dialect, None)
+    return [ddl.get_column_specification(column) for column in table.columns if column.name not in skip]
+
+
+def _email_columns() -> List[str]:
+    return [column.name for column in Email.__table__.columns]
+
+
+def _email_indexes():
+    # The primary key (id, account_id) already covers lookups by id
+    return [index for index in Email.__table__.indexes if [column.name for column in index.columns] != ["id"]]
+
+
+def create_emails_table(conn, name: str, partitions: int, index_suffix: str = ""):
+    """Create an emails table hash-partitioned by account_id, with the model's columns and indexes.
+
+    Every partition gets its own copy of each index, so index depth and
+    vacuum work follow the size of a partition rather than of all mail.
+    """
+    columns = [f"id INTEGER DEFAULT nextval('{ID_SEQUENCE}') NOT NULL"] + _column_specs(conn, Email.__table__, ("id",))
+    conn.exec_driver_sql(f"CREATE SEQUENCE IF NOT EXISTS {ID_SEQUENCE}")
+    conn.exec_driver_sql(
+        f"CREATE TABLE {name} ({', '.join(columns)}, "
+        f"CONSTRAINT {name}_pkey PRIMARY KEY (id, account_id), "
+        f"CONSTRAINT {EMAILS}_account_id_fkey FOREIGN KEY (account_id) REFERENCES email_accounts (id)"
+        f") PARTITION BY HASH (account_id)"
+    )
+    for remainder in range(partitions):
+        conn.exec_driver_sql(
+            f"CREATE TABLE {partition_name(partitions, remainder)} PARTITION OF {name} "
+            f"FOR VALUES WITH (MODULUS {partitions}, REMAINDER {remainder})"
+        )
+    for index in _email_indexes():
+        columns = ", ".join(column.name for column in index.columns)
+        conn.exec_driver_sql(f"CREATE INDEX {index.name}{index_suffix} ON {name} ({columns})")
+
+
+def create_archive_table(conn, *constraints: str):
+    columns = _column_specs(conn, ArchivedEmailBody.__table__)
+    conn.exec_driver_sql(f"CREATE TABLE {ARCHIVE} ({', '.join(columns + ['PRIMARY KEY (email_id)', *constraints])})")
+
+
+def _archive_foreign_key() -> str:
+    # A foreign key to a partitioned table has to name its whole primary key
+    return (
+        f"CONSTRAINT {ARCHIVE_FOREIGN_KEY} FOREIGN KEY (email_id, account_id) "
+        f"REFERENCES {EMAILS} (id, account_id) ON DELETE CASCADE"
+    )
+
+
+class EmailRepartition:
+    """Rebuilds an existing emails table hash-partitioned by account_id while the app keeps using it.
+
+    A new partitioned table is filled in id ranges of EMAIL_REPARTITION_BATCH_SIZE,
+    each in its own short transaction, while a trigger copies every insert,
+    update and delete made meanwhile. Once the copy is complete both tables are
+    swapped by renaming them in one brief transaction. The old table is kept as
+    emails_before_repartition until drop_previous() is called.
+    """
+
+    def __init__(self, partitions: int):
+        if partitions < 1:
+            raise ValueError("At least one partition is needed")
+        self.partitions = partitions
+        self._stop = threading.Event()
+
+    def stop(self):
+        """Stop after the current batch; run() picks up where it stopped next time"""
+        self._stop.set()
+
+    def run(self) -> Optional[Dict[str, int]]:
+        """Copy, swap and return what was done; None if there was nothing to do. Blocking."""
+        if engine.dialect.name != "postgresql":
+            raise RuntimeError("Partitioning is only supported on Postgres")
+
+        lease = LeaseLock(lease_backend, "email-repartition", REPARTITION_LEASE_TTL)
+        if not lease.acquire():
+            return None
+        try:
+            with engine.begin() as conn:
+                if partition_count(conn) == self.partitions:
+                    return None
+                if table_exists(conn, PREVIOUS):
+                    raise RuntimeError(f"{PREVIOUS} is left from an earlier repartition; drop it first")
+                self._prepare(conn)
+            with engine.connect() as conn:
+                last_id = conn.execute(text(f"SELECT coalesce(max(id), 0) FROM {EMAILS}")).scalar()
+
+            done = {"rows": 0, "archived": 0}
+            low = 0
+            while low < last_id:
+                if self._stop.is_set() or lease.lost.is_set():
+                    return None
+                high = low + settings.EMAIL_REPARTITION_BATCH_SIZE
+                with engine.begin() as conn:
+                    done["rows"] += _copy_range(conn, low, high)
+                    done["archived"] += _fill_archive_accounts(conn, low, high)
+                low = high
+                self._stop.wait(settings.EMAIL_REPARTITION_BATCH_PAUSE)
+
+            self._swap()
+            with engine.begin() as conn:
+                # Checks the archive rows without blocking writes to it
+                conn.exec_driver_sql(f"ALTER TABLE {ARCHIVE} VALIDATE CONSTRAINT {ARCHIVE_FOREIGN_KEY}")
+            logger.info(f"Repartitioned {done['rows']} emails into {self.partitions} partitions by account")
+            return done
+        finally:
+            lease.release()
+
+    def _prepare(self, conn):
+        staged = partition_count(conn, STAGING)
+        if staged and staged != self.partitions:
+            # Left from an interrupted run with another partition count
+            conn.exec_driver_sql(f"DROP TRIGGER IF EXISTS {SYNC_TRIGGER} ON {EMAILS}")
+            conn.exec_driver_sql(f"DROP TABLE {STAGING}")
+            staged = 0
+        if not staged:
+            create_emails_table(conn, STAGING, self.partitions, index_suffix="_new")
+        if table_exists(conn, ARCHIVE):
+            conn.exec_driver_sql(f"ALTER TABLE {ARCHIVE} ADD COLUMN IF NOT EXISTS account_id INTEGER")
+        else:
+            # Referenced by the foreign key added in the swap
+            create_archive_table(conn)
+        conn.exec_driver_sql(_sync_function_sql())
+        conn.exec_driver_sql(f"DROP TRIGGER IF EXISTS {SYNC_TRIGGER} ON {EMAILS}")
+        conn.exec_driver_sql(
+            f"CREATE TRIGGER {SYNC_TRIGGER} AFTER INSERT OR UPDATE OR DELETE ON {EMAILS} "
+            f"FOR EACH ROW EXECUTE FUNCTION {SYNC_TRIGGER}()"
+        )
+
+    def _swap(self):
+        for attempt in range(1, SWAP_ATTEMPTS + 1):
+            try:
+                with engine.begin() as conn:
+                    _swap_tables(conn)
+                return
+            except Exception as e:
+                if attempt == SWAP_ATTEMPTS:
+                    raise
+                logger.warning(f"Swapping in the partitioned emails table failed (attempt {attempt}): {str(e)}")
+                self._stop.wait(attempt)
+
+
+def _copy_range(conn, low: int, high: int) -> int:
+    # FOR SHARE holds off updates and deletes of these rows until the batch commits; the trigger then applies them
+    columns = ", ".join(_email_columns())
+    return conn.execute(text(
+        f"INSERT INTO {STAGING} ({columns}) SELECT {columns} FROM {EMAILS} WHERE id > :low AND id <= :high "
+        f"FOR SHARE ON CONFLICT (id, account_id) DO NOTHING"
+    ), {"low": low, "high": high}).rowcount
+
+
+def _fill_archive_accounts(conn, low: int, high: int) -> int:
+    """Set account_id on archive rows written before it was recorded"""
+    return conn.execute(text(
+        f"UPDATE {ARCHIVE} a SET account_id = e.account_id FROM {EMAILS} e "
+        f"WHERE e.id = a.email_id AND a.account_id IS NULL AND a.email_id > :low AND a.email_id <= :high"
+    ), {"low": low, "high": high}).rowcount
+
+
+def _sync_function_sql() -> str:
+    columns = _email_columns()
+    updates = ", ".join(f"{column} = EXCLUDED.{column}" for column in columns if column not in ("id", "account_id"))
+    return f"""
+        CREATE OR REPLACE FUNCTION {SYNC_TRIGGER}() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP = 'DELETE' OR (TG_OP = 'UPDATE' AND NEW.account_id IS DISTINCT FROM OLD.account_id) THEN
+                DELETE FROM {STAGING} WHERE id = OLD.id AND account_id = OLD.account_id;
+            END IF;
+            IF TG_OP <> 'DELETE' THEN
+                INSERT INTO {STAGING} ({", ".join(columns)})
+                VALUES ({", ".join(f"NEW.{column}" for column in columns)})
+                ON CONFLICT (id, account_id) DO UPDATE SET {updates};
+            END IF;
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql
+    """
+
+
+def _swap_tables(conn):
+    conn.exec_driver_sql(f"SET LOCAL lock_timeout = '{SWAP_LOCK_TIMEOUT}'")
+    conn.exec_driver_sql(f"LOCK TABLE {EMAILS}, {ARCHIVE} IN ACCESS EXCLUSIVE MODE")
+    conn.exec_driver_sql(f"DROP TRIGGER {SYNC_TRIGGER} ON {EMAILS}")
+    conn.exec_driver_sql(f"DROP FUNCTION {SYNC_TRIGGER}()")
+
+    # Archived since their range was copied, or while the archive worker ran an older version
+    conn.exec_driver_sql(
+        f"UPDATE {ARCHIVE} a SET account_id = e.account_id FROM {EMAILS} e "
+        f"WHERE e.id = a.email_id AND a.account_id IS NULL"
+    )
+    # Only the declared keys; Postgres adds one per partition under a key to a partitioned table
+    archive_keys = conn.execute(text(
+        "SELECT conname FROM pg_constraint WHERE conrelid = to_regclass(:table) AND contype = 'f' AND conparentid = 0"
+    ), {"table": ARCHIVE}).scalars().all()
+    for name in archive_keys:
+        conn.exec_driver_sql(f"ALTER TABLE {ARCHIVE} DROP CONSTRAINT {name}")
+
+    # Index names are unique per schema, so the old ones make way first
+    old_indexes = conn.execute(text(
+        "SELECT indexname FROM pg_indexes WHERE schemaname = current_schema() AND tablename = :table"
+    ), {"table": EMAILS}).scalars().all()
+    for name in old_indexes:
+        conn.exec_driver_sql(f"ALTER INDEX {name} RENAME TO {name}_old")
+    conn.exec_driver_sql(f"ALTER TABLE {EMAILS} RENAME TO {PREVIOUS}")
+
+    conn.exec_driver_sql(f"ALTER TABLE {STAGING} RENAME TO {EMAILS}")
+    conn.exec_driver_sql(f"ALTER INDEX {STAGING}_pkey RENAME TO {EMAILS}_pkey")
+    for index in _email_indexes():
+        conn.exec_driver_sql(f"ALTER INDEX {index.name}_new RENAME TO {index.name}")
+    conn.exec_driver_sql(f"ALTER SEQUENCE {ID_SEQUENCE} OWNED BY {EMAILS}.id")
+
+    # Validated after the swap commits, without holding these locks
+    conn.exec_driver_sql(f"ALTER TABLE {ARCHIVE} ADD {_archive_foreign_key()} NOT VALID")
+
+
+def check_partitions():
+    """Warn at startup when emails is not partitioned as EMAIL_PARTITIONS says; repartitioning is left to the command"""
+    if engine.dialect.name != "postgresql" or settings.EMAIL_PARTITIONS <= 0:
+        return
+    with engine.connect() as conn:
+        partitions = partition_count(conn)
+    if partitions != settings.EMAIL_PARTITIONS:
+        logger.warning(
+            f"emails has {partitions} partitions but EMAIL_PARTITIONS is {settings.EMAIL_PARTITIONS}; "
+            f"run python -m app.ops.partition_emails --partitions {settings.EMAIL_PARTITIONS} to repartition it online"
+        )
+
+
+def drop_previous():
+    """Drop the table a repartition replaced"""
+    with engine.begin() as conn:
+        conn.exec_driver_sql(f"DROP TABLE IF EXISTS {PREVIOUS}")
+
+
+def partition_report(conn) -> List[Dict]:
+    """Per partition of emails: estimated rows, table and index size, dead rows and last autovacuum"""
+    return [dict(row._mapping) for row in conn.execute(text(
+        "SELECT c.relname AS partition, c.reltuples::bigint AS rows, pg_table_size(c.oid) AS table_bytes, "
+        "pg_indexes_size(c.oid) AS index_bytes, s.n_dead_tup AS dead_rows, s.last_autovacuum "
+        "FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+        "LEFT JOIN pg_stat_user_tables s ON s.relid = c.oid "
+        "WHERE i.inhparent = to_regclass(:table) ORDER BY c.relname"
+    ), {"table": EMAILS})]
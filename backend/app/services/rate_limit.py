@@ -0,0 +1,89 @@
+from typing import Dict, Tuple
+import logging
+import threading
+import time
+
+from app.core.cache import RedisCache, cache
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class RateLimiter:
+    """Token buckets keyed by host, holding a minute's worth of tokens, for this process"""
+
+    def __init__(self):
+        self._buckets: Dict[str, Tuple[float, float]] = {}  # key -> (tokens, last refill)
+        self._lock = threading.Lock()
+
+    def try_acquire(self, key: str, per_minute: int) -> float:
+        """Take a token for key if one is free and return 0, else the seconds until one is; per_minute <= 0 means unlimited"""
+        if per_minute <= 0:
+            return 0.0
+
+        rate = per_minute / 60.0
+        with self._lock:
+            now = time.monotonic()
+            tokens, last = self._buckets.get(key, (float(per_minute), now))
+            tokens = min(float(per_minute), tokens + (now - last) * rate)
+            if tokens >= 1:
+                self._buckets[key] = (tokens - 1, now)
+                return 0.0
+            self._buckets[key] = (tokens, now)
+            return (1 - tokens) / rate
+
+
+class RedisRateLimiter(RateLimiter):
+    """The same token buckets in Redis, shared by every worker process"""
+
+    # Refills by the server's clock, so workers on different hosts agree
+    TAKE_SCRIPT = """
+        local rate = tonumber(ARGV[1])
+        local capacity = tonumber(ARGV[2])
+        local clock = redis.call('time')
+        local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+        local state = redis.call('hmget', KEYS[1], 'tokens', 'at')
+        local tokens = tonumber(state[1]) or capacity
+        local at = tonumber(state[2]) or now
+        tokens = math.min(capacity, tokens + math.max(0, now - at) * rate)
+        local wait = 0
+        if tokens >= 1 then
+            tokens = tokens - 1
+        else
+            wait = (1 - tokens) / rate
+        end
+        redis.call('hset', KEYS[1], 'tokens', tostring(tokens), 'at', tostring(now))
+        redis.call('expire', KEYS[1], 120)
+        return tostring(wait)
+    """
+
+    def __init__(self, client, prefix: str = "mailbox:rate"):
+        super().__init__()
+        self.prefix = prefix
+        self._take = client.register_script(self.TAKE_SCRIPT)
+
+    def try_acquire(self, key: str, per_minute: int) -> float:
+        if per_minute <= 0:
+            return 0.0
+        try:
+            return float(self._take(keys=[f"{self.prefix}:{key}"], args=[per_minute / 60.0, per_minute]))
+        except Exception as e:
+            # Better this process's own limit than none while Redis is unreachable
+            logger.warning(f"Shared rate limit unavailable for {key}: {str(e)}")
+            return super().try_acquire(key, per_minute)
+
+
+def smtp_rate_limit(smtp_host: str) -> int:
+    """Messages per minute allowed for an SMTP provider"""
+    return settings.SMTP_RATE_LIMITS.get(smtp_host, settings.SMTP_DEFAULT_RATE_LIMIT)
+
+
+def create_rate_limiter() -> RateLimiter:
+    """Buckets in Redis alongside the Redis cache, otherwise in this process"""
+    if isinstance(cache.backend, RedisCache):
+        return RedisRateLimiter(cache.backend.client)
+    return RateLimiter()
+
+
+# Global instance
+smtp_rate_limiter = create_rate_limiter()
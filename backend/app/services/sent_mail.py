@@ -0,0 +1,82 @@
+from datetime import datetime
+from email.parser import BytesHeaderParser
+from typing import BinaryIO
+import logging
+import os
+import tempfile
+
+from app.core.config import settings
+from app.core.write_queue import write_queue
+from app.models.account import EmailAccount
+from app.models.email import Email
+from app.schemas.email import EmailCompose
+from app.services.events import event_broker, publish_folder_counters
+from app.services.flag_sync import queue_append, sent_folder
+from app.services.message_store import message_store, store_raw_message
+
+logger = logging.getLogger(__name__)
+
+
+def new_sent_copy() -> BinaryIO:
+    """Buffer that SMTPService.send_email fills with the serialized message"""
+    return tempfile.SpooledTemporaryFile(max_size=settings.SENT_COPY_SPOOL_SIZE)
+
+
+def record_sent_email(db, account: EmailAccount, email_data: EmailCompose, sent_copy: BinaryIO) -> int:
+    """Insert the local Sent row for a delivered message and queue its IMAP APPEND.
+
+    The APPEND is queued with the row and sent from the stored copy by the
+    flag sync worker, so it survives restarts and is retried. Closes sent_copy.
+    """
+    try:
+        sent_copy.seek(0)
+        headers = BytesHeaderParser().parse(sent_copy)
+        raw_hash = store_raw_message(sent_copy)
+        if raw_hash is None and settings.SENT_APPEND_ENABLED:
+            # The APPEND is read from the store even when other mail is not kept there
+            raw_hash = message_store.put_file(sent_copy)
+        size = sent_copy.seek(0, os.SEEK_END)
+    finally:
+        sent_copy.close()
+
+    folder = sent_folder(account.id)
+    now = datetime.utcnow()
+
+    values = dict(
+        account_id=account.id,
+        message_id=headers.get('Message-ID', ''),
+        subject=email_data.subject,
+        sender_email=account.email_address,
+        sender_name=account.display_name or account.email_address,
+        to_addresses=[addr.model_dump() for addr in email_data.to_addresses],
+        cc_addresses=[addr.model_dump() for addr in email_data.cc_addresses] if email_data.cc_addresses else None,
+        bcc_addresses=[addr.model_dump() for addr in email_data.bcc_addresses] if email_data.bcc_addresses else None,
+        body_text=email_data.body_text,
+        body_html=email_data.body_html,
+        attachments=[
+            {'filename': os.path.basename(path), 'content_type': 'application/octet-stream', 'size': os.path.getsize(path)}
+            for path in (email_data.attachments or []) if os.path.exists(path)
+        ],
+        raw_hash=raw_hash,
+        date_sent=now,
+        date_received=now,
+        size=size,
+        is_read=True,
+        is_sent=True,
+        folder=folder
+    )
+    email_id = write_queue.apply(db, _insert_sent_email, values)
+
+    event_broker.publish(account.user_id, "emails.new", {"account_id": account.id, "folder": folder, "ids": [email_id]})
+    publish_folder_counters(db, account.user_id, account.id, folder)
+
+    return email_id
+
+
+def _insert_sent_email(db, values: dict) -> int:
+    email_row = Email(**values)
+    db.add(email_row)
+    db.flush()
+    if settings.SENT_APPEND_ENABLED:
+        queue_append(db, email_row)
+    return email_row.id
@@ -0,0 +1,122 @@
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Tuple
+import hashlib
+import logging
+import threading
+import time
+
+from app.core.config import settings
+from app.schemas.account import EmailAccount
+from app.services.smtp_service import SMTPService
+
+logger = logging.getLogger(__name__)
+
+
+class SMTPConnectionPool:
+    """Keeps authenticated SMTP sessions alive between sends, per account"""
+
+    def __init__(self, idle_timeout: int, max_idle_per_account: int):
+        self.idle_timeout = idle_timeout
+        self.max_idle_per_account = max_idle_per_account
+        self._idle: Dict[Tuple, List[Tuple[SMTPService, float]]] = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def session(self, account: EmailAccount, password: str) -> Iterator[SMTPService]:
+        """Borrow a session for the account, returning it to the pool afterwards.
+
+        A session is closed instead if the block raised or a send on it failed
+        (send_email returned False), since it may be mid-transaction or broken.
+        """
+        key = self._key(account, password)
+        smtp = self._checkout(key)
+        if smtp is None:
+            smtp = SMTPService(account, password)
+
+        healthy = False
+        try:
+            yield smtp
+            healthy = True
+        finally:
+            self._checkin(key, smtp, healthy)
+
+    def close_all(self):
+        """Disconnect every idle session"""
+        with self._lock:
+            sessions = [smtp for entries in self._idle.values() for smtp, _ in entries]
+            self._idle.clear()
+        for smtp in sessions:
+            smtp.disconnect()
+
+    def idle_count(self) -> int:
+        """Number of sessions currently parked in the pool"""
+        with self._lock:
+            return sum(len(entries) for entries in self._idle.values())
+
+    def _key(self, account: EmailAccount, password: str) -> Tuple:
+        # Include a password digest so changed credentials never reuse an old login
+        digest = hashlib.sha256(password.encode()).hexdigest()
+        return (account.id, account.smtp_host, account.smtp_port, account.smtp_username, digest)
+
+    def _checkout(self, key: Tuple):
+        """Take the most recently used live session for key, if any"""
+        expired = []
+        candidate = None
+        now = time.monotonic()
+
+        with self._lock:
+            entries = self._idle.get(key, [])
+            while entries:
+                smtp, released_at = entries.pop()
+                if now - released_at > self.idle_timeout:
+                    expired.append(smtp)
+                    continue
+                candidate = smtp
+                break
+
+        for smtp in expired:
+            smtp.disconnect()
+
+        if candidate is not None and not candidate.is_alive():
+            logger.info("Pooled SMTP session went away, reconnecting")
+            candidate.disconnect()
+        return candidate
+
+    def _checkin(self, key: Tuple, smtp: SMTPService, healthy: bool):
+        """Return a session to the pool, or close it if it can't be reused"""
+        if not healthy or smtp.failed or not smtp.connection or not smtp.reset():
+            smtp.disconnect()
+            return
+
+        evicted = []
+        now = time.monotonic()
+        with self._lock:
+            entries = self._idle.setdefault(key, [])
+            entries.append((smtp, now))
+            while len(entries) > self.max_idle_per_account:
+                evicted.append(entries.pop(0)[0])
+            self._reap_locked(now, evicted)
+
+        for old in evicted:
+            old.disconnect()
+
+    def _reap_locked(self, now: float, evicted: List[SMTPService]):
+        """Drop expired sessions from every account (caller holds the lock)"""
+        for key in list(self._idle):
+            live = []
+            for smtp, released_at in self._idle[key]:
+                if now - released_at > self.idle_timeout:
+                    evicted.append(smtp)
+                else:
+                    live.append((smtp, released_at))
+            if live:
+                self._idle[key] = live
+            else:
+                del self._idle[key]
+
+
+# Global instance
+smtp_pool = SMTPConnectionPool(
+    idle_timeout=settings.SMTP_POOL_IDLE_TIMEOUT,
+    max_idle_per_account=settings.SMTP_POOL_MAX_IDLE_PER_ACCOUNT,
+)
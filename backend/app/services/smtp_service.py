@@ -1,23 +1,32 @@
 import smtplib
+import socket
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
-from email.mime.base import MIMEBase
-from email import encoders
-from typing import List, Optional, Tuple
+from email.utils import formatdate, make_msgid
+from typing import BinaryIO, Dict, Iterable, List, Optional, Tuple
 import logging
 import os
+import time
 
+from app.core.config import settings
+from app.core.metrics import SMTP_SEND_SECONDS
 from app.schemas.email import EmailCompose
 from app.schemas.account import EmailAccount
+from app.services.mime_stream import StreamingMessage, coalesce, dot_stuff, tee_to
 
 logger = logging.getLogger(__name__)
 
+# Size of each write (and BDAT chunk) when streaming a message body
+DATA_CHUNK_SIZE = 64 * 1024
+
 
 class SMTPService:
     def __init__(self, account: EmailAccount, password: str):
         self.account = account
         self.password = password
         self.connection = None
+        # Set when a send fails: the session's state is unknown, so it is not reused
+        self.failed = False
     
     def connect(self) -> bool:
         """Connect to SMTP server"""
@@ -25,15 +34,19 @@ class SMTPService:
             if self.account.smtp_ssl:
                 self.connection = smtplib.SMTP_SSL(
                     self.account.smtp_host,
-                    self.account.smtp_port
+                    self.account.smtp_port,
+                    timeout=settings.SMTP_TIMEOUT
                 )
             else:
                 self.connection = smtplib.SMTP(
                     self.account.smtp_host,
-                    self.account.smtp_port
+                    self.account.smtp_port,
+                    timeout=settings.SMTP_TIMEOUT
                 )
                 self.connection.starttls()
             
+            # Commands and body chunks each go out in one write; don't let Nagle hold back their tails
+            self.connection.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
             self.connection.login(self.account.smtp_username, self.password)
             logger.info(f"Successfully connected to SMTP server for {self.account.email_address}")
             return True
@@ -51,6 +64,26 @@ class SMTPService:
                 pass
             self.connection = None
     
+    def is_alive(self) -> bool:
+        """Check that an established session still answers (NOOP)"""
+        if not self.connection:
+            return False
+        try:
+            code, _ = self.connection.noop()
+            return code == 250
+        except Exception:
+            return False
+    
+    def reset(self) -> bool:
+        """Abort any half-finished transaction so the session can be reused (RSET)"""
+        if not self.connection:
+            return False
+        try:
+            code, _ = self.connection.rset()
+            return code == 250
+        except Exception:
+            return False
+    
     def test_connection(self) -> Tuple[bool, Optional[str]]:
         """Test SMTP connection"""
         try:
@@ -61,8 +94,8 @@ class SMTPService:
         except Exception as e:
             return False, str(e)
     
-    def send_email(self, email_data: EmailCompose) -> Tuple[bool, Optional[str]]:
-        """Send an email"""
+    def send_email(self, email_data: EmailCompose, sink: Optional[BinaryIO] = None) -> Tuple[bool, Optional[str]]:
+        """Send an email, optionally copying the serialized message into sink"""
         if not self.connection:
             if not self.connect():
                 return False, "Could not connect to SMTP server"
@@ -71,26 +104,139 @@ class SMTPService:
             msg = self._create_message(email_data)
             
             # Get recipient emails
-            to_emails = [addr['email'] for addr in email_data.to_addresses]
-            cc_emails = [addr['email'] for addr in email_data.cc_addresses] if email_data.cc_addresses else []
-            bcc_emails = [addr['email'] for addr in email_data.bcc_addresses] if email_data.bcc_addresses else []
+            to_emails = [addr.email for addr in email_data.to_addresses]
+            cc_emails = [addr.email for addr in email_data.cc_addresses] if email_data.cc_addresses else []
+            bcc_emails = [addr.email for addr in email_data.bcc_addresses] if email_data.bcc_addresses else []
             
             all_recipients = to_emails + cc_emails + bcc_emails
             
             # Send the email
-            self.connection.send_message(msg, to_addrs=all_recipients)
+            self._deliver(msg, all_recipients, sink)
             
             logger.info(f"Email sent successfully from {self.account.email_address}")
             return True, None
             
         except Exception as e:
+            self.failed = True
             error_msg = f"Failed to send email: {str(e)}"
             logger.error(error_msg)
             return False, error_msg
     
-    def _create_message(self, email_data: EmailCompose) -> MIMEMultipart:
+    def _deliver(self, msg: StreamingMessage, recipients: List[str], sink: Optional[BinaryIO] = None):
+        """Send a built message over the current session, streaming its body"""
+        started = time.perf_counter()
+        outcome = "error"
+        try:
+            from_addr = self.account.email_address
+            self._send_envelope(from_addr, recipients)
+            
+            chunks = coalesce(msg.iter_bytes(), DATA_CHUNK_SIZE)
+            if sink is not None:
+                chunks = tee_to(chunks, sink)
+            if self.connection.has_extn('chunking'):
+                self._send_bdat(chunks)
+            else:
+                self._send_data(chunks)
+            outcome = "sent"
+        finally:
+            SMTP_SEND_SECONDS.labels(outcome).observe(time.perf_counter() - started)
+    
+    def _send_data(self, chunks: Iterable[bytes]):
+        """Stream the message body with DATA, dot-stuffing on the fly"""
+        connection = self.connection
+        connection.putcmd("data")
+        code, resp = connection.getreply()
+        if code != 354:
+            raise smtplib.SMTPDataError(code, resp)
+        
+        tail = b""
+        last = b""
+        for chunk in dot_stuff(chunks):
+            # Hold back each chunk so the last one goes out with the terminator;
+            # a separate small write would wait on the server's delayed ACK
+            if last:
+                connection.send(last)
+            last = chunk
+            tail = chunk[-2:] if len(chunk) >= 2 else (tail + chunk)[-2:]
+        
+        connection.send(last + (b".\r\n" if tail == b"\r\n" else b"\r\n.\r\n"))
+        code, resp = connection.getreply()
+        if code != 250:
+            raise smtplib.SMTPDataError(code, resp)
+    
+    def _send_bdat(self, chunks: Iterable[bytes]):
+        """Stream the message body with BDAT (RFC 3030 CHUNKING), no dot-stuffing needed"""
+        pending = None
+        for chunk in chunks:
+            if pending is not None:
+                self._bdat(pending, last=False)
+            pending = chunk
+        self._bdat(pending or b"", last=True)
+    
+    def _bdat(self, chunk: bytes, last: bool):
+        command = f"BDAT {len(chunk)}{' LAST' if last else ''}\r\n".encode('ascii')
+        self.connection.send(command + chunk)
+        code, resp = self.connection.getreply()
+        if code != 250:
+            raise smtplib.SMTPDataError(code, resp)
+    
+    def _send_envelope(self, from_addr: str, recipients: List[str]) -> Dict[str, Tuple[int, bytes]]:
+        """Send MAIL FROM and RCPT TO, pipelined when the server supports it"""
+        connection = self.connection
+        
+        if connection.does_esmtp and connection.has_extn('pipelining'):
+            # RFC 2920: send the whole envelope in one write, then read the replies in order
+            commands = [f"MAIL FROM:{smtplib.quoteaddr(from_addr)}"]
+            commands += [f"RCPT TO:{smtplib.quoteaddr(addr)}" for addr in recipients]
+            connection.send("".join(f"{command}\r\n" for command in commands))
+            replies = [connection.getreply() for _ in commands]
+            mail_reply, rcpt_replies = replies[0], replies[1:]
+        else:
+            mail_reply = connection.mail(from_addr)
+            rcpt_replies = []
+            if mail_reply[0] == 250:
+                rcpt_replies = [connection.rcpt(addr) for addr in recipients]
+        
+        if mail_reply[0] != 250:
+            connection.rset()
+            raise smtplib.SMTPSenderRefused(mail_reply[0], mail_reply[1], from_addr)
+        
+        refused = {}
+        for addr, (code, resp) in zip(recipients, rcpt_replies):
+            if code not in (250, 251):
+                refused[addr] = (code, resp)
+        
+        if len(refused) == len(recipients):
+            connection.rset()
+            raise smtplib.SMTPRecipientsRefused(refused)
+        
+        return refused
+    
+    def _create_message(self, email_data: EmailCompose) -> StreamingMessage:
         """Create email message"""
-        msg = MIMEMultipart('alternative')
+        body = MIMEMultipart('alternative')
+        
+        # Add body content
+        if email_data.body_text:
+            text_part = MIMEText(email_data.body_text, 'plain', 'utf-8')
+            body.attach(text_part)
+        
+        if email_data.body_html:
+            html_part = MIMEText(email_data.body_html, 'html', 'utf-8')
+            body.attach(html_part)
+        
+        # If no body is provided, add a default text part
+        if not email_data.body_text and not email_data.body_html:
+            body.attach(MIMEText("", 'plain', 'utf-8'))
+        
+        # Attachments go next to the body in a multipart/mixed container
+        if email_data.attachments:
+            msg = StreamingMessage(MIMEMultipart('mixed'))
+            msg.message.attach(body)
+            for attachment_path in email_data.attachments:
+                self._add_attachment(msg, attachment_path)
+        else:
+            msg = StreamingMessage(body)
         
         # Set headers
         display_name = self.account.display_name or self.account.email_address
@@ -99,63 +245,36 @@ class SMTPService:
         # Format recipients
         to_list = []
         for addr in email_data.to_addresses:
-            if addr.get('name'):
-                to_list.append(f"{addr['name']} <{addr['email']}>")
+            if addr.name:
+                to_list.append(f"{addr.name} <{addr.email}>")
             else:
-                to_list.append(addr['email'])
+                to_list.append(addr.email)
         msg['To'] = ', '.join(to_list)
         
         if email_data.cc_addresses:
             cc_list = []
             for addr in email_data.cc_addresses:
-                if addr.get('name'):
-                    cc_list.append(f"{addr['name']} <{addr['email']}>")
+                if addr.name:
+                    cc_list.append(f"{addr.name} <{addr.email}>")
                 else:
-                    cc_list.append(addr['email'])
+                    cc_list.append(addr.email)
             msg['Cc'] = ', '.join(cc_list)
         
         msg['Subject'] = email_data.subject
-        
-        # Add body content
-        if email_data.body_text:
-            text_part = MIMEText(email_data.body_text, 'plain', 'utf-8')
-            msg.attach(text_part)
-        
-        if email_data.body_html:
-            html_part = MIMEText(email_data.body_html, 'html', 'utf-8')
-            msg.attach(html_part)
-        
-        # If no body is provided, add a default text part
-        if not email_data.body_text and not email_data.body_html:
-            msg.attach(MIMEText("", 'plain', 'utf-8'))
-        
-        # Add attachments
-        if email_data.attachments:
-            for attachment_path in email_data.attachments:
-                self._add_attachment(msg, attachment_path)
+        msg['Date'] = formatdate(localtime=True)
+        msg['Message-ID'] = make_msgid(domain=self.account.email_address.rpartition('@')[2] or None)
         
         return msg
     
-    def _add_attachment(self, msg: MIMEMultipart, file_path: str):
-        """Add file attachment to email"""
+    def _add_attachment(self, msg: StreamingMessage, file_path: str):
+        """Add file attachment to email; the file is read only while sending"""
         try:
             if not os.path.exists(file_path):
                 logger.warning(f"Attachment file not found: {file_path}")
                 return
             
-            with open(file_path, 'rb') as attachment:
-                part = MIMEBase('application', 'octet-stream')
-                part.set_payload(attachment.read())
-            
-            encoders.encode_base64(part)
-            
             filename = os.path.basename(file_path)
-            part.add_header(
-                'Content-Disposition',
-                f'attachment; filename= {filename}'
-            )
-            
-            msg.attach(part)
+            msg.attach_file(msg.message, file_path, filename)
             
         except Exception as e:
             logger.error(f"Error adding attachment {file_path}: {str(e)}")
@@ -177,14 +296,14 @@ class SMTPService:
             msg['References'] = original_message_id
             
             # Get recipient emails
-            to_emails = [addr['email'] for addr in email_data.to_addresses]
-            cc_emails = [addr['email'] for addr in email_data.cc_addresses] if email_data.cc_addresses else []
-            bcc_emails = [addr['email'] for addr in email_data.bcc_addresses] if email_data.bcc_addresses else []
+            to_emails = [addr.email for addr in email_data.to_addresses]
+            cc_emails = [addr.email for addr in email_data.cc_addresses] if email_data.cc_addresses else []
+            bcc_emails = [addr.email for addr in email_data.bcc_addresses] if email_data.bcc_addresses else []
             
             all_recipients = to_emails + cc_emails + bcc_emails
             
             # Send the email
-            self.connection.send_message(msg, to_addrs=all_recipients)
+            self._deliver(msg, all_recipients)
             
             logger.info(f"Reply sent successfully from {self.account.email_address}")
             return True, None
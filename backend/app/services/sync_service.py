@@ -0,0 +1,286 @@
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+import logging
+import time
+
+from sqlalchemy import Integer, cast, func
+
+from app.core.config import settings
+from app.core.database import SessionLocal
+from app.core.metrics import SYNC_SECONDS, SYNC_THROUGHPUT
+from app.core.locks import single_flight
+from app.core.write_queue import write_queue
+from app.models.account import EmailAccount
+from app.models.email import Email
+from app.services.events import event_broker, publish_folder_counters
+from app.services.flag_sync import SEEN, pending_email_ids
+from app.services.imap_service import IMAPService
+from app.services.message_store import load_stored_content
+from app.services.tiering import unarchive
+from app.utils.password import account_password
+
+logger = logging.getLogger(__name__)
+
+
+def sync_folder(db, account: EmailAccount, imap_service: IMAPService, folder: str = "INBOX",
+                limit: int = 50, since_uid: Optional[int] = None) -> Dict:
+    """Store new messages and read-state changes from a folder through the write queue, then publish events.
+
+    Returns counts: synced, updated, full_content and the ids of the new rows.
+    """
+    logger.info(f"Starting email sync for account {account.id}, folder {folder}")
+    started = time.perf_counter()
+    email_list = imap_service.get_email_list(folder=folder, limit=limit, since_uid=since_uid)
+    logger.info(f"Retrieved {len(email_list)} emails from IMAP server")
+
+    updated_count = 0
+    full_content_count = 0
+    # Plain values, written in one go by _store_synced
+    new_rows = []
+    updates = {}
+    # Read changes not yet on the server would be undone by the server's state
+    pending_reads = pending_email_ids(db, account.id, SEEN)
+
+    for email_data in email_list:
+        try:
+            # Check if email already exists
+            existing = db.query(Email).filter(
+                Email.message_id == email_data.get('message_id', ''),
+                Email.account_id == account.id
+            ).first()
+
+            if not existing:
+                # For new emails, try to get full content immediately
+                full_content = None
+                if email_data.get('uid'):
+                    try:
+                        full_content = imap_service.get_email_content(email_data['uid'], folder)
+                        if full_content:
+                            full_content_count += 1
+                    except Exception as e:
+                        logger.debug(f"Could not fetch full content for UID {email_data.get('uid')}: {e}")
+
+                # Use full content if available, otherwise use header data
+                content_data = full_content if full_content else email_data
+
+                # New email record
+                new_rows.append({
+                    "message_id": content_data.get('message_id', ''),
+                    "uid": content_data.get('uid'),
+                    "subject": content_data.get('subject'),
+                    "sender_email": content_data.get('sender_email', ''),
+                    "sender_name": content_data.get('sender_name'),
+                    "reply_to": content_data.get('reply_to'),
+                    "to_addresses": content_data.get('to_addresses'),
+                    "body_text": content_data.get('body_text'),
+                    "body_html": content_data.get('body_html'),
+                    "attachments": content_data.get('attachments'),
+                    "raw_hash": content_data.get('raw_hash'),
+                    "date_sent": content_data.get('date_sent'),
+                    "date_received": content_data.get('date_received'),
+                    "size": content_data.get('size', 0),
+                    "is_read": content_data.get('is_read', False),
+                })
+            else:
+                changes = {}
+                # Update existing email if read status changed
+                if existing.is_read != email_data.get('is_read', False) and existing.id not in pending_reads:
+                    changes["is_read"] = email_data.get('is_read', False)
+
+                # Moved here without the server reporting the new UID
+                if not existing.uid and existing.folder == folder and email_data.get('uid'):
+                    changes["uid"] = email_data['uid']
+
+                # If existing email doesn't have content, take it from the stored original or fetch it
+                uid = changes.get("uid", existing.uid)
+                if not existing.body_text and not existing.body_html and uid:
+                    try:
+                        full_content = load_stored_content(existing.raw_hash, uid)
+                        if not full_content:
+                            full_content = imap_service.get_email_content(uid, folder)
+                        if full_content:
+                            changes.update(
+                                body_text=full_content.get('body_text'),
+                                body_html=full_content.get('body_html'),
+                                attachments=full_content.get('attachments'),
+                                raw_hash=full_content.get('raw_hash') or existing.raw_hash
+                            )
+                            full_content_count += 1
+                    except Exception as e:
+                        logger.debug(f"Could not fetch full content for existing email {existing.id}: {e}")
+
+                if changes:
+                    updates[existing.id] = changes
+                    updated_count += 1
+
+        except Exception as e:
+            logger.error(f"Error processing email {email_data.get('uid', 'unknown')}: {str(e)}")
+            continue
+
+    new_ids = write_queue.apply(db, _store_synced, account.id, folder, new_rows, updates, idempotent=True)
+    synced_count = len(new_ids)
+
+    logger.info(f"Sync completed: {synced_count} new emails, {updated_count} updated emails, {full_content_count} with full content")
+
+    elapsed = time.perf_counter() - started
+    mode = "full" if since_uid is None else "incremental"
+    SYNC_SECONDS.labels(mode).observe(elapsed)
+    if synced_count and elapsed > 0:
+        SYNC_THROUGHPUT.labels(mode).observe(synced_count / elapsed)
+
+    if new_ids:
+        event_broker.publish(account.user_id, "emails.new", {
+            "account_id": account.id,
+            "folder": folder,
+            "ids": new_ids
+        })
+    if new_ids or updated_count:
+        publish_folder_counters(db, account.user_id, account.id, folder)
+
+    return {
+        "synced": synced_count,
+        "updated": updated_count,
+        "full_content": full_content_count,
+        "new_ids": new_ids
+    }
+
+
+def _store_synced(db, account_id: int, folder: str, new_rows: List[Dict], updates: Dict[int, Dict]) -> List[int]:
+    """Insert the new emails of a sync and apply its changes to existing ones; returns the new ids"""
+    # A sync of the same account elsewhere may have stored some of them since they were read
+    stored = {message_id for message_id, in db.query(Email.message_id).filter(
+        Email.account_id == account_id,
+        Email.message_id.in_([row["message_id"] for row in new_rows])
+    )} if new_rows else set()
+    new_emails = []
+    for row in new_rows:
+        if row["message_id"] in stored:
+            continue
+        stored.add(row["message_id"])
+        new_emails.append(Email(account_id=account_id, folder=folder, **row))
+    db.add_all(new_emails)
+
+    pending_reads = pending_email_ids(db, account_id, SEEN) if updates else set()
+    for email_row in db.query(Email).filter(Email.id.in_(updates)).all() if updates else []:
+        changes = updates[email_row.id]
+        if email_row.id in pending_reads:
+            # Read locally since the sync looked
+            changes.pop("is_read", None)
+        for field, value in changes.items():
+            setattr(email_row, field, value)
+        if "body_text" in changes:
+            unarchive(db, email_row)
+
+    account = db.get(EmailAccount, account_id)
+    account.last_sync = datetime.utcnow()
+    db.flush()
+    return [new_email.id for new_email in new_emails]
+
+
+def run_sync(account_id: int, folder: str = "INBOX", limit: int = 50) -> Dict:
+    """Connect and sync a folder, sharing the result of an identical sync already running.
+
+    Blocking; uses its own session so it can run in a worker thread.
+    """
+    def sync():
+        db = SessionLocal()
+        try:
+            account = db.query(EmailAccount).filter(EmailAccount.id == account_id).first()
+            imap_service = IMAPService(account, account_password(account, "imap"))
+            if not imap_service.connect():
+                raise ConnectionError("Could not connect to IMAP server")
+            try:
+                return sync_folder(db, account, imap_service, folder=folder, limit=limit)
+            finally:
+                imap_service.disconnect()
+        finally:
+            db.close()
+
+    result, _ = single_flight.run(sync_key(account_id, folder), sync, settings.SYNC_LOCK_TTL, settings.SYNC_LOCK_WAIT)
+    return result
+
+
+def sync_key(account_id: int, folder: str) -> str:
+    """Single-flight key shared by every sync of a folder"""
+    return f"sync:{account_id}:{folder}"
+
+
+def latest_uid(db, account_id: int, folder: str) -> Optional[int]:
+    """Highest IMAP UID stored locally for a folder"""
+    return db.query(func.max(cast(Email.uid, Integer))).filter(
+        Email.account_id == account_id,
+        Email.folder == folder,
+        Email.uid.isnot(None)
+    ).scalar()
+
+
+def apply_read_flags(db, account: EmailAccount, folder: str, read_by_uid: Dict[int, bool]) -> int:
+    """Store \\Seen changes reported by the server; returns how many rows changed"""
+    if not read_by_uid:
+        return 0
+
+    changed = write_queue.apply(db, _store_read_flags, account.id, folder, read_by_uid, idempotent=True)
+    if not changed:
+        return 0
+
+    for email_id, is_read in changed:
+        event_broker.publish(account.user_id, "email.updated", {
+            "id": email_id,
+            "account_id": account.id,
+            "folder": folder,
+            "changes": {"is_read": is_read}
+        })
+    publish_folder_counters(db, account.user_id, account.id, folder)
+    return len(changed)
+
+
+def _store_read_flags(db, account_id: int, folder: str, read_by_uid: Dict[int, bool]) -> List[Tuple[int, bool]]:
+    changed = []
+    emails = db.query(Email).filter(
+        Email.account_id == account_id,
+        Email.folder == folder,
+        Email.uid.in_([str(uid) for uid in read_by_uid])
+    ).all()
+    pending_reads = pending_email_ids(db, account_id, SEEN)
+    for email_row in emails:
+        is_read = read_by_uid[int(email_row.uid)]
+        if email_row.is_read != is_read and email_row.id not in pending_reads:
+            email_row.is_read = is_read
+            changed.append((email_row.id, is_read))
+    return changed
+
+
+def mark_expunged(db, account: EmailAccount, folder: str, uids: Iterable[int]) -> int:
+    """Mark messages removed from the server folder as deleted; returns how many rows changed"""
+    uids = [str(uid) for uid in uids]
+    if not uids:
+        return 0
+
+    removed = write_queue.apply(db, _store_expunged, account.id, folder, uids, idempotent=True)
+    if not removed:
+        return 0
+
+    for email_id in removed:
+        event_broker.publish(account.user_id, "email.deleted", {
+            "id": email_id,
+            "account_id": account.id,
+            "folder": folder
+        })
+    publish_folder_counters(db, account.user_id, account.id, folder)
+    return len(removed)
+
+
+def _store_expunged(db, account_id: int, folder: str, uids: List[str]) -> List[int]:
+    emails = db.query(Email).filter(
+        Email.account_id == account_id,
+        Email.folder == folder,
+        Email.uid.in_(uids),
+        Email.is_deleted.isnot(True)
+    ).all()
+    now = datetime.utcnow()
+    for email_row in emails:
+        email_row.is_deleted = True
+        email_row.deleted_at = now
+        # Gone from the server already
+        email_row.expunged_at = now
+    return [email_row.id for email_row in emails]
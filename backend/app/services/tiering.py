@@ -0,0 +1,183 @@
+from datetime import datetime, timedelta
+from typing import List, Optional, Tuple
+import asyncio
+import logging
+import re
+import threading
+
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import delete, func, insert, literal, null, or_, select, update
+
+from app.core.config import settings
+from app.core.database import SessionLocal
+from app.core.locks import LeaseLock, lease_backend
+from app.core.write_queue import write_queue
+from app.models.email import Email
+from app.models.email_archive import ArchivedEmailBody
+from app.models.folder_state import bump_folder_versions
+
+logger = logging.getLogger(__name__)
+
+# Keeps a second worker from archiving the same rows
+ARCHIVE_LEASE_TTL = 60
+
+_TAG_RE = re.compile(r"<[^>]*>")
+_SPACE_RE = re.compile(r"\s+")
+
+
+class BodyTiering:
+    """Periodically moves bodies and attachment lists of old mail to the email_archive table.
+
+    The emails row keeps a short text preview (so list views still have one)
+    and archived_at; everything else about it is unchanged. Rows archive in
+    batches of ARCHIVE_BATCH_SIZE, each in one short transaction through the
+    write queue.
+    """
+
+    def __init__(self):
+        self._task: Optional[asyncio.Task] = None
+        self._stop = threading.Event()
+
+    async def start(self):
+        """Start the archiving loop on the running event loop"""
+        if self._task is None and settings.ARCHIVE_ENABLED:
+            self._stop.clear()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop after the current batch"""
+        if self._task is not None:
+            self._stop.set()
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                await run_in_threadpool(self.run_once)
+            except Exception as e:
+                logger.error(f"Archiving old email bodies failed: {str(e)}")
+            await asyncio.sleep(settings.ARCHIVE_INTERVAL)
+
+    def run_once(self, older_than_days: Optional[int] = None) -> int:
+        """Archive every email received before the cutoff; returns how many were moved. Blocking."""
+        days = settings.ARCHIVE_AFTER_DAYS if older_than_days is None else older_than_days
+        cutoff = datetime.utcnow() - timedelta(days=days)
+
+        lease = LeaseLock(lease_backend, "body-tiering", ARCHIVE_LEASE_TTL)
+        if not lease.acquire():
+            return 0
+        try:
+            archived = 0
+            last_id = 0
+            while not self._stop.is_set() and not lease.lost.is_set():
+                batch = _archivable_batch(cutoff, last_id, settings.ARCHIVE_BATCH_SIZE)
+                if not batch:
+                    break
+                last_id = batch[-1][0]
+                archived += archive_emails(batch)
+                self._stop.wait(settings.ARCHIVE_BATCH_PAUSE)
+            if archived:
+                logger.info(f"Archived bodies of {archived} emails received before {cutoff:%Y-%m-%d}")
+            return archived
+        finally:
+            lease.release()
+
+
+def _archivable_batch(cutoff: datetime, after_id: int, limit: int) -> List[Tuple[int, int, Optional[str], Optional[str]]]:
+    """(id, account_id, body_text, body_html) of emails after after_id received before cutoff and not archived yet.
+
+    Emails whose body was never fetched are left alone: there is nothing to
+    archive, and they must stay fetchable.
+    """
+    db = SessionLocal()
+    try:
+        return [tuple(row) for row in db.execute(
+            select(Email.id, Email.account_id, Email.body_text, Email.body_html)
+            .where(
+                Email.id > after_id, Email.archived_at.is_(None), Email.date_received < cutoff,
+                or_(Email.body_text.isnot(None), Email.body_html.isnot(None))
+            )
+            .order_by(Email.id)
+            .limit(limit)
+        )]
+    finally:
+        db.close()
+
+
+def archive_emails(rows: List[Tuple[int, int, Optional[str], Optional[str]]]) -> int:
+    """Move bodies and attachment lists to email_archive, leaving a preview; returns how many moved"""
+    now = datetime.utcnow()
+    previews = {
+        (email_id, account_id): preview(body_text, body_html)
+        for email_id, account_id, body_text, body_html in rows
+        if body_text or body_html
+    }
+    if not previews:
+        return 0
+
+    def write(db) -> int:
+        ids = [email_id for email_id, _ in previews]
+        # Copied inside the database, so compressed bodies are moved as they are stored
+        db.execute(insert(ArchivedEmailBody).from_select(
+            ["email_id", "account_id", "body_text", "body_html", "attachments", "archived_at"],
+            select(Email.id, Email.account_id, Email.body_text, Email.body_html, Email.attachments, literal(now))
+            .where(Email.id.in_(ids), Email.archived_at.is_(None))
+        ))
+        # The preview replaces body_text in listings, and Core statements skip the flush hooks
+        folders = set(db.execute(
+            select(Email.account_id, func.coalesce(Email.folder, "INBOX"))
+            .where(Email.id.in_(ids), Email.archived_at.is_(None))
+        ))
+        moved = 0
+        for (email_id, account_id), text in previews.items():
+            # The row now holds a preview, so updated_at moves on (through its onupdate) with the folder's version
+            moved += db.execute(
+                update(Email)
+                .where(Email.id == email_id, Email.account_id == account_id, Email.archived_at.is_(None))
+                .values(body_text=text, body_html=None, attachments=null(), archived_at=now),
+                execution_options={"synchronize_session": False}
+            ).rowcount
+        bump_folder_versions(db, folders)
+        return moved
+
+    db = SessionLocal()
+    try:
+        return write_queue.apply(db, write, idempotent=True)
+    finally:
+        db.close()
+
+
+def preview(body_text: Optional[str], body_html: Optional[str]) -> Optional[str]:
+    """Start of the text body (or of the HTML body's text), whitespace collapsed"""
+    source = body_text or _TAG_RE.sub(" ", body_html or "")
+    text = _SPACE_RE.sub(" ", source).strip()
+    return text[:settings.ARCHIVE_PREVIEW_LENGTH] or None
+
+
+def unarchive(db, email: Email):
+    """Drop the archived copy of an email whose bodies were just stored on the row again; the caller commits"""
+    if email.archived_at is None:
+        return
+    email.archived_at = None
+    db.execute(
+        delete(ArchivedEmailBody).where(ArchivedEmailBody.email_id == email.id),
+        execution_options={"synchronize_session": False}
+    )
+
+
+def rehydrate(email: Email, archived: Optional[ArchivedEmailBody]):
+    """Put an archived email's bodies and attachments back on a loaded row, for serving only"""
+    if archived is None:
+        return
+    email.body_text = archived.body_text
+    email.body_html = archived.body_html
+    email.attachments = archived.attachments
+
+
+# Global instance
+body_tiering = BodyTiering()
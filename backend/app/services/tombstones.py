@@ -0,0 +1,212 @@
+from datetime import datetime, timedelta
+from typing import List, Optional, Set, Tuple
+import asyncio
+import logging
+import threading
+
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import delete, exists, func, select
+
+from app.core.config import settings
+from app.core.database import SessionLocal
+from app.core.locks import LeaseLock, lease_backend
+from app.core.write_queue import write_queue
+from app.models.email import Email
+from app.models.email_archive import ArchivedEmailBody
+from app.models.flag_change import FlagChange
+from app.models.folder_state import bump_folder_versions
+from app.services.flag_sync import DELETE
+from app.services.message_store import message_store
+
+logger = logging.getLogger(__name__)
+
+# Keeps a second worker from purging the same rows
+PURGE_LEASE_TTL = 60
+
+# Stored originals stored again this recently are kept, as a new email may be about to refer to them
+STORE_REMOVE_GRACE = 3600
+
+
+class TombstoneCompaction:
+    """Periodically removes deleted emails whose deletion the IMAP server has confirmed.
+
+    Deleted rows stay hidden from every read path until then, so a sync
+    running meanwhile does not bring the message back; they are kept
+    TOMBSTONE_RETENTION seconds after the confirmation. Rows deleted without
+    one (before deletions were sent to the server) get a deletion queued
+    first. Rows go in batches of TOMBSTONE_PURGE_BATCH_SIZE, each in one short
+    transaction through the write queue, and originals in the message store
+    that no email refers to any more go with them.
+    """
+
+    def __init__(self):
+        self._task: Optional[asyncio.Task] = None
+        self._stop = threading.Event()
+
+    async def start(self):
+        """Start the purge loop on the running event loop"""
+        if self._task is None and settings.TOMBSTONE_PURGE_ENABLED:
+            self._stop.clear()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop after the current batch"""
+        if self._task is not None:
+            self._stop.set()
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                await run_in_threadpool(self.run_once)
+            except Exception as e:
+                logger.error(f"Purging deleted emails failed: {str(e)}")
+            await asyncio.sleep(settings.TOMBSTONE_PURGE_INTERVAL)
+
+    def run_once(self, retention: Optional[int] = None) -> int:
+        """Purge every deleted email past its retention; returns how many rows went. Blocking."""
+        seconds = settings.TOMBSTONE_RETENTION if retention is None else retention
+        cutoff = datetime.utcnow() - timedelta(seconds=seconds)
+
+        lease = LeaseLock(lease_backend, "tombstone-compaction", PURGE_LEASE_TTL)
+        if not lease.acquire():
+            return 0
+        try:
+            queued = 0
+            last_id = 0
+            while not self._stop.is_set() and not lease.lost.is_set():
+                batch = _unconfirmed_batch(last_id, settings.TOMBSTONE_PURGE_BATCH_SIZE)
+                if not batch:
+                    break
+                last_id = batch[-1]
+                queued += queue_deletions(batch)
+            if queued:
+                logger.info(f"Queued {queued} deleted emails for the server")
+
+            purged = 0
+            last_id = 0
+            while not self._stop.is_set() and not lease.lost.is_set():
+                batch = _purgeable_batch(cutoff, last_id, settings.TOMBSTONE_PURGE_BATCH_SIZE)
+                if not batch:
+                    break
+                last_id = batch[-1]
+                purged += purge_emails(batch, cutoff)
+                self._stop.wait(settings.TOMBSTONE_PURGE_BATCH_PAUSE)
+            if purged:
+                logger.info(f"Purged {purged} deleted emails")
+            return purged
+        finally:
+            lease.release()
+
+
+def _unconfirmed():
+    """Deleted, never confirmed by the server and with no deletion queued for it"""
+    return (
+        Email.is_deleted.is_(True),
+        Email.expunged_at.is_(None),
+        ~exists().where(FlagChange.email_id == Email.id, FlagChange.change == DELETE)
+    )
+
+
+def _unconfirmed_batch(after_id: int, limit: int) -> List[int]:
+    """Ids of deleted emails the server was never told about after after_id, in order"""
+    db = SessionLocal()
+    try:
+        return list(db.scalars(
+            select(Email.id).where(Email.id > after_id, *_unconfirmed()).order_by(Email.id).limit(limit)
+        ))
+    finally:
+        db.close()
+
+
+def queue_deletions(ids: List[int]) -> int:
+    """Queue a deletion for the server for the emails among ids still unconfirmed; returns how many were queued"""
+    def write(db) -> int:
+        emails = db.scalars(select(Email).where(Email.id.in_(ids), *_unconfirmed())).all()
+        now = datetime.utcnow()
+        for email in emails:
+            # Anything else pending is overtaken by the deletion, as when it is queued by the API
+            db.execute(
+                delete(FlagChange).where(FlagChange.email_id == email.id),
+                execution_options={"synchronize_session": False}
+            )
+            # Without a UID the message is looked up by Message-ID
+            db.add(FlagChange(
+                account_id=email.account_id, email_id=email.id, change=DELETE, folder=email.folder,
+                uid=email.uid or "", attempts=0, next_attempt_at=now
+            ))
+            if email.deleted_at is None:
+                email.deleted_at = now
+        return len(emails)
+
+    db = SessionLocal()
+    try:
+        return write_queue.apply(db, write, idempotent=True)
+    finally:
+        db.close()
+
+
+def _purgeable(cutoff: datetime):
+    """Confirmed gone from the server before cutoff, with nothing queued for it"""
+    return (
+        Email.is_deleted.is_(True),
+        Email.expunged_at < cutoff,
+        ~exists().where(FlagChange.email_id == Email.id)
+    )
+
+
+def _purgeable_batch(cutoff: datetime, after_id: int, limit: int) -> List[int]:
+    """Ids of purgeable emails after after_id, in order"""
+    db = SessionLocal()
+    try:
+        return list(db.scalars(
+            select(Email.id).where(Email.id > after_id, *_purgeable(cutoff)).order_by(Email.id).limit(limit)
+        ))
+    finally:
+        db.close()
+
+
+def purge_emails(ids: List[int], cutoff: datetime) -> int:
+    """Delete the emails among ids that are still purgeable, with their archived bodies and unshared originals; returns how many went"""
+    def write(db) -> Tuple[int, Set[str]]:
+        # Checked again in the transaction: an email may have been restored since the batch was read
+        still = select(Email.id).where(Email.id.in_(ids), *_purgeable(cutoff))
+        hashes = set(db.scalars(select(Email.raw_hash).where(Email.id.in_(still), Email.raw_hash.isnot(None))))
+        # Core statements skip the flush hooks, so the folders' versions are bumped here
+        folders = set(db.execute(
+            select(Email.account_id, func.coalesce(Email.folder, "INBOX")).where(Email.id.in_(still))
+        ))
+        db.execute(
+            delete(ArchivedEmailBody).where(ArchivedEmailBody.email_id.in_(still)),
+            execution_options={"synchronize_session": False}
+        )
+        purged = db.execute(
+            delete(Email).where(Email.id.in_(still)),
+            execution_options={"synchronize_session": False}
+        ).rowcount
+        bump_folder_versions(db, folders)
+        return purged, hashes
+
+    db = SessionLocal()
+    try:
+        purged, hashes = write_queue.apply(db, write, idempotent=True)
+        if hashes:
+            # The same message may be stored for other emails, in other folders or accounts
+            shared = set(db.scalars(select(Email.raw_hash).where(Email.raw_hash.in_(hashes))))
+            for digest in hashes - shared:
+                try:
+                    message_store.remove(digest, STORE_REMOVE_GRACE)
+                except Exception as e:
+                    logger.error(f"Error removing stored message {digest}: {str(e)}")
+        return purged
+    finally:
+        db.close()
+
+
+# Global instance
+tombstone_compaction = TombstoneCompaction()
@@ -31,3 +31,7 @@ class PasswordCrypto:
 
 # Global instance
 password_crypto = PasswordCrypto()
+
+def account_password(account, kind: str) -> str:
+    """The password an account uses for kind ("imap", "smtp" or "pop3"), decrypted if stored encrypted"""
+    return password_crypto.decrypt_password(getattr(account, f"{kind}_password"))
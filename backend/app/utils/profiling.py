@@ -0,0 +1,187 @@
+from collections import Counter
+from typing import Optional
+import cProfile
+import hmac
+import logging
+import os
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+
+from fastapi.concurrency import run_in_threadpool
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+logger = logging.getLogger(__name__)
+
+# Leaf frames of threads parked with nothing to do (idle pool workers, waiting queues)
+IDLE_FILES = ("threading.py", "queue.py")
+
+
+class StackSampler:
+    """Wall-clock sampler that counts the stacks of every busy thread.
+
+    Unlike cProfile it also sees work the request hands to the threadpool
+    (IMAP and SMTP round-trips, body fetches), at the cost of including
+    whatever else the process is doing at the same time. Stops by itself
+    after max_samples.
+    """
+
+    def __init__(self, interval: float = 0.005, max_samples: Optional[int] = None):
+        self.interval = interval
+        self.max_samples = max_samples
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="profile-sampler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def collapsed(self) -> str:
+        """Stacks in the folded format read by flamegraph.pl and speedscope"""
+        lines = [f"{';'.join(stack)} {count}" for stack, count in self.stacks.most_common()]
+        return "\n".join(lines) + "\n"
+
+    def _run(self):
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            if self.max_samples is not None and self.samples >= self.max_samples:
+                return
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            self.samples += 1
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                if os.path.basename(frame.f_code.co_filename) in IDLE_FILES:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                stack.append(names.get(thread_id, str(thread_id)))
+                self.stacks[tuple(reversed(stack))] += 1
+
+
+class ProfilingMiddleware:
+    """Profile a fraction of requests, or one that carries the profiling token.
+
+    Requests are profiled one at a time; the output files are named in the
+    X-Profile-Id response header. A profile ends with the response, after
+    max_seconds, or as soon as an event stream starts; only the newest keep
+    profiles are kept. Install only when profiling is enabled, so that it
+    costs nothing otherwise.
+    """
+
+    def __init__(self, app: ASGIApp, output_dir: str, sample_rate: float = 0.0,
+                 token: Optional[str] = None, mode: str = "sample", interval: float = 0.005,
+                 max_seconds: float = 30.0, keep: int = 200):
+        self.app = app
+        self.output_dir = output_dir
+        self.sample_rate = sample_rate
+        # Header values arrive as latin-1; compared as bytes so any header can be checked
+        self.token = token.encode() if token else None
+        self.mode = mode
+        self.interval = interval
+        self.max_seconds = max_seconds
+        self.keep = keep
+        self._busy = threading.Lock()
+        os.makedirs(output_dir, exist_ok=True)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http" or not self._wanted(scope) or not self._busy.acquire(blocking=False):
+            await self.app(scope, receive, send)
+            return
+
+        profile_id = self._profile_id(scope)
+        sampler = StackSampler(self.interval, max_samples=int(self.max_seconds / self.interval))
+        profiler = cProfile.Profile() if self.mode == "cprofile" else None
+        started = time.perf_counter()
+        finished = False
+
+        async def finish():
+            nonlocal finished
+            if finished:
+                return
+            finished = True
+            try:
+                if profiler is not None:
+                    profiler.disable()
+                sampler.stop()
+                elapsed = time.perf_counter() - started
+                await run_in_threadpool(self._write, profile_id, sampler, profiler)
+                logger.info(f"Profiled {scope['method']} {scope['path']} for {elapsed * 1000:.1f}ms as {profile_id}")
+            finally:
+                self._busy.release()
+
+        async def send_with_id(message: Message):
+            streaming = False
+            if message["type"] == "http.response.start":
+                headers = MutableHeaders(scope=message)
+                headers.append("X-Profile-Id", profile_id)
+                streaming = headers.get("content-type", "").startswith("text/event-stream")
+            await send(message)
+            # A stream stays open for as long as the client listens; the rest goes unprofiled
+            if streaming or time.perf_counter() - started > self.max_seconds:
+                await finish()
+
+        sampler.start()
+        if profiler is not None:
+            profiler.enable()
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            await finish()
+
+    def _wanted(self, scope: Scope) -> bool:
+        headers = Headers(scope=scope)
+        # Event streams never finish; there is nothing to profile in them
+        if "text/event-stream" in headers.get("accept", ""):
+            return False
+        if self.token:
+            header = headers.get("x-profile")
+            if header is not None and hmac.compare_digest(header.encode("latin-1"), self.token):
+                return True
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def _profile_id(self, scope: Scope) -> str:
+        path = re.sub(r"[^A-Za-z0-9]+", "_", scope["path"]).strip("_") or "root"
+        return f"{time.strftime('%Y%m%d-%H%M%S')}-{scope['method'].lower()}-{path[:60]}-{uuid.uuid4().hex[:6]}"
+
+    def _write(self, profile_id: str, sampler: StackSampler, profiler: Optional[cProfile.Profile]):
+        base = os.path.join(self.output_dir, profile_id)
+        try:
+            with open(f"{base}.folded", "w") as folded:
+                folded.write(sampler.collapsed())
+            if profiler is not None:
+                profiler.dump_stats(f"{base}.prof")
+        except OSError as e:
+            logger.error(f"Could not write profile {profile_id}: {str(e)}")
+        self._prune()
+
+    def _prune(self):
+        """Remove all but the newest keep profiles; names start with the time they were taken"""
+        try:
+            names = os.listdir(self.output_dir)
+        except OSError as e:
+            logger.error(f"Could not list profiles: {str(e)}")
+            return
+        profiles = sorted({os.path.splitext(name)[0] for name in names if name.endswith((".folded", ".prof"))})
+        for profile_id in profiles[:max(len(profiles) - self.keep, 0)]:
+            for suffix in (".folded", ".prof"):
+                try:
+                    os.remove(os.path.join(self.output_dir, profile_id + suffix))
+                except FileNotFoundError:
+                    pass
+                except OSError as e:
+                    logger.error(f"Could not remove profile {profile_id}: {str(e)}")
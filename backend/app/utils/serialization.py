@@ -0,0 +1,39 @@
+from typing import Iterable, List, Optional, Type
+
+import orjson
+from fastapi.responses import ORJSONResponse, Response
+from pydantic import BaseModel
+
+# Datetimes are written like Pydantic does (UTC as "Z")
+JSON_OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_UTC_Z
+
+
+class FastJSONResponse(ORJSONResponse):
+    """orjson-encoded response"""
+
+    def render(self, content) -> bytes:
+        return orjson.dumps(content, option=JSON_OPTIONS)
+
+
+def schema_columns(model, schema: Type[BaseModel]) -> list:
+    """ORM columns backing every field of a response schema"""
+    return [getattr(model, field) for field in schema.model_fields]
+
+
+def render_rows(rows: Iterable) -> bytes:
+    """Serialize column rows from the database without re-validating them.
+
+    For read-only list endpoints whose rows come straight from our own tables
+    (selected with schema_columns), so they already match the response schema.
+    """
+    content: List[dict] = [row._asdict() for row in rows]
+    return orjson.dumps(content, option=JSON_OPTIONS)
+
+
+def rows_response(rows: Iterable, headers: Optional[dict] = None) -> Response:
+    return json_bytes_response(render_rows(rows), headers=headers)
+
+
+def json_bytes_response(body: bytes, headers: Optional[dict] = None) -> Response:
+    """Response for JSON that is already serialized, e.g. from the cache"""
+    return Response(body, media_type="application/json", headers=headers)
@@ -0,0 +1,67 @@
+import hashlib
+import os
+import re
+
+from fastapi.staticfiles import StaticFiles
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse, Response
+from starlette.types import Scope
+
+from app.core.config import settings
+from app.utils.etag import etag_matches
+
+# Uploaded files are named "<prefix>_<16 hex chars of sha256(content)><ext>"
+HASHED_FILENAME_RE = re.compile(r"_(?P<digest>[0-9a-f]{16})\.[A-Za-z0-9]+$")
+
+
+def content_hash(content: bytes) -> str:
+    """Short content hash used in upload filenames"""
+    return hashlib.sha256(content).hexdigest()[:16]
+
+
+def hashed_filename(prefix: str, content: bytes, extension: str) -> str:
+    """Build a content-addressed filename for an uploaded file"""
+    return f"{prefix}_{content_hash(content)}{extension}"
+
+
+class CachedStaticFiles(StaticFiles):
+    """StaticFiles with strong ETags and immutable caching for hashed uploads"""
+
+    def file_response(
+        self,
+        full_path,
+        stat_result: os.stat_result,
+        scope: Scope,
+        status_code: int = 200,
+    ) -> Response:
+        request_headers = Headers(scope=scope)
+        etag, cache_control = self._cache_headers(str(full_path), stat_result)
+
+        headers = {"ETag": etag, "Cache-Control": cache_control}
+        if etag_matches(request_headers.get("if-none-match"), etag):
+            return Response(status_code=304, headers=headers)
+
+        response = FileResponse(
+            full_path,
+            status_code=status_code,
+            stat_result=stat_result,
+            method=scope["method"],
+            headers=headers,
+        )
+        # Fall back to If-Modified-Since for clients that don't send ETags
+        if "if-none-match" not in request_headers and self.is_not_modified(response.headers, request_headers):
+            return Response(status_code=304, headers=headers)
+        return response
+
+    def _cache_headers(self, full_path: str, stat_result: os.stat_result) -> tuple:
+        """Return (etag, cache-control) for a file"""
+        match = HASHED_FILENAME_RE.search(os.path.basename(full_path))
+        if match:
+            # The name changes whenever the content does, so it never needs revalidating
+            etag = f'"{match.group("digest")}"'
+            cache_control = f"public, max-age={settings.UPLOAD_CACHE_MAX_AGE}, immutable"
+        else:
+            # Legacy uploads: validator derived from size and mtime, always revalidate
+            etag = f'"{stat_result.st_size:x}-{stat_result.st_mtime_ns:x}"'
+            cache_control = "public, no-cache"
+        return etag, cache_control
@@ -0,0 +1,194 @@
+"""Read, starred and folder changes: one IMAP session per change against the queued, batched flag sync.
+
+Run from backend/:  DATABASE_URL=sqlite:///./bench_flags.db python -m benchmarks.bench_flags
+                        [--messages 500] [--changes 300] [--moves 0.1] [--latency 0.005] [--seed 0]
+
+Use a scratch database: the run adds a user, an account and its emails. A
+random series of changes (mostly read and starred toggles, a --moves share
+of moves to Trash) is applied twice to a fake IMAP server: first the way
+update_email used to, connecting and sending each change on its own, then
+the way it does now, queueing changes in the request and sending them with
+one push. Both report the time a request waits, IMAP commands and
+connections, and check the server ends up with the database's flags and
+folders.
+"""
+from datetime import datetime, timedelta
+import argparse
+import random
+import statistics
+import time
+
+from sqlalchemy import update
+
+from app.core.config import settings
+from app.core.database import Base, SessionLocal, engine
+from app.models import account, email, email_archive, flag_change, folder_state, lease, outbox, user  # noqa: F401 (register tables)
+from app.models.account import EmailAccount
+from app.models.email import Email
+from app.models.flag_change import FlagChange
+from app.models.user import User
+from app.services.flag_sync import FLAG_FIELDS, push_account, queue_flag_changes
+from app.services.imap_service import IMAPService
+from benchmarks.fake_servers import FakeIMAPServer, Mailbox
+from benchmarks.mailgen import MailboxGenerator
+
+
+def make_changes(rng: random.Random, messages: int, count: int, moves: float) -> list:
+    """(message number, changes) pairs; each message moves at most once"""
+    moved = set()
+    changes = []
+    for _ in range(count):
+        number = rng.randrange(messages)
+        if rng.random() < moves and number not in moved:
+            moved.add(number)
+            changes.append((number, {"folder": "Trash"}))
+        else:
+            changes.append((number, {rng.choice(list(FLAG_FIELDS)): rng.random() < 0.5}))
+    return changes
+
+
+def seed_account(imap_port: int, mailbox: Mailbox, messages: int) -> int:
+    """A fresh account whose emails mirror the fake server's INBOX; returns its id"""
+    db = SessionLocal()
+    try:
+        bench_user = db.query(User).filter(User.username == "bench-flags").first()
+        if bench_user is None:
+            bench_user = User(username="bench-flags", email="bench-flags@example.com", hashed_password="-")
+            db.add(bench_user)
+            db.flush()
+        bench_account = EmailAccount(
+            user_id=bench_user.id, name="Flag benchmark", email_address="me@example.com",
+            imap_host="127.0.0.1", imap_port=imap_port, imap_ssl=False, imap_username="me", imap_password="secret",
+            smtp_host="127.0.0.1", smtp_port=25, smtp_ssl=False, smtp_username="me", smtp_password="secret",
+        )
+        db.add(bench_account)
+        db.flush()
+        inbox = mailbox.folders["INBOX"]
+        for number, uid in enumerate(inbox.uids[:messages]):
+            db.add(Email(
+                account_id=bench_account.id, message_id=f"<bench-flags-{bench_account.id}-{number}@example.com>",
+                uid=str(uid), sender_email="sender@example.com", folder="INBOX",
+                is_read="\\Seen" in inbox.messages[uid].flags, is_starred=False
+            ))
+        db.commit()
+        return bench_account.id
+    finally:
+        db.close()
+
+
+def email_ids(account_id: int) -> list:
+    db = SessionLocal()
+    try:
+        return [email_id for email_id, in db.query(Email.id).filter(Email.account_id == account_id).order_by(Email.id)]
+    finally:
+        db.close()
+
+
+def run_direct(account_id: int, ids: list, changes: list) -> list:
+    """Each change in its request: update the row, connect, send it, disconnect"""
+    waits = []
+    db = SessionLocal()
+    try:
+        bench_account = db.query(EmailAccount).filter(EmailAccount.id == account_id).first()
+        for number, change in changes:
+            start = time.perf_counter()
+            row = db.query(Email).filter(Email.id == ids[number]).first()
+            imap = IMAPService(bench_account, bench_account.imap_password)
+            if imap.connect():
+                try:
+                    if "folder" in change:
+                        ok, _, new_uids = imap.move_messages([row.uid], change["folder"], row.folder)
+                        if ok:
+                            row.uid = new_uids.get(row.uid)
+                    else:
+                        field, value = next(iter(change.items()))
+                        imap.store_flags([row.uid], FLAG_FIELDS[field], value, row.folder)
+                finally:
+                    imap.disconnect()
+            for field, value in change.items():
+                setattr(row, field, value)
+            db.commit()
+            waits.append(time.perf_counter() - start)
+    finally:
+        db.close()
+    return waits
+
+
+def run_queued(account_id: int, ids: list, changes: list) -> tuple:
+    """Each change queued in its request, then everything sent in one push"""
+    waits = []
+    db = SessionLocal()
+    try:
+        for number, change in changes:
+            start = time.perf_counter()
+            row = db.query(Email).filter(Email.id == ids[number]).first()
+            queue_flag_changes(db, row, change)
+            for field, value in change.items():
+                setattr(row, field, value)
+            db.commit()
+            waits.append(time.perf_counter() - start)
+        # Due now rather than at the end of the window
+        db.execute(update(FlagChange).where(FlagChange.account_id == account_id).values(
+            next_attempt_at=datetime.utcnow() - timedelta(seconds=1)
+        ))
+        db.commit()
+    finally:
+        db.close()
+    start = time.perf_counter()
+    push_account(account_id)
+    return waits, time.perf_counter() - start
+
+
+def mismatches(account_id: int, mailbox: Mailbox) -> int:
+    """Emails whose folder, read or starred state on the server differs from the database"""
+    db = SessionLocal()
+    try:
+        wrong = 0
+        for row in db.query(Email).filter(Email.account_id == account_id):
+            message = mailbox.folders[row.folder].messages.get(int(row.uid)) if row.uid else None
+            if message is None or any((flag in message.flags) != bool(getattr(row, field)) for field, flag in FLAG_FIELDS.items()):
+                wrong += 1
+        return wrong
+    finally:
+        db.close()
+
+
+def report(name: str, server: FakeIMAPServer, waits: list, push: float = None):
+    commands = sum(server.commands.values())
+    print(f"  {name:<8} request wait median {statistics.median(waits) * 1000:7.2f} ms, "
+          f"p95 {sorted(waits)[int(len(waits) * 0.95)] * 1000:7.2f} ms, total {sum(waits):6.2f}s"
+          + (f", push {push:5.2f}s" if push is not None else ""))
+    print(f"  {'':<8} {commands} IMAP commands over {server.commands['LOGIN']} connections: "
+          + ", ".join(f"{command} {count}" for command, count in sorted(server.commands.items())))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=500)
+    parser.add_argument("--changes", type=int, default=300)
+    parser.add_argument("--moves", type=float, default=0.1, help="share of changes that move a message to Trash")
+    parser.add_argument("--latency", type=float, default=0.005, help="seconds added to every command")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    Base.metadata.create_all(bind=engine)
+    changes = make_changes(random.Random(args.seed), args.messages, args.changes, args.moves)
+    print(f"{args.changes} changes to {args.messages} messages, {args.latency * 1000:.1f} ms per IMAP command, "
+          f"flag sync window {settings.FLAG_SYNC_WINDOW}s")
+
+    for name in ("direct", "queued"):
+        mailbox = Mailbox()
+        mailbox.seed(MailboxGenerator(args.seed), args.messages)
+        with FakeIMAPServer(mailbox, {"*": args.latency}) as server:
+            account_id = seed_account(server.port, mailbox, args.messages)
+            ids = email_ids(account_id)
+            server.commands.clear()
+            if name == "direct":
+                report(name, server, run_direct(account_id, ids, changes))
+            else:
+                report(name, server, *run_queued(account_id, ids, changes))
+            print(f"  {'':<8} {mismatches(account_id, mailbox)} emails out of step with the server")
+
+
+if __name__ == "__main__":
+    main()
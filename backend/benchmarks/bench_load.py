@@ -0,0 +1,152 @@
+"""Drive the email API at a fixed concurrency and report latency percentiles per route.
+
+Seed a database and start the server against it first, for example:
+    python -m benchmarks.seed_db --database-url sqlite:///./data/load.db --emails 2000000
+    DATABASE_URL=sqlite:///./data/load.db SQLITE_PRODUCTION_PROFILE=true uvicorn app.main:app --workers 4
+
+Run from backend/:  python -m benchmarks.bench_load [--base-url http://127.0.0.1:8000]
+                        [--concurrency 32] [--duration 60] [--mix list:50,search:15,get:25,update:10]
+"""
+from collections import defaultdict
+from typing import Dict, List
+import argparse
+import asyncio
+import json
+import random
+import time
+
+import httpx
+
+from benchmarks.seed_db import FOLDER_SHARE, PASSWORD, WORDS
+
+API = "/api/v1"
+ROUTES = {
+    "list": "GET /emails",
+    "search": "POST /emails/search",
+    "get": "GET /emails/{id}",
+    "update": "PUT /emails/{id}",
+}
+
+
+class LoadUser:
+    def __init__(self, username: str, token: str, email_ids: List[int]):
+        self.username = username
+        self.headers = {"Authorization": f"Bearer {token}"}
+        self.email_ids = email_ids
+
+
+def parse_mix(spec: str) -> Dict[str, float]:
+    mix = {}
+    for item in spec.split(","):
+        name, _, weight = item.partition(":")
+        if name not in ROUTES:
+            raise SystemExit(f"Unknown route {name!r}, expected one of {', '.join(ROUTES)}")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def percentile(samples: List[float], fraction: float) -> float:
+    """Nearest-rank percentile of sorted samples"""
+    return samples[min(len(samples) - 1, max(0, int(round(fraction * len(samples))) - 1))]
+
+
+async def log_in(client: httpx.AsyncClient, username: str) -> LoadUser:
+    response = await client.post(f"{API}/auth/login", json={"username": username, "password": PASSWORD})
+    response.raise_for_status()
+    user = LoadUser(username, response.json()["access_token"], [])
+    # Ids to read and update: the first pages of the busiest folders
+    for folder in ("INBOX", "Archive"):
+        page = await client.get(f"{API}/emails/", params={"folder": folder, "limit": 100}, headers=user.headers)
+        if page.status_code == 200:
+            user.email_ids += [item["id"] for item in page.json()]
+    return user
+
+
+async def request(client: httpx.AsyncClient, route: str, user: LoadUser, rng: random.Random) -> httpx.Response:
+    if route == "list":
+        folder = rng.choices(list(FOLDER_SHARE), list(FOLDER_SHARE.values()))[0]
+        params = {"folder": folder, "limit": 50, "offset": 50 * min(int(rng.expovariate(0.7)), 20)}
+        return await client.get(f"{API}/emails/", params=params, headers=user.headers)
+    if route == "search":
+        return await client.post(f"{API}/emails/search", json={"query": rng.choice(WORDS)}, headers=user.headers)
+    email_id = rng.choice(user.email_ids)
+    if route == "get":
+        return await client.get(f"{API}/emails/{email_id}", headers=user.headers)
+    # Starring keeps the update on the database; read flags would also go to the IMAP server
+    return await client.put(f"{API}/emails/{email_id}", json={"is_starred": rng.random() < 0.5}, headers=user.headers)
+
+
+async def worker(client: httpx.AsyncClient, users: List[LoadUser], mix: Dict[str, float], deadline: float,
+                 latencies: Dict[str, List[float]], errors: Dict[str, int], seed: int):
+    rng = random.Random(seed)
+    routes, weights = list(mix), list(mix.values())
+    while time.perf_counter() < deadline:
+        route = rng.choices(routes, weights)[0]
+        user = rng.choice(users)
+        if route in ("get", "update") and not user.email_ids:
+            continue
+        started = time.perf_counter()
+        try:
+            response = await request(client, route, user, rng)
+            failed = response.status_code >= 400
+        except httpx.HTTPError:
+            failed = True
+        latencies[route].append(time.perf_counter() - started)
+        if failed:
+            errors[route] += 1
+
+
+async def run(args):
+    mix = parse_mix(args.mix)
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=args.base_url, limits=limits, timeout=args.timeout) as client:
+        users = await asyncio.gather(*(log_in(client, f"load{n}") for n in range(args.users)))
+        print(f"Logged in {len(users)} users, {sum(len(user.email_ids) for user in users)} email ids to read and update")
+
+        latencies: Dict[str, List[float]] = defaultdict(list)
+        errors: Dict[str, int] = defaultdict(int)
+        started = time.perf_counter()
+        deadline = started + args.duration
+        await asyncio.gather(*(
+            worker(client, users, mix, deadline, latencies, errors, args.seed + n)
+            for n in range(args.concurrency)
+        ))
+        elapsed = time.perf_counter() - started
+
+    report = {}
+    print(f"{args.concurrency} concurrent clients for {elapsed:.1f}s against {args.base_url}")
+    print(f"  {'route':<22} {'requests':>9} {'errors':>7} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8}")
+    for route in mix:
+        samples = sorted(latencies[route])
+        if not samples:
+            continue
+        p50, p95, p99 = (percentile(samples, fraction) * 1000 for fraction in (0.5, 0.95, 0.99))
+        report[ROUTES[route]] = {
+            "requests": len(samples), "errors": errors[route], "rps": len(samples) / elapsed,
+            "p50_ms": p50, "p95_ms": p95, "p99_ms": p99, "max_ms": samples[-1] * 1000
+        }
+        print(f"  {ROUTES[route]:<22} {len(samples):>9} {errors[route]:>7} {len(samples) / elapsed:>8.1f} "
+              f"{p50:>8.1f} {p95:>8.1f} {p99:>8.1f} {samples[-1] * 1000:>8.1f}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"concurrency": args.concurrency, "duration": elapsed, "routes": report}, f, indent=2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--base-url", default="http://127.0.0.1:8000")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=60, help="seconds")
+    parser.add_argument("--users", type=int, default=50, help="seeded users to spread the load over")
+    parser.add_argument("--mix", default="list:50,search:15,get:25,update:10")
+    parser.add_argument("--timeout", type=float, default=30)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="also write the results as JSON")
+    args = parser.parse_args()
+
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""Time the legacy and the fast-path MIME parser over the benchmark corpus.
+
+Run from backend/:  python -m benchmarks.bench_mime [--repeat 5] [--attachment-size 10485760] [--only nested,plain]
+
+For each message it prints the median parse time of both parsers, whether the
+boundary scan handled it or fell back to a full parse, and the fields where the
+result differs from the legacy parser (dates and size are left out: the first
+are "now" when unparseable, the second is the raw length on the fast path).
+It exits with status 1 if the scan ever builds a different result than a full
+parse of the same message, which is the fast path's correctness contract.
+"""
+from email import message_from_bytes
+import argparse
+import statistics
+import sys
+import time
+
+from app.services import mime_parser
+from app.services.imap_service import IMAPService
+from benchmarks.mime_corpus import corpus
+
+IGNORED_FIELDS = ("date_sent", "date_received", "size")
+
+
+def legacy_parse(raw: bytes, uid: str) -> dict:
+    return IMAPService(None, None)._parse_email_message(message_from_bytes(raw), uid)
+
+
+def median_ms(fn, raw: bytes, repeat: int) -> float:
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn(raw, "1")
+        samples.append(time.perf_counter() - started)
+    return statistics.median(samples) * 1000
+
+
+def differences(left: dict, right: dict) -> list:
+    return sorted(key for key in set(left) | set(right)
+                  if key not in IGNORED_FIELDS and left.get(key) != right.get(key))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--attachment-size", type=int, default=10 * 1024 * 1024,
+                        help="bytes in the large_attachment case")
+    parser.add_argument("--only", help="comma separated corpus entries to run")
+    args = parser.parse_args()
+
+    messages = corpus(args.attachment_size)
+    if args.only:
+        messages = {name: messages[name] for name in args.only.split(",")}
+
+    mismatches = []
+    print(f"  {'message':<20} {'bytes':>10} {'legacy ms':>10} {'fast ms':>10} {'speedup':>8}  {'path':<5} differs from legacy")
+    for name, raw in messages.items():
+        legacy_ms = median_ms(legacy_parse, raw, args.repeat)
+        fast_ms = median_ms(mime_parser.parse_message, raw, args.repeat)
+
+        scanned = mime_parser._scan(raw) is not None
+        fast = mime_parser.parse_message(raw, "1")
+        full = mime_parser._extract(mime_parser._parser.parsebytes(raw), "1", len(raw))
+        if differences(fast, full):
+            mismatches.append(name)
+
+        changed = ", ".join(differences(fast, legacy_parse(raw, "1"))) or "-"
+        print(f"  {name:<20} {len(raw):>10} {legacy_ms:>10.2f} {fast_ms:>10.2f} {legacy_ms / fast_ms:>7.1f}x  "
+              f"{'scan' if scanned else 'full':<5} {changed}")
+
+    if mismatches:
+        print(f"Boundary scan disagrees with the full parse for: {', '.join(mismatches)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""Compare the two ways of serializing email list pages.
+
+Run from backend/:  python -m benchmarks.bench_serialization [--rows 100] [--repeat 50]
+"""
+from datetime import datetime, timedelta
+import argparse
+import gzip
+import json
+import statistics
+import time
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from app.core.database import Base
+from app.models import account, email, user  # noqa: F401 (register tables)
+from app.models.email import Email
+from app.schemas.email import Email as EmailSchema
+from app.utils.serialization import rows_response, schema_columns
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+def make_session(rows: int):
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(bind=engine)
+    session = sessionmaker(bind=engine)()
+    now = datetime.utcnow()
+    session.add_all(
+        Email(
+            account_id=1,
+            message_id=f"<bench-{i}@example.com>",
+            uid=str(i),
+            subject=f"Quarterly report {i}",
+            sender_email=f"sender{i % 40}@example.com",
+            sender_name=f"Sender {i % 40}",
+            to_addresses=[{"email": "me@example.com", "name": "Me"}],
+            body_text="Lorem ipsum dolor sit amet, consectetur adipiscing elit. " * 20,
+            body_html="<p>" + "Lorem ipsum dolor sit amet, consectetur adipiscing elit. " * 20 + "</p>",
+            attachments=[],
+            date_sent=now - timedelta(minutes=i),
+            date_received=now - timedelta(minutes=i),
+            size=4096,
+            folder="INBOX",
+            created_at=now,
+        )
+        for i in range(rows)
+    )
+    session.commit()
+    return session
+
+
+def orm_and_pydantic(session, rows: int) -> bytes:
+    """The original path: ORM objects, response_model validation, stdlib json"""
+    emails = session.query(Email).order_by(Email.date_received.desc()).limit(rows).all()
+    validated = [EmailSchema.model_validate(e) for e in emails]
+    return JSONResponse(jsonable_encoder(validated)).body
+
+
+def columns_and_orjson(session, rows: int) -> bytes:
+    """The fast path: column rows serialized directly with orjson"""
+    columns = schema_columns(Email, EmailSchema)
+    emails = session.query(Email).with_entities(*columns).order_by(Email.date_received.desc()).limit(rows).all()
+    return rows_response(emails).body
+
+
+def timed(fn, session, rows: int, repeat: int):
+    samples = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn(session, rows)
+        samples.append(time.perf_counter() - start)
+        # Keep identity-map effects out of the measurement
+        session.expunge_all()
+    return statistics.median(samples) * 1000, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=100)
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    session = make_session(args.rows)
+
+    slow_ms, slow_body = timed(orm_and_pydantic, session, args.rows, args.repeat)
+    fast_ms, fast_body = timed(columns_and_orjson, session, args.rows, args.repeat)
+    if json.loads(slow_body) != json.loads(fast_body):
+        raise SystemExit("The two paths produced different JSON")
+
+    print(f"{args.rows} rows, median of {args.repeat} runs")
+    print(f"  ORM + Pydantic + json : {slow_ms:8.2f} ms  {len(slow_body):>9} bytes")
+    print(f"  columns + orjson      : {fast_ms:8.2f} ms  {len(fast_body):>9} bytes  ({slow_ms / fast_ms:.1f}x)")
+
+    start = time.perf_counter()
+    gzipped = gzip.compress(fast_body, compresslevel=6)
+    print(f"  gzip -6               : {(time.perf_counter() - start) * 1000:8.2f} ms  {len(gzipped):>9} bytes")
+    if brotli is not None:
+        start = time.perf_counter()
+        compressed = brotli.compress(fast_body, quality=5)
+        print(f"  brotli q5             : {(time.perf_counter() - start) * 1000:8.2f} ms  {len(compressed):>9} bytes")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,202 @@
+"""Messages per second through the IMAP, sync and SMTP paths, against local fake servers.
+
+Run from backend/:  python -m benchmarks.bench_sync [--messages 200] [--latency 0.001]
+                        [--size-mix small:70,medium:25,large:5] [--attachments 0.1]
+                        [--repeat 3] [--save-baseline] [--tolerance 0.2]
+
+Each result is compared with the baseline stored for the same settings
+(benchmarks/baseline_sync.json); the run exits with status 1 when any of them
+is slower by more than the tolerance. Baselines are machine specific: save
+one on the machine that runs the comparison.
+"""
+from email import message_from_bytes, policy
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from app.core.database import Base
+from app.models import account, email, user  # noqa: F401 (register tables)
+from app.models.account import EmailAccount
+from app.models.user import User
+from app.schemas.email import EmailAddress, EmailCompose
+from app.services.imap_service import IMAPService
+from app.services.smtp_service import SMTPService
+from app.services.sync_service import sync_folder
+from benchmarks.fake_servers import FakeIMAPServer, FakeSMTPServer, Mailbox
+from benchmarks.mailgen import MailboxGenerator, parse_size_mix
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), "baseline_sync.json")
+
+
+def make_account(imap_port: int, smtp_port: int) -> EmailAccount:
+    return EmailAccount(
+        user_id=1,
+        name="Benchmark",
+        email_address="me@example.com",
+        imap_host="127.0.0.1",
+        imap_port=imap_port,
+        imap_ssl=False,
+        imap_username="me",
+        imap_password="secret",
+        smtp_host="127.0.0.1",
+        smtp_port=smtp_port,
+        smtp_ssl=False,
+        smtp_username="me",
+        smtp_password="secret",
+    )
+
+
+def connected_imap(mail_account: EmailAccount) -> IMAPService:
+    imap = IMAPService(mail_account, mail_account.imap_password)
+    if not imap.connect():
+        raise SystemExit("Could not connect to the fake IMAP server")
+    return imap
+
+
+def bench_email_list(mail_account: EmailAccount, messages: int) -> float:
+    imap = connected_imap(mail_account)
+    try:
+        start = time.perf_counter()
+        listed = imap.get_email_list("INBOX", limit=messages)
+        elapsed = time.perf_counter() - start
+    finally:
+        imap.disconnect()
+    return len(listed) / elapsed
+
+
+def bench_email_content(mail_account: EmailAccount, messages: int) -> float:
+    imap = connected_imap(mail_account)
+    try:
+        uids = imap.search_uids("INBOX")[-messages:]
+        start = time.perf_counter()
+        fetched = sum(1 for uid in uids if imap.get_email_content(str(uid), "INBOX"))
+        elapsed = time.perf_counter() - start
+    finally:
+        imap.disconnect()
+    return fetched / elapsed
+
+
+def bench_sync_folder(mail_account: EmailAccount, messages: int) -> float:
+    """A first sync of the folder into an empty database"""
+    mail_account = make_account(mail_account.imap_port, mail_account.smtp_port)
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(bind=engine)
+    db = sessionmaker(bind=engine)()
+    db.add(User(id=1, username="bench", email="me@example.com", hashed_password="-"))
+    db.add(mail_account)
+    db.commit()
+    imap = connected_imap(mail_account)
+    try:
+        start = time.perf_counter()
+        result = sync_folder(db, mail_account, imap, "INBOX", limit=messages)
+        elapsed = time.perf_counter() - start
+    finally:
+        imap.disconnect()
+        db.close()
+        engine.dispose()
+    return result["synced"] / elapsed
+
+
+def bench_smtp_send(mail_account: EmailAccount, messages: int, body: str) -> float:
+    """Sends over one authenticated session, as the outbox worker does"""
+    smtp = SMTPService(mail_account, mail_account.smtp_password)
+    if not smtp.connect():
+        raise SystemExit("Could not connect to the fake SMTP server")
+    try:
+        start = time.perf_counter()
+        sent = 0
+        for i in range(messages):
+            ok, _ = smtp.send_email(EmailCompose(
+                account_id=1,
+                to_addresses=[EmailAddress(email=f"rcpt{i % 20}@example.com")],
+                subject=f"Benchmark message {i}",
+                body_text=body,
+                body_html=f"<p>{body}</p>",
+            ))
+            sent += ok
+        elapsed = time.perf_counter() - start
+    finally:
+        smtp.disconnect()
+    return sent / elapsed
+
+
+def median_of(fn, repeat: int, *args) -> float:
+    return statistics.median(fn(*args) for _ in range(repeat))
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> bool:
+    ok = True
+    for name, rate in results.items():
+        expected = baseline.get(name)
+        if expected is None:
+            continue
+        change = rate / expected - 1
+        regressed = change < -tolerance
+        ok = ok and not regressed
+        print(f"  {name:<14} {rate:9.1f} msg/s  baseline {expected:9.1f}  {change:+7.1%}{'  REGRESSION' if regressed else ''}")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=200)
+    parser.add_argument("--latency", type=float, default=0.001, help="seconds added to every command")
+    parser.add_argument("--size-mix", default="small:70,medium:25,large:5")
+    parser.add_argument("--attachments", type=float, default=0.1, help="share of messages with an attachment")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed slowdown before failing")
+    parser.add_argument("--save-baseline", action="store_true")
+    args = parser.parse_args()
+
+    generator = MailboxGenerator(args.seed, parse_size_mix(args.size_mix), args.attachments)
+    mailbox = Mailbox()
+    mailbox.seed(generator, args.messages)
+    latency = {"*": args.latency}
+    config = f"messages={args.messages} latency={args.latency} size_mix={args.size_mix} attachments={args.attachments} seed={args.seed}"
+
+    with FakeIMAPServer(mailbox, latency) as imap_server, FakeSMTPServer(latency) as smtp_server:
+        mail_account = make_account(imap_server.port, smtp_server.port)
+        body = message_from_bytes(generator.message(0), policy=policy.default).get_body(("plain",)).get_content()
+        results = {
+            "email_list": median_of(bench_email_list, args.repeat, mail_account, args.messages),
+            "email_content": median_of(bench_email_content, args.repeat, mail_account, args.messages),
+            "sync_folder": median_of(bench_sync_folder, args.repeat, mail_account, args.messages),
+            "smtp_send": median_of(bench_smtp_send, args.repeat, mail_account, args.messages, body),
+        }
+
+    baselines = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baselines = json.load(f)
+
+    print(f"{config}, median of {args.repeat} runs")
+    if args.save_baseline:
+        baselines[config] = {name: round(rate, 1) for name, rate in results.items()}
+        with open(args.baseline, "w") as f:
+            json.dump(baselines, f, indent=2, sort_keys=True)
+            f.write("\n")
+        for name, rate in results.items():
+            print(f"  {name:<14} {rate:9.1f} msg/s")
+        print(f"Saved as the baseline in {args.baseline}")
+        return
+
+    if config not in baselines:
+        for name, rate in results.items():
+            print(f"  {name:<14} {rate:9.1f} msg/s")
+        print("No baseline for these settings; run with --save-baseline to store one")
+        return
+
+    if not compare(results, baselines[config], args.tolerance):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
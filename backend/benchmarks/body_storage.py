@@ -0,0 +1,80 @@
+"""Report how much space body compression and cold storage save, optionally applying them first.
+
+Run from backend/:  python -m benchmarks.body_storage [--migrate] [--archive-after 365] [--read-sample 2000]
+
+Uses DATABASE_URL, like the server. --migrate compresses every eligible body
+and --archive-after moves bodies of mail older than that many days to the
+archive table before reporting (the server runs both in the background when
+BODY_COMPRESSION_MIGRATE and ARCHIVE_ENABLED are set); --read-sample also
+times loading that many bodies, which includes decompressing them.
+"""
+import argparse
+import time
+
+from sqlalchemy import select, text
+
+from app.core.database import SessionLocal
+from app.models import account, email, email_archive, flag_change, folder_state, lease, outbox, user  # noqa: F401 (register tables)
+from app.models.email import Email
+from app.services.body_compression import BodyCompressionMigration, body_storage_report
+from app.services.tiering import BodyTiering
+
+TABLES = ("emails", "email_archive")
+
+
+def megabytes(size: int) -> str:
+    return f"{size / 1024 / 1024:.1f} MB"
+
+
+def table_bytes(db, table: str) -> int:
+    """Space a table and its indexes take up"""
+    if db.get_bind().dialect.name == "postgresql":
+        return db.execute(text("SELECT pg_total_relation_size(:table)"), {"table": table}).scalar()
+    return db.execute(text(
+        "SELECT coalesce(sum(pgsize), 0) FROM dbstat WHERE name = :table "
+        "OR name IN (SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = :table)"
+    ), {"table": table}).scalar()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--migrate", action="store_true", help="compress existing bodies before reporting")
+    parser.add_argument("--archive-after", type=int, help="archive bodies of mail older than this many days first")
+    parser.add_argument("--read-sample", type=int, default=0, help="time loading this many emails' bodies")
+    args = parser.parse_args()
+
+    if args.migrate:
+        started = time.perf_counter()
+        done = BodyCompressionMigration().run()
+        if done is not None:
+            print(f"Migrated {done['rows']} emails in {time.perf_counter() - started:.1f}s: "
+                  f"{megabytes(done['original_bytes'])} -> {megabytes(done['stored_bytes'])}")
+
+    if args.archive_after is not None:
+        started = time.perf_counter()
+        archived = BodyTiering().run_once(args.archive_after)
+        print(f"Archived {archived} emails in {time.perf_counter() - started:.1f}s")
+
+    db = SessionLocal()
+    try:
+        for table in TABLES:
+            print(f"  {table:<14} {megabytes(table_bytes(db, table)):>10}")
+
+        report = body_storage_report(db)
+        print(f"  {'column':<10} {'values':>10} {'compressed':>11} {'original':>12} {'stored':>12} {'saved':>12}")
+        for column, row in report.items():
+            print(f"  {column:<10} {row['values']:>10} {row['compressed']:>11} {megabytes(row['original_bytes']):>12} "
+                  f"{megabytes(row['stored_bytes']):>12} {megabytes(row['saved_bytes']):>12}")
+
+        if args.read_sample:
+            started = time.perf_counter()
+            rows = db.execute(select(Email.body_text, Email.body_html).order_by(Email.id).limit(args.read_sample)).all()
+            elapsed = time.perf_counter() - started
+            characters = sum(len(body or "") for row in rows for body in row)
+            print(f"Loaded {len(rows)} emails' bodies ({characters} characters) in {elapsed * 1000:.0f} ms")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
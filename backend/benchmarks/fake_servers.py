@@ -0,0 +1,462 @@
+"""In-process IMAP4rev1 and SMTP servers for benchmarks and local experiments.
+
+They implement only what IMAPService and SMTPService use, keep everything in
+memory, and can add a delay to each command to stand in for network and
+server latency. Responses go out in one write per command with Nagle
+disabled, so the servers themselves add as little time as possible.
+"""
+from bisect import bisect_left
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Set
+import random
+import re
+import socketserver
+import ssl
+import tempfile
+import threading
+import time
+
+from benchmarks.mailgen import MailboxGenerator
+
+# Latency keys are command names (FETCH, SEARCH and STORE for the UID variants); "*" is the default
+Latency = Dict[str, float]
+
+
+def self_signed_context() -> ssl.SSLContext:
+    """Server TLS context with a throwaway certificate for localhost"""
+    from cryptography import x509
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import ec
+    from cryptography.x509.oid import NameOID
+
+    key = ec.generate_private_key(ec.SECP256R1())
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "localhost")])
+    now = datetime.utcnow()
+    cert = (
+        x509.CertificateBuilder()
+        .subject_name(name)
+        .issuer_name(name)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now - timedelta(days=1))
+        .not_valid_after(now + timedelta(days=1))
+        .sign(key, hashes.SHA256())
+    )
+    with tempfile.NamedTemporaryFile(suffix=".pem") as pem:
+        pem.write(key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+                                    serialization.NoEncryption()))
+        pem.write(cert.public_bytes(serialization.Encoding.PEM))
+        pem.flush()
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(pem.name)
+    return context
+
+
+class _Message:
+    __slots__ = ("uid", "raw", "flags")
+
+    def __init__(self, uid: int, raw: bytes, flags: Set[str]):
+        self.uid = uid
+        self.raw = raw
+        self.flags = flags
+
+
+class _Folder:
+    def __init__(self, attribute: Optional[str] = None):
+        self.attribute = attribute
+        self.uids: List[int] = []
+        self.messages: Dict[int, _Message] = {}
+        self.uidnext = 1
+
+    def sequence(self, uid: int) -> int:
+        return bisect_left(self.uids, uid) + 1
+
+    def remove(self, uids: Iterable[int]):
+        for uid in uids:
+            self.messages.pop(uid, None)
+        self.uids = [uid for uid in self.uids if uid in self.messages]
+
+
+class Mailbox:
+    """Folders of raw messages shared by every connection to a FakeIMAPServer"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.folders: Dict[str, _Folder] = {
+            "INBOX": _Folder(),
+            "Sent": _Folder("\\Sent"),
+            "Drafts": _Folder("\\Drafts"),
+            "Trash": _Folder("\\Trash"),
+        }
+
+    def add(self, folder: str, raw: bytes, flags: Iterable[str] = ()) -> int:
+        with self.lock:
+            target = self.folders.setdefault(folder, _Folder())
+            uid = target.uidnext
+            target.uidnext += 1
+            target.uids.append(uid)
+            target.messages[uid] = _Message(uid, raw, set(flags))
+            return uid
+
+    def seed(self, generator: MailboxGenerator, count: int, folder: str = "INBOX", read_ratio: float = 0.5):
+        """Fill a folder with generated messages, a read_ratio share of them marked \\Seen"""
+        rng = random.Random(f"{generator.seed}:{folder}:flags")
+        for raw in generator.messages(count, folder):
+            self.add(folder, raw, ("\\Seen",) if rng.random() < read_ratio else ())
+
+
+def parse_uid_set(spec: str, uids: List[int]) -> List[int]:
+    """Resolve a UID set such as "4,7:9" or "12:*" against a folder's UIDs"""
+    highest = uids[-1] if uids else 0
+    present = set(uids)
+    selected: Set[int] = set()
+    for part in spec.split(","):
+        if ":" in part:
+            low, high = (highest if bound == "*" else int(bound) for bound in part.split(":"))
+            low, high = min(low, high), max(low, high)
+            selected.update(uid for uid in uids[bisect_left(uids, low):] if uid <= high)
+        else:
+            uid = highest if part == "*" else int(part)
+            if uid in present:
+                selected.add(uid)
+    return sorted(selected)
+
+
+class _Quit(Exception):
+    pass
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    """Line-oriented session with buffered replies and optional per-command delay"""
+    disable_nagle_algorithm = True
+    wbufsize = 64 * 1024
+
+    def reply(self, line, *more):
+        for item in (line,) + more:
+            self.wfile.write((item.encode() if isinstance(item, str) else item) + b"\r\n")
+
+    def delay(self, command: str):
+        with self.server.lock:
+            self.server.commands[command] += 1
+        latency = self.server.latency
+        seconds = latency.get(command, latency.get("*", 0))
+        if seconds:
+            time.sleep(seconds)
+
+    def start_tls(self):
+        self.wfile.flush()
+        self.request = self.server.tls_context.wrap_socket(self.request, server_side=True)
+        self.connection = self.request
+        self.rfile = self.request.makefile("rb", self.rbufsize)
+        self.wfile = self.request.makefile("wb", self.wbufsize)
+
+
+class _IMAPHandler(_Handler):
+    selected: Optional[_Folder] = None
+
+    def setup(self):
+        if self.server.implicit_tls:
+            self.request = self.server.tls_context.wrap_socket(self.request, server_side=True)
+        super().setup()
+
+    def handle(self):
+        self.reply("* OK [CAPABILITY IMAP4rev1] fake IMAP4rev1 ready")
+        self.wfile.flush()
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            match = re.match(r"(\S+) (\S+)(?: (.*))?$", line.decode(errors="replace").rstrip("\r\n"))
+            if not match:
+                self.reply("* BAD unparsable command")
+                self.wfile.flush()
+                continue
+            tag, command, args = match.group(1), match.group(2).upper(), match.group(3) or ""
+            handler = getattr(self, f"do_{command.lower()}", None)
+            try:
+                if handler is None:
+                    self.reply(f"{tag} BAD unknown command")
+                else:
+                    self.delay(args.split(" ", 1)[0].upper() if command == "UID" else command)
+                    handler(tag, args)
+            except _Quit:
+                self.wfile.flush()
+                return
+            except Exception as e:
+                self.reply(f"{tag} BAD {e}")
+            self.wfile.flush()
+
+    def do_capability(self, tag, args):
+        self.reply("* CAPABILITY IMAP4rev1 UIDPLUS MOVE SPECIAL-USE", f"{tag} OK CAPABILITY completed")
+
+    def do_login(self, tag, args):
+        self.reply(f"{tag} OK [CAPABILITY IMAP4rev1 UIDPLUS MOVE SPECIAL-USE] logged in")
+
+    def do_logout(self, tag, args):
+        self.reply("* BYE logging out", f"{tag} OK LOGOUT completed")
+        raise _Quit()
+
+    def do_noop(self, tag, args):
+        self.reply(f"{tag} OK NOOP completed")
+
+    def do_list(self, tag, args):
+        for name, folder in self.server.mailbox.folders.items():
+            attributes = "\\HasNoChildren" + (f" {folder.attribute}" if folder.attribute else "")
+            self.reply(f'* LIST ({attributes}) "." "{name}"')
+        self.reply(f"{tag} OK LIST completed")
+
+    def do_select(self, tag, args):
+        folder = self.server.mailbox.folders.get(args.strip().strip('"'))
+        if folder is None:
+            self.reply(f"{tag} NO no such folder")
+            return
+        self.selected = folder
+        self.reply(
+            f"* {len(folder.uids)} EXISTS",
+            "* 0 RECENT",
+            "* OK [UIDVALIDITY 1] UIDs valid",
+            f"* OK [UIDNEXT {folder.uidnext}] predicted next UID",
+            f"{tag} OK [READ-WRITE] SELECT completed"
+        )
+
+    do_examine = do_select
+
+    def do_append(self, tag, args):
+        match = re.match(r'("[^"]*"|\S+)(?: \(([^)]*)\))?(?: "[^"]*")? \{(\d+)\}$', args)
+        if not match:
+            self.reply(f"{tag} BAD invalid APPEND")
+            return
+        self.reply("+ ready for literal")
+        self.wfile.flush()
+        raw = self.rfile.read(int(match.group(3)))
+        self.rfile.readline()
+        name = match.group(1).strip('"')
+        if name not in self.server.mailbox.folders:
+            self.reply(f"{tag} NO [TRYCREATE] no such folder")
+            return
+        uid = self.server.mailbox.add(name, raw, (match.group(2) or "").split())
+        self.reply(f"{tag} OK [APPENDUID 1 {uid}] APPEND completed")
+
+    def do_expunge(self, tag, args):
+        self._expunge(self.selected.uids)
+        self.reply(f"{tag} OK EXPUNGE completed")
+
+    def do_uid(self, tag, args):
+        if self.selected is None:
+            self.reply(f"{tag} BAD no folder selected")
+            return
+        command, _, rest = args.partition(" ")
+        handler = getattr(self, f"uid_{command.lower()}", None)
+        if handler is None:
+            self.reply(f"{tag} BAD unknown UID command")
+            return
+        handler(tag, rest)
+
+    def uid_search(self, tag, args):
+        criteria = args.replace("CHARSET utf-8", "").strip()
+        uids = self.selected.uids
+        match = re.match(r"UID (\S+)", criteria)
+        if match:
+            uids = parse_uid_set(match.group(1), uids)
+        self.reply("* SEARCH " + " ".join(map(str, uids)), f"{tag} OK SEARCH completed")
+
+    def uid_fetch(self, tag, args):
+        spec, _, items = args.partition(" ")
+        items = items.strip("()").upper()
+        folder = self.selected
+        for uid in parse_uid_set(spec, folder.uids):
+            message = folder.messages[uid]
+            parts = [f"UID {uid}"]
+            literal = None
+            if "RFC822.HEADER" in items or "BODY.PEEK[HEADER]" in items:
+                literal = message.raw.split(b"\r\n\r\n", 1)[0] + b"\r\n\r\n"
+                key = "RFC822.HEADER"
+            elif re.search(r"RFC822(?![.])|BODY(\.PEEK)?\[\]", items):
+                literal = message.raw
+                key = "RFC822"
+                if "PEEK" not in items:
+                    message.flags.add("\\Seen")
+            if "FLAGS" in items:
+                parts.append(f"FLAGS ({' '.join(sorted(message.flags))})")
+            if "RFC822.SIZE" in items:
+                parts.append(f"RFC822.SIZE {len(message.raw)}")
+            line = f"* {folder.sequence(uid)} FETCH ({' '.join(parts)}"
+            if literal is None:
+                self.reply(line + ")")
+            else:
+                self.reply(f"{line} {key} {{{len(literal)}}}".encode() + b"\r\n" + literal + b")")
+        self.reply(f"{tag} OK FETCH completed")
+
+    def uid_store(self, tag, args):
+        spec, operation, flags = args.split(" ", 2)
+        flags = set(flags.strip("()").split())
+        folder = self.selected
+        for uid in parse_uid_set(spec, folder.uids):
+            message = folder.messages[uid]
+            if operation.startswith("+"):
+                message.flags |= flags
+            elif operation.startswith("-"):
+                message.flags -= flags
+            else:
+                message.flags = set(flags)
+            if ".SILENT" not in operation.upper():
+                self.reply(f"* {folder.sequence(uid)} FETCH (UID {uid} FLAGS ({' '.join(sorted(message.flags))}))")
+        self.reply(f"{tag} OK STORE completed")
+
+    def uid_copy(self, tag, args, move: bool = False):
+        spec, _, destination = args.partition(" ")
+        destination = destination.strip('"')
+        if destination not in self.server.mailbox.folders:
+            self.reply(f"{tag} NO [TRYCREATE] no such folder")
+            return
+        uids = parse_uid_set(spec, self.selected.uids)
+        new_uids = []
+        for uid in uids:
+            message = self.selected.messages[uid]
+            new_uids.append(self.server.mailbox.add(destination, message.raw, set(message.flags)))
+        copied = f"[COPYUID 1 {','.join(map(str, uids))} {','.join(map(str, new_uids))}] " if uids else ""
+        if move:
+            # RFC 6851: the COPYUID goes out untagged, before the expunges
+            if copied:
+                self.reply(f"* OK {copied}moved")
+            for uid in reversed(uids):
+                self.reply(f"* {self.selected.sequence(uid)} EXPUNGE")
+            with self.server.mailbox.lock:
+                self.selected.remove(uids)
+            self.reply(f"{tag} OK MOVE completed")
+        else:
+            self.reply(f"{tag} OK {copied}COPY completed")
+
+    def uid_move(self, tag, args):
+        self.uid_copy(tag, args, move=True)
+
+    def uid_expunge(self, tag, args):
+        self._expunge(parse_uid_set(args.strip(), self.selected.uids))
+        self.reply(f"{tag} OK EXPUNGE completed")
+
+    def _expunge(self, uids: Iterable[int]):
+        folder = self.selected
+        deleted = [uid for uid in uids if "\\Deleted" in folder.messages[uid].flags]
+        # Highest first so the sequence numbers reported stay valid
+        for uid in reversed(deleted):
+            self.reply(f"* {folder.sequence(uid)} EXPUNGE")
+        with self.server.mailbox.lock:
+            folder.remove(deleted)
+
+
+class _SMTPHandler(_Handler):
+    def handle(self):
+        self.reply("220 localhost fake ESMTP ready")
+        self.wfile.flush()
+        chunks: List[bytes] = []
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode(errors="replace").strip()
+            verb = command.split(" ", 1)[0].upper()
+            self.delay(verb)
+            if verb in ("EHLO", "HELO"):
+                extensions = ["PIPELINING", "8BITMIME", "AUTH PLAIN LOGIN"]
+                if self.server.tls_context is not None and not isinstance(self.request, ssl.SSLSocket):
+                    extensions.append("STARTTLS")
+                if self.server.chunking:
+                    extensions.append("CHUNKING")
+                self.reply("250-localhost", *(f"250-{ext}" for ext in extensions[:-1]), f"250 {extensions[-1]}")
+            elif verb == "STARTTLS":
+                self.reply("220 ready to start TLS")
+                self.start_tls()
+                continue
+            elif verb == "AUTH":
+                self.reply("235 authentication succeeded")
+            elif verb in ("MAIL", "RCPT", "RSET", "NOOP"):
+                chunks = [] if verb in ("MAIL", "RSET") else chunks
+                self.reply("250 OK")
+            elif verb == "DATA":
+                self.reply("354 end data with <CR><LF>.<CR><LF>")
+                self.wfile.flush()
+                while True:
+                    data = self.rfile.readline()
+                    if data in (b".\r\n", b""):
+                        break
+                    chunks.append(data)
+                self.server.received(b"".join(chunks))
+                self.reply("250 OK queued")
+            elif verb == "BDAT":
+                arguments = command.split()
+                chunks.append(self.rfile.read(int(arguments[1])))
+                if len(arguments) > 2 and arguments[2].upper() == "LAST":
+                    self.server.received(b"".join(chunks))
+                    chunks = []
+                self.reply("250 OK")
+            elif verb == "QUIT":
+                self.reply("221 bye")
+                self.wfile.flush()
+                return
+            else:
+                self.reply("502 command not implemented")
+            self.wfile.flush()
+
+
+class _FakeServer(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, handler, latency: Optional[Latency], tls_context: Optional[ssl.SSLContext]):
+        super().__init__(("127.0.0.1", 0), handler)
+        self.latency = latency or {}
+        self.tls_context = tls_context
+        # Commands received, by the same names as the latency keys
+        self.lock = threading.Lock()
+        self.commands: Counter = Counter()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def port(self) -> int:
+        return self.server_address[1]
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, name=type(self).__name__, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+
+class FakeIMAPServer(_FakeServer):
+    """IMAP server on a free localhost port; implicit TLS when tls=True"""
+
+    def __init__(self, mailbox: Optional[Mailbox] = None, latency: Optional[Latency] = None, tls: bool = False):
+        super().__init__(_IMAPHandler, latency, self_signed_context() if tls else None)
+        self.mailbox = mailbox or Mailbox()
+        self.implicit_tls = tls
+
+
+class FakeSMTPServer(_FakeServer):
+    """SMTP server on a free localhost port offering STARTTLS, PIPELINING and optionally CHUNKING.
+
+    Delivered messages are counted; they are kept in .messages only when keep=True.
+    """
+
+    def __init__(self, latency: Optional[Latency] = None, chunking: bool = True, keep: bool = False):
+        super().__init__(_SMTPHandler, latency, self_signed_context())
+        self.chunking = chunking
+        self.keep = keep
+        self.delivered = 0
+        self.messages: List[bytes] = []
+        self._lock = threading.Lock()
+
+    def received(self, message: bytes):
+        with self._lock:
+            self.delivered += 1
+            if self.keep:
+                self.messages.append(message)
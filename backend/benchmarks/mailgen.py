@@ -0,0 +1,89 @@
+"""Deterministic synthetic mailboxes for benchmarks.
+
+The same seed always produces the same messages, so runs are comparable.
+"""
+from datetime import datetime, timedelta
+from email.message import EmailMessage
+from email.utils import format_datetime
+from typing import Dict, Iterator, Optional, Tuple
+import random
+
+# Body size ranges in bytes for each size class
+SIZE_CLASSES: Dict[str, Tuple[int, int]] = {
+    "small": (500, 4000),
+    "medium": (20000, 60000),
+    "large": (150000, 400000),
+}
+DEFAULT_SIZE_MIX = {"small": 0.7, "medium": 0.25, "large": 0.05}
+
+WORDS = (
+    "meeting report invoice project update schedule review budget quarter team "
+    "release customer feedback agenda deadline proposal contract summary draft "
+    "the a of to and in for on with please thanks regards attached see below"
+).split()
+
+BASE_DATE = datetime(2024, 1, 1, 8, 0, 0)
+
+
+def parse_size_mix(spec: str) -> Dict[str, float]:
+    """Parse "small:70,medium:25,large:5" into normalized weights"""
+    weights = {}
+    for item in spec.split(","):
+        name, _, weight = item.partition(":")
+        name = name.strip()
+        if name not in SIZE_CLASSES:
+            raise ValueError(f"Unknown size class {name!r}, expected one of {', '.join(SIZE_CLASSES)}")
+        weights[name] = float(weight or 1)
+    total = sum(weights.values())
+    return {name: weight / total for name, weight in weights.items()}
+
+
+class MailboxGenerator:
+    """Builds RFC 5322 messages with a configurable size mix and attachment ratio"""
+
+    def __init__(self, seed: int = 0, size_mix: Optional[Dict[str, float]] = None,
+                 attachment_ratio: float = 0.1, domain: str = "example.com"):
+        self.seed = seed
+        self.size_mix = size_mix or DEFAULT_SIZE_MIX
+        self.attachment_ratio = attachment_ratio
+        self.domain = domain
+
+    def messages(self, count: int, folder: str = "INBOX") -> Iterator[bytes]:
+        for index in range(count):
+            yield self.message(index, folder)
+
+    def message(self, index: int, folder: str = "INBOX") -> bytes:
+        # Seeded per message so any message can be rebuilt on its own
+        rng = random.Random(f"{self.seed}:{folder}:{index}")
+        size_class = rng.choices(list(self.size_mix), weights=list(self.size_mix.values()))[0]
+        body_size = rng.randint(*SIZE_CLASSES[size_class])
+
+        sender = rng.randrange(200)
+        msg = EmailMessage()
+        msg["From"] = f"Sender {sender} <sender{sender}@{self.domain}>"
+        msg["To"] = f"Me <me@{self.domain}>"
+        msg["Subject"] = f"{' '.join(rng.choices(WORDS, k=rng.randint(3, 8))).capitalize()} #{index}"
+        msg["Date"] = format_datetime(BASE_DATE + timedelta(minutes=index))
+        msg["Message-ID"] = f"<gen-{self.seed}-{folder.lower()}-{index}@{self.domain}>"
+
+        text = self._text(rng, body_size)
+        msg.set_content(text)
+        if size_class != "small":
+            msg.add_alternative(f"<html><body><p>{text}</p></body></html>", subtype="html")
+        if rng.random() < self.attachment_ratio:
+            payload = rng.randbytes(rng.randint(10000, 300000))
+            msg.add_attachment(payload, maintype="application", subtype="pdf", filename=f"document-{index}.pdf")
+        # The email package picks random boundaries
+        for number, part in enumerate(part for part in msg.walk() if part.is_multipart()):
+            part.set_boundary(f"=_gen_{self.seed}_{index}_{number}")
+
+        return msg.as_bytes().replace(b"\r\n", b"\n").replace(b"\n", b"\r\n")
+
+    def _text(self, rng: random.Random, size: int) -> str:
+        lines = []
+        length = 0
+        while length < size:
+            line = " ".join(rng.choices(WORDS, k=12))
+            lines.append(line)
+            length += len(line) + 1
+        return "\n".join(lines)
@@ -0,0 +1,145 @@
+"""Messages for the MIME parsing benchmark, one per shape that costs or breaks parsers.
+
+Built in code so the corpus needs no binary fixtures; the same call always
+returns the same bytes.
+"""
+from email.message import EmailMessage
+from email.mime.application import MIMEApplication
+from email.mime.image import MIMEImage
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+from typing import Dict
+import random
+
+HEADERS = (
+    b"From: Alice Example <alice@example.com>\r\n"
+    b"To: Bob <bob@example.com>, carol@example.org\r\n"
+    b"Date: Tue, 05 Mar 2024 09:15:00 +0100\r\n"
+    b"Message-ID: <corpus-%s@example.com>\r\n"
+)
+
+
+def _crlf(data: bytes) -> bytes:
+    return data.replace(b"\r\n", b"\n").replace(b"\n", b"\r\n")
+
+
+def _paragraphs(rng: random.Random, size: int) -> str:
+    words = "the quarterly report is attached please review the numbers before our meeting on friday".split()
+    lines = []
+    length = 0
+    while length < size:
+        lines.append(" ".join(rng.choices(words, k=12)))
+        length += len(lines[-1]) + 1
+    return "\n".join(lines)
+
+
+def _finish(msg, name: str, subject: str) -> bytes:
+    msg["Subject"] = subject
+    msg["From"] = "Alice Example <alice@example.com>"
+    msg["To"] = "Bob <bob@example.com>, carol@example.org"
+    msg["Date"] = "Tue, 05 Mar 2024 09:15:00 +0100"
+    msg["Message-ID"] = f"<corpus-{name}@example.com>"
+    for number, part in enumerate(part for part in msg.walk() if part.is_multipart()):
+        part.set_boundary(f"==corpus-{name}-{number}==")
+    return _crlf(msg.as_bytes())
+
+
+def corpus(attachment_size: int = 10 * 1024 * 1024) -> Dict[str, bytes]:
+    rng = random.Random(0)
+    messages = {}
+
+    plain = EmailMessage()
+    plain.set_content(_paragraphs(rng, 2000))
+    messages["plain"] = _finish(plain, "plain", "Plain text")
+
+    alternative = EmailMessage()
+    text = _paragraphs(rng, 8000)
+    alternative.set_content(text)
+    alternative.add_alternative(f"<html><body><p>{text}</p></body></html>", subtype="html")
+    messages["alternative"] = _finish(alternative, "alternative", "Text and HTML")
+
+    # mixed(related(alternative(text, html), inline image), pdf, forwarded message)
+    related = MIMEMultipart("related")
+    inner = MIMEMultipart("alternative")
+    inner.attach(MIMEText(_paragraphs(rng, 4000), "plain", "utf-8"))
+    inner.attach(MIMEText('<p>See the chart <img src="cid:chart"></p>', "html", "utf-8"))
+    related.attach(inner)
+    image = MIMEImage(rng.randbytes(40000), "png")
+    image.add_header("Content-ID", "<chart>")
+    image.add_header("Content-Disposition", "inline", filename="chart.png")
+    related.attach(image)
+    nested = MIMEMultipart("mixed")
+    nested.attach(related)
+    pdf = MIMEApplication(rng.randbytes(200000), "pdf")
+    pdf.add_header("Content-Disposition", "attachment", filename="report.pdf")
+    nested.attach(pdf)
+    forwarded = MIMEText(_paragraphs(rng, 1000), "plain", "utf-8")
+    forwarded["Subject"] = "Original message"
+    wrapper = EmailMessage()
+    wrapper.set_content(forwarded)
+    wrapper.replace_header("Content-Disposition", "attachment; filename=forwarded.eml") \
+        if wrapper.get("Content-Disposition") else wrapper.add_header("Content-Disposition", "attachment", filename="forwarded.eml")
+    nested.attach(wrapper)
+    messages["nested"] = _finish(nested, "nested", "Nested multipart with inline image and attachments")
+
+    large = MIMEMultipart("mixed")
+    large.attach(MIMEText(_paragraphs(rng, 1500), "plain", "utf-8"))
+    archive = MIMEApplication(rng.randbytes(attachment_size), "zip")
+    archive.add_header("Content-Disposition", "attachment", filename="backup.zip")
+    large.attach(archive)
+    messages["large_attachment"] = _finish(large, "large", "Large attachment")
+
+    digest = MIMEMultipart("mixed")
+    for number in range(60):
+        digest.attach(MIMEText(f"Item {number}\n" + _paragraphs(rng, 600), "plain", "utf-8"))
+    messages["many_text_parts"] = _finish(digest, "digest", "Digest with many text parts")
+
+    newsletter = MIMEText("<html><body>" + "".join(
+        f"<div class='item'><h2>Story {n}</h2><p>{_paragraphs(rng, 400)}</p></div>" for n in range(300)
+    ) + "</body></html>", "html", "utf-8")
+    messages["html_newsletter"] = _finish(newsletter, "newsletter", "Weekly newsletter")
+
+    # Legacy charsets, in encoded words and in bodies
+    charsets = MIMEMultipart("alternative")
+    charsets.attach(MIMEText("Привет, это проверка кодировки.\n" * 50, "plain", "koi8-r"))
+    charsets.attach(MIMEText("<p>こんにちは、文字コードのテストです。</p>" * 50, "html", "iso-2022-jp"))
+    charsets["Subject"] = "=?iso-2022-jp?b?GyRCJUYlOSVIGyhC?= =?koi8-r?q?=F0=D2=C9=D7=C5=D4?= mixed"
+    messages["odd_charsets"] = _finish(charsets, "charsets", charsets["Subject"])
+    del charsets["Subject"]
+
+    messages["latin1_8bit"] = (
+        HEADERS % b"latin1" + b"Subject: Caf\xe9 cr\xe8me\r\n"
+        b"MIME-Version: 1.0\r\nContent-Type: text/plain; charset=windows-1252\r\n"
+        b"Content-Transfer-Encoding: 8bit\r\n\r\n" + b"Na\xefve fa\xe7ade \x80 price list\r\n" * 200
+    )
+
+    messages["unknown_charset"] = (
+        HEADERS % b"unknown" + b"Subject: Unknown charset body\r\n"
+        b"MIME-Version: 1.0\r\nContent-Type: multipart/alternative; boundary=b1\r\n\r\n"
+        b"--b1\r\nContent-Type: text/plain; charset=us-ascii\r\n\r\nReadable part\r\n"
+        b"--b1\r\nContent-Type: text/plain; charset=x-no-such-charset\r\n\r\nUnreadable part\r\n"
+        b"--b1--\r\n"
+    )
+
+    messages["long_folded_subject"] = (
+        HEADERS % b"folded" + b"Subject: =?utf-8?q?A_rather_long_subject_that_the_sender?=\r\n"
+        b" =?utf-8?q?_folded_over_two_lines_=E2=9C=93?=\r\n"
+        b"MIME-Version: 1.0\r\nContent-Type: text/plain; charset=utf-8\r\n\r\nShort body\r\n"
+    )
+
+    messages["malformed"] = (
+        b"From: broken sender <no-at-sign>\r\nTo: undisclosed-recipients:;\r\n"
+        b"Date: not a date\r\nSubject: Malformed =?utf-8?b?bm90IGJhc2U2NA?=\r\n"
+        b"This header line has no colon\r\n"
+        b"MIME-Version: 1.0\r\nContent-Type: multipart/mixed; boundary=\"missing-end\"\r\n\r\n"
+        b"--missing-end\r\nContent-Type: text/plain; charset=utf-8\r\nContent-Transfer-Encoding: base64\r\n\r\n"
+        b"SGVsbG8gd29ybGQ@@@not-base64\r\n"
+        b"--missing-end\r\nContent-Type: application/octet-stream; name=\"data.bin\"\r\n"
+        b"Content-Transfer-Encoding: base64\r\n\r\nAAEC\r\n"
+    )
+
+    messages["no_content_type"] = (
+        b"From: bare@example.com\r\nSubject: No MIME headers at all\r\n\r\n" + b"Just some text.\r\n" * 100
+    )
+
+    return messages
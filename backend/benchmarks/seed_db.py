@@ -0,0 +1,220 @@
+"""Fill a database with a synthetic user population for load tests.
+
+Run from backend/:  python -m benchmarks.seed_db [--emails 1000000] [--users 500] [--database-url URL] [--reset]
+
+The database defaults to DATABASE_URL, so point it at a scratch SQLite file or
+a local Postgres (postgresql://...) and start the server with the same URL.
+Users are named load0, load1, ... and share the password "loadtest".
+"""
+from datetime import datetime, timedelta
+from typing import Dict, List
+import argparse
+import asyncio
+import math
+import random
+import time
+
+from sqlalchemy import insert, select, text
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from app.core.config import settings
+from app.core.database import Base, async_database_url
+from app.core.security import get_password_hash
+from app.models import account, email, email_archive, flag_change, folder_state, lease, outbox, user  # noqa: F401 (register tables)
+from app.models.account import EmailAccount
+from app.models.email import Email
+from app.models.user import User
+
+PASSWORD = "loadtest"
+
+# How mail is spread in a typical mailbox
+ACCOUNTS_PER_USER = {1: 0.6, 2: 0.3, 3: 0.07, 4: 0.03}
+FOLDER_SHARE = {"INBOX": 0.55, "Archive": 0.2, "Sent": 0.12, "Trash": 0.05, "Spam": 0.05, "Drafts": 0.03}
+HTML_SHARE = 0.6
+ATTACHMENT_SHARE = 0.15
+STARRED_SHARE = 0.03
+# Mail older than this is almost always read
+RECENT_DAYS = 14
+HISTORY_DAYS = 3 * 365
+
+WORDS = (
+    "meeting report invoice project update schedule review budget quarter team release customer "
+    "feedback agenda deadline proposal contract summary draft travel order shipping payment account "
+    "security password newsletter offer webinar launch roadmap hiring interview lunch weekend family "
+    "the a of to and in for on with please thanks regards attached see below let me know"
+).split()
+ATTACHMENT_TYPES = [("application/pdf", "pdf"), ("image/jpeg", "jpg"), ("image/png", "png"),
+                    ("application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", "xlsx")]
+
+BATCH_SIZE = 5000
+
+
+def text_pool(rng: random.Random, size: int = 1 << 20) -> str:
+    """One long text that bodies are sliced from, so generating them costs next to nothing"""
+    words = []
+    length = 0
+    while length < size:
+        word = rng.choice(WORDS)
+        words.append(word + ("\n" if rng.random() < 0.08 else " "))
+        length += len(words[-1])
+    return "".join(words)
+
+
+def account_weights(rng: random.Random, accounts: int) -> List[float]:
+    """Heavy-tailed mailbox sizes: a few accounts hold much of the mail"""
+    weights = [rng.paretovariate(1.2) for _ in range(accounts)]
+    total = sum(weights)
+    return [weight / total for weight in weights]
+
+
+class EmailRows:
+    """Builds rows for the emails table with realistic field distributions"""
+
+    def __init__(self, rng: random.Random, now: datetime):
+        self.rng = rng
+        self.now = now
+        self.pool = text_pool(rng)
+        self.folders = list(FOLDER_SHARE)
+        self.folder_weights = list(FOLDER_SHARE.values())
+        self.next_uid: Dict[tuple, int] = {}
+
+    def row(self, account_id: int, index: int) -> dict:
+        rng = self.rng
+        folder = rng.choices(self.folders, self.folder_weights)[0]
+        uid = self.next_uid.get((account_id, folder), 1)
+        self.next_uid[(account_id, folder)] = uid + 1
+
+        # Skewed towards recent mail
+        age = timedelta(days=HISTORY_DAYS * rng.random() ** 2, seconds=rng.randrange(86400))
+        received = self.now - age
+        if folder in ("Sent", "Drafts"):
+            is_read = True
+        else:
+            is_read = rng.random() < (0.6 if age.days < RECENT_DAYS else 0.97)
+
+        body_size = min(max(int(rng.lognormvariate(math.log(1500), 0.9)), 100), 200000)
+        start = rng.randrange(len(self.pool) - min(body_size, len(self.pool) - 1))
+        body_text = self.pool[start:start + body_size]
+        body_html = f"<html><body><p>{body_text}</p></body></html>" if rng.random() < HTML_SHARE else None
+
+        attachments = []
+        if rng.random() < ATTACHMENT_SHARE:
+            for number in range(1 + int(rng.random() < 0.3)):
+                content_type, extension = rng.choice(ATTACHMENT_TYPES)
+                attachments.append({
+                    "filename": f"{rng.choice(WORDS)}-{number}.{extension}",
+                    "content_type": content_type,
+                    "size": int(rng.lognormvariate(math.log(150000), 1.2))
+                })
+
+        # Correspondents follow a Zipf-like distribution
+        correspondent = int(rng.paretovariate(1.1)) % 2000
+        sender = f"contact{correspondent}@example{correspondent % 50}.com"
+        if folder in ("Sent", "Drafts"):
+            sender = f"account{account_id}@example.com"
+        subject_words = " ".join(rng.choices(WORDS, k=rng.randint(2, 8)))
+
+        return {
+            "account_id": account_id,
+            "message_id": f"<load-{account_id}-{index}@example.com>",
+            "uid": str(uid),
+            "subject": subject_words.capitalize(),
+            "sender_email": sender,
+            "sender_name": f"Contact {correspondent}",
+            "to_addresses": [{"email": f"account{account_id}@example.com", "name": ""}],
+            "body_text": body_text,
+            "body_html": body_html,
+            "attachments": attachments,
+            "date_sent": received - timedelta(seconds=rng.randrange(1, 120)),
+            "date_received": received,
+            "size": len(body_text) + len(body_html or "") + sum(a["size"] for a in attachments),
+            "is_read": is_read,
+            "is_starred": rng.random() < STARRED_SHARE,
+            "is_deleted": folder == "Trash",
+            "is_draft": folder == "Drafts",
+            "is_sent": folder == "Sent",
+            "folder": folder,
+            "created_at": received,
+        }
+
+
+async def seed(url: str, users: int, emails: int, seed_value: int, reset: bool):
+    rng = random.Random(seed_value)
+    engine = create_async_engine(async_database_url(url))
+    try:
+        async with engine.begin() as conn:
+            if reset:
+                await conn.run_sync(Base.metadata.drop_all)
+            await conn.run_sync(Base.metadata.create_all)
+            if await conn.scalar(select(User.id).where(User.username == "load0")):
+                raise SystemExit("The database already holds load test users; use --reset to replace everything")
+
+        # Hashing is slow on purpose, every user gets the same hash
+        hashed = get_password_hash(PASSWORD)
+        user_rows = [
+            {"username": f"load{n}", "email": f"load{n}@example.com", "hashed_password": hashed, "full_name": f"Load {n}"}
+            for n in range(users)
+        ]
+        async with engine.begin() as conn:
+            user_ids = list((await conn.execute(insert(User).returning(User.id), user_rows)).scalars())
+
+            account_rows = []
+            for user_id in user_ids:
+                count = rng.choices(list(ACCOUNTS_PER_USER), list(ACCOUNTS_PER_USER.values()))[0]
+                for number in range(count):
+                    account_rows.append({
+                        "user_id": user_id,
+                        "name": f"Account {number + 1}",
+                        "email_address": f"user{user_id}.{number}@example.com",
+                        # Nothing listens here, so the rare request that reaches for IMAP fails fast
+                        "imap_host": "127.0.0.1",
+                        "imap_port": 9,
+                        "imap_ssl": False,
+                        "imap_username": "load",
+                        "imap_password": PASSWORD,
+                        "smtp_host": "127.0.0.1",
+                        "smtp_port": 9,
+                        "smtp_ssl": False,
+                        "smtp_username": "load",
+                        "smtp_password": PASSWORD,
+                        "is_default": number == 0,
+                        # Keeps the IDLE watchers from dialing them
+                        "is_active": False,
+                    })
+            account_ids = list((await conn.execute(insert(EmailAccount).returning(EmailAccount.id), account_rows)).scalars())
+
+        print(f"{len(user_ids)} users, {len(account_ids)} accounts")
+
+        owners = rng.choices(account_ids, account_weights(rng, len(account_ids)), k=emails)
+        rows = EmailRows(rng, datetime.utcnow())
+        started = time.perf_counter()
+        for offset in range(0, emails, BATCH_SIZE):
+            batch = [rows.row(account_id, offset + i) for i, account_id in enumerate(owners[offset:offset + BATCH_SIZE])]
+            async with engine.begin() as conn:
+                await conn.execute(insert(Email), batch)
+            done = offset + len(batch)
+            if done % (BATCH_SIZE * 20) == 0 or done == emails:
+                elapsed = time.perf_counter() - started
+                print(f"  {done:>10} emails  {done / elapsed:8.0f} rows/s")
+
+        # Fresh statistics so the planner sees the real table sizes
+        async with engine.begin() as conn:
+            await conn.execute(text("ANALYZE"))
+    finally:
+        await engine.dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database-url", default=settings.DATABASE_URL)
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--emails", type=int, default=1000000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--reset", action="store_true", help="drop and recreate every table first")
+    args = parser.parse_args()
+
+    asyncio.run(seed(args.database_url, args.users, args.emails, args.seed, args.reset))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""Report deleted rows in the emails table and what they cost list queries, optionally purging them first.
+
+Run from backend/:  python -m benchmarks.tombstones [--mark-deleted 0.3] [--purge] [--accounts 50]
+
+Uses DATABASE_URL, like the server. --mark-deleted marks that share of the
+emails deleted and confirmed by the server (for experiments on a database
+filled by seed_db), --purge removes every confirmed tombstone with nothing
+queued for the server, as the purge worker does in the background. The report gives live and deleted rows, the
+space the emails table and its indexes take, and the median time of the
+inbox page query of GET /emails over --accounts accounts.
+"""
+from datetime import datetime
+import argparse
+import random
+import statistics
+import time
+
+from sqlalchemy import func, select, update
+
+from app.core.database import SessionLocal
+from app.models import account, email, email_archive, flag_change, folder_state, lease, outbox, user  # noqa: F401 (register tables)
+from app.models.email import Email
+from app.services.tombstones import TombstoneCompaction
+from benchmarks.body_storage import megabytes, table_bytes
+
+
+def mark_deleted(db, share: float) -> int:
+    """Mark a random share of the live emails deleted and expunged on the server, as of now"""
+    ids = [email_id for email_id, in db.execute(select(Email.id).where(Email.is_deleted.isnot(True)))]
+    chosen = random.Random(0).sample(ids, int(len(ids) * share))
+    now = datetime.utcnow()
+    for start in range(0, len(chosen), 5000):
+        db.execute(
+            update(Email).where(Email.id.in_(chosen[start:start + 5000])).values(is_deleted=True, deleted_at=now, expunged_at=now),
+            execution_options={"synchronize_session": False}
+        )
+    db.commit()
+    return len(chosen)
+
+
+def time_inbox_pages(db, accounts: int) -> float:
+    """Median seconds for the first inbox page of each of the busiest accounts"""
+    busiest = [account_id for account_id, in db.execute(
+        select(Email.account_id).group_by(Email.account_id).order_by(func.count().desc()).limit(accounts)
+    )]
+    timings = []
+    for account_id in busiest:
+        started = time.perf_counter()
+        db.execute(
+            select(Email.id, Email.subject, Email.sender_email, Email.date_received)
+            .where(Email.account_id == account_id, Email.is_deleted.isnot(True), Email.folder == "INBOX")
+            .order_by(Email.date_received.desc())
+            .limit(50)
+        ).all()
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings) if timings else 0.0
+
+
+def report(db, accounts: int):
+    live, deleted = db.execute(select(
+        func.count().filter(Email.is_deleted.isnot(True)),
+        func.count().filter(Email.is_deleted.is_(True))
+    )).one()
+    print(f"  {live} live emails, {deleted} deleted, emails table {megabytes(table_bytes(db, 'emails'))}, "
+          f"inbox page median {time_inbox_pages(db, accounts) * 1000:.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mark-deleted", type=float, help="mark this share of the emails deleted first")
+    parser.add_argument("--purge", action="store_true", help="purge deleted emails before reporting")
+    parser.add_argument("--accounts", type=int, default=50, help="accounts whose inbox page is timed")
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        if args.mark_deleted:
+            print(f"Marked {mark_deleted(db, args.mark_deleted)} emails deleted")
+        print("Before" if args.purge else "Now")
+        report(db, args.accounts)
+    finally:
+        db.close()
+
+    if args.purge:
+        started = time.perf_counter()
+        purged = TombstoneCompaction().run_once(retention=0)
+        print(f"Purged {purged} emails in {time.perf_counter() - started:.1f}s")
+        db = SessionLocal()
+        try:
+            print("After")
+            report(db, args.accounts)
+        finally:
+            db.close()
+
+
+if __name__ == "__main__":
+    main()
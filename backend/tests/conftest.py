@@ -0,0 +1,107 @@
+"""Test settings: a throwaway database and directories, set before anything imports the app"""
+import os
+import tempfile
+
+_root = tempfile.mkdtemp(prefix="mailbox-tests-")
+for _name in ("uploads", "messages", "profiles"):
+    os.makedirs(os.path.join(_root, _name))
+
+os.environ.update({
+    "DATABASE_URL": f"sqlite:///{_root}/email.db",
+    "UPLOAD_DIR": os.path.join(_root, "uploads"),
+    "MESSAGE_STORE_DIR": os.path.join(_root, "messages"),
+    "PROFILING_DIR": os.path.join(_root, "profiles"),
+    "REDIS_URL": "",
+    "WEB_CONCURRENCY": "1",
+    # Workers that reach out to mail servers on their own stay off; tests drive them directly
+    "IMAP_IDLE_ENABLED": "false",
+    "BODY_COMPRESSION_MIGRATE": "false",
+    "ARCHIVE_ENABLED": "false",
+    "TOMBSTONE_PURGE_ENABLED": "false",
+})
+os.environ.pop("PROMETHEUS_MULTIPROC_DIR", None)
+
+import pytest  # noqa: E402
+
+
+@pytest.fixture
+def database():
+    """Empty tables and caches for each test"""
+    import app.main  # noqa: F401  Registers every model
+    from app.core.cache import MemoryCache, cache
+    from app.core.database import Base, create_tables, engine
+
+    Base.metadata.drop_all(bind=engine)
+    create_tables()
+    cache.backend = MemoryCache()
+    yield
+    cache.backend = MemoryCache()
+
+
+@pytest.fixture
+def db(database):
+    """A session on the empty database"""
+    from app.core.database import SessionLocal
+
+    session = SessionLocal()
+    yield session
+    session.close()
+
+
+@pytest.fixture
+def client(database):
+    """The app with its background workers running"""
+    from fastapi.testclient import TestClient
+
+    from app.main import app
+
+    with TestClient(app) as test_client:
+        yield test_client
+
+
+@pytest.fixture
+def auth(client):
+    """Headers of a registered user"""
+    client.post("/api/v1/auth/register", json={"username": "tester", "email": "tester@example.com", "password": "secret"})
+    token = client.post("/api/v1/auth/login", json={"username": "tester", "password": "secret"}).json()["access_token"]
+    return {"Authorization": f"Bearer {token}"}
+
+
+@pytest.fixture
+def make_account(client, auth):
+    """Create a mail account of the test user pointing at local (fake) servers, returning its id"""
+    def make(smtp_port: int = 1, imap_port: int = 1, **fields) -> int:
+        account = {
+            "name": "Test", "email_address": "tester@example.com",
+            "imap_host": "127.0.0.1", "imap_port": imap_port, "imap_ssl": False, "imap_username": "tester",
+            "imap_password": "secret", "smtp_host": "127.0.0.1", "smtp_port": smtp_port, "smtp_ssl": False,
+            "smtp_username": "tester", "smtp_password": "secret", **fields,
+        }
+        response = client.post("/api/v1/accounts/", json=account, headers=auth)
+        assert response.status_code == 200, response.text
+        return response.json()["id"]
+    return make
+
+
+@pytest.fixture
+def add_account(db):
+    """Create a user's mail account pointing at local (fake) servers straight in the database, returning it"""
+    from app.models.account import EmailAccount
+    from app.models.user import User
+    from app.utils.password import password_crypto
+
+    def add(smtp_port: int = 1, imap_port: int = 1, **fields):
+        number = db.query(User).count()
+        user = User(username=f"user{number}", email=f"user{number}@example.com", hashed_password="-")
+        db.add(user)
+        db.flush()
+        account = EmailAccount(
+            user_id=user.id, name="Test", email_address="tester@example.com",
+            imap_host="127.0.0.1", imap_port=imap_port, imap_ssl=False, imap_username="tester",
+            imap_password=password_crypto.encrypt_password("secret"), smtp_host="127.0.0.1", smtp_port=smtp_port,
+            smtp_ssl=False, smtp_username="tester", smtp_password=password_crypto.encrypt_password("secret"), **fields
+        )
+        db.add(account)
+        db.commit()
+        return account
+    return add
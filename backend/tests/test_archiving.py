@@ -0,0 +1,118 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+
+from app.api.v1.emails import _store_content
+from app.core.config import Settings, settings
+from app.core.locks import lease_backend
+from app.models.email import Email
+from app.models.email_archive import ArchivedEmailBody
+from app.services.tiering import BodyTiering, preview
+
+OLD = datetime.utcnow() - timedelta(days=400)
+BODY = "Minutes of the planning meeting. " * 20 + "Budget for Zanzibar approved."
+ATTACHMENTS = [{"filename": "minutes.pdf", "size": 1024}]
+
+
+@pytest.fixture(autouse=True)
+def no_pause(monkeypatch):
+    monkeypatch.setattr(settings, "ARCHIVE_BATCH_PAUSE", 0)
+
+
+def add_email(db, account_id: int, body_text=BODY, date_received=OLD, **fields) -> int:
+    email = Email(account_id=account_id, message_id=f"<{db.query(Email).count()}@example.com>",
+                  sender_email="a@example.com", subject="Planning", body_text=body_text,
+                  date_received=date_received, **fields)
+    db.add(email)
+    db.commit()
+    return email.id
+
+
+def test_only_old_mail_with_a_body_is_archived(db, add_account, monkeypatch):
+    monkeypatch.setattr(settings, "ARCHIVE_BATCH_SIZE", 2)
+    account_id = add_account().id
+    old_ids = [add_email(db, account_id, attachments=ATTACHMENTS) for _ in range(3)]
+    recent_id = add_email(db, account_id, date_received=datetime.utcnow())
+    unfetched_id = add_email(db, account_id, body_text=None)
+
+    assert BodyTiering().run_once(older_than_days=365) == 3
+
+    db.expire_all()
+    for email_id in old_ids:
+        email = db.get(Email, email_id)
+        assert email.archived_at is not None
+        assert email.updated_at is not None
+        assert email.body_text == BODY[:settings.ARCHIVE_PREVIEW_LENGTH].strip()
+        assert email.body_html is None and email.attachments is None
+        archived = db.get(ArchivedEmailBody, email_id)
+        assert archived.account_id == account_id
+        assert archived.body_text == BODY and archived.attachments == ATTACHMENTS
+    assert db.get(Email, recent_id).archived_at is None
+    assert db.get(Email, unfetched_id).archived_at is None
+    # Nothing left to do
+    assert BodyTiering().run_once(older_than_days=365) == 0
+
+
+def test_preview_is_plain_text():
+    assert preview(None, "<p>Hello\n  <b>there</b></p>") == "Hello there"
+    assert preview("  Text\tfirst ", "<p>ignored</p>") == "Text first"
+    assert preview(None, None) is None
+
+
+def test_archived_bodies_are_served_in_full(client, auth, make_account, db):
+    email_id = add_email(db, make_account(), body_html="<p>Minutes</p>", attachments=ATTACHMENTS)
+    BodyTiering().run_once(older_than_days=365)
+
+    response = client.get(f"/api/v1/emails/{email_id}", headers=auth)
+
+    assert response.status_code == 200
+    assert response.json()["body_text"] == BODY
+    assert response.json()["body_html"] == "<p>Minutes</p>"
+    assert response.json()["attachments"] == ATTACHMENTS
+    # Serving never writes the bodies back to the row
+    db.expire_all()
+    assert db.get(Email, email_id).body_html is None
+
+
+def test_search_finds_text_only_in_the_archived_body(client, auth, make_account, db):
+    email_id = add_email(db, make_account())
+    BodyTiering().run_once(older_than_days=365)
+    db.expire_all()
+    assert "Zanzibar" not in db.get(Email, email_id).body_text
+
+    response = client.post("/api/v1/emails/search", json={"query": "Zanzibar"}, headers=auth)
+
+    assert [email["id"] for email in response.json()] == [email_id]
+
+
+def test_storing_the_bodies_again_drops_the_archived_copy(db, add_account):
+    account_id = add_account().id
+    email_id = add_email(db, account_id)
+    BodyTiering().run_once(older_than_days=365)
+
+    _store_content(db, email_id, account_id, {"body_text": "Fetched again", "body_html": None, "attachments": []})
+    db.commit()
+
+    db.expire_all()
+    assert db.get(Email, email_id).archived_at is None
+    assert db.get(Email, email_id).body_text == "Fetched again"
+    assert db.get(ArchivedEmailBody, email_id) is None
+
+
+def test_another_worker_holding_the_lease_archives_nothing(db, add_account):
+    add_email(db, add_account().id)
+    assert lease_backend.acquire("body-tiering", "other-worker", 60)
+    try:
+        assert BodyTiering().run_once(older_than_days=365) == 0
+    finally:
+        lease_backend.release("body-tiering", "other-worker")
+
+
+def test_archiving_is_opt_in(monkeypatch):
+    assert Settings.model_fields["ARCHIVE_ENABLED"].default is False
+
+    monkeypatch.setattr(settings, "ARCHIVE_ENABLED", False)
+    tiering = BodyTiering()
+    asyncio.run(tiering.start())
+    assert tiering._task is None
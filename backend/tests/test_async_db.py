@@ -0,0 +1,47 @@
+import threading
+import time
+
+import pytest
+from sqlalchemy import select
+
+from app.core.database import AsyncSessionLocal, async_database_url
+from app.models.account import EmailAccount
+from benchmarks.fake_servers import FakeIMAPServer
+
+
+def test_async_database_url():
+    assert async_database_url("sqlite:///./data/email.db") == "sqlite+aiosqlite:///./data/email.db"
+    assert async_database_url("postgresql://u:p@db/mail") == "postgresql+asyncpg://u:p@db/mail"
+    assert async_database_url("postgresql+psycopg2://u:p@db/mail") == "postgresql+asyncpg://u:p@db/mail"
+    assert async_database_url("postgres://u:p@db/mail") == "postgresql+asyncpg://u:p@db/mail"
+    assert async_database_url("mysql://u:p@db/mail") == "mysql://u:p@db/mail"
+
+
+@pytest.mark.asyncio
+async def test_async_sessions_see_rows_written_by_background_threads(db, add_account):
+    account_id = add_account().id
+
+    async with AsyncSessionLocal() as session:
+        account = await session.scalar(select(EmailAccount).where(EmailAccount.id == account_id))
+        await session.commit()
+        # Still readable after commit, without lazy loading
+        assert account.imap_host == "127.0.0.1"
+
+
+def test_slow_imap_call_does_not_hold_up_other_requests(client, auth, make_account):
+    with FakeIMAPServer(latency={"LIST": 1.0}) as server:
+        account_id = make_account(imap_port=server.port)
+        slow = threading.Thread(target=client.get, args=(f"/api/v1/accounts/{account_id}/folders",), kwargs={"headers": auth})
+        slow.start()
+        deadline = time.monotonic() + 5
+        while not server.commands["LIST"] and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+        started = time.monotonic()
+        response = client.get("/api/v1/accounts/", headers=auth)
+        elapsed = time.monotonic() - started
+        slow.join(5)
+
+    assert response.status_code == 200
+    assert [account["id"] for account in response.json()] == [account_id]
+    assert elapsed < 0.5
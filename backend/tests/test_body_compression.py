@@ -0,0 +1,96 @@
+import asyncio
+
+from sqlalchemy import text
+
+from app.core.config import Settings, settings
+from app.models.email import Email
+from app.services.body_compression import BodyCompressionMigration, body_storage_report
+
+LONG_BODY = "Quarterly numbers attached. " * 200
+SHORT_BODY = "See you at noon."
+
+
+def add_email(db, account_id: int, body_text: str, **fields) -> int:
+    email = Email(account_id=account_id, message_id=f"<{db.query(Email).count()}@example.com>",
+                  sender_email="a@example.com", subject="Report", body_text=body_text, **fields)
+    db.add(email)
+    db.commit()
+    return email.id
+
+
+def stored_type(db, email_id: int) -> str:
+    return db.execute(text("SELECT typeof(body_text) FROM emails WHERE id = :id"), {"id": email_id}).scalar()
+
+
+def test_long_bodies_are_stored_compressed(db, add_account):
+    account_id = add_account().id
+    long_id, short_id = add_email(db, account_id, LONG_BODY), add_email(db, account_id, SHORT_BODY)
+
+    assert stored_type(db, long_id) == "blob"
+    assert stored_type(db, short_id) == "text"
+    db.expire_all()
+    assert db.get(Email, long_id).body_text == LONG_BODY
+    assert db.get(Email, short_id).body_text == SHORT_BODY
+
+
+def test_compression_can_be_turned_off(db, add_account, monkeypatch):
+    monkeypatch.setattr(settings, "BODY_COMPRESSION_ENABLED", False)
+
+    assert stored_type(db, add_email(db, add_account().id, LONG_BODY)) == "text"
+
+
+def test_search_looks_inside_compressed_bodies(client, auth, make_account, db):
+    account_id = make_account()
+    email_id = add_email(db, account_id, LONG_BODY.replace("numbers", "numbers for Zanzibar", 1))
+    assert stored_type(db, email_id) == "blob"
+
+    response = client.post("/api/v1/emails/search", json={"query": "Zanzibar"}, headers=auth)
+
+    assert [email["id"] for email in response.json()] == [email_id]
+
+
+def test_migration_compresses_older_rows_without_touching_them(db, add_account, monkeypatch):
+    monkeypatch.setattr(settings, "BODY_COMPRESSION_BATCH_SIZE", 2)
+    monkeypatch.setattr(settings, "BODY_COMPRESSION_BATCH_PAUSE", 0)
+    account_id = add_account().id
+    # Stored before compression existed: plain text, whatever the length
+    db.execute(text(
+        "INSERT INTO emails (account_id, message_id, sender_email, body_text) VALUES (:account_id, :message_id, 'a@example.com', :body)"
+    ), [
+        {"account_id": account_id, "message_id": f"<{i}@example.com>", "body": LONG_BODY if i < 3 else SHORT_BODY}
+        for i in range(4)
+    ])
+    db.commit()
+    before = {row.id: row.updated_at for row in db.query(Email.id, Email.updated_at)}
+
+    done = BodyCompressionMigration().run()
+
+    assert done["rows"] == 3
+    assert done["stored_bytes"] < done["original_bytes"]
+    assert [stored_type(db, email_id) for email_id in sorted(before)] == ["blob", "blob", "blob", "text"]
+    db.expire_all()
+    assert {row.id: row.updated_at for row in db.query(Email.id, Email.updated_at)} == before
+    assert [email.body_text for email in db.query(Email).order_by(Email.id)] == [LONG_BODY] * 3 + [SHORT_BODY]
+    # Nothing left to do
+    assert BodyCompressionMigration().run()["rows"] == 0
+
+
+def test_storage_report(db, add_account):
+    account_id = add_account().id
+    add_email(db, account_id, LONG_BODY)
+    add_email(db, account_id, SHORT_BODY)
+
+    report = body_storage_report(db)["body_text"]
+
+    assert report["values"] == 2 and report["compressed"] == 1
+    assert report["original_bytes"] == len(LONG_BODY) + len(SHORT_BODY)
+    assert report["saved_bytes"] == report["original_bytes"] - report["stored_bytes"] > 0
+
+
+def test_migration_is_opt_in(monkeypatch):
+    assert Settings.model_fields["BODY_COMPRESSION_MIGRATE"].default is False
+
+    monkeypatch.setattr(settings, "BODY_COMPRESSION_MIGRATE", False)
+    migration = BodyCompressionMigration()
+    asyncio.run(migration.start())
+    assert migration._task is None
@@ -0,0 +1,133 @@
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import threading
+import time
+
+import pytest
+
+from app.core.cache import Cache, CacheBackend, MemoryCache
+from benchmarks.fake_servers import FakeIMAPServer
+
+
+class BrokenBackend(CacheBackend):
+    """Every call fails, like Redis being down"""
+
+    def get(self, *args):
+        raise ConnectionError("down")
+
+    set = delete = add = delete_if_equal = get
+
+
+def slow_loader(calls: list, value, delay: float = 0.2):
+    def load():
+        calls.append(value)
+        time.sleep(delay)
+        return value
+    return load
+
+
+def test_values_are_cached_and_counted():
+    cache = Cache(MemoryCache())
+    calls = []
+
+    assert cache.get_or_set("things", (1,), slow_loader(calls, {"a": 1}, 0)) == {"a": 1}
+    assert cache.get_or_set("things", (1,), slow_loader(calls, {"a": 2}, 0)) == {"a": 1}
+    cache.delete("things", 1)
+    assert cache.get_or_set("things", (1,), slow_loader(calls, {"a": 3}, 0)) == {"a": 3}
+
+    assert calls == [{"a": 1}, {"a": 3}]
+    assert cache.stats()["things"] == {"hits": 1, "misses": 2, "coalesced": 0, "errors": 0}
+
+
+def test_concurrent_misses_run_the_loader_once():
+    cache = Cache(MemoryCache())
+    calls = []
+    load = slow_loader(calls, [1, 2, 3])
+
+    with ThreadPoolExecutor(8) as pool:
+        results = list(pool.map(lambda _: cache.get_or_set("things", (1,), load), range(8)))
+
+    assert results == [[1, 2, 3]] * 8
+    assert len(calls) == 1
+
+
+def test_waits_for_another_workers_fill():
+    backend = MemoryCache()
+    cache = Cache(backend)
+    key = cache.key("things", 1)
+    # Another worker holds the fill lock and is about to write the value
+    assert backend.add(f"{key}:fill", b"theirs", 10)
+    threading.Timer(0.1, backend.set, (key, b'"theirs"', 60)).start()
+    calls = []
+
+    assert cache.get_or_set("things", (1,), slow_loader(calls, "mine", 0)) == "theirs"
+    assert calls == []
+    assert cache.stats()["things"]["coalesced"] == 1
+
+
+def test_gives_up_waiting_for_a_fill_that_never_comes(monkeypatch):
+    from app.core.config import settings
+
+    monkeypatch.setattr(settings, "CACHE_FILL_WAIT", 0.1)
+    backend = MemoryCache()
+    cache = Cache(backend)
+    assert backend.add(f"{cache.key('things', 1)}:fill", b"gone", 10)
+
+    assert cache.get_or_set("things", (1,), lambda: "mine") == "mine"
+
+
+def test_backend_errors_are_misses():
+    cache = Cache(BrokenBackend())
+
+    assert cache.get_or_set("things", (1,), lambda: "value") == "value"
+    cache.delete("things", 1)
+    assert cache.stats()["things"]["errors"] >= 3
+
+
+@pytest.mark.asyncio
+async def test_async_misses_run_the_loader_once():
+    cache = Cache(MemoryCache())
+    calls = []
+
+    async def load():
+        calls.append(1)
+        await asyncio.sleep(0.1)
+        return b"page"
+
+    results = await asyncio.gather(*(cache.get_or_set_bytes_async("pages", ("a",), load) for _ in range(5)))
+
+    assert results == [b"page"] * 5
+    assert calls == [1]
+
+
+def test_memory_cache_expires_and_evicts():
+    backend = MemoryCache(max_entries=2)
+    backend.set("a", b"1", 60)
+    backend.set("b", b"2", 60)
+    backend.get("a")
+    backend.set("c", b"3", 60)
+    # b was the least recently used
+    assert [backend.get(key) for key in "abc"] == [b"1", None, b"3"]
+
+    backend.set("short", b"x", 0)
+    assert backend.get("short") is None
+    assert backend.add("short", b"y", 60)
+    assert not backend.add("short", b"z", 60)
+
+
+def test_folder_list_is_cached_until_the_account_changes(client, auth, make_account):
+    with FakeIMAPServer() as server:
+        account_id = make_account(imap_port=server.port)
+
+        def folders():
+            response = client.get(f"/api/v1/accounts/{account_id}/folders", headers=auth)
+            assert response.status_code == 200, response.text
+            return response.json()["folders"]
+
+        first = folders()
+        assert folders() == first
+        assert server.commands["LIST"] == 1
+
+        client.put(f"/api/v1/accounts/{account_id}", json={"name": "Renamed"}, headers=auth)
+        assert folders() == first
+        assert server.commands["LIST"] == 2
@@ -0,0 +1,100 @@
+import gzip
+
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Route
+from starlette.testclient import TestClient
+
+from app.utils.compression import CompressionMiddleware, accepted_encodings, is_compressible
+
+BIG_TEXT = "hello mailbox " * 200
+PNG = b"\x89PNG\r\n\x1a\n" + bytes(range(256)) * 20
+
+
+def make_client() -> TestClient:
+    async def text(request):
+        return Response(BIG_TEXT, media_type="text/plain", headers={"ETag": '"abc"'})
+
+    async def small(request):
+        return Response("tiny", media_type="text/plain")
+
+    async def json(request):
+        return JSONResponse({"body": BIG_TEXT})
+
+    async def image(request):
+        return Response(PNG, media_type="image/png")
+
+    async def stream(request):
+        async def chunks():
+            yield BIG_TEXT.encode()
+            yield BIG_TEXT.encode()
+        return StreamingResponse(chunks(), media_type="text/plain")
+
+    app = Starlette(routes=[
+        Route("/text", text), Route("/small", small), Route("/json", json),
+        Route("/image", image), Route("/stream", stream),
+    ])
+    app.add_middleware(CompressionMiddleware, minimum_size=1024)
+    return TestClient(app)
+
+
+def get(client: TestClient, path: str, accept_encoding: str):
+    # Read the raw bytes, as sent on the wire
+    with client.stream("GET", path, headers={"Accept-Encoding": accept_encoding}) as response:
+        return response, b"".join(response.iter_raw())
+
+
+def test_accepted_encodings_skips_zero_quality():
+    assert accepted_encodings("gzip;q=0, BR , deflate;q=0.5") == ["br", "deflate"]
+
+
+def test_is_compressible():
+    assert is_compressible("text/html; charset=utf-8")
+    assert is_compressible("application/json")
+    assert is_compressible("application/problem+json")
+    assert not is_compressible("image/png")
+    assert not is_compressible("application/zip")
+    assert not is_compressible("text/event-stream")
+    assert not is_compressible("")
+
+
+def test_gzip_response_varies_and_weakens_etag():
+    response, body = get(make_client(), "/text", "gzip")
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.headers["vary"] == "Accept-Encoding"
+    assert response.headers["etag"] == 'W/"abc"'
+    assert gzip.decompress(body).decode() == BIG_TEXT
+
+
+def test_identity_response_still_varies():
+    # A cache must not hand this copy to clients that accept gzip, or the reverse
+    response, body = get(make_client(), "/text", "identity")
+    assert "content-encoding" not in response.headers
+    assert response.headers["vary"] == "Accept-Encoding"
+    assert response.headers["etag"] == '"abc"'
+    assert body.decode() == BIG_TEXT
+
+
+def test_json_is_compressed():
+    response, body = get(make_client(), "/json", "gzip")
+    assert response.headers["content-encoding"] == "gzip"
+    assert BIG_TEXT in gzip.decompress(body).decode()
+
+
+def test_small_response_is_sent_as_is():
+    response, body = get(make_client(), "/small", "gzip")
+    assert "content-encoding" not in response.headers
+    assert body == b"tiny"
+
+
+def test_image_is_not_compressed_and_does_not_vary():
+    response, body = get(make_client(), "/image", "gzip")
+    assert "content-encoding" not in response.headers
+    assert "vary" not in response.headers
+    assert body == PNG
+
+
+def test_streaming_response_passes_through():
+    response, body = get(make_client(), "/stream", "gzip")
+    assert "content-encoding" not in response.headers
+    assert body == BIG_TEXT.encode() * 2
@@ -0,0 +1,36 @@
+from app.utils.etag import etag_matches, make_etag
+
+
+def test_make_etag_is_quoted_and_stable():
+    etag = make_etag("emails", 1, "INBOX", 50)
+    assert etag.startswith('"') and etag.endswith('"')
+    assert etag == make_etag("emails", 1, "INBOX", 50)
+    assert etag != make_etag("emails", 1, "INBOX", 51)
+
+
+def test_etag_matches_exact():
+    assert etag_matches('"abc"', '"abc"')
+    assert not etag_matches('"abd"', '"abc"')
+
+
+def test_etag_matches_weak_validator():
+    # The compression middleware weakens the ETag of compressed responses
+    assert etag_matches('W/"abc"', '"abc"')
+
+
+def test_etag_matches_any_in_a_list():
+    assert etag_matches('"x", W/"abc" ,"y"', '"abc"')
+    assert not etag_matches('"x", "y"', '"abc"')
+
+
+def test_etag_matches_wildcard():
+    assert etag_matches(" * ", '"abc"')
+
+
+def test_etag_matches_requires_the_quotes():
+    assert not etag_matches("abc", '"abc"')
+
+
+def test_etag_matches_nothing_without_header():
+    assert not etag_matches(None, '"abc"')
+    assert not etag_matches("", '"abc"')
@@ -0,0 +1,105 @@
+import asyncio
+
+import pytest
+
+from app.api.v1.events import EventStreamResponse
+from app.services.events import EventBroker, RedisEventRelay
+
+
+@pytest.mark.asyncio
+async def test_publish_from_a_thread_reaches_the_stream():
+    broker = EventBroker(queue_size=10, max_streams_per_user=5)
+    subscription = broker.subscribe(1)
+
+    await asyncio.to_thread(broker.publish, 1, "emails.new", {"ids": [5]})
+
+    assert await subscription.next_event(1) == 'event: emails.new\ndata: {"ids": [5]}\n\n'
+    assert await subscription.next_event(0.05) is None
+
+
+@pytest.mark.asyncio
+async def test_events_only_reach_their_user():
+    broker = EventBroker(queue_size=10, max_streams_per_user=5)
+    mine, theirs = broker.subscribe(1), broker.subscribe(2)
+
+    broker.publish(2, "email.updated", {"id": 3})
+
+    assert await mine.next_event(0.05) is None
+    assert (await theirs.next_event(1)).startswith("event: email.updated")
+
+
+@pytest.mark.asyncio
+async def test_stream_limit_per_user():
+    broker = EventBroker(queue_size=10, max_streams_per_user=2)
+    first = broker.subscribe(1)
+    assert broker.subscribe(1) is not None
+    assert broker.subscribe(1) is None
+
+    broker.unsubscribe(first)
+    assert broker.subscribe(1) is not None
+
+
+@pytest.mark.asyncio
+async def test_slow_stream_is_dropped_with_an_overflow_event():
+    broker = EventBroker(queue_size=2, max_streams_per_user=5)
+    subscription = broker.subscribe(1)
+
+    for i in range(3):
+        broker.publish(1, "email.updated", {"id": i})
+
+    assert subscription.dropped
+    assert broker.stream_count() == 0
+    assert await subscription.next_event(1) == "event: overflow\ndata: {}\n\n"
+
+
+@pytest.mark.asyncio
+async def test_response_unsubscribes_when_the_stream_never_starts(monkeypatch):
+    broker = EventBroker(queue_size=10, max_streams_per_user=5)
+    monkeypatch.setattr("app.api.v1.events.event_broker", broker)
+    subscription = broker.subscribe(1)
+
+    async def never_iterated():
+        raise AssertionError("not reached")
+        yield ""
+
+    async def receive():
+        await asyncio.sleep(10)
+
+    async def send(message):
+        # The client is gone before the headers go out
+        raise OSError("connection reset")
+
+    response = EventStreamResponse(subscription, never_iterated(), media_type="text/event-stream")
+    with pytest.raises(OSError):
+        await response({"type": "http", "method": "GET", "path": "/"}, receive, send)
+
+    assert broker.stream_count() == 0
+
+
+def test_relay_queue_is_bounded_and_counts_drops():
+    from app.core.metrics import EVENTS_RELAY_DROPPED
+
+    # Nothing connects to Redis until the relay is started
+    relay = RedisEventRelay("redis://127.0.0.1:1", lambda user_id, message: None, lambda: None, queue_size=2)
+    before = EVENTS_RELAY_DROPPED._value.get()
+
+    for i in range(5):
+        relay.send(1, f"event {i}")
+
+    assert relay._outgoing.qsize() == 2
+    assert EVENTS_RELAY_DROPPED._value.get() - before == 3
+
+
+def test_stream_limit_answers_429(client, auth, monkeypatch):
+    from app.services.events import event_broker
+
+    user_id = client.get("/api/v1/auth/me", headers=auth).json()["id"]
+    monkeypatch.setattr(event_broker, "max_streams_per_user", 0)
+
+    response = client.get("/api/v1/events/stream", headers=auth)
+    assert response.status_code == 429
+    assert not event_broker.has_streams(user_id)
+
+
+def test_stream_needs_a_token(client):
+    assert client.get("/api/v1/events/stream").status_code == 401
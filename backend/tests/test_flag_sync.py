@@ -0,0 +1,166 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from app.core.config import settings
+from app.models.email import Email
+from app.models.flag_change import FlagChange
+from app.models.folder_state import FolderState
+from app.services import flag_sync
+from app.services.flag_sync import FLAGGED, SEEN, push_account, queue_flag_changes
+from app.services.sync_service import run_sync
+from benchmarks.fake_servers import FakeIMAPServer, Mailbox, _Folder
+from benchmarks.mailgen import MailboxGenerator
+
+
+@pytest.fixture(autouse=True)
+def no_window(monkeypatch):
+    # Changes are due as soon as they are queued, and pushed by the tests rather than the app's worker
+    monkeypatch.setattr(settings, "FLAG_SYNC_WINDOW", 0)
+    monkeypatch.setattr(flag_sync, "_due_accounts", lambda: [])
+    # Detected folders are remembered per account id, which the next test reuses
+    monkeypatch.setattr(flag_sync, "_sent_folders", {})
+    monkeypatch.setattr(flag_sync, "_trash_folders", {})
+
+
+@pytest.fixture
+def mailbox():
+    inbox = Mailbox()
+    inbox.seed(MailboxGenerator(seed=3), 3, read_ratio=0)
+    inbox.folders["Archive"] = _Folder()
+    return inbox
+
+
+@pytest.fixture
+def server(mailbox):
+    with FakeIMAPServer(mailbox) as imap_server:
+        yield imap_server
+
+
+@pytest.fixture
+def account_id(make_account, server):
+    """An account whose INBOX has been synced from the fake server"""
+    account_id = make_account(imap_port=server.port)
+    run_sync(account_id)
+    return account_id
+
+
+def inbox(db) -> dict:
+    db.expire_all()
+    return {int(email.uid): email.id for email in db.query(Email).filter(Email.folder == "INBOX")}
+
+
+def pending(db) -> list:
+    db.expire_all()
+    return db.query(FlagChange).order_by(FlagChange.id).all()
+
+
+def flags(mailbox) -> dict:
+    return {uid: message.flags for uid, message in mailbox.folders["INBOX"].messages.items()}
+
+
+def test_read_and_starred_changes_reach_the_server(client, auth, db, account_id, server, mailbox):
+    uids = inbox(db)
+    client.put(f"/api/v1/emails/{uids[1]}", json={"is_read": True, "is_starred": True}, headers=auth)
+    client.put(f"/api/v1/emails/{uids[2]}", json={"is_read": True}, headers=auth)
+
+    assert push_account(account_id) == 3
+
+    assert flags(mailbox)[1] == {SEEN, FLAGGED}
+    assert flags(mailbox)[2] == {SEEN}
+    assert FLAGGED not in flags(mailbox)[3]
+    # One command per flag and folder
+    assert server.commands["STORE"] == 2
+    assert pending(db) == []
+
+
+def test_quick_toggles_collapse_into_the_last_one(client, auth, db, account_id, server, mailbox):
+    email_id = inbox(db)[1]
+    for is_read in (True, False, True):
+        client.put(f"/api/v1/emails/{email_id}", json={"is_read": is_read}, headers=auth)
+
+    item, = pending(db)
+    assert (item.change, item.value) == (SEEN, True)
+
+    push_account(account_id)
+
+    assert server.commands["STORE"] == 1
+    assert flags(mailbox)[1] == {SEEN}
+
+
+def test_moved_email_follows_its_new_uid(client, auth, db, account_id, mailbox):
+    email_id = inbox(db)[2]
+    client.put(f"/api/v1/emails/{email_id}", json={"folder": "Archive"}, headers=auth)
+    state = (FolderState.account_id == account_id, FolderState.folder == "Archive")
+    version = db.query(FolderState.version).filter(*state).scalar()
+
+    assert push_account(account_id) == 1
+
+    assert sorted(mailbox.folders["INBOX"].messages) == [1, 3]
+    assert sorted(mailbox.folders["Archive"].messages) == [1]
+    db.expire_all()
+    email = db.get(Email, email_id)
+    assert (email.folder, email.uid) == ("Archive", "1")
+    # The new UID went through the ORM, so cached listings of the folder are invalidated
+    assert db.query(FolderState.version).filter(*state).scalar() > version
+
+
+def test_deleted_email_moves_to_trash(client, auth, db, account_id, mailbox):
+    email_id = inbox(db)[1]
+    client.delete(f"/api/v1/emails/{email_id}", headers=auth)
+
+    assert push_account(account_id) == 1
+
+    assert sorted(mailbox.folders["INBOX"].messages) == [2, 3]
+    assert len(mailbox.folders["Trash"].messages) == 1
+    db.expire_all()
+    # Confirmed gone from the server, so the row may be purged
+    assert db.get(Email, email_id).expunged_at is not None
+
+
+def test_deleted_email_is_expunged_when_configured(client, auth, db, account_id, mailbox, monkeypatch):
+    monkeypatch.setattr(settings, "DELETE_EXPUNGE", True)
+    email_id = inbox(db)[1]
+    client.delete(f"/api/v1/emails/{email_id}", headers=auth)
+
+    push_account(account_id)
+
+    assert sorted(mailbox.folders["INBOX"].messages) == [2, 3]
+    assert mailbox.folders["Trash"].messages == {}
+    db.expire_all()
+    assert db.get(Email, email_id).expunged_at is not None
+
+
+def unreachable_email(db, add_account) -> Email:
+    # Nothing listens on port 1
+    account = add_account(imap_port=1)
+    email = Email(account_id=account.id, message_id="<1@example.com>", sender_email="a@example.com",
+                  folder="INBOX", uid="1", is_starred=False)
+    db.add(email)
+    db.commit()
+    queue_flag_changes(db, email, {"is_starred": True})
+    email.is_starred = True
+    db.commit()
+    return email
+
+
+def test_failed_change_is_retried_later(db, add_account):
+    email = unreachable_email(db, add_account)
+
+    assert push_account(email.account_id) == 0
+
+    item, = pending(db)
+    assert item.attempts == 1 and item.last_error
+    assert item.next_attempt_at > datetime.utcnow() + timedelta(seconds=settings.FLAG_SYNC_BACKOFF_BASE / 2)
+    assert db.get(Email, email.id).is_starred
+
+
+def test_change_given_up_on_puts_the_email_back(db, add_account, monkeypatch):
+    monkeypatch.setattr(settings, "FLAG_SYNC_MAX_ATTEMPTS", 1)
+    email = unreachable_email(db, add_account)
+
+    push_account(email.account_id)
+
+    assert pending(db) == []
+    # Still unstarred on the server
+    assert not db.get(Email, email.id).is_starred
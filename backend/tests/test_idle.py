@@ -0,0 +1,125 @@
+import time
+
+import pytest
+
+from app.core.config import settings
+from app.core.locks import LeaseLock, lease_backend
+from app.models.email import Email
+from app.services import idle_service
+from app.services.idle_service import IdleManager, MailboxWatcher
+from app.services.imap_service import IMAPService
+from app.utils.password import account_password
+from benchmarks.fake_servers import FakeIMAPServer, Mailbox
+from benchmarks.mailgen import MailboxGenerator
+
+
+@pytest.fixture
+def mailbox():
+    inbox = Mailbox()
+    inbox.seed(MailboxGenerator(seed=1), 3, read_ratio=0)
+    return inbox
+
+
+@pytest.fixture
+def server(mailbox):
+    with FakeIMAPServer(mailbox) as imap_server:
+        yield imap_server
+
+
+@pytest.fixture
+def watched(db, add_account, server):
+    """A watcher that has caught up with the INBOX, and its open connection"""
+    account = add_account(imap_port=server.port)
+    lease = LeaseLock(lease_backend, f"idle:{account.id}", settings.IMAP_IDLE_LEASE_TTL)
+    assert lease.acquire()
+    watcher = MailboxWatcher(account.id, lease)
+    imap_service = IMAPService(account, account_password(account, "imap"))
+    assert imap_service.connect() and imap_service.select_folder("INBOX")
+    watcher._catch_up(imap_service)
+    yield watcher, imap_service
+    imap_service.disconnect()
+    lease.release()
+
+
+def inbox(db) -> dict:
+    db.expire_all()
+    return {int(email.uid): email for email in db.query(Email).filter(Email.folder == "INBOX")}
+
+
+def test_catch_up_stores_new_mail_and_maps_sequence_numbers(db, watched):
+    watcher, _ = watched
+    assert sorted(inbox(db)) == [1, 2, 3]
+    assert watcher._uids == [1, 2, 3]
+
+
+def test_expunge_and_flag_changes_update_the_right_rows(db, watched):
+    watcher, imap_service = watched
+
+    # Sequence numbers: 2 is UID 2; after it is gone, 2 is UID 3
+    watcher._apply_changes(imap_service, [b"* 2 EXPUNGE", b"* 2 FETCH (FLAGS (\\Seen))"])
+
+    emails = inbox(db)
+    assert emails[2].is_deleted
+    assert emails[3].is_read and not emails[1].is_read
+    assert watcher._uids == [1, 3]
+
+
+def test_exists_stores_the_new_mail(db, watched, mailbox):
+    watcher, imap_service = watched
+    mailbox.add("INBOX", MailboxGenerator(seed=2).message(0))
+
+    watcher._apply_changes(imap_service, [b"* 4 EXISTS"])
+
+    assert sorted(inbox(db)) == [1, 2, 3, 4]
+    assert watcher._uids == [1, 2, 3, 4]
+
+
+def test_unknown_sequence_number_resyncs_the_uid_map(db, watched, mailbox):
+    watcher, imap_service = watched
+    # Removed on the server while the map went stale
+    with mailbox.lock:
+        mailbox.folders["INBOX"].remove([1])
+
+    watcher._apply_changes(imap_service, [b"* 9 EXPUNGE"])
+
+    assert inbox(db)[1].is_deleted
+    assert watcher._uids == [2, 3]
+
+
+def test_watcher_polls_when_the_server_has_no_idle(db, add_account, server, monkeypatch):
+    monkeypatch.setattr(settings, "IMAP_POLL_INTERVAL", 0.05)
+    account = add_account(imap_port=server.port)
+    lease = LeaseLock(lease_backend, f"idle:{account.id}", settings.IMAP_IDLE_LEASE_TTL)
+    assert lease.acquire()
+    watcher = MailboxWatcher(account.id, lease)
+    watcher.start()
+    try:
+        deadline = time.monotonic() + 5
+        while server.commands["NOOP"] < 2 and time.monotonic() < deadline:
+            time.sleep(0.05)
+        assert server.commands["NOOP"] >= 2
+    finally:
+        watcher.stop()
+        watcher.join(5)
+    assert sorted(inbox(db)) == [1, 2, 3]
+    # The watcher's lease goes with it
+    assert lease_backend.acquire(f"idle:{account.id}", "next-worker", 1)
+
+
+def test_manager_watches_free_accounts_up_to_its_cap(db, add_account, monkeypatch):
+    monkeypatch.setattr(settings, "IMAP_IDLE_MAX_CONNECTIONS", 2)
+    # Connections are not the point here
+    monkeypatch.setattr(idle_service.MailboxWatcher, "start", lambda self: None)
+    monkeypatch.setattr(idle_service.MailboxWatcher, "is_alive", lambda self: True)
+    taken, first, second, third = (add_account().id for _ in range(4))
+    elsewhere = LeaseLock(lease_backend, f"idle:{taken}", settings.IMAP_IDLE_LEASE_TTL)
+    assert elsewhere.acquire()
+
+    manager = IdleManager()
+    try:
+        manager._rescan()
+        assert manager.watched_accounts() == [first, second]
+    finally:
+        elsewhere.release()
+        for watcher in manager._watchers.values():
+            watcher.lease.release()
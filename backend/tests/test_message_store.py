@@ -0,0 +1,96 @@
+import hashlib
+import io
+import os
+import time
+
+import pytest
+
+from app.core.config import settings
+from app.models.email import Email
+from app.services.message_store import MessageStore, store_raw_message
+from app.services.sync_service import run_sync
+from benchmarks.fake_servers import FakeIMAPServer, Mailbox
+from benchmarks.mailgen import MailboxGenerator
+
+RAW = b"Subject: Stored\r\nFrom: a@example.com\r\n\r\n" + b"The same line, many times over.\r\n" * 500
+
+
+@pytest.fixture(params=["zstd", "zlib"])
+def store(request, tmp_path):
+    return MessageStore(str(tmp_path), request.param)
+
+
+def test_messages_are_stored_once_compressed(store):
+    digest = store.put(RAW)
+
+    assert digest == hashlib.sha256(RAW).hexdigest()
+    assert store.put(RAW) == digest
+    path = store.path(digest)
+    assert path.endswith(os.path.join(digest[:2], digest[2:4], digest))
+    assert os.path.getsize(path) < len(RAW) / 10
+    assert store.get(digest) == RAW
+    assert b"".join(store.chunks(digest)) == RAW
+
+
+def test_files_are_stored_like_bytes(store):
+    source = io.BytesIO(RAW)
+
+    assert store.put_file(source) == hashlib.sha256(RAW).hexdigest()
+    assert source.tell() == len(RAW)
+    assert store.get(store.put(RAW)) == RAW
+
+
+def test_missing_and_invalid_digests(store):
+    assert store.get("0" * 64) is None
+    assert not store.has("0" * 64)
+    with pytest.raises(FileNotFoundError):
+        list(store.chunks("0" * 64))
+    with pytest.raises(ValueError):
+        store.path("../../etc/passwd")
+
+
+def test_messages_stay_readable_when_the_codec_changes(tmp_path):
+    digest = MessageStore(str(tmp_path), "zstd").put(RAW)
+
+    assert MessageStore(str(tmp_path), "zlib").get(digest) == RAW
+
+
+def test_only_untouched_messages_are_removed(store):
+    digest = store.put(RAW)
+    long_ago = time.time() - 3600
+    os.utime(store.path(digest), (long_ago, long_ago))
+
+    # Stored again just now
+    store.put(RAW)
+    assert not store.remove(digest, untouched_for=60)
+
+    os.utime(store.path(digest), (long_ago, long_ago))
+    assert store.remove(digest, untouched_for=60)
+    assert not store.has(digest)
+
+
+def test_nothing_is_kept_when_the_store_is_disabled(monkeypatch):
+    monkeypatch.setattr(settings, "MESSAGE_STORE_ENABLED", False)
+
+    assert store_raw_message(RAW) is None
+
+
+def test_synced_mail_is_served_from_the_store(client, auth, make_account, db):
+    mailbox = Mailbox()
+    mailbox.seed(MailboxGenerator(seed=5), 2)
+
+    with FakeIMAPServer(mailbox) as server:
+        account_id = make_account(imap_port=server.port)
+        run_sync(account_id)
+        email_id, raw_hash = db.query(Email.id, Email.raw_hash).order_by(Email.uid).first()
+        fetches = server.commands["FETCH"]
+
+        response = client.get(f"/api/v1/emails/{email_id}/raw", headers=auth)
+
+        # No round-trip to the server
+        assert server.commands["FETCH"] == fetches
+
+    assert raw_hash
+    assert response.status_code == 200
+    assert response.content == mailbox.folders["INBOX"].messages[1].raw
+    assert response.headers["content-type"] == "message/rfc822"
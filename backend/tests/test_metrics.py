@@ -0,0 +1,74 @@
+from types import SimpleNamespace
+
+from prometheus_client import REGISTRY
+
+from app.core.metrics import metrics_body
+from app.schemas.email import EmailCompose
+from app.services.smtp_service import SMTPService
+from app.services.sync_service import run_sync
+from benchmarks.fake_servers import FakeIMAPServer, FakeSMTPServer, Mailbox
+from benchmarks.mailgen import MailboxGenerator
+
+
+def sample(name: str, **labels) -> float:
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+
+def test_database_time_is_labelled_with_the_route(client, auth):
+    endpoint = {"endpoint": "/api/v1/accounts/"}
+    before = sample("db_query_duration_seconds_count", **endpoint)
+
+    client.get("/api/v1/accounts/", headers=auth)
+
+    assert sample("db_query_duration_seconds_count", **endpoint) > before
+
+
+def test_sync_and_imap_commands_are_timed(db, add_account):
+    mailbox = Mailbox()
+    mailbox.seed(MailboxGenerator(seed=4), 3)
+    before = {
+        "sync": sample("mail_sync_duration_seconds_count", mode="full"),
+        "select": sample("imap_command_duration_seconds_count", command="SELECT"),
+        "fetch": sample("imap_command_duration_seconds_count", command="UID FETCH"),
+    }
+
+    with FakeIMAPServer(mailbox) as server:
+        run_sync(add_account(imap_port=server.port).id)
+
+    assert sample("mail_sync_duration_seconds_count", mode="full") == before["sync"] + 1
+    assert sample("imap_command_duration_seconds_count", command="SELECT") > before["select"]
+    assert sample("imap_command_duration_seconds_count", command="UID FETCH") > before["fetch"]
+
+
+def test_smtp_sends_are_timed_by_outcome():
+    before = sample("smtp_send_duration_seconds_count", outcome="sent")
+    with FakeSMTPServer() as server:
+        sender = SimpleNamespace(
+            smtp_host="127.0.0.1", smtp_port=server.port, smtp_ssl=False, smtp_username="user",
+            email_address="sender@example.com", display_name="Sender"
+        )
+        smtp = SMTPService(sender, "secret")
+        message = EmailCompose(account_id=1, to_addresses=[{"email": "to@example.com"}], subject="Hi", body_text="Hi")
+        assert smtp.send_email(message)[0]
+        smtp.disconnect()
+
+    assert sample("smtp_send_duration_seconds_count", outcome="sent") == before + 1
+
+
+def test_scrape_includes_runtime_values(client):
+    response = client.get("/metrics")
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    for name in ("db_pool_connections", "smtp_pool_idle_sessions", "event_streams", "outbox_in_flight",
+                 "sqlite_write_queue_depth", "imap_command_duration_seconds_bucket"):
+        assert name in response.text
+
+
+def test_multiprocess_scrape_keeps_runtime_values(tmp_path, monkeypatch):
+    monkeypatch.setenv("PROMETHEUS_MULTIPROC_DIR", str(tmp_path))
+
+    body, _ = metrics_body()
+
+    # Nothing written by worker processes yet, but this worker's live values are there
+    assert b"event_streams" in body
@@ -0,0 +1,87 @@
+import pytest
+
+from app.services import mime_parser
+from benchmarks.mime_corpus import corpus
+
+# Dates are "now" when the Date header cannot be parsed; size is the raw length on the fast path
+IGNORED_FIELDS = ("date_sent", "date_received", "size")
+MESSAGES = corpus(attachment_size=64 * 1024)
+
+MULTIPART = (
+    b"From: a@example.com\r\n"
+    b"Subject: parts\r\n"
+    b"Content-Type: multipart/mixed; boundary=\"b1\"\r\n"
+    b"\r\n"
+    b"preamble\r\n"
+    b"--b1\r\n"
+    b"Content-Type: text/plain\r\n"
+    b"\r\n"
+    b"first\r\n"
+    b"--b1  \r\n"
+    b"Content-Type: text/plain\r\n"
+    b"\r\n"
+    b"--b1x is not a delimiter\r\n"
+    b"--b1--\r\n"
+    b"epilogue\r\n"
+)
+
+
+def body_start(raw: bytes, eol: bytes) -> int:
+    """Position of the line ending before the body, as _scan_entity passes it"""
+    return raw.index(eol + eol) + len(eol)
+
+
+def test_part_ranges_finds_parts_between_delimiters():
+    ranges = mime_parser._part_ranges(MULTIPART, body_start(MULTIPART, b"\r\n"), len(MULTIPART), b"--b1", b"\r\n")
+    parts = [MULTIPART[start:end] for start, end in ranges]
+    # The line ending before a delimiter belongs to the delimiter; trailing whitespace is allowed after it
+    assert parts == [
+        b"Content-Type: text/plain\r\n\r\nfirst",
+        b"Content-Type: text/plain\r\n\r\n--b1x is not a delimiter",
+    ]
+
+
+def test_part_ranges_with_bare_newlines():
+    raw = MULTIPART.replace(b"\r\n", b"\n")
+    ranges = mime_parser._part_ranges(raw, body_start(raw, b"\n"), len(raw), b"--b1", b"\n")
+    assert [raw[start:end] for start, end in ranges][0] == b"Content-Type: text/plain\n\nfirst"
+
+
+def test_part_ranges_with_a_delimiter_on_the_first_body_line():
+    raw = MULTIPART.replace(b"preamble\r\n", b"")
+    ranges = mime_parser._part_ranges(raw, body_start(raw, b"\r\n"), len(raw), b"--b1", b"\r\n")
+    assert len(ranges) == 2
+
+
+def test_part_ranges_without_closing_delimiter():
+    raw = MULTIPART.replace(b"--b1--", b"--b1")
+    assert mime_parser._part_ranges(raw, body_start(raw, b"\r\n"), len(raw), b"--b1", b"\r\n") is None
+
+
+def test_scan_builds_the_tree():
+    message = mime_parser._scan(MULTIPART)
+    assert message is not None
+    assert message["Subject"] == "parts"
+    assert [part.get_content() for part in message.iter_parts()] == ["first", "--b1x is not a delimiter"]
+
+
+def test_scan_leaves_mixed_line_endings_to_the_full_parser():
+    assert mime_parser._scan(MULTIPART.replace(b"first\r\n", b"first\n")) is None
+
+
+def test_scan_leaves_a_missing_closing_delimiter_to_the_full_parser():
+    assert mime_parser._scan(MULTIPART.replace(b"--b1--", b"--b1")) is None
+
+
+def test_scan_leaves_malformed_headers_to_the_full_parser():
+    assert mime_parser._scan(b"not a header\r\n\r\nbody\r\n") is None
+
+
+@pytest.mark.parametrize("name", sorted(MESSAGES))
+def test_parse_matches_the_full_parse(name):
+    raw = MESSAGES[name]
+    fast = mime_parser.parse_message(raw, "1")
+    full = mime_parser._extract(mime_parser._parser.parsebytes(raw), "1", len(raw))
+    for field in set(fast) | set(full):
+        if field not in IGNORED_FIELDS:
+            assert fast.get(field) == full.get(field), field
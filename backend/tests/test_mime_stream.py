@@ -0,0 +1,58 @@
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+import base64
+import email
+
+from app.services.mime_stream import StreamingMessage, coalesce, dot_stuff
+
+
+def test_dot_stuff_escapes_leading_dots():
+    assert b"".join(dot_stuff([b".hidden\r\nplain\r\n.\r\n..two\r\n"])) == b"..hidden\r\nplain\r\n..\r\n...two\r\n"
+
+
+def test_dot_stuff_leaves_other_dots_alone():
+    assert b"".join(dot_stuff([b"a.b\r\nend.\r\n"])) == b"a.b\r\nend.\r\n"
+
+
+def test_dot_stuff_across_chunk_boundaries():
+    # The dot starts a line only because of the previous chunk's line ending
+    chunks = [b"first line\r", b"\n", b".second", b" line\r\n", b"third\r\n."]
+    assert b"".join(dot_stuff(chunks)) == b"first line\r\n..second line\r\nthird\r\n.."
+
+
+def test_dot_stuff_yields_whole_lines_until_the_end():
+    chunks = list(dot_stuff([b"no line ending", b" yet\r\nand a", b" tail"]))
+    assert chunks == [b"no line ending yet\r\n", b"and a tail"]
+
+
+def test_coalesce_merges_small_chunks():
+    assert list(coalesce([b"ab", b"cd", b"ef", b"g"], 4)) == [b"abcd", b"efg"]
+
+
+def test_coalesce_passes_large_chunks_and_skips_empty_ones():
+    assert list(coalesce([b"", b"abcdef", b"", b"gh", b"ijkl"], 4)) == [b"abcdef", b"ghijkl"]
+
+
+def test_coalesce_of_nothing():
+    assert list(coalesce([], 4)) == []
+    assert list(coalesce([b""], 4)) == []
+
+
+def test_streaming_message_splices_attachment(tmp_path):
+    content = bytes(range(256)) * 1000
+    path = tmp_path / "data.bin"
+    path.write_bytes(content)
+
+    msg = StreamingMessage(MIMEMultipart("mixed"))
+    msg["Subject"] = "attached"
+    msg.message.attach(MIMEText("body", "plain", "utf-8"))
+    msg.attach_file(msg.message, str(path), "data.bin")
+
+    raw = b"".join(msg.iter_bytes())
+    assert raw == msg.as_bytes()
+    assert raw.count(b"\n") == raw.count(b"\r\n")
+    parsed = email.message_from_bytes(raw)
+    attachment = parsed.get_payload()[1]
+    assert attachment.get_filename() == "data.bin"
+    assert base64.b64decode(attachment.get_payload()) == content
+    assert all(len(line) <= 76 for line in attachment.get_payload().splitlines())
@@ -0,0 +1,155 @@
+from datetime import datetime, timedelta
+import time
+
+import pytest
+
+from app.core.config import settings
+from app.core.locks import LeaseLock, lease_backend
+from app.models.outbox import OutboundEmail
+from app.schemas.email import EmailCompose
+from app.services import outbox
+from app.services.outbox import OutboxWorker, enqueue_bulk, enqueue_email
+from benchmarks.fake_servers import FakeSMTPServer
+
+
+@pytest.fixture
+def server():
+    with FakeSMTPServer(keep=True) as smtp_server:
+        yield smtp_server
+
+
+def queue(db, account, subject: str = "Hello") -> int:
+    outbox_id = enqueue_email(db, EmailCompose(
+        account_id=account.id, to_addresses=[{"email": "to@example.com"}], subject=subject, body_text="Hi"
+    ))
+    db.commit()
+    return outbox_id
+
+
+def deliver_due(worker: OutboxWorker) -> list:
+    """One scan of the worker, sending what it claimed in this thread"""
+    claimed = worker._claim_due()
+    for outbox_id, lease in claimed:
+        worker._deliver(outbox_id, lease)
+    return [outbox_id for outbox_id, lease in claimed]
+
+
+def row(db, outbox_id: int) -> OutboundEmail:
+    db.expire_all()
+    return db.get(OutboundEmail, outbox_id)
+
+
+def test_queued_email_is_delivered_with_the_decrypted_password(db, add_account, server, monkeypatch):
+    account = add_account(smtp_port=server.port)
+    outbox_id = queue(db, account)
+    passwords = []
+    session = outbox.smtp_pool.session
+
+    def recording_session(sender, password):
+        passwords.append(password)
+        return session(sender, password)
+
+    monkeypatch.setattr(outbox.smtp_pool, "session", recording_session)
+
+    assert deliver_due(OutboxWorker()) == [outbox_id]
+
+    item = row(db, outbox_id)
+    assert (item.status, item.attempts, item.last_error) == ("sent", 1, None)
+    assert passwords == ["secret"]
+    assert server.delivered == 1
+    assert b"Subject: Hello" in server.messages[0]
+
+
+def test_failed_send_is_retried_later(db, add_account):
+    # Nothing listens on port 1
+    outbox_id = queue(db, add_account(smtp_port=1))
+
+    deliver_due(OutboxWorker())
+
+    item = row(db, outbox_id)
+    assert (item.status, item.attempts) == ("queued", 1)
+    assert item.last_error
+    assert item.next_attempt_at > datetime.utcnow() + timedelta(seconds=settings.OUTBOX_BACKOFF_BASE * 0.5)
+    # Not due yet
+    assert deliver_due(OutboxWorker()) == []
+
+
+def test_last_attempt_fails_for_good(db, add_account, monkeypatch):
+    monkeypatch.setattr(settings, "OUTBOX_MAX_ATTEMPTS", 1)
+    outbox_id = queue(db, add_account(smtp_port=1))
+
+    deliver_due(OutboxWorker())
+
+    assert row(db, outbox_id).status == "failed"
+
+
+def test_claims_are_limited_per_account(db, add_account, monkeypatch):
+    monkeypatch.setattr(settings, "OUTBOX_ACCOUNT_CONCURRENCY", 2)
+    busy, other = add_account(), add_account()
+    for i in range(5):
+        queue(db, busy, f"busy {i}")
+    quiet = queue(db, other)
+
+    claimed = OutboxWorker()._claim_due()
+    try:
+        ids = [outbox_id for outbox_id, lease in claimed]
+        assert len(ids) == 3
+        assert quiet in ids
+        # A second scan finds the busy account at its limit
+        assert OutboxWorker()._claim_due() == []
+    finally:
+        for outbox_id, lease in claimed:
+            lease.release()
+
+
+def test_only_claims_without_a_live_lease_are_reclaimed(db, add_account):
+    account = add_account()
+    alive, dead = queue(db, account, "alive"), queue(db, account, "dead")
+    long_ago = datetime.utcnow() - timedelta(seconds=settings.OUTBOX_SEND_TIMEOUT + 60)
+    db.query(OutboundEmail).update({"status": "sending", "claimed_at": long_ago})
+    db.commit()
+
+    # A slow send that is still renewing its lease
+    lease = LeaseLock(lease_backend, f"outbox:{alive}", settings.OUTBOX_SEND_TIMEOUT)
+    assert lease.acquire()
+    try:
+        OutboxWorker()._reclaim_stale(db, datetime.utcnow())
+    finally:
+        lease.release()
+
+    assert row(db, alive).status == "sending"
+    assert row(db, dead).status == "queued"
+
+
+def test_bulk_send_renders_one_message_per_recipient(client, auth, make_account, server):
+    account_id = make_account(smtp_port=server.port)
+    response = client.post("/api/v1/emails/bulk", headers=auth, json={
+        "account_id": account_id,
+        "subject": "Hello $name",
+        "body_text": "Dear ${name}, your code is $code",
+        "recipients": [
+            {"email": f"r{i}@example.com", "name": f"Reader {i}", "variables": {"code": str(i)}} for i in range(3)
+        ]
+    })
+    assert response.status_code == 202
+    bulk_id = response.json()["bulk_id"]
+    assert response.json()["queued"] == 3
+
+    # The app's own worker delivers them
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        progress = client.get(f"/api/v1/emails/bulk/{bulk_id}", headers=auth).json()
+        if progress["sent"] == 3:
+            break
+        time.sleep(0.1)
+
+    assert progress == {"bulk_id": bulk_id, "queued": 0, "sending": 0, "sent": 3, "failed": 0, "failures": []}
+    subjects = sorted(message.split(b"Subject: ")[1].split(b"\r\n")[0] for message in server.messages)
+    assert subjects == [b"Hello Reader 0", b"Hello Reader 1", b"Hello Reader 2"]
+
+
+def test_bulk_status_is_only_visible_to_its_owner(db, add_account, client, auth):
+    enqueue_bulk(db, add_account().id, [{"to_addresses": [{"email": "a@example.com"}]}], "someone-elses")
+    db.commit()
+
+    assert client.get("/api/v1/emails/bulk/someone-elses", headers=auth).status_code == 404
@@ -0,0 +1,91 @@
+import asyncio
+import os
+import time
+
+from starlette.applications import Starlette
+from starlette.responses import PlainTextResponse, StreamingResponse
+from starlette.routing import Route
+from starlette.testclient import TestClient
+
+from app.utils.profiling import ProfilingMiddleware, StackSampler
+
+
+def lookup():
+    time.sleep(0.05)
+
+
+def make_client(output_dir, **options) -> TestClient:
+    async def slow(request):
+        # Work in the threadpool shows up too
+        await asyncio.to_thread(lookup)
+        return PlainTextResponse("done")
+
+    async def stream(request):
+        async def events():
+            yield "data: 1\n\n"
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    app = Starlette(routes=[Route("/slow", slow), Route("/stream", stream)])
+    app.add_middleware(ProfilingMiddleware, output_dir=str(output_dir), interval=0.001, **options)
+    return TestClient(app)
+
+
+def profiles(output_dir) -> list:
+    return sorted(os.listdir(output_dir))
+
+
+def test_request_with_the_token_is_profiled(tmp_path):
+    response = make_client(tmp_path, token="s3cret").get("/slow", headers={"X-Profile": "s3cret"})
+
+    profile_id = response.headers["x-profile-id"]
+    assert profiles(tmp_path) == [f"{profile_id}.folded"]
+    folded = (tmp_path / f"{profile_id}.folded").read_text()
+    assert "lookup (test_profiling.py" in folded
+    # Every line is a stack and a count
+    assert all(line.rsplit(" ", 1)[1].isdigit() for line in folded.splitlines())
+
+
+def test_other_requests_are_not_profiled(tmp_path):
+    client = make_client(tmp_path, token="s3cret")
+
+    assert "x-profile-id" not in client.get("/slow", headers={"X-Profile": "wrong"}).headers
+    assert "x-profile-id" not in client.get("/slow").headers
+    assert profiles(tmp_path) == []
+
+
+def test_sampled_requests_are_profiled(tmp_path):
+    make_client(tmp_path, sample_rate=1.0).get("/slow")
+
+    assert len(profiles(tmp_path)) == 1
+
+
+def test_cprofile_mode_adds_a_prof_file(tmp_path):
+    response = make_client(tmp_path, sample_rate=1.0, mode="cprofile").get("/slow")
+
+    profile_id = response.headers["x-profile-id"]
+    assert profiles(tmp_path) == [f"{profile_id}.folded", f"{profile_id}.prof"]
+
+
+def test_event_streams_are_not_profiled(tmp_path):
+    response = make_client(tmp_path, sample_rate=1.0).get("/stream", headers={"Accept": "text/event-stream"})
+
+    assert response.text == "data: 1\n\n"
+    assert profiles(tmp_path) == []
+
+
+def test_only_the_newest_profiles_are_kept(tmp_path):
+    for name in ("20200101-000000-get-old-a", "20200101-000001-get-old-b"):
+        (tmp_path / f"{name}.folded").write_text("")
+
+    response = make_client(tmp_path, sample_rate=1.0, keep=2).get("/slow")
+
+    assert profiles(tmp_path) == ["20200101-000001-get-old-b.folded", f"{response.headers['x-profile-id']}.folded"]
+
+
+def test_sampler_stops_after_max_samples():
+    sampler = StackSampler(interval=0.001, max_samples=5)
+    sampler.start()
+    time.sleep(0.1)
+    sampler.stop()
+
+    assert sampler.samples == 5
@@ -0,0 +1,107 @@
+import pytest
+
+from app.models.email import Email
+from app.models.flag_change import FlagChange
+from app.schemas.email import EmailCompose
+from app.services import flag_sync
+from app.services.flag_sync import APPEND, push_account, queue_flag_changes
+from app.services.sent_mail import new_sent_copy, record_sent_email
+from benchmarks.fake_servers import FakeIMAPServer, Mailbox, _Folder
+
+RAW = b"Message-ID: <sent-1@example.com>\r\nSubject: Hello\r\nTo: to@example.com\r\n\r\nHi there\r\n"
+
+
+@pytest.fixture(autouse=True)
+def no_detected_folders(monkeypatch):
+    # Detected folders are remembered per account id, which the next test reuses
+    monkeypatch.setattr(flag_sync, "_sent_folders", {})
+    monkeypatch.setattr(flag_sync, "_trash_folders", {})
+
+
+@pytest.fixture
+def server():
+    with FakeIMAPServer() as imap_server:
+        yield imap_server
+
+
+def record_sent(db, account) -> int:
+    sent_copy = new_sent_copy()
+    sent_copy.write(RAW)
+    email_data = EmailCompose(account_id=account.id, to_addresses=[{"email": "to@example.com"}], subject="Hello", body_text="Hi there")
+    return record_sent_email(db, account, email_data, sent_copy)
+
+
+def email(db, email_id: int) -> Email:
+    db.expire_all()
+    return db.get(Email, email_id)
+
+
+def pending(db) -> list:
+    db.expire_all()
+    return db.query(FlagChange).all()
+
+
+def test_sent_mail_is_appended_from_the_stored_copy(db, add_account, server):
+    account = add_account(imap_port=server.port)
+    email_id = record_sent(db, account)
+    assert [item.change for item in pending(db)] == [APPEND]
+
+    assert push_account(account.id) == 1
+
+    sent = server.mailbox.folders["Sent"]
+    assert [message.raw for message in sent.messages.values()] == [RAW]
+    assert sent.messages[1].flags == {"\\Seen"}
+    row = email(db, email_id)
+    assert (row.folder, row.uid, row.is_sent) == ("Sent", "1", True)
+    assert pending(db) == []
+
+
+def test_append_goes_to_the_detected_sent_folder(db, add_account):
+    mailbox = Mailbox()
+    del mailbox.folders["Sent"]
+    mailbox.folders["Sent Items"] = _Folder("\\Sent")
+    with FakeIMAPServer(mailbox) as server:
+        account = add_account(imap_port=server.port)
+        email_id = record_sent(db, account)
+        push_account(account.id)
+
+    assert len(mailbox.folders["Sent Items"].messages) == 1
+    assert email(db, email_id).folder == "Sent Items"
+
+
+def test_append_keeps_flags_changed_before_it_ran(db, add_account, server):
+    account = add_account(imap_port=server.port)
+    row = email(db, record_sent(db, account))
+    # No UID yet, so nothing is queued: the append carries the flags instead
+    assert queue_flag_changes(db, row, {"is_starred": True}) == 0
+    row.is_starred = True
+    db.commit()
+
+    push_account(account.id)
+
+    assert server.mailbox.folders["Sent"].messages[1].flags == {"\\Seen", "\\Flagged"}
+
+
+def test_failed_append_is_retried(db, add_account):
+    # Nothing listens on port 1
+    account = add_account(imap_port=1)
+    email_id = record_sent(db, account)
+
+    assert push_account(account.id) == 0
+
+    item, = pending(db)
+    assert item.attempts == 1 and item.last_error
+    assert email(db, email_id).uid is None
+
+
+def test_mail_deleted_before_the_append_is_not_appended(db, add_account, server):
+    account = add_account(imap_port=server.port)
+    row = email(db, record_sent(db, account))
+    assert queue_flag_changes(db, row, {"is_deleted": True}) == 0
+    row.is_deleted = True
+    db.commit()
+
+    push_account(account.id)
+
+    assert server.mailbox.folders["Sent"].messages == {}
+    assert pending(db) == []
@@ -0,0 +1,88 @@
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import time
+
+import orjson
+import pytest
+
+from app.core.cache import Cache, MemoryCache
+from app.core.locks import DatabaseLeaseBackend, FlightBusy, SingleFlight
+from app.models.email import Email
+from app.services.sync_service import run_sync
+from benchmarks.fake_servers import FakeIMAPServer, Mailbox
+from benchmarks.mailgen import MailboxGenerator
+
+
+@pytest.fixture
+def flight(database):
+    return SingleFlight(DatabaseLeaseBackend(), Cache(MemoryCache()))
+
+
+def test_concurrent_calls_run_once_and_share_the_result(flight):
+    calls = []
+
+    def work():
+        calls.append(1)
+        time.sleep(0.2)
+        return {"synced": 3}
+
+    with ThreadPoolExecutor(4) as pool:
+        results = list(pool.map(lambda _: flight.run("job", work), range(4)))
+
+    assert calls == [1]
+    assert sorted(shared for _, shared in results) == [False, True, True, True]
+    assert all(result == {"synced": 3} for result, _ in results)
+
+
+def test_waiters_get_the_leaders_error(flight):
+    started = threading.Event()
+
+    def fail():
+        started.set()
+        time.sleep(0.2)
+        raise ConnectionError("server down")
+
+    with ThreadPoolExecutor(2) as pool:
+        leader = pool.submit(flight.run, "job", fail)
+        started.wait(5)
+        waiter = pool.submit(flight.run, "job", lambda: "not run")
+        for future in (leader, waiter):
+            with pytest.raises(ConnectionError):
+                future.result(5)
+
+
+def test_result_of_another_worker_is_picked_up(flight):
+    # Another worker holds the lease, then stores its result and lets go
+    assert flight.leases.acquire("flight:job", "other-worker", 10)
+
+    def finish():
+        flight.results.backend.set(
+            flight.results.key("flight_result", "job"),
+            orjson.dumps({"finished_at": time.time(), "result": "theirs"}), 60
+        )
+        flight.leases.release("flight:job", "other-worker")
+
+    threading.Timer(0.2, finish).start()
+
+    assert flight.run("job", lambda: "mine", wait=5) == ("theirs", True)
+
+
+def test_busy_when_another_worker_takes_too_long(flight):
+    assert flight.leases.acquire("flight:job", "other-worker", 10)
+
+    with pytest.raises(FlightBusy):
+        flight.run("job", lambda: "mine", wait=0.2)
+
+
+def test_concurrent_syncs_of_a_folder_share_one_session(db, add_account):
+    mailbox = Mailbox()
+    mailbox.seed(MailboxGenerator(seed=3), 5)
+    with FakeIMAPServer(mailbox, {"FETCH": 0.05}) as server:
+        account = add_account(imap_port=server.port)
+        with ThreadPoolExecutor(3) as pool:
+            results = list(pool.map(lambda _: run_sync(account.id), range(3)))
+        logins = server.commands["LOGIN"]
+
+    assert logins == 1
+    assert [result["synced"] for result in results] == [5, 5, 5]
+    assert db.query(Email).count() == 5
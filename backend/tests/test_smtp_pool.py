@@ -0,0 +1,108 @@
+from types import SimpleNamespace
+
+import pytest
+
+from app.core.config import settings
+from app.schemas.email import EmailCompose
+from app.services.smtp_pool import SMTPConnectionPool
+from benchmarks.fake_servers import FakeSMTPServer
+
+
+def account(port: int, account_id: int = 1):
+    return SimpleNamespace(
+        id=account_id, smtp_host="127.0.0.1", smtp_port=port, smtp_ssl=False, smtp_username="user",
+        email_address="sender@example.com", display_name="Sender"
+    )
+
+
+def message(subject: str = "Hello") -> EmailCompose:
+    return EmailCompose(account_id=1, to_addresses=[{"email": "to@example.com"}], subject=subject, body_text="Hi")
+
+
+@pytest.fixture
+def server():
+    with FakeSMTPServer(keep=True) as smtp_server:
+        yield smtp_server
+
+
+@pytest.fixture
+def pool():
+    connection_pool = SMTPConnectionPool(idle_timeout=60, max_idle_per_account=2)
+    yield connection_pool
+    connection_pool.close_all()
+
+
+def send(pool: SMTPConnectionPool, sender, password: str = "secret", subject: str = "Hello"):
+    with pool.session(sender, password) as smtp:
+        return smtp.send_email(message(subject))
+
+
+def test_sessions_are_reused_between_sends(server, pool):
+    sender = account(server.port)
+    assert send(pool, sender, subject="one") == (True, None)
+    assert send(pool, sender, subject="two") == (True, None)
+
+    assert server.delivered == 2
+    # One login, and the session was reset for reuse
+    assert server.commands["AUTH"] == 1
+    assert server.commands["RSET"] >= 1
+    assert pool.idle_count() == 1
+
+
+def test_changed_password_logs_in_again(server, pool):
+    sender = account(server.port)
+    send(pool, sender, "old")
+    send(pool, sender, "new")
+
+    assert server.commands["AUTH"] == 2
+    assert pool.idle_count() == 2
+
+
+def test_failed_send_closes_the_session(server, pool):
+    sender = account(server.port)
+    with pool.session(sender, "secret") as smtp:
+        def broken(*args, **kwargs):
+            raise OSError("connection reset mid-message")
+        smtp._deliver = broken
+        success, error = smtp.send_email(message())
+
+    assert not success and "connection reset" in error
+    assert pool.idle_count() == 0
+
+    # The next send opens a fresh session
+    assert send(pool, sender) == (True, None)
+    assert server.commands["AUTH"] == 2
+
+
+def test_exception_in_the_block_closes_the_session(server, pool):
+    with pytest.raises(RuntimeError):
+        with pool.session(account(server.port), "secret") as smtp:
+            smtp.connect()
+            raise RuntimeError("caller failed")
+    assert pool.idle_count() == 0
+
+
+def test_idle_sessions_are_capped_per_account(server, pool):
+    sender = account(server.port)
+    with pool.session(sender, "secret") as first, pool.session(sender, "secret") as second, \
+            pool.session(sender, "secret") as third:
+        for smtp in (first, second, third):
+            assert smtp.send_email(message())[0]
+    assert pool.idle_count() == 2
+
+
+def test_expired_sessions_are_not_reused(server):
+    pool = SMTPConnectionPool(idle_timeout=0, max_idle_per_account=2)
+    sender = account(server.port)
+    send(pool, sender)
+    send(pool, sender)
+    assert server.commands["AUTH"] == 2
+    pool.close_all()
+
+
+def test_connections_use_the_smtp_timeout(server, pool, monkeypatch):
+    monkeypatch.setattr(settings, "SMTP_TIMEOUT", 7)
+    with pool.session(account(server.port), "secret") as smtp:
+        assert smtp.connect()
+        assert smtp.connection.timeout == 7
+        assert smtp.connection.sock.gettimeout() == 7
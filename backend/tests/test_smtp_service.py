@@ -0,0 +1,109 @@
+from email.mime.text import MIMEText
+from types import SimpleNamespace
+import io
+
+import pytest
+
+from app.services import smtp_service
+from app.services.mime_stream import StreamingMessage
+from app.services.smtp_service import SMTPService
+from benchmarks.fake_servers import FakeSMTPServer
+
+
+class RecordingConnection:
+    """Stands in for smtplib.SMTP: records every write and answers with the given replies"""
+
+    def __init__(self, *replies):
+        self.writes = []
+        self.replies = list(replies)
+
+    def putcmd(self, command):
+        self.writes.append(f"{command}\r\n".encode())
+
+    def send(self, data):
+        self.writes.append(data)
+
+    def getreply(self):
+        return self.replies.pop(0)
+
+
+def service(connection=None) -> SMTPService:
+    smtp = SMTPService(None, "secret")
+    smtp.connection = connection
+    return smtp
+
+
+def account(port: int):
+    return SimpleNamespace(
+        smtp_host="127.0.0.1", smtp_port=port, smtp_ssl=False, smtp_username="user",
+        email_address="sender@example.com", display_name="Sender"
+    )
+
+
+def test_bdat_sends_each_chunk_with_its_size_and_marks_the_last():
+    connection = RecordingConnection((250, b"OK"), (250, b"OK"), (250, b"OK"))
+    service(connection)._send_bdat(iter([b"abc", b"defgh", b"ij"]))
+    assert connection.writes == [b"BDAT 3\r\nabc", b"BDAT 5\r\ndefgh", b"BDAT 2 LAST\r\nij"]
+
+
+def test_bdat_of_an_empty_message_is_a_single_zero_length_last_chunk():
+    connection = RecordingConnection((250, b"OK"))
+    service(connection)._send_bdat(iter([]))
+    assert connection.writes == [b"BDAT 0 LAST\r\n"]
+
+
+def test_bdat_stops_at_a_rejected_chunk():
+    connection = RecordingConnection((250, b"OK"), (552, b"too big"))
+    with pytest.raises(smtp_service.smtplib.SMTPDataError):
+        service(connection)._send_bdat(iter([b"abc", b"def", b"ghi"]))
+    assert len(connection.writes) == 2
+
+
+def test_data_sends_the_terminator_with_the_last_chunk():
+    connection = RecordingConnection((354, b"go ahead"), (250, b"OK"))
+    service(connection)._send_data(iter([b"Subject: x\r\n\r\n", b".dot\r\n", b"end\r\n"]))
+    assert connection.writes == [b"data\r\n", b"Subject: x\r\n\r\n", b"..dot\r\n", b"end\r\n.\r\n"]
+
+
+def test_data_ends_an_unterminated_last_line_before_the_dot():
+    connection = RecordingConnection((354, b"go ahead"), (250, b"OK"))
+    service(connection)._send_data(iter([b"Subject: x\r\n\r\nno newline"]))
+    assert connection.writes[-2:] == [b"Subject: x\r\n\r\n", b"no newline\r\n.\r\n"]
+
+
+def test_data_rejected_before_the_body():
+    connection = RecordingConnection((554, b"no"))
+    with pytest.raises(smtp_service.smtplib.SMTPDataError):
+        service(connection)._send_data(iter([b"body\r\n"]))
+    assert connection.writes == [b"data\r\n"]
+
+
+def dotted_message() -> StreamingMessage:
+    text = MIMEText(".starts with a dot\n..two dots\nplain\n.\n", "plain", "us-ascii")
+    msg = StreamingMessage(text)
+    msg["Subject"] = "dots"
+    return msg
+
+
+@pytest.mark.parametrize("chunking", [True, False])
+def test_server_receives_the_message_as_written(monkeypatch, chunking):
+    # Small chunks, so the message goes out in several BDAT chunks or writes
+    monkeypatch.setattr(smtp_service, "DATA_CHUNK_SIZE", 16)
+    with FakeSMTPServer(chunking=chunking, keep=True) as server:
+        smtp = SMTPService(account(server.port), "secret")
+        assert smtp.connect()
+        try:
+            sink = io.BytesIO()
+            smtp._deliver(dotted_message(), ["to@example.com"], sink)
+        finally:
+            smtp.disconnect()
+
+    sent = sink.getvalue()
+    assert b"\r\n.starts with a dot\r\n" in sent
+    received = server.messages[0]
+    if not chunking:
+        # The fake server keeps DATA as it arrived, dot-stuffed
+        assert b"\r\n..starts with a dot\r\n...two dots\r\n" in received
+        received = received.replace(b"\r\n..", b"\r\n.")
+    assert received == sent
+    assert server.commands["BDAT" if chunking else "DATA"] > 0
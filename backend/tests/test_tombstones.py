@@ -0,0 +1,110 @@
+import os
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+from app.core.config import settings
+from app.models.email import Email
+from app.models.email_archive import ArchivedEmailBody
+from app.models.flag_change import FlagChange
+from app.models.folder_state import FolderState
+from app.services.flag_sync import DELETE, SEEN
+from app.services.message_store import message_store
+from app.services.tombstones import TombstoneCompaction
+
+LONG_AGO = datetime.utcnow() - timedelta(hours=2)
+
+
+@pytest.fixture(autouse=True)
+def no_pause(monkeypatch):
+    monkeypatch.setattr(settings, "TOMBSTONE_PURGE_BATCH_PAUSE", 0)
+
+
+def add_email(db, account_id: int, **fields) -> int:
+    number = db.query(Email).count() + 1
+    email = Email(**{"account_id": account_id, "message_id": f"<{number}@example.com>",
+                     "sender_email": "a@example.com", "folder": "INBOX", "uid": str(number), **fields})
+    db.add(email)
+    db.commit()
+    return email.id
+
+
+def remaining(db) -> list:
+    db.expire_all()
+    return [email_id for email_id, in db.query(Email.id).order_by(Email.id)]
+
+
+def stored_long_ago(raw: bytes) -> str:
+    digest = message_store.put(raw)
+    long_ago = time.time() - 2 * 3600
+    os.utime(message_store.path(digest), (long_ago, long_ago))
+    return digest
+
+
+def test_only_confirmed_deletions_past_the_retention_are_purged(db, add_account, monkeypatch):
+    monkeypatch.setattr(settings, "TOMBSTONE_PURGE_BATCH_SIZE", 2)
+    account_id = add_account().id
+    for _ in range(3):
+        add_email(db, account_id, is_deleted=True, deleted_at=LONG_AGO, expunged_at=LONG_AGO)
+    kept = [
+        add_email(db, account_id),
+        # Confirmed only just now
+        add_email(db, account_id, is_deleted=True, deleted_at=LONG_AGO, expunged_at=datetime.utcnow()),
+        # With a change still queued for the server
+        add_email(db, account_id, is_deleted=True, deleted_at=LONG_AGO, expunged_at=LONG_AGO),
+    ]
+    db.add(FlagChange(account_id=account_id, email_id=kept[-1], change=SEEN, value=True, folder="INBOX",
+                      uid="1", attempts=0, next_attempt_at=datetime.utcnow()))
+    db.commit()
+
+    assert TombstoneCompaction().run_once(retention=600) == 3
+
+    assert remaining(db) == kept
+    # Nothing left to do
+    assert TombstoneCompaction().run_once(retention=600) == 0
+
+
+def test_unconfirmed_deletions_are_sent_to_the_server_first(db, add_account):
+    account_id = add_account().id
+    email_id = add_email(db, account_id, is_deleted=True)
+
+    assert TombstoneCompaction().run_once(retention=0) == 0
+
+    assert remaining(db) == [email_id]
+    item, = db.query(FlagChange).all()
+    assert (item.email_id, item.change, item.folder, item.uid) == (email_id, DELETE, "INBOX", "1")
+    assert db.get(Email, email_id).deleted_at is not None
+    # Queued once
+    TombstoneCompaction().run_once(retention=0)
+    assert db.query(FlagChange).count() == 1
+
+
+def test_purge_takes_archived_bodies_and_unshared_originals(db, add_account):
+    account_id = add_account().id
+    gone, shared = stored_long_ago(b"Subject: Gone\r\n\r\nBye\r\n"), stored_long_ago(b"Subject: Copy\r\n\r\nHi\r\n")
+    email_id = add_email(db, account_id, is_deleted=True, expunged_at=LONG_AGO, raw_hash=gone, archived_at=LONG_AGO)
+    add_email(db, account_id, is_deleted=True, expunged_at=LONG_AGO, raw_hash=shared)
+    # The same message, still in another folder
+    add_email(db, account_id, folder="Archive", raw_hash=shared)
+    db.add(ArchivedEmailBody(email_id=email_id, account_id=account_id, body_text="Bye"))
+    db.commit()
+
+    assert TombstoneCompaction().run_once(retention=600) == 2
+
+    db.expire_all()
+    assert db.get(ArchivedEmailBody, email_id) is None
+    assert not message_store.has(gone)
+    assert message_store.has(shared)
+
+
+def test_purge_invalidates_folder_listings(db, add_account):
+    account_id = add_account().id
+    add_email(db, account_id, is_deleted=True, expunged_at=LONG_AGO)
+    state = (FolderState.account_id == account_id, FolderState.folder == "INBOX")
+    version = db.query(FolderState.version).filter(*state).scalar() or 0
+
+    TombstoneCompaction().run_once(retention=600)
+
+    db.expire_all()
+    assert db.query(FolderState.version).filter(*state).scalar() > version
@@ -0,0 +1,140 @@
+import threading
+
+import pytest
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import sessionmaker
+
+from app.core.write_queue import BYPASS, WriteQueue
+
+
+@pytest.fixture
+def factory(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'queue.db'}", connect_args={"check_same_thread": False})
+    with engine.begin() as conn:
+        conn.execute(text("CREATE TABLE items (id INTEGER PRIMARY KEY, name TEXT UNIQUE)"))
+    yield sessionmaker(bind=engine)
+    engine.dispose()
+
+
+@pytest.fixture
+def queue(factory):
+    write_queue = WriteQueue(factory, enabled=True, batch_size=10, batch_window=0.2)
+    yield write_queue
+    write_queue.shutdown()
+
+
+def names(factory):
+    with factory() as db:
+        return sorted(name for name, in db.execute(text("SELECT name FROM items")))
+
+
+def insert(db, name: str, calls: list):
+    calls.append(name)
+    db.execute(text("INSERT INTO items (name) VALUES (:name)"), {"name": name})
+    return name
+
+
+def submit_together(queue: WriteQueue, writes):
+    """Queue writes while the writer is held up, so they land in the same batch"""
+    gate = threading.Event()
+    queue.submit(lambda db: gate.wait(), idempotent=True)
+    futures = [queue.submit(fn, *args, idempotent=idempotent) for fn, args, idempotent in writes]
+    gate.set()
+    return futures
+
+
+def test_idempotent_writes_share_a_transaction(queue, factory):
+    sessions = []
+
+    def record(db, name):
+        sessions.append(id(db))
+        return insert(db, name, [])
+
+    futures = submit_together(queue, [(record, (name,), True) for name in "abc"])
+    assert [future.result(5) for future in futures] == ["a", "b", "c"]
+    assert len(set(sessions)) == 1
+    assert names(factory) == ["a", "b", "c"]
+
+
+def test_failed_batch_retries_idempotent_writes_alone(queue, factory):
+    calls = []
+    futures = submit_together(queue, [
+        (insert, ("a", calls), True),
+        (insert, ("a", calls), True),  # Violates the unique constraint
+        (insert, ("b", calls), True),
+    ])
+
+    assert futures[0].result(5) == "a"
+    with pytest.raises(Exception):
+        futures[1].result(5)
+    assert futures[2].result(5) == "b"
+    assert names(factory) == ["a", "b"]
+    # The batch stopped at the failing write; then each ran on its own
+    assert calls == ["a", "a", "a", "a", "b"]
+
+
+def test_other_writes_get_their_own_transaction_and_run_once(queue, factory):
+    calls = []
+    futures = submit_together(queue, [
+        (insert, ("a", calls), True),
+        (insert, ("b", calls), False),
+        (insert, ("a", calls), True),  # Fails the batch it is in
+    ])
+
+    assert futures[1].result(5) == "b"
+    assert futures[0].result(5) == "a"
+    with pytest.raises(Exception):
+        futures[2].result(5)
+    assert calls.count("b") == 1
+    assert names(factory) == ["a", "b"]
+
+
+def test_apply_returns_the_result_after_commit(queue, factory):
+    with factory() as db:
+        assert queue.apply(db, insert, "a", []) == "a"
+    assert names(factory) == ["a"]
+
+
+def test_disabled_queue_writes_in_the_callers_session(factory):
+    write_queue = WriteQueue(factory, enabled=False)
+    write_queue.guard(factory)
+    with factory() as db:
+        assert write_queue.apply(db, insert, "a", []) == "a"
+    assert names(factory) == ["a"]
+
+
+def test_guard_rejects_writes_outside_the_queue(queue, factory):
+    from sqlalchemy import Column, Integer, String
+    from sqlalchemy.orm import declarative_base
+
+    Base = declarative_base()
+
+    class Item(Base):
+        __tablename__ = "items"
+        id = Column(Integer, primary_key=True)
+        name = Column(String)
+
+    queue.guard(factory)
+
+    with factory() as db:
+        db.add(Item(name="direct"))
+        with pytest.raises(RuntimeError, match="write queue"):
+            db.commit()
+
+    with factory() as db:
+        with pytest.raises(RuntimeError, match="write queue"):
+            db.query(Item).update({"name": "x"})
+
+    def add(db, name):
+        db.add(Item(name=name))
+
+    with factory() as db:
+        queue.apply(db, add, "queued")
+        # Reads are never affected
+        assert db.query(Item).count() == 1
+
+    with factory(info={BYPASS: "test"}) as db:
+        db.add(Item(name="bypass"))
+        db.commit()
+
+    assert names(factory) == ["bypass", "queued"]
@@ -1,3 +1,4 @@
+import { useEffect } from 'react'
 import { useQuery, useMutation, useQueryClient } from '@tanstack/react-query'
 import { apiService, Email } from '../services/api'
 import { toast } from 'react-hot-toast'
@@ -27,6 +28,33 @@ export function useEmails(params?: {
   })
 }
 
+// Refresh cached emails when the server pushes changes
+export function useEmailEvents(enabled = true) {
+  const queryClient = useQueryClient()
+
+  useEffect(() => {
+    if (!enabled) return
+    const source = apiService.openEventStream()
+    if (!source) return
+
+    const refreshLists = () => queryClient.invalidateQueries({ queryKey: emailKeys.lists() })
+    const refreshEmail = (event: MessageEvent) => {
+      const { id } = JSON.parse(event.data)
+      queryClient.invalidateQueries({ queryKey: emailKeys.detail(id) })
+      refreshLists()
+    }
+
+    source.addEventListener('emails.new', refreshLists)
+    source.addEventListener('folder.counters', refreshLists)
+    source.addEventListener('email.updated', refreshEmail as EventListener)
+    source.addEventListener('email.deleted', refreshEmail as EventListener)
+    // We fell behind and events were dropped; resync everything
+    source.addEventListener('overflow', () => queryClient.invalidateQueries({ queryKey: emailKeys.all }))
+
+    return () => source.close()
+  }, [enabled, queryClient])
+}
+
 // Get single email
 export function useEmail(emailId: number) {
   return useQuery({
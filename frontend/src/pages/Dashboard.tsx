@@ -3,7 +3,7 @@ import { Link } from 'react-router-dom'
 import { useAuthStore } from '../stores/authStore'
 import { useEmailStore } from '../stores/emailStore'
 import { useEmailAccounts } from '../hooks/useAccount'
-import { useEmails, useUpdateEmail, useSyncEmails } from '../hooks/useEmails'
+import { useEmails, useEmailEvents, useUpdateEmail, useSyncEmails } from '../hooks/useEmails'
 import EmailViewer from '../components/EmailViewer'
 import { 
   Mail, 
@@ -75,6 +75,9 @@ const Dashboard = () => {
   const updateEmailMutation = useUpdateEmail()
   const syncEmailsMutation = useSyncEmails()
 
+  // Live updates instead of polling
+  useEmailEvents(!!user)
+
   // Hide context menu when clicking elsewhere
   useEffect(() => {
     const handleClickOutside = () => {
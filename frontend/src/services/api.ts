@@ -208,6 +208,14 @@ class ApiService {
     await this.api.post('/api/v1/emails/compose', emailData)
   }
 
+  // Server-sent events stream (EventSource can't send headers, so the token goes in the URL)
+  openEventStream(): EventSource | null {
+    const token = useAuthStore.getState().token
+    if (!token) return null
+    const baseURL = this.api.defaults.baseURL
+    return new EventSource(`${baseURL}/api/v1/events/stream?token=${encodeURIComponent(token)}`)
+  }
+
   async syncEmails(accountId: number, folder = 'INBOX') {
     const response = await this.api.post(`/api/v1/emails/sync/${accountId}`, null, {
       params: { folder }